@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+"""Benchmark the CPU backends of TextureTsne.fit_transform
+
+Embed synthetic data of increasing size with the Barnes-Hut ("cpu")
+and the FFT interpolation ("cpu_fft") backends. Print the gradient
+descent time per iteration and per point, the FFT backend should
+be close to constant per point (linear in the number of points).
+"""
+import argparse
+import numpy as np
+import nptsne
+
+
+def make_blobs(num_points, num_dimensions, num_clusters, seed=0):
+    """Gaussian clusters with random centers"""
+    rng = np.random.default_rng(seed)
+    centers = rng.uniform(-20, 20, size=(num_clusters, num_dimensions))
+    labels = rng.integers(num_clusters, size=num_points)
+    return (centers[labels] + rng.normal(size=(num_points, num_dimensions))).astype(np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--points', type=int, nargs='+', default=[10000, 100000, 1000000],
+                        help='Numbers of synthetic data points')
+    parser.add_argument('--dimensions', type=int, default=32, help='Dimensions of the synthetic data')
+    parser.add_argument('--clusters', type=int, default=20, help='Number of synthetic clusters')
+    parser.add_argument('--iterations', type=int, default=500, help='Gradient descent iterations')
+    parser.add_argument('--threads', type=int, default=0, help='Number of threads, 0 is all cores')
+    parser.add_argument('--backends', nargs='+', default=['cpu', 'cpu_fft'], help='Backends to compare')
+    args = parser.parse_args()
+
+    print(f'{"backend":>8} {"points":>9} {"knn s":>8} {"ms/iter":>10} {"ns/iter/point":>14}')
+    for num_points in args.points:
+        X = make_blobs(num_points, args.dimensions, args.clusters)
+        for backend in args.backends:
+            tsne = nptsne.TextureTsne(iterations=args.iterations)
+            tsne.fit_transform(X, backend=backend, num_threads=args.threads)
+            phases = tsne.last_run_stats['phase_seconds']
+            descent = phases['gradient_descent'] / args.iterations
+            print(f'{backend:>8} {num_points:>9} {phases["similarities"]:>8.1f} {1e3 * descent:>10.2f} '
+                  f'{1e9 * descent / num_points:>14.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""Benchmark the scaling of the multi-threaded CPU analysis embedder
+
+Build a synthetic hierarchy and embed the top scale landmarks with
+EmbedderType.CPU (single threaded) and with EmbedderType.CPU_PARALLEL
+for 1, 2, 4 ... up to the number of cores. Print the iteration time,
+the speedup relative to one thread and whether the embedding is
+identical to the one thread embedding.
+"""
+import argparse
+import os
+import time
+import numpy as np
+import nptsne
+from nptsne.hsne_analysis import Analysis, EmbedderType
+
+
+def make_blobs(num_points, num_dimensions, num_clusters, seed=0):
+    """Gaussian clusters with random centers"""
+    rng = np.random.default_rng(seed)
+    centers = rng.uniform(-20, 20, size=(num_clusters, num_dimensions))
+    labels = rng.integers(num_clusters, size=num_points)
+    return (centers[labels] + rng.normal(size=(num_points, num_dimensions))).astype(np.float32)
+
+
+def thread_counts(max_threads):
+    counts = []
+    count = 1
+    while count < max_threads:
+        counts.append(count)
+        count *= 2
+    counts.append(max_threads)
+    return counts
+
+
+def time_embedding(hsne, embedder_type, num_threads, iterations):
+    analysis = Analysis(hsne, embedder_type, num_threads=num_threads)
+    start = time.perf_counter()
+    analysis.run(iterations)
+    elapsed = time.perf_counter() - start
+    return elapsed, analysis.embedding.copy()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--points', type=int, default=500000, help='Number of synthetic data points')
+    parser.add_argument('--dimensions', type=int, default=32, help='Dimensions of the synthetic data')
+    parser.add_argument('--clusters', type=int, default=20, help='Number of synthetic clusters')
+    parser.add_argument('--scales', type=int, default=2, help='Number of hsne scales')
+    parser.add_argument('--iterations', type=int, default=300, help='Embedding iterations')
+    parser.add_argument('--max-threads', type=int, default=os.cpu_count(), help='Largest thread count')
+    args = parser.parse_args()
+
+    X = make_blobs(args.points, args.dimensions, args.clusters)
+    hsne = nptsne.HSne(False)
+    hsne.create_hsne(X, args.scales)
+    print(f'{hsne.get_scale(args.scales - 1).num_points} landmarks in the top scale')
+
+    elapsed, _ = time_embedding(hsne, EmbedderType.CPU, 0, args.iterations)
+    print(f'{"embedder":>14} {"threads":>8} {"ms/iter":>10} {"speedup":>8} {"identical":>10}')
+    print(f'{"CPU":>14} {1:>8} {1000 * elapsed / args.iterations:>10.2f} {"":>8} {"":>10}')
+
+    reference = None
+    single_thread_time = None
+    for threads in thread_counts(args.max_threads):
+        elapsed, embedding = time_embedding(hsne, EmbedderType.CPU_PARALLEL, threads, args.iterations)
+        if reference is None:
+            reference, single_thread_time = embedding, elapsed
+        identical = np.array_equal(reference, embedding)
+        print(f'{"CPU_PARALLEL":>14} {threads:>8} {1000 * elapsed / args.iterations:>10.2f} '
+              f'{single_thread_time / elapsed:>8.2f} {str(identical):>10}')
+
+
+if __name__ == '__main__':
+    main()
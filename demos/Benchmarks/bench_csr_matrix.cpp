@@ -0,0 +1,263 @@
+// Copyright 2020 LKEB at LUMC
+// Author: B. van Lew
+//
+// Benchmark the sparse matrix storage: the HDILib row maps
+// (std::vector<MapMemEff>, nptsne::SparseScalarMatrixType) against the
+// contiguous nptsne::CsrMatrix with float and half precision values.
+//
+// A synthetic kNN probability matrix (random neighbors, uniform weights)
+// is built row by row in each format. The table shows the build time,
+// the memory footprint and the time of a parallel row scan that computes
+// the tSNE attractive forces on a random 2-D embedding, as in one
+// gradient descent iteration.
+//
+// Build (the HDILib headers are in the nptsne build tree, e.g. under
+// the conan package folder):
+//   g++ -O3 -std=c++14 -fopenmp -I<HDILib include> -I../../src/cpp bench_csr_matrix.cpp -o bench_csr_matrix
+// Run:
+//   ./bench_csr_matrix [num. points (default 1000000)] [num. neighbors (default 90)]
+
+#include <hdi/data/map_mem_eff.h>
+#include "CsrMatrix.h"
+#include <algorithm>
+#include <chrono>
+#include <cmath>
+#include <cstdio>
+#include <cstdlib>
+#include <cstring>
+#include <random>
+#include <utility>
+#include <vector>
+
+namespace {
+    using MapType = hdi::data::MapMemEff<uint32_t, float>;
+    using RowsMatrix = std::vector<MapType>;
+
+    // An estimate of the per allocation overhead of the heap (glibc malloc)
+    const uint64_t kAllocationOverhead = 16;
+    const int kScans = 10;
+
+    // IEEE 754 binary16 storage of a float value, half the memory of a float
+    // with about 3 significant digits. The conversion rounds to the nearest even
+    // value. Suited to conditional (row normalized) probabilities: values below
+    // 6e-8 become zero.
+    class Half {
+     public:
+        Half() : _bits(0) {}
+        Half(float value) : _bits(from_float(value)) {}  // NOLINT: converts like a float
+        operator float() const { return to_float(_bits); }
+        uint16_t bits() const { return _bits; }
+
+        static uint16_t from_float(float value) {
+            uint32_t f;
+            std::memcpy(&f, &value, sizeof(f));
+            const uint16_t sign = static_cast<uint16_t>((f >> 16) & 0x8000);
+            const uint32_t abs = f & 0x7fffffff;
+            if (abs >= 0x7f800000) {
+                // Infinity or NaN (kept quiet)
+                return sign | 0x7c00 | (abs > 0x7f800000 ? 0x200 : 0);
+            }
+            if (abs >= 0x477ff000) {
+                // Rounds to 65520 or more, beyond the largest half
+                return sign | 0x7c00;
+            }
+            if (abs < 0x38800000) {
+                // Below the smallest normal half (2^-14): subnormal or zero
+                if (abs < 0x33000000) {
+                    return sign;
+                }
+                const uint32_t exponent = abs >> 23;
+                const uint32_t mantissa = (abs & 0x7fffff) | 0x800000;
+                const uint32_t shift = 126 - exponent;
+                uint32_t result = mantissa >> shift;
+                const uint32_t rest = mantissa & ((1u << shift) - 1);
+                const uint32_t halfway = 1u << (shift - 1);
+                if (rest > halfway || (rest == halfway && (result & 1))) {
+                    ++result;
+                }
+                return sign | static_cast<uint16_t>(result);
+            }
+            // Rebias the exponent (127 to 15) and round the mantissa to 10 bits,
+            // a carry into the exponent is correct rounding
+            uint32_t result = (abs - 0x38000000) >> 13;
+            const uint32_t rest = abs & 0x1fff;
+            if (rest > 0x1000 || (rest == 0x1000 && (result & 1))) {
+                ++result;
+            }
+            return sign | static_cast<uint16_t>(result);
+        }
+
+        static float to_float(uint16_t bits) {
+            const uint32_t sign = static_cast<uint32_t>(bits & 0x8000) << 16;
+            const uint32_t exponent = (bits >> 10) & 0x1f;
+            uint32_t mantissa = bits & 0x3ff;
+            uint32_t f;
+            if (exponent == 0x1f) {
+                f = sign | 0x7f800000 | (mantissa << 13);
+            } else if (exponent != 0) {
+                f = sign | ((exponent + 112) << 23) | (mantissa << 13);
+            } else if (mantissa == 0) {
+                f = sign;
+            } else {
+                // Subnormal, normalize for the float
+                uint32_t float_exponent = 113;
+                while (!(mantissa & 0x400)) {
+                    mantissa <<= 1;
+                    --float_exponent;
+                }
+                f = sign | (float_exponent << 23) | ((mantissa & 0x3ff) << 13);
+            }
+            float value;
+            std::memcpy(&value, &f, sizeof(value));
+            return value;
+        }
+
+     private:
+        uint16_t _bits;
+    };
+
+    double seconds_since(std::chrono::steady_clock::time_point start) {
+        return std::chrono::duration<double>(std::chrono::steady_clock::now() - start).count();
+    }
+
+    uint64_t rows_memory_bytes(const RowsMatrix& matrix) {
+        uint64_t bytes = matrix.capacity() * sizeof(MapType);
+        for (const auto& row : matrix) {
+            auto capacity = row.memory().capacity();
+            bytes += capacity * sizeof(MapType::value_type) + (capacity > 0 ? kAllocationOverhead : 0);
+        }
+        return bytes;
+    }
+
+    // The attractive forces of a tSNE iteration, the mean force is returned
+    // as a check that the formats hold the same matrix.
+    // for_each_entry(i, f) calls f(column, value) for the entries of row i.
+    template <typename RowScan>
+    double attractive_forces(int64_t num_points, const std::vector<float>& embedding, RowScan for_each_entry) {
+        std::vector<double> force(num_points * 2);
+#pragma omp parallel for schedule(dynamic, 256)
+        for (int64_t i = 0; i < num_points; ++i) {
+            const double y_x = embedding[i * 2];
+            const double y_y = embedding[i * 2 + 1];
+            double a_x = 0, a_y = 0;
+            for_each_entry(i, [&](uint32_t j, float p) {
+                const double d_x = y_x - embedding[j * 2];
+                const double d_y = y_y - embedding[j * 2 + 1];
+                const double q = 1.0 / (1.0 + d_x * d_x + d_y * d_y);
+                a_x += p * q * d_x;
+                a_y += p * q * d_y;
+            });
+            force[i * 2] = a_x;
+            force[i * 2 + 1] = a_y;
+        }
+        double sum = 0;
+        for (auto f : force) {
+            sum += std::abs(f);
+        }
+        return sum / force.size();
+    }
+
+    // Seconds per scan, averaged over kScans
+    template <typename RowScan>
+    double time_scans(int64_t num_points, const std::vector<float>& embedding, RowScan for_each_entry,
+        double* mean_force) {
+        auto start = std::chrono::steady_clock::now();
+        for (int s = 0; s < kScans; ++s) {
+            *mean_force = attractive_forces(num_points, embedding, for_each_entry);
+        }
+        return seconds_since(start) / kScans;
+    }
+
+    template <typename Value>
+    double time_csr_scans(const nptsne::CsrMatrix<Value>& matrix, const std::vector<float>& embedding,
+        double* mean_force) {
+        return time_scans(matrix.num_rows(), embedding, [&matrix](int64_t i, auto&& f) {
+            const auto row = matrix.row(i);
+            for (uint64_t k = 0; k < row.size; ++k) {
+                f(row.indices[k], static_cast<float>(row.values[k]));
+            }
+        }, mean_force);
+    }
+
+    void print_row(const char* format, double build_seconds, uint64_t bytes, double scan_seconds, double mean_force) {
+        std::printf("%-22s %10.3f %12.1f %10.4f %14.6e\n",
+            format, build_seconds, bytes / (1024.0 * 1024.0), scan_seconds, mean_force);
+    }
+}  // namespace
+
+int main(int argc, char** argv) {
+    const int64_t num_points = argc > 1 ? std::atoll(argv[1]) : 1000000;
+    const int num_neighbors = argc > 2 ? std::atoi(argv[2]) : 90;
+    std::printf("%lld points, %d neighbors\n", static_cast<long long>(num_points), num_neighbors);
+
+    // The kNN graph, neighbors in random (distance) order as a kNN library returns them
+    std::mt19937 generator(0);
+    std::uniform_int_distribution<uint32_t> random_point(0, static_cast<uint32_t>(num_points - 1));
+    std::vector<uint32_t> neighbors(num_points * num_neighbors);
+    for (auto& n : neighbors) {
+        n = random_point(generator);
+    }
+    std::vector<float> embedding(num_points * 2);
+    std::normal_distribution<float> normal(0, 10);
+    for (auto& y : embedding) {
+        y = normal(generator);
+    }
+    const float p = 1.0f / num_neighbors;
+
+    std::printf("%-22s %10s %12s %10s %14s\n", "format", "build s", "memory MiB", "scan s", "mean force");
+
+    double mean_force = 0;
+    {
+        // Row maps, filled as the HDILib probability generator does
+        auto start = std::chrono::steady_clock::now();
+        RowsMatrix rows(num_points);
+        for (int64_t i = 0; i < num_points; ++i) {
+            for (int k = 0; k < num_neighbors; ++k) {
+                rows[i][neighbors[i * num_neighbors + k]] = p;
+            }
+        }
+        double build_seconds = seconds_since(start);
+        double scan_seconds = time_scans(num_points, embedding, [&rows](int64_t i, auto&& f) {
+            for (const auto& elem : rows[i].memory()) {
+                f(elem.first, elem.second);
+            }
+        }, &mean_force);
+        print_row("MapMemEff rows", build_seconds, rows_memory_bytes(rows), scan_seconds, mean_force);
+
+        start = std::chrono::steady_clock::now();
+        auto converted = nptsne::CsrMatrix<float>::from_rows(rows);
+        double convert_seconds = seconds_since(start);
+        std::printf("%-22s %10.3f %12.1f\n", "CSR from MapMemEff", convert_seconds,
+            converted.memory_bytes() / (1024.0 * 1024.0));
+    }
+    {
+        // CSR filled directly: each row is sorted and merged once
+        auto start = std::chrono::steady_clock::now();
+        std::vector<uint64_t> indptr(num_points + 1, 0);
+        std::vector<uint32_t> indices;
+        std::vector<float> values;
+        indices.reserve(num_points * num_neighbors);
+        values.reserve(num_points * num_neighbors);
+        std::vector<uint32_t> row(num_neighbors);
+        for (int64_t i = 0; i < num_points; ++i) {
+            std::copy(neighbors.begin() + i * num_neighbors, neighbors.begin() + (i + 1) * num_neighbors, row.begin());
+            std::sort(row.begin(), row.end());
+            // A repeated neighbor is assigned once, as in the row maps
+            auto last = std::unique(row.begin(), row.end());
+            indices.insert(indices.end(), row.begin(), last);
+            values.insert(values.end(), last - row.begin(), p);
+            indptr[i + 1] = indices.size();
+        }
+        nptsne::CsrMatrix<float> csr(std::move(indptr), std::move(indices), std::move(values));
+        double build_seconds = seconds_since(start);
+        double scan_seconds = time_csr_scans(csr, embedding, &mean_force);
+        print_row("CSR float32", build_seconds, csr.memory_bytes(), scan_seconds, mean_force);
+
+        start = std::chrono::steady_clock::now();
+        auto compact = csr.with_values<Half>();
+        build_seconds = seconds_since(start);
+        scan_seconds = time_csr_scans(compact, embedding, &mean_force);
+        print_row("CSR float16 (from f32)", build_seconds, compact.memory_bytes(), scan_seconds, mean_force);
+    }
+    return 0;
+}
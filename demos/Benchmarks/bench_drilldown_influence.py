@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""Benchmark the influence engines of a drill-down (sub-analysis)
+
+Build a synthetic hierarchy and create sub-analyses of the top analysis
+for growing selections (a fraction of the top landmarks) with
+InfluenceType.WALKS and InfluenceType.MATRIX_POWER. Print the time of the
+influence phase (last_run_stats) and of the whole sub-analysis creation,
+the number of landmarks found, whether a repeated drill-down returns the
+same landmarks and the overlap (Jaccard index) of the two engines.
+"""
+import argparse
+import time
+import numpy as np
+import nptsne
+from nptsne.hsne_analysis import Analysis, EmbedderType, InfluenceType
+
+
+def make_blobs(num_points, num_dimensions, num_clusters, seed=0):
+    """Gaussian clusters with random centers"""
+    rng = np.random.default_rng(seed)
+    centers = rng.uniform(-20, 20, size=(num_clusters, num_dimensions))
+    labels = rng.integers(num_clusters, size=num_points)
+    return (centers[labels] + rng.normal(size=(num_points, num_dimensions))).astype(np.float32)
+
+
+def drill_down(hsne, top, selection, influence_type):
+    start = time.perf_counter()
+    analysis = Analysis(hsne, EmbedderType.CPU, top, selection, influence_type=influence_type)
+    elapsed = time.perf_counter() - start
+    influence = analysis.last_run_stats['phase_seconds']['influence']
+    return influence, elapsed, set(analysis.landmark_indexes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--points', type=int, default=500000, help='Number of synthetic data points')
+    parser.add_argument('--dimensions', type=int, default=32, help='Dimensions of the synthetic data')
+    parser.add_argument('--clusters', type=int, default=20, help='Number of synthetic clusters')
+    parser.add_argument('--scales', type=int, default=3, help='Number of hsne scales')
+    parser.add_argument('--fractions', type=float, nargs='+', default=[0.01, 0.1, 0.5, 1.0],
+                        help='Selection sizes as a fraction of the top landmarks')
+    args = parser.parse_args()
+
+    X = make_blobs(args.points, args.dimensions, args.clusters)
+    hsne = nptsne.HSne(False)
+    hsne.create_hsne(X, args.scales)
+    top = Analysis(hsne, EmbedderType.CPU)
+    print(f'{top.number_of_points} landmarks in the top scale')
+
+    rng = np.random.default_rng(0)
+    print(f'{"selection":>10} {"engine":>13} {"influence s":>12} {"create s":>9} '
+          f'{"landmarks":>10} {"repeatable":>11} {"jaccard":>8}')
+    for fraction in args.fractions:
+        size = max(1, int(fraction * top.number_of_points))
+        selection = sorted(rng.choice(top.number_of_points, size, replace=False).tolist())
+        found = {}
+        for influence_type in (InfluenceType.WALKS, InfluenceType.MATRIX_POWER):
+            influence, elapsed, landmarks = drill_down(hsne, top, selection, influence_type)
+            _, _, again = drill_down(hsne, top, selection, influence_type)
+            found[influence_type] = landmarks
+            jaccard = ''
+            if influence_type == InfluenceType.MATRIX_POWER:
+                walks = found[InfluenceType.WALKS]
+                jaccard = f'{len(walks & landmarks) / max(1, len(walks | landmarks)):.3f}'
+            print(f'{size:>10} {influence_type.name:>13} {influence:>12.4f} {elapsed:>9.3f} '
+                  f'{len(landmarks):>10} {str(landmarks == again):>11} {jaccard:>8}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+"""Benchmark repeated HSne.get_scale calls on a large hierarchy
+
+The HSneScale returned by get_scale is a view on the HSne data,
+so the resident memory should not grow with the number of calls.
+"""
+import argparse
+import time
+import numpy as np
+import psutil
+import nptsne
+
+
+def rss_mb():
+    return psutil.Process().memory_info().rss / (1024 * 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--points', type=int, default=1000000, help='Number of synthetic data points')
+    parser.add_argument('--dimensions', type=int, default=16, help='Dimensions of the synthetic data')
+    parser.add_argument('--scales', type=int, default=3, help='Number of hsne scales')
+    parser.add_argument('--calls', type=int, default=1000, help='Number of get_scale calls per scale')
+    parser.add_argument('--hsne-file', type=str, default=None, help='Load this .hsne file instead of creating one')
+    args = parser.parse_args()
+
+    X = np.random.randint(256, size=(args.points, args.dimensions)).astype(np.float32)
+    hsne = nptsne.HSne(False)
+    if args.hsne_file is None:
+        hsne.create_hsne(X, args.scales)
+    else:
+        hsne.load_hsne(X, args.hsne_file)
+
+    print(f'{"scale":>6} {"points":>10} {"us/call":>10} {"rss delta MB":>14}')
+    for scale_number in range(hsne.num_scales):
+        rss_start = rss_mb()
+        scales = []
+        start = time.perf_counter()
+        for _ in range(args.calls):
+            # hold the results to expose any per call copy
+            scales.append(hsne.get_scale(scale_number))
+        elapsed = time.perf_counter() - start
+        rss_delta = rss_mb() - rss_start
+        print(f'{scale_number:>6} {scales[0].num_points:>10} '
+              f'{1e6 * elapsed / args.calls:>10.2f} {rss_delta:>14.2f}')
+
+
+if __name__ == '__main__':
+    main()
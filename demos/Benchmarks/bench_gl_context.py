@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+"""Benchmark the per call overhead of the OpenGL context in TextureTsne
+
+Run many small TextureTsne.fit_transform calls. Without pooling (the
+context is destroyed after each call with nptsne.release_gl_contexts,
+as before the context pool) and with pooling (the default, the context
+is reused). Print the mean wall time per call and the part of it spent
+outside the similarity and gradient descent phases.
+"""
+import argparse
+import time
+import numpy as np
+import nptsne
+
+
+def run_calls(X, num_calls, iterations, pooled):
+    nptsne.release_gl_contexts()
+    tsne = nptsne.TextureTsne(iterations=iterations)
+    wall = 0.0
+    overhead = 0.0
+    for _ in range(num_calls):
+        start = time.perf_counter()
+        tsne.fit_transform(X)
+        elapsed = time.perf_counter() - start
+        if not pooled:
+            nptsne.release_gl_contexts()
+        wall += elapsed
+        overhead += elapsed - sum(tsne.last_run_stats['phase_seconds'].values())
+    return wall / num_calls, overhead / num_calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--points', type=int, default=500, help='Number of points per embedding')
+    parser.add_argument('--dimensions', type=int, default=16, help='Dimensions of the synthetic data')
+    parser.add_argument('--calls', type=int, default=100, help='Number of fit_transform calls')
+    parser.add_argument('--iterations', type=int, default=100, help='Gradient descent iterations per call')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(args.points, args.dimensions)).astype(np.float32)
+    print(f'{"context":>10} {"ms/call":>10} {"overhead ms/call":>18}')
+    for pooled in (False, True):
+        wall, overhead = run_calls(X, args.calls, args.iterations, pooled)
+        print(f'{"pooled" if pooled else "per call":>10} {1e3 * wall:>10.2f} {1e3 * overhead:>18.2f}')
+
+
+if __name__ == '__main__':
+    main()
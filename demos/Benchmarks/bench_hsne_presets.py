@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""Benchmark the HSneParameters presets on synthetic data
+
+For each preset print the hierarchy build time, the peak memory
+of the build and the neighborhood preservation of an embedding
+of the top scale landmarks. Each preset is run in a separate
+process so that the peak memory is measured independently.
+"""
+import argparse
+import multiprocessing
+import time
+import numpy as np
+import nptsne
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+    import psutil
+
+
+def make_blobs(num_points, num_dimensions, num_clusters, seed=0):
+    """Gaussian clusters with random centers"""
+    rng = np.random.default_rng(seed)
+    centers = rng.uniform(-20, 20, size=(num_clusters, num_dimensions))
+    labels = rng.integers(num_clusters, size=num_points)
+    return (centers[labels] + rng.normal(size=(num_points, num_dimensions))).astype(np.float32)
+
+
+def peak_mb():
+    if resource is not None:
+        # ru_maxrss is in kilobytes on linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return psutil.Process().memory_info().peak_wset / (1024 * 1024)
+
+
+def knn_indexes(points, k, chunk=1024):
+    """Brute force k nearest neighbors (excluding self)"""
+    result = np.empty((points.shape[0], k), dtype=np.int64)
+    sq_norms = (points ** 2).sum(axis=1)
+    for start in range(0, points.shape[0], chunk):
+        block = points[start:start + chunk]
+        dist = sq_norms[start:start + chunk, None] - 2 * block @ points.T + sq_norms[None, :]
+        dist[np.arange(block.shape[0]), np.arange(start, start + block.shape[0])] = np.inf
+        result[start:start + chunk] = np.argpartition(dist, k, axis=1)[:, :k]
+    return result
+
+
+def neighborhood_preservation(high_dim, low_dim, k):
+    """Mean fraction of the k nearest neighbors preserved in the embedding"""
+    high = knn_indexes(high_dim.astype(np.float64), k)
+    low = knn_indexes(low_dim.astype(np.float64), k)
+    shared = [len(np.intersect1d(h, l, assume_unique=True)) for h, l in zip(high, low)]
+    return np.mean(shared) / k
+
+
+def run_preset(preset, args, queue):
+    X = make_blobs(args.points, args.dimensions, args.clusters)
+    baseline_mb = peak_mb()
+    hsne = nptsne.HSne(False)
+    start = time.perf_counter()
+    hsne.create_hsne(X, args.scales, params=nptsne.HSneParameters.preset(preset))
+    build_time = time.perf_counter() - start
+    build_mb = peak_mb() - baseline_mb
+
+    analysis = nptsne.hsne_analysis.Analysis(hsne, nptsne.hsne_analysis.EmbedderType.CPU)
+    analysis.run(args.iterations)
+    preservation = neighborhood_preservation(
+        X[analysis.landmark_orig_indexes], analysis.embedding, args.k)
+    queue.put((preset, analysis.number_of_points, build_time, build_mb, preservation))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--points', type=int, default=100000, help='Number of synthetic data points')
+    parser.add_argument('--dimensions', type=int, default=32, help='Dimensions of the synthetic data')
+    parser.add_argument('--clusters', type=int, default=20, help='Number of synthetic clusters')
+    parser.add_argument('--scales', type=int, default=3, help='Number of hsne scales')
+    parser.add_argument('--iterations', type=int, default=1000, help='Top scale embedding iterations')
+    parser.add_argument('--k', type=int, default=10, help='Neighborhood size for the preservation')
+    args = parser.parse_args()
+
+    print(f'{"preset":>10} {"landmarks":>10} {"build s":>10} {"peak MB":>10} {"knn preserved":>14}')
+    for preset in ['fast', 'balanced', 'accurate']:
+        queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=run_preset, args=(preset, args, queue))
+        process.start()
+        preset, landmarks, build_time, build_mb, preservation = queue.get()
+        process.join()
+        print(f'{preset:>10} {landmarks:>10} {build_time:>10.2f} {build_mb:>10.1f} {preservation:>14.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+"""Benchmark projecting new points into an existing HSNE hierarchy
+
+Create a hierarchy and a top level analysis from synthetic data, then
+project batches of new points with HSne.project (landmark memberships at
+every scale) and Analysis.project (positions in the top level embedding).
+Print the time per batch, compared to the time of the hierarchy build.
+"""
+import argparse
+import time
+import numpy as np
+import nptsne
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--points', type=int, default=100000, help='Number of training points')
+    parser.add_argument('--new-points', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--dimensions', type=int, default=50, help='Dimensions of the synthetic data')
+    parser.add_argument('--scales', type=int, default=3, help='Number of hierarchy scales')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    centers = rng.normal(scale=5, size=(10, args.dimensions))
+    labels = rng.integers(10, size=args.points + max(args.new_points))
+    data = (centers[labels] + rng.normal(size=(labels.size, args.dimensions))).astype(np.float32)
+    X, X_new = data[:args.points], data[args.points:]
+
+    hsne = nptsne.HSne(False)
+    hsne.keep_training_data = True
+    start = time.perf_counter()
+    hsne.create_hsne(X, args.scales)
+    print(f'hierarchy of {args.points} points: {time.perf_counter() - start:.2f} s')
+    analysis = nptsne.hsne_analysis.Analysis(hsne, nptsne.hsne_analysis.EmbedderType.CPU)
+    analysis.run(500)
+
+    print(f'{"new points":>10} {"hsne s":>10} {"analysis s":>12} {"placed":>8}')
+    for num_new in args.new_points:
+        start = time.perf_counter()
+        hsne.project(X_new[:num_new])
+        hsne_time = time.perf_counter() - start
+        start = time.perf_counter()
+        positions = analysis.project(X_new[:num_new])
+        analysis_time = time.perf_counter() - start
+        placed = np.isfinite(positions).all(axis=1).mean()
+        print(f'{num_new:>10} {hsne_time:>10.3f} {analysis_time:>12.3f} {placed:>8.1%}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""Benchmark the scale construction of the parallel random walk engine
+
+Build a synthetic hierarchy with the HDILib random walks and with
+HSneParameters.parallel_walks for 1, 2, 4 ... up to the number of cores.
+Print the scale construction time (the scale_N phases of last_run_stats,
+landmark selection, areas of influence and transition matrices), the
+speedup relative to one thread and whether the landmarks of every scale
+are identical to those of the one thread build with the same seed.
+"""
+import argparse
+import os
+import numpy as np
+import nptsne
+
+
+def make_blobs(num_points, num_dimensions, num_clusters, seed=0):
+    """Gaussian clusters with random centers"""
+    rng = np.random.default_rng(seed)
+    centers = rng.uniform(-20, 20, size=(num_clusters, num_dimensions))
+    labels = rng.integers(num_clusters, size=num_points)
+    return (centers[labels] + rng.normal(size=(num_points, num_dimensions))).astype(np.float32)
+
+
+def thread_counts(max_threads):
+    counts = []
+    count = 1
+    while count < max_threads:
+        counts.append(count)
+        count *= 2
+    counts.append(max_threads)
+    return counts
+
+
+def build(X, num_scales, params):
+    """The scale construction seconds and the landmarks of each scale"""
+    hsne = nptsne.HSne(False)
+    hsne.create_hsne(X, num_scales, params=params)
+    phases = hsne.last_run_stats['phase_seconds']
+    seconds = sum(phases[f'scale_{s}'] for s in range(1, num_scales))
+    landmarks = [hsne.get_scale(s).landmark_orig_indexes.copy() for s in range(1, num_scales)]
+    return seconds, landmarks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--points', type=int, default=500000, help='Number of synthetic data points')
+    parser.add_argument('--dimensions', type=int, default=32, help='Dimensions of the synthetic data')
+    parser.add_argument('--clusters', type=int, default=20, help='Number of synthetic clusters')
+    parser.add_argument('--scales', type=int, default=3, help='Number of hsne scales')
+    parser.add_argument('--seed', type=int, default=1, help='Random walk seed')
+    parser.add_argument('--max-threads', type=int, default=os.cpu_count(), help='Largest thread count')
+    args = parser.parse_args()
+
+    X = make_blobs(args.points, args.dimensions, args.clusters)
+    params = nptsne.HSneParameters()
+    params.seed = args.seed
+
+    seconds, landmarks = build(X, args.scales, params)
+    sizes = '/'.join(str(len(scale)) for scale in landmarks)
+    print(f'{"engine":>10} {"threads":>8} {"scales s":>10} {"speedup":>8} {"landmarks":>16} {"identical":>10}')
+    print(f'{"HDILib":>10} {1:>8} {seconds:>10.2f} {"":>8} {sizes:>16} {"":>10}')
+
+    params.parallel_walks = True
+    reference = None
+    single_thread_time = None
+    for threads in thread_counts(args.max_threads):
+        params.num_walk_threads = threads
+        seconds, landmarks = build(X, args.scales, params)
+        if reference is None:
+            reference, single_thread_time = landmarks, seconds
+        identical = all(np.array_equal(a, b) for a, b in zip(reference, landmarks))
+        sizes = '/'.join(str(len(scale)) for scale in landmarks)
+        print(f'{"parallel":>10} {threads:>8} {seconds:>10.2f} {single_thread_time / seconds:>8.2f} '
+              f'{sizes:>16} {str(identical):>10}')
+
+
+if __name__ == '__main__':
+    main()
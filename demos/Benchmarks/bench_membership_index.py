@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""Benchmark the cross scale membership index
+
+Build a synthetic hierarchy, then build, save and load its membership index
+(HSne.build_membership_index). Print the build time and the file size, and
+the time of area of influence queries for growing selections of top scale
+landmarks: Analysis.get_area_of_influence propagating through the scales
+(without the index), the same call answered from the index, the largest
+difference between the two, and the sparse HSne.membership_influence lookup. Also the time to find the representative
+(dominant) landmark of single data points with HSne.dominant_landmarks.
+"""
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+import nptsne
+from nptsne.hsne_analysis import Analysis, EmbedderType
+
+
+def make_blobs(num_points, num_dimensions, num_clusters, seed=0):
+    """Gaussian clusters with random centers"""
+    rng = np.random.default_rng(seed)
+    centers = rng.uniform(-20, 20, size=(num_clusters, num_dimensions))
+    labels = rng.integers(num_clusters, size=num_points)
+    return (centers[labels] + rng.normal(size=(num_points, num_dimensions))).astype(np.float32)
+
+
+def mean_seconds(function, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        function()
+    return (time.perf_counter() - start) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--points', type=int, default=500000, help='Number of synthetic data points')
+    parser.add_argument('--dimensions', type=int, default=32, help='Dimensions of the synthetic data')
+    parser.add_argument('--clusters', type=int, default=20, help='Number of synthetic clusters')
+    parser.add_argument('--scales', type=int, default=3, help='Number of hsne scales')
+    parser.add_argument('--repeats', type=int, default=10, help='Repeats of each query')
+    args = parser.parse_args()
+
+    X = make_blobs(args.points, args.dimensions, args.clusters)
+    hsne = nptsne.HSne(False)
+    hsne.create_hsne(X, args.scales)
+    top = Analysis(hsne, EmbedderType.CPU)
+    top_scale = args.scales - 1
+    print(f'{top.number_of_points} landmarks in the top scale')
+
+    rng = np.random.default_rng(0)
+    selections = {}
+    for fraction in (0.01, 0.1, 0.5):
+        size = max(1, int(fraction * top.number_of_points))
+        selections[size] = sorted(rng.choice(top.number_of_points, size, replace=False).tolist())
+
+    without_index = {size: mean_seconds(lambda: top.get_area_of_influence(selection), args.repeats)
+                     for size, selection in selections.items()}
+    propagated = {size: top.get_area_of_influence(selection) for size, selection in selections.items()}
+
+    start = time.perf_counter()
+    hsne.build_membership_index()
+    build_seconds = time.perf_counter() - start
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.hsne')
+        hsne.save(path, mappable=True)
+        index_bytes = os.path.getsize(path + '.membership')
+        start = time.perf_counter()
+        loaded = nptsne.HSne.open(path)
+        load_seconds = time.perf_counter() - start
+        assert loaded.has_membership_index
+        del loaded
+    print(f'index build {build_seconds:.3f} s, file {index_bytes / 2**20:.1f} MiB, '
+          f'open with index {load_seconds:.3f} s')
+
+    print(f'{"selection":>10} {"propagate ms":>13} {"index ms":>9} {"sparse ms":>10} {"max diff":>9}')
+    for size, selection in selections.items():
+        with_index = mean_seconds(lambda: top.get_area_of_influence(selection), args.repeats)
+        sparse = mean_seconds(lambda: hsne.membership_influence(top_scale, selection), args.repeats)
+        print(f'{size:>10} {1000 * without_index[size]:>13.3f} {1000 * with_index:>9.3f} '
+              f'{1000 * sparse:>10.3f}', end='')
+        difference = np.abs(top.get_area_of_influence(selection) - propagated[size]).max()
+        print(f' {float(difference):>9.2e}')
+
+    points = rng.integers(args.points, size=1000)
+    single = mean_seconds(lambda: [hsne.dominant_landmarks(top_scale, [p]) for p in points], 1) / len(points)
+    print(f'dominant landmark of one point: {1e6 * single:.1f} us')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+"""Benchmark a perplexity sweep from a single kNN
+
+Initialize TextureTsneExtended embedders for several perplexities, once
+with a separate init_transform (and kNN) per perplexity and once with
+TextureTsneExtended.perplexity_sweep. Print the similarity phase times.
+"""
+import argparse
+import time
+import numpy as np
+import nptsne
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--points', type=int, default=50000, help='Number of points')
+    parser.add_argument('--dimensions', type=int, default=64, help='Dimensions of the synthetic data')
+    parser.add_argument('--perplexities', type=int, nargs='+', default=[5, 10, 20, 30, 50])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(args.points, args.dimensions)).astype(np.float32)
+
+    print(f'{"perplexity":>10} {"init_transform s":>18} {"sweep s":>10}')
+    separate = []
+    for perplexity in args.perplexities:
+        tsne = nptsne.TextureTsneExtended(perplexity=perplexity)
+        tsne.init_transform(X)
+        separate.append(tsne.last_run_stats['phase_seconds']['similarities'])
+    start = time.perf_counter()
+    embedders = nptsne.TextureTsneExtended.perplexity_sweep(X, args.perplexities)
+    sweep_wall = time.perf_counter() - start
+    for perplexity, seconds, tsne in zip(args.perplexities, separate, embedders):
+        sweep = tsne.last_run_stats['phase_seconds']['similarities']
+        print(f'{perplexity:>10} {seconds:>18.3f} {sweep:>10.3f}')
+    print(f'{"total":>10} {sum(separate):>18.3f} {sweep_wall:>10.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+"""Benchmark the similarity phase with the on-disk similarity cache
+
+Initialize a TextureTsneExtended on the same data several times, as
+repeated experiment runs with different seeds or iteration counts do.
+Print the similarity phase time without the cache, for the first run
+with the cache (compute and store) and for the following runs (read).
+"""
+import argparse
+import tempfile
+import numpy as np
+import nptsne
+
+
+def similarity_seconds(X, perplexity):
+    tsne = nptsne.TextureTsneExtended(perplexity=perplexity)
+    tsne.init_transform(X)
+    return tsne.last_run_stats['phase_seconds']['similarities']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--points', type=int, default=50000, help='Number of points')
+    parser.add_argument('--dimensions', type=int, default=64, help='Dimensions of the synthetic data')
+    parser.add_argument('--runs', type=int, default=3, help='Number of runs reading the cache')
+    parser.add_argument('--perplexity', type=int, default=30, help='The tSNE perplexity')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(args.points, args.dimensions)).astype(np.float32)
+    print(f'{"run":>12} {"similarities s":>16}')
+    nptsne.set_similarity_cache('')
+    print(f'{"no cache":>12} {similarity_seconds(X, args.perplexity):>16.3f}')
+    with tempfile.TemporaryDirectory() as cache_dir:
+        nptsne.set_similarity_cache(cache_dir)
+        print(f'{"store":>12} {similarity_seconds(X, args.perplexity):>16.3f}')
+        for run in range(args.runs):
+            print(f'{"read " + str(run):>12} {similarity_seconds(X, args.perplexity):>16.3f}')
+        info = nptsne.similarity_cache_info()
+        print(f'cache: {info["num_entries"]} entries, {info["total_bytes"] / 2**20:.1f} MiB, '
+              f'{info["hits"]} hits, {info["misses"]} misses')
+        nptsne.set_similarity_cache('')
+
+
+if __name__ == '__main__':
+    main()
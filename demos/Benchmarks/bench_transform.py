@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+"""Benchmark placing new points in an existing TextureTsneExtended embedding
+
+Embed a synthetic training set, then place batches of new points with
+TextureTsneExtended.transform. Print the time per batch split in the
+neighbor search and the optimization, compared to the time of the full
+embedding.
+"""
+import argparse
+import time
+import numpy as np
+import nptsne
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--points', type=int, default=100000, help='Number of training points')
+    parser.add_argument('--new-points', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--dimensions', type=int, default=50, help='Dimensions of the synthetic data')
+    parser.add_argument('--iterations', type=int, default=1000, help='Iterations of the full embedding')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    centers = rng.normal(scale=5, size=(10, args.dimensions))
+    labels = rng.integers(10, size=args.points + max(args.new_points))
+    data = (centers[labels] + rng.normal(size=(labels.size, args.dimensions))).astype(np.float32)
+    X, X_new = data[:args.points], data[args.points:]
+
+    tsne = nptsne.TextureTsneExtended()
+    start = time.perf_counter()
+    tsne.init_transform(X, keep_data=True)
+    tsne.run_transform(iterations=args.iterations)
+    print(f'full embedding of {args.points} points: {time.perf_counter() - start:.2f} s')
+
+    print(f'{"new points":>10} {"total s":>10} {"knn s":>8} {"descent s":>10}')
+    for num_new in args.new_points:
+        start = time.perf_counter()
+        tsne.transform(X_new[:num_new])
+        total = time.perf_counter() - start
+        phases = tsne.last_run_stats['phase_seconds']
+        print(f'{num_new:>10} {total:>10.2f} {phases["knn"]:>8.2f} {phases["gradient_descent"]:>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -150,10 +150,9 @@ class AnalysisController(QtWidgets.QDialog):
             return
         if not self._stop_iter:
             self.timer_count = self.timer_count + 1
-            for j in range(self.iters_per_frame):
-                self.analysis.do_iteration()
-                self._iter_count = self.timer_count * self.iters_per_frame + j
-                self.status.showMessage(f"Iteration: {self._iter_count}")
+            # All the iterations for this frame are performed in a single native call
+            self._iter_count += self.analysis.run(self.iters_per_frame)
+            self.status.showMessage(f"Iteration: {self._iter_count}")
 
             if self.timer_count == self.num_frames - 1:
                 self._stop_iter = True
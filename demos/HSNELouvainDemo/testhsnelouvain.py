@@ -22,19 +22,10 @@ hsne.create_hsne(X, 3)
 print(f'Num scales: {hsne.num_scales} Num points {hsne.num_data_points}')
 scale2 = hsne.get_scale(2)
 print(f'Num points in scale 2 {scale2.num_points}')
-tmatrix = scale2.transition_matrix
+indptr, col, data = scale2.transition_matrix_csr()
 
-row = []
-col = []
-data = []
-
-for r_ind, rcol in enumerate(tmatrix):
-    for tup in rcol:
-        if not isinstance(tup, tuple):
-            continue
-        row.append(r_ind)
-        col.append(tup[0])
-        data.append(tup[1])
+# Expand the CSR row pointers to one row index per entry
+row = np.repeat(np.arange(scale2.num_points), np.diff(indptr))
 
 def make_nxgraph_from_sparse_data(drow, dcol, weights):
     """Get igraph graph from row cols indexes and weights
@@ -46,7 +37,7 @@ def make_nxgraph_from_sparse_data(drow, dcol, weights):
 
 graph = make_nxgraph_from_sparse_data(row, col, data)
 
-# sparse = coo_matrix((data, (row, col)), shape = (len(tmatrix), len(tmatrix)))
+# sparse = csr_matrix((data, col, indptr), shape = (scale2.num_points, scale2.num_points))
 
 markers = [r'$\alpha$', r'$\beta$', r'$\gamma$', r'$\delta$', r'$\epsilon$', \
             r'$\zeta$', r'$\eta$', r'$\theta$', r'$\iota$', r'$\kappa$', \
@@ -1,12 +1,22 @@
 // Copyright 2020 LKEB at LUMC
 // Author: B. van Lew
 #include "Analysis.h"
+#include "Influence.h"
+#include "Log.h"
 #include <hdi/utils/graph_algorithms.h>
-#include <iostream>
+#include <algorithm>
+#include <chrono>
 #include <memory>
+#include <limits>
 #include <map>
+#include <utility>
 
-uint32_t Analysis::id_counter = 0;
+std::atomic<uint32_t> Analysis::id_counter(0);
+
+namespace {
+    // The walk length of the drill-down influence
+    const int kMaxInfluenceWalkLength = 100;
+}  // namespace
 
 #ifdef __APPLE__
 // building using C++11 on macOS 
@@ -21,7 +31,9 @@ std::unique_ptr<Analysis> Analysis::make_analysis(
     HSne &hsne,
     EmbedderType embedderType,
     Analysis *parent,
-    std::vector<uint32_t> parent_selection) {
+    std::vector<uint32_t> parent_selection,
+    int num_threads,
+    InfluenceType influence_type) {
 #ifdef __APPLE__
     auto result = make_unique<Analysis>();
 #else
@@ -31,39 +43,65 @@ std::unique_ptr<Analysis> Analysis::make_analysis(
     result->parent = parent;
     result->parent_selection = parent_selection;
     result->hsne = hsne._hsne;
+    result->hsne_owner = &hsne;
     result->embedderType = embedderType;
+    result->num_threads = num_threads;
+    result->influence_type = influence_type;
     if (nullptr == parent) {
         // making the toplevel analysis with
         // all toplevel landmarks
-        std::cout << "Initialize num scales: "<< hsne.num_scales() << "\n";
+        NPTSNE_LOG(Debug) << "Initialize num scales: "<< hsne.num_scales();
         result->scale_id = hsne.num_scales() - 1;
-        std::cout << "Get landmark weights\n";
+        NPTSNE_LOG(Debug) << "Get landmark weights";
         // all the landmarks in the scale are in the top level analysis
         result->landmark_weights = hsne.get_scale(result->scale_id).getLandmarkWeight();
         result->landmark_indexes.resize(result->landmark_weights.size());
         std::iota(result->landmark_indexes.begin(), result->landmark_indexes.end(), 0);
-        std::cout << "Initialize embedder\n";
-        std::cout << "Top scale transition matrix size: " <<
-            result->hsne->top_scale()._transition_matrix.size() << "\n";
+        NPTSNE_LOG(Debug) << "Initialize embedder";
+        NPTSNE_LOG(Debug) << "Top scale transition matrix size: " <<
+            result->hsne->top_scale()._transition_matrix.size();
+        nptsne::RunStats::Phase phase(result->last_run_stats, "embedding_init");
         result->initialize_embedding();
     } else {
         // A sub-analysis derived from a parent
         result->scale_id = parent->scale_id - 1;
-        std::cout << "Sub-analysis at scale: " << result->scale_id << "\n";
+        // Scales opened from a mapped file are read on first use
+        hsne.ensure_scale_loaded(result->scale_id);
+        NPTSNE_LOG(Debug) << "Sub-analysis at scale: " << result->scale_id;
         // get the landmarks corresponding to the parent selection
         std::vector<uint32_t> parent_landmark_selection;
         Analysis::get_parent_landmark_selection(*result, parent_landmark_selection);
 
-        std::cout << "Get the influence of these landmarks at the lower scale " << "\n";
-        // From the parent level landmarks perform random walks to
-        // determine the neighboring landmarks at the previous scale
+        NPTSNE_LOG(Debug) << "Get the influence of these landmarks at the lower scale";
+        // From the parent level landmarks determine the neighboring landmarks
+        // at the previous scale: random walks seeded as the hierarchy build
+        // or the walk probabilities computed by sparse matrix products
         std::map<uint32_t, float> parent_neighbor_landmarks;
-        result->hsne->getInfluencedLandmarksInPreviousScale(
-            parent->scale_id,
-            parent_landmark_selection,
-            parent_neighbor_landmarks);
+        {
+            nptsne::RunStats::Phase phase(result->last_run_stats, "influence");
+            if (InfluenceType::MATRIX_POWER == influence_type) {
+                nptsne::matrix_power_influence(
+                    result->hsne->scale(result->scale_id),
+                    result->hsne->scale(parent->scale_id),
+                    parent_landmark_selection,
+                    parent_neighbor_landmarks,
+                    kMaxInfluenceWalkLength,
+                    num_threads);
+            } else {
+                nptsne::walk_influence(
+                    result->hsne->scale(result->scale_id),
+                    result->hsne->scale(parent->scale_id),
+                    parent->scale_id,
+                    parent_landmark_selection,
+                    parent_neighbor_landmarks,
+                    hsne._hsneParams._num_walks_per_landmark,
+                    kMaxInfluenceWalkLength,
+                    hsne._seed,
+                    num_threads);
+            }
+        }
 
-        std::cout << "Filter landmarks with high relevance " << "\n";
+        NPTSNE_LOG(Debug) << "Filter landmarks with high relevance";
         // Use a 0.5 threshold to select relevant landmarks from those found
         std::vector<uint32_t> relevant_landmarks;
         for (auto l : parent_neighbor_landmarks) {
@@ -73,37 +111,131 @@ std::unique_ptr<Analysis> Analysis::make_analysis(
         }
 
         // Get a transition matrix and the landmark weights
-        std::cout << "Get the new transition matrix " << "\n";
+        NPTSNE_LOG(Debug) << "Get the new transition matrix";
         nptsne::SparseScalarMatrixType new_transition_matrix;
-        hdi::utils::extractSubGraph(
-            result->hsne->scale(result->scale_id)._transition_matrix,
-            relevant_landmarks,
-            new_transition_matrix,
-            result->landmark_indexes, 1);
+        {
+            nptsne::RunStats::Phase phase(result->last_run_stats, "subgraph");
+            hdi::utils::extractSubGraph(
+                result->hsne->scale(result->scale_id)._transition_matrix,
+                relevant_landmarks,
+                new_transition_matrix,
+                result->landmark_indexes, 1);
+        }
 
         result->landmark_weights.reserve(result->landmark_indexes.size());
         for (auto id : result->landmark_indexes) {
             result->landmark_weights.push_back(
                 result->hsne->scale(result->scale_id)._landmark_weight[id]);
         }
-        std::cout << "Initialize the embedder" << "\n";
+        NPTSNE_LOG(Debug) << "Initialize the embedder";
         // Initialize the tSNE embedder with this selection to create a 2D embedding
-        result->initialize_embedding(new_transition_matrix);
+        nptsne::RunStats::Phase phase(result->last_run_stats, "embedding_init");
+        // The embedder takes over the sub graph, it is not copied
+        result->initialize_embedding(nptsne::share_matrix(std::move(new_transition_matrix)));
     }
     // Get the indexes for the original data
     for (auto& e : result->landmark_indexes) {
         result->landmarks_orig_data.push_back(
             result->hsne->scale(result->scale_id)._landmark_to_original_data_idx[e]);
     }
-    std::cout << "return new Analysis \n";
+    result->last_run_stats.record_peak_memory();
+    NPTSNE_LOG(Debug) << "return new Analysis";
     return result;
 }
 
 void Analysis::get_parent_landmark_selection(const Analysis& newAnalysis,
     std::vector<uint32_t>& parent_landmark_selection) {
-    std::cout << "Get the landmark indexes of the parent selection \n";
+    NPTSNE_LOG(Debug) << "Get the landmark indexes of the parent selection";
     for (auto i : newAnalysis.parent_selection) {
         parent_landmark_selection.push_back(newAnalysis.parent->landmark_indexes[i]);
     }
 }
 
+
+int Analysis::run(int iterations, double time_budget_ms) {
+    last_run_stats.clear();
+    int done = 0;
+    {
+        nptsne::RunStats::Phase phase(last_run_stats, "gradient_descent");
+        done = run_embedder(iterations, time_budget_ms);
+    }
+    last_run_stats.add_iterations(done);
+    last_run_stats.record_peak_memory();
+    return done;
+}
+
+int Analysis::run_embedder(int iterations, double time_budget_ms) {
+    int done = 0;
+    const bool has_budget = time_budget_ms >= 0;
+    if (!has_budget && EmbedderType::GPU == embedderType) {
+        // Without a time budget the GPU iterations are run in batches,
+        // only the iteration that starts the exaggeration decay is run singly.
+        while (done < iterations) {
+            int count = textureEmbedder.get_iteration_count();
+            int batch = iterations - done;
+            if (count + 1 == remove_exaggeration_iter) {
+                doAnIteration();
+                batch = 1;
+            } else {
+                if (count + 1 < remove_exaggeration_iter) {
+                    batch = std::min(batch, remove_exaggeration_iter - 1 - count);
+                }
+                textureEmbedder.run_iterations(false, batch, false);
+            }
+            done += batch;
+        }
+        return done;
+    }
+
+    auto start = std::chrono::steady_clock::now();
+    while (done < iterations) {
+        doAnIteration();
+        ++done;
+        if (has_budget) {
+            std::chrono::duration<double, std::milli> elapsed = std::chrono::steady_clock::now() - start;
+            if (elapsed.count() >= time_budget_ms) {
+                break;
+            }
+        }
+    }
+    return done;
+}
+
+void Analysis::place_points(
+    const nptsne::SparseScalarMatrixType &membership,
+    std::vector<float> &positions) {
+    auto &embedding = getEmbedding();
+    const size_t dims = embedding.numDimensions();
+    const auto &container = embedding.getContainer();
+    // The embedding row of each landmark of the scale, -1 if not in this analysis
+    uint32_t scale_size = 0;
+    for (auto landmark : landmark_indexes) {
+        scale_size = std::max(scale_size, landmark + 1);
+    }
+    std::vector<int64_t> rows(scale_size, -1);
+    for (size_t r = 0; r < landmark_indexes.size(); ++r) {
+        rows[landmark_indexes[r]] = r;
+    }
+    positions.assign(membership.size() * dims, std::numeric_limits<float>::quiet_NaN());
+    std::vector<double> position(dims);
+    for (size_t i = 0; i < membership.size(); ++i) {
+        std::fill(position.begin(), position.end(), 0.0);
+        double sum_weights = 0;
+        for (const auto &elem : membership[i].memory()) {
+            if (elem.first >= scale_size || rows[elem.first] < 0) {
+                continue;
+            }
+            const float *y = container.data() + rows[elem.first] * dims;
+            for (size_t d = 0; d < dims; ++d) {
+                position[d] += elem.second * y[d];
+            }
+            sum_weights += elem.second;
+        }
+        if (sum_weights <= 0) {
+            continue;
+        }
+        for (size_t d = 0; d < dims; ++d) {
+            positions[i * dims + d] = static_cast<float>(position[d] / sum_weights);
+        }
+    }
+}
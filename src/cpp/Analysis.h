@@ -7,7 +7,9 @@
 #include "SparseTsne.h"
 #include "TextureTsneExtended.h"
 #include "EmbedderType.h"
+#include "InfluenceType.h"
 #include "Types.h"
+#include <atomic>
 #include <cstdint>
 #include <memory>
 #include <vector>
@@ -19,14 +21,17 @@ struct Analysis {
         HSne &hsne,
         EmbedderType embedderType = EmbedderType::CPU,
         Analysis *parent = nullptr,
-        std::vector<uint32_t> parent_selection = std::vector<uint32_t>());
+        std::vector<uint32_t> parent_selection = std::vector<uint32_t>(),
+        int num_threads = 0,
+        InfluenceType influence_type = InfluenceType::WALKS);
 
     static void get_parent_landmark_selection(const Analysis& newAnalysis,
         std::vector<uint32_t>& parent_landmark_selection);
 
     static void reset_id() {id_counter = 0;}
 
-    explicit Analysis(bool verbose = false) : textureEmbedder(verbose), remove_exaggeration_iter(170) {
+    explicit Analysis(bool verbose = false) : num_threads(0), influence_type(InfluenceType::WALKS),
+        textureEmbedder(verbose), remove_exaggeration_iter(170) {
         this->id = Analysis::get_new_id();
     }
 
@@ -37,17 +42,14 @@ struct Analysis {
             std::to_string(scale_id) + "]";
     }
 
+    // Embed the whole scale, the embedder shares the scale transition matrix
     void initialize_embedding() {
-        if (EmbedderType::CPU == embedderType) {
-            embedder.initialize(
-                hsne->scale(scale_id)._transition_matrix, id);
-        } else {
-            textureEmbedder.init_transform_with_distribution(hsne->scale(scale_id)._transition_matrix);
-        }
+        initialize_embedding(hsne_owner->transition_matrix(scale_id));
     }
 
-    void initialize_embedding(nptsne::SparseScalarMatrixType &new_transition_matrix) {
-        if (EmbedderType::CPU == embedderType) {
+    void initialize_embedding(nptsne::SharedSparseMatrixType new_transition_matrix) {
+        if (EmbedderType::GPU != embedderType) {
+            embedder.set_embedder_type(embedderType, num_threads);
             embedder.initialize(
                 new_transition_matrix, id);
         } else {
@@ -56,25 +58,53 @@ struct Analysis {
     }
 
     void doAnIteration() {
-        if (EmbedderType::CPU == embedderType) {
+        if (EmbedderType::GPU != embedderType) {
             embedder.doAnIteration();
         } else {
             if (remove_exaggeration_iter == textureEmbedder.get_iteration_count() + 1) {
                 textureEmbedder.start_exaggeration_decay();
             }
-            textureEmbedder.run_transform(false, 1);
+            textureEmbedder.run_iterations(false, 1, false);
+        }
+    }
+
+    // Acquire the OpenGL context of the GPU embedder on the calling thread,
+    // e.g. the main thread before running the analysis in another thread
+    void prepare_context() {
+        if (EmbedderType::GPU == embedderType) {
+            textureEmbedder.prepare_context();
         }
     }
 
+    // A single iteration, only adds to the iteration count of last_run_stats
+    void do_iteration() {
+        doAnIteration();
+        last_run_stats.add_iterations(1);
+    }
+
+    // Perform up to iterations steps of the embedder in a native loop.
+    // If time_budget_ms is not negative stop when the elapsed time reaches it,
+    // checked after each iteration. A negative budget (the default) is no limit.
+    // Returns the number of iterations performed.
+    int run(int iterations, double time_budget_ms = -1);
+
     nptsne::EmbeddingType& getEmbedding() {
-        if (EmbedderType::CPU == embedderType) {
+        if (EmbedderType::GPU != embedderType) {
             return embedder.getEmbedding();
         }
         return textureEmbedder.getEmbedding();
     }
 
-    nptsne::SparseScalarMatrixType& getTransitionMatrix() {
-        if (EmbedderType::CPU == embedderType) {
+    // Approximate positions of new points in this embedding: the membership
+    // weighted mean of the positions of the analysis landmarks, given the
+    // memberships at this scale (see HSne::project). Points that have no
+    // landmarks in this analysis are NaN. positions is (num. points x dims).
+    void place_points(
+        const nptsne::SparseScalarMatrixType &membership,
+        std::vector<float> &positions);
+
+    const nptsne::SparseScalarMatrixType& getTransitionMatrix() {
+        if (EmbedderType::GPU != embedderType) {
             return embedder.getTransitionMatrix();
         }
         return textureEmbedder.getTransitionMatrix();
@@ -88,13 +118,23 @@ struct Analysis {
     Analysis *parent;  // a selection the parent Analysis defined this analysis
     std::vector<uint32_t> parent_selection;  // indices of the selection within the parent analysis
     EmbedderType embedderType;
+    int num_threads;  // for EmbedderType::CPU_PARALLEL, 0 uses all cores
+    InfluenceType influence_type;  // how the landmarks of a sub-analysis are found
     SparseTsne embedder;
     TextureTsneExtended textureEmbedder;
-    nptsne::HsneType *hsne;
+    // The hierarchy of the analysis, shared so that it outlives a rebuild
+    std::shared_ptr<nptsne::HsneType> hsne;
+    // The owner of the hierarchy, used to read scales from an opened file
+    HSne *hsne_owner;
     int remove_exaggeration_iter;
+    // Phase times, iterations and peak memory of the creation or the last run
+    nptsne::RunStats last_run_stats;
 
  private:
+    // The iteration loop of run
+    int run_embedder(int iterations, double time_budget_ms);
+
     static uint32_t get_new_id() {return id_counter++;}
-    static uint32_t id_counter;
+    static std::atomic<uint32_t> id_counter;
 };
 
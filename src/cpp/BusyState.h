@@ -0,0 +1,99 @@
+// Copyright 2020 LKEB at LUMC
+// Author: B. van Lew
+#pragma once
+
+#include <mutex>
+#include <stdexcept>
+#include <string>
+#include <thread>
+
+namespace nptsne {
+
+// Marks an object as busy with a call that runs in another thread (the
+// *_async methods). Only the thread running the call may use the object,
+// any other use raises std::runtime_error (a RuntimeError in python)
+// instead of racing the running call.
+class BusyState {
+ public:
+    explicit BusyState(const char* name) : _name(name), _busy(false) {}
+
+    BusyState(const BusyState&) = delete;
+    BusyState& operator=(const BusyState&) = delete;
+
+    // Mark busy for a call that is about to be submitted,
+    // throws std::runtime_error if already busy
+    void reserve() {
+        std::lock_guard<std::mutex> lock(_mutex);
+        throw_if_busy();
+        _busy = true;
+        _owner = std::thread::id();
+    }
+
+    // The thread running a reserved call takes it over
+    void adopt() {
+        std::lock_guard<std::mutex> lock(_mutex);
+        _owner = std::this_thread::get_id();
+    }
+
+    void release() {
+        std::lock_guard<std::mutex> lock(_mutex);
+        _busy = false;
+        _owner = std::thread::id();
+    }
+
+    // Throws std::runtime_error if busy with a call in another thread
+    void check() {
+        std::lock_guard<std::mutex> lock(_mutex);
+        if (_owner != std::this_thread::get_id()) {
+            throw_if_busy();
+        }
+    }
+
+ private:
+    friend class BusyGuard;
+
+    void throw_if_busy() const {
+        if (_busy) {
+            throw std::runtime_error(std::string("The ") + _name +
+                " is in use by another thread (e.g. an asynchronous call), wait for it to finish");
+        }
+    }
+
+    std::mutex _mutex;
+    const char* _name;
+    bool _busy;
+    // Default constructed (no thread) while a reserved call is not yet running
+    std::thread::id _owner;
+};
+
+// Marks the object busy for the duration of a (synchronous) call, a call
+// nested in a call of the same thread, e.g. the running asynchronous call,
+// is allowed. Throws std::runtime_error if busy in another thread.
+class BusyGuard {
+ public:
+    explicit BusyGuard(BusyState& state) : _state(state), _owns(false) {
+        std::lock_guard<std::mutex> lock(_state._mutex);
+        if (_state._busy && _state._owner == std::this_thread::get_id()) {
+            return;
+        }
+        _state.throw_if_busy();
+        _state._busy = true;
+        _state._owner = std::this_thread::get_id();
+        _owns = true;
+    }
+
+    ~BusyGuard() {
+        if (_owns) {
+            _state.release();
+        }
+    }
+
+    BusyGuard(const BusyGuard&) = delete;
+    BusyGuard& operator=(const BusyGuard&) = delete;
+
+ private:
+    BusyState& _state;
+    bool _owns;
+};
+
+}  // namespace nptsne
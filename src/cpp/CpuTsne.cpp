@@ -0,0 +1,741 @@
+// Copyright 2020 LKEB at LUMC
+// Author: B. van Lew
+#include "CpuTsne.h"
+#include <algorithm>
+#include <cmath>
+#include <limits>
+#include <stdexcept>
+#include <utility>
+#ifdef _OPENMP
+#include <omp.h>
+#endif
+
+namespace {
+    // Below this cell size (or above this depth) a node is a leaf holding all its points
+    const int kMaxTreeDepth = 24;
+    // The tree starts with a grid of 4^kTopLevels cells
+    const int kTopLevels = 4;
+    const double kMinGain = 0.01;
+    // Interpolation nodes per grid box and dimension
+    const int kInterpolationPoints = 3;
+    // Upper bound on the (padded) FFT size per dimension
+    const int kMaxFftSize = 4096;
+    // Number of columns transformed together in the column pass of the 2-D FFT
+    const int kFftColumnBlock = 8;
+
+    // In place radix-2 FFT of n (a power of two) values, twiddles holds exp(-+2 pi i k / n) for k < n / 2
+    void fft(std::complex<double> *data, int n, const std::vector<std::complex<double>> &twiddles) {
+        for (int i = 1, j = 0; i < n; ++i) {
+            int bit = n >> 1;
+            for (; j & bit; bit >>= 1) {
+                j ^= bit;
+            }
+            j ^= bit;
+            if (i < j) {
+                std::swap(data[i], data[j]);
+            }
+        }
+        for (int len = 2; len <= n; len <<= 1) {
+            const int half = len / 2;
+            const int stride = n / len;
+            for (int i = 0; i < n; i += len) {
+                for (int k = 0; k < half; ++k) {
+                    // Written out, std::complex multiplication checks for infinities
+                    const std::complex<double> u = data[i + k];
+                    const std::complex<double> x = data[i + k + half];
+                    const std::complex<double> w = twiddles[k * stride];
+                    const std::complex<double> v(
+                        x.real() * w.real() - x.imag() * w.imag(),
+                        x.real() * w.imag() + x.imag() * w.real());
+                    data[i + k] = u + v;
+                    data[i + k + half] = u - v;
+                }
+            }
+        }
+    }
+
+    std::vector<std::complex<double>> fft_twiddles(int size, bool inverse) {
+        const double pi = 3.14159265358979323846;
+        std::vector<std::complex<double>> twiddles(size / 2);
+        for (int k = 0; k < size / 2; ++k) {
+            const double angle = (inverse ? 2 : -2) * pi * k / size;
+            twiddles[k] = std::complex<double>(std::cos(angle), std::sin(angle));
+        }
+        return twiddles;
+    }
+
+    // 2-D FFT of a size x size row major grid, the inverse is not normalized.
+    // Only the first num_rows rows are non zero on input (forward)
+    // or needed on output (inverse), the other row transforms are skipped.
+    void fft_2d(std::vector<std::complex<double>> &grid, int size, bool inverse, int num_rows, int num_threads) {
+        const std::vector<std::complex<double>> twiddles = fft_twiddles(size, inverse);
+        auto row_pass = [&]() {
+#pragma omp parallel for schedule(static) num_threads(num_threads)
+            for (int row = 0; row < num_rows; ++row) {
+                fft(&grid[static_cast<size_t>(row) * size], size, twiddles);
+            }
+        };
+        if (!inverse) {
+            row_pass();
+        }
+        // Columns are copied out in blocks to read the grid along rows
+        const int block = std::min(size, kFftColumnBlock);
+#pragma omp parallel num_threads(num_threads)
+        {
+            std::vector<std::complex<double>> columns(static_cast<size_t>(block) * size);
+#pragma omp for schedule(static)
+            for (int first = 0; first < size; first += block) {
+                for (int row = 0; row < size; ++row) {
+                    const std::complex<double> *source = &grid[static_cast<size_t>(row) * size + first];
+                    for (int c = 0; c < block; ++c) {
+                        columns[static_cast<size_t>(c) * size + row] = source[c];
+                    }
+                }
+                for (int c = 0; c < block; ++c) {
+                    fft(&columns[static_cast<size_t>(c) * size], size, twiddles);
+                }
+                for (int row = 0; row < size; ++row) {
+                    std::complex<double> *target = &grid[static_cast<size_t>(row) * size + first];
+                    for (int c = 0; c < block; ++c) {
+                        target[c] = columns[static_cast<size_t>(c) * size + row];
+                    }
+                }
+            }
+        }
+        if (inverse) {
+            row_pass();
+        }
+    }
+
+    // In place spectrum of a real size x size row major grid that is even in both
+    // directions, the spectrum is then real and even as well. Two rows (columns)
+    // are transformed at once as the real and imaginary part of one FFT and only
+    // the first half + 1 rows (columns) are transformed, the others are mirrored.
+    void even_spectrum_2d(std::vector<double> &grid, int size, int num_threads) {
+        const std::vector<std::complex<double>> twiddles = fft_twiddles(size, false);
+        const int half = size / 2;
+        for (int pass = 0; pass < 2; ++pass) {
+            // Pass 0 transforms rows, pass 1 columns
+            const size_t line_step = pass == 0 ? size : 1;
+            const size_t element_step = pass == 0 ? 1 : size;
+#pragma omp parallel num_threads(num_threads)
+            {
+                std::vector<std::complex<double>> line(size);
+#pragma omp for schedule(static)
+                for (int first = 0; first <= half; first += 2) {
+                    double *a = &grid[first * line_step];
+                    double *b = first + 1 <= half ? &grid[(first + 1) * line_step] : nullptr;
+                    for (int k = 0; k < size; ++k) {
+                        line[k] = std::complex<double>(a[k * element_step], b ? b[k * element_step] : 0.0);
+                    }
+                    fft(line.data(), size, twiddles);
+                    for (int k = 0; k < size; ++k) {
+                        a[k * element_step] = line[k].real();
+                        if (b) {
+                            b[k * element_step] = line[k].imag();
+                        }
+                    }
+                }
+            }
+            for (int mirror = half + 1; mirror < size; ++mirror) {
+                for (int k = 0; k < size; ++k) {
+                    grid[mirror * line_step + k * element_step] = grid[(size - mirror) * line_step + k * element_step];
+                }
+            }
+        }
+    }
+
+    // Lagrange weights of the interpolation nodes at t (in box units, 0 <= t <= 1)
+    void lagrange_weights(double t, double *weights) {
+        for (int k = 0; k < kInterpolationPoints; ++k) {
+            const double node_k = (k + 0.5) / kInterpolationPoints;
+            double w = 1;
+            for (int m = 0; m < kInterpolationPoints; ++m) {
+                if (m != k) {
+                    const double node_m = (m + 0.5) / kInterpolationPoints;
+                    w *= (t - node_m) / (node_k - node_m);
+                }
+            }
+            weights[k] = w;
+        }
+    }
+}  // namespace
+
+void nptsne::CpuTsne::set_num_threads(int num_threads) {
+#ifdef _OPENMP
+    if (num_threads <= 0) {
+        num_threads = omp_get_max_threads();
+    }
+#else
+    // Without OpenMP the loops run serially
+    num_threads = 1;
+#endif
+    _num_threads = num_threads;
+}
+
+void nptsne::CpuTsne::initialize(
+    const CsrMatrix<float> &probabilities,
+    float *embedding,
+    const Parameters &params,
+    int num_threads) {
+    const uint64_t num_points = probabilities.num_rows();
+    const std::vector<uint64_t> &indptr = probabilities.indptr();
+    const std::vector<uint32_t> &indices = probabilities.indices();
+    const std::vector<float> &values = probabilities.values();
+    for (auto index : indices) {
+        if (index >= num_points) {
+            throw std::invalid_argument("The sparse matrix must be square, a column index is out of range");
+        }
+    }
+    if (num_points > static_cast<uint64_t>(std::numeric_limits<int>::max())) {
+        throw std::invalid_argument("Too many points for the CPU embedder");
+    }
+    _num_points = num_points;
+    _params = params;
+    set_num_threads(num_threads);
+    const int n = static_cast<int>(num_points);
+
+    // Symmetrize: count the entries per row of P + P^T, fill, then sort and merge each row
+    std::vector<uint64_t> row_count(num_points, 0);
+    for (uint64_t i = 0; i < num_points; ++i) {
+        for (uint64_t k = indptr[i]; k < indptr[i + 1]; ++k) {
+            ++row_count[i];
+            ++row_count[indices[k]];
+        }
+    }
+    std::vector<uint64_t> fill(num_points + 1, 0);
+    for (uint64_t i = 0; i < num_points; ++i) {
+        fill[i + 1] = fill[i] + row_count[i];
+    }
+    std::vector<std::pair<uint32_t, double>> entries(fill[num_points]);
+    std::vector<uint64_t> pos(fill.begin(), fill.end() - 1);
+    double total = 0;
+    for (uint64_t i = 0; i < num_points; ++i) {
+        for (uint64_t k = indptr[i]; k < indptr[i + 1]; ++k) {
+            const uint32_t j = indices[k];
+            entries[pos[i]++] = std::make_pair(j, values[k]);
+            entries[pos[j]++] = std::make_pair(static_cast<uint32_t>(i), values[k]);
+            total += 2.0 * values[k];
+        }
+    }
+    std::vector<uint64_t> merged_count(num_points, 0);
+#pragma omp parallel for schedule(dynamic, 1024) num_threads(_num_threads)
+    for (int i = 0; i < n; ++i) {
+        auto first = entries.begin() + fill[i];
+        auto last = entries.begin() + fill[i + 1];
+        std::sort(first, last, [](const std::pair<uint32_t, double> &a, const std::pair<uint32_t, double> &b) {
+            return a.first < b.first;
+        });
+        // Merge duplicate columns in place
+        auto out = first;
+        for (auto it = first; it != last; ++it) {
+            if (out != first && (out - 1)->first == it->first) {
+                (out - 1)->second += it->second;
+            } else {
+                *out++ = *it;
+            }
+        }
+        merged_count[i] = out - first;
+    }
+    std::vector<uint64_t> p_indptr(num_points + 1, 0);
+    for (uint64_t i = 0; i < num_points; ++i) {
+        p_indptr[i + 1] = p_indptr[i] + merged_count[i];
+    }
+    std::vector<uint32_t> p_indices(p_indptr[num_points]);
+    std::vector<float> p_values(p_indptr[num_points]);
+    const double scale = total > 0 ? 1.0 / total : 0;
+    for (uint64_t i = 0; i < num_points; ++i) {
+        for (uint64_t k = 0; k < merged_count[i]; ++k) {
+            p_indices[p_indptr[i] + k] = entries[fill[i] + k].first;
+            p_values[p_indptr[i] + k] = static_cast<float>(entries[fill[i] + k].second * scale);
+        }
+    }
+    // The merge buffer is no longer needed
+    std::vector<std::pair<uint32_t, double>>().swap(entries);
+    _p = CsrMatrix<float>(std::move(p_indptr), std::move(p_indices), std::move(p_values));
+
+    // A small random initial embedding
+    std::mt19937 generator(params.seed < 0 ? std::random_device()() : static_cast<unsigned int>(params.seed));
+    std::normal_distribution<float> distribution(0, 1e-4f);
+    for (uint64_t i = 0; i < num_points * 2; ++i) {
+        embedding[i] = distribution(generator);
+    }
+
+    _gains.assign(num_points * 2, 1.0f);
+    _update.assign(num_points * 2, 0.0f);
+    _gradient.assign(num_points * 2, 0.0f);
+    _repulsive.assign(num_points * 2, 0.0);
+    _sum_q.assign(num_points, 0.0);
+    if (params.repulsion == Repulsion::FFT) {
+        _point_box.assign(num_points * 2, 0);
+        _point_weights.assign(num_points * 2 * kInterpolationPoints, 0.0);
+    }
+    _iteration = 0;
+    _initialized = true;
+}
+
+double nptsne::CpuTsne::exaggeration() const {
+    if (_iteration < _params.remove_exaggeration_iter) {
+        return _params.exaggeration_factor;
+    }
+    const int decay_iter = std::max(1, _params.exponential_decay_iter);
+    const double remaining = 1.0 - static_cast<double>(_iteration - _params.remove_exaggeration_iter) / decay_iter;
+    return 1.0 + (_params.exaggeration_factor - 1.0) * std::max(0.0, remaining);
+}
+
+void nptsne::CpuTsne::build_tree(const float *embedding) {
+    const int n = static_cast<int>(_num_points);
+    float min_x = std::numeric_limits<float>::max(), min_y = min_x;
+    float max_x = std::numeric_limits<float>::lowest(), max_y = max_x;
+    for (int i = 0; i < n; ++i) {
+        min_x = std::min(min_x, embedding[i * 2]);
+        max_x = std::max(max_x, embedding[i * 2]);
+        min_y = std::min(min_y, embedding[i * 2 + 1]);
+        max_y = std::max(max_y, embedding[i * 2 + 1]);
+    }
+    const float width = std::max(std::max(max_x - min_x, max_y - min_y), 1e-6f) * 1.0001f;
+
+    // Split the bounding square in a fixed grid of top level cells, the subtrees
+    // are built in parallel. The grid does not depend on the number of threads.
+    const int levels = kTopLevels;
+    const int cells_per_side = 1 << levels;
+    const int num_cells = cells_per_side * cells_per_side;
+    const float cell_width = width / cells_per_side;
+    auto cell_of = [&](int i) {
+        int cx = std::min(cells_per_side - 1, static_cast<int>((embedding[i * 2] - min_x) / cell_width));
+        int cy = std::min(cells_per_side - 1, static_cast<int>((embedding[i * 2 + 1] - min_y) / cell_width));
+        return cy * cells_per_side + cx;
+    };
+    // Counting sort of the points by cell
+    std::vector<uint32_t> cell_start(num_cells + 1, 0);
+    std::vector<int> point_cell(n);
+    for (int i = 0; i < n; ++i) {
+        point_cell[i] = cell_of(i);
+        ++cell_start[point_cell[i] + 1];
+    }
+    for (int c = 0; c < num_cells; ++c) {
+        cell_start[c + 1] += cell_start[c];
+    }
+    _tree_points.resize(n);
+    std::vector<uint32_t> cell_pos(cell_start.begin(), cell_start.end() - 1);
+    for (int i = 0; i < n; ++i) {
+        _tree_points[cell_pos[point_cell[i]]++] = i;
+    }
+
+    _subtrees.resize(num_cells);
+#pragma omp parallel for schedule(dynamic, 1) num_threads(_num_threads)
+    for (int c = 0; c < num_cells; ++c) {
+        std::vector<Node> &nodes = _subtrees[c];
+        nodes.clear();
+        nodes.resize(1);
+        Node &root = nodes[0];
+        root.half_width = cell_width / 2;
+        root.center_x = min_x + ((c % cells_per_side) + 0.5f) * cell_width;
+        root.center_y = min_y + ((c / cells_per_side) + 0.5f) * cell_width;
+        build_node(nodes, 0, embedding, cell_start[c], cell_start[c + 1], levels);
+    }
+}
+
+void nptsne::CpuTsne::build_node(
+    std::vector<Node> &nodes,
+    int32_t node_index,
+    const float *embedding,
+    uint32_t begin,
+    uint32_t end,
+    int depth) {
+    {
+        Node &node = nodes[node_index];
+        node.count = end - begin;
+        node.first_child = -1;
+        node.point_begin = begin;
+        node.point_end = end;
+        double sum_x = 0, sum_y = 0;
+        for (uint32_t p = begin; p < end; ++p) {
+            sum_x += embedding[_tree_points[p] * 2];
+            sum_y += embedding[_tree_points[p] * 2 + 1];
+        }
+        node.mass_x = node.count > 0 ? static_cast<float>(sum_x / node.count) : node.center_x;
+        node.mass_y = node.count > 0 ? static_cast<float>(sum_y / node.count) : node.center_y;
+        if (node.count <= 1 || depth >= kMaxTreeDepth) {
+            return;
+        }
+    }
+    const float center_x = nodes[node_index].center_x;
+    const float center_y = nodes[node_index].center_y;
+    const float child_half_width = nodes[node_index].half_width / 2;
+    // Stable partition of the points in the quadrants
+    auto quadrant = [&](uint32_t p) {
+        const uint32_t i = _tree_points[p];
+        return (embedding[i * 2] >= center_x ? 1 : 0) + (embedding[i * 2 + 1] >= center_y ? 2 : 0);
+    };
+    uint32_t quadrant_start[5] = {0, 0, 0, 0, 0};
+    for (uint32_t p = begin; p < end; ++p) {
+        ++quadrant_start[quadrant(p) + 1];
+    }
+    for (int q = 0; q < 4; ++q) {
+        quadrant_start[q + 1] += quadrant_start[q];
+    }
+    std::vector<uint32_t> partitioned(end - begin);
+    uint32_t quadrant_pos[4] = {quadrant_start[0], quadrant_start[1], quadrant_start[2], quadrant_start[3]};
+    for (uint32_t p = begin; p < end; ++p) {
+        partitioned[quadrant_pos[quadrant(p)]++] = _tree_points[p];
+    }
+    std::copy(partitioned.begin(), partitioned.end(), _tree_points.begin() + begin);
+
+    const int32_t first_child = static_cast<int32_t>(nodes.size());
+    nodes.resize(nodes.size() + 4);
+    nodes[node_index].first_child = first_child;
+    for (int q = 0; q < 4; ++q) {
+        Node &child = nodes[first_child + q];
+        child.half_width = child_half_width;
+        child.center_x = center_x + ((q & 1) ? child_half_width : -child_half_width);
+        child.center_y = center_y + ((q & 2) ? child_half_width : -child_half_width);
+    }
+    for (int q = 0; q < 4; ++q) {
+        build_node(nodes, first_child + q, embedding,
+            begin + quadrant_start[q], begin + quadrant_start[q + 1], depth + 1);
+    }
+}
+
+void nptsne::CpuTsne::repulsion(const float *embedding, double y_x, double y_y, uint32_t skip,
+    double *force, double *sum_q) const {
+    const double theta_sq = _params.theta * _params.theta;
+    double f_x = 0, f_y = 0, z = 0;
+    std::vector<int32_t> stack;
+    stack.reserve(64);
+    for (const auto &nodes : _subtrees) {
+        stack.push_back(0);
+        while (!stack.empty()) {
+            const Node &node = nodes[stack.back()];
+            stack.pop_back();
+            if (node.count == 0) {
+                continue;
+            }
+            if (node.first_child < 0) {
+                // Leaf: exact contributions
+                for (uint32_t p = node.point_begin; p < node.point_end; ++p) {
+                    const uint32_t j = _tree_points[p];
+                    if (j == skip) {
+                        continue;
+                    }
+                    const double d_x = y_x - embedding[j * 2];
+                    const double d_y = y_y - embedding[j * 2 + 1];
+                    const double q = 1.0 / (1.0 + d_x * d_x + d_y * d_y);
+                    z += q;
+                    f_x += q * q * d_x;
+                    f_y += q * q * d_y;
+                }
+                continue;
+            }
+            const double d_x = y_x - node.mass_x;
+            const double d_y = y_y - node.mass_y;
+            const double dist_sq = d_x * d_x + d_y * d_y;
+            const double size = 2.0 * node.half_width;
+            if (size * size < theta_sq * dist_sq) {
+                // Far enough: the node acts as a single mass
+                const double q = 1.0 / (1.0 + dist_sq);
+                z += node.count * q;
+                f_x += node.count * q * q * d_x;
+                f_y += node.count * q * q * d_y;
+            } else {
+                for (int q = 0; q < 4; ++q) {
+                    stack.push_back(node.first_child + q);
+                }
+            }
+        }
+    }
+    force[0] = f_x;
+    force[1] = f_y;
+    *sum_q = z;
+}
+
+void nptsne::CpuTsne::fft_repulsion(const float *embedding) {
+    const int n = static_cast<int>(_num_points);
+    const int p = kInterpolationPoints;
+    float min_x = std::numeric_limits<float>::max(), min_y = min_x;
+    float max_x = std::numeric_limits<float>::lowest(), max_y = max_x;
+    for (int i = 0; i < n; ++i) {
+        min_x = std::min(min_x, embedding[i * 2]);
+        max_x = std::max(max_x, embedding[i * 2]);
+        min_y = std::min(min_y, embedding[i * 2 + 1]);
+        max_y = std::max(max_y, embedding[i * 2 + 1]);
+    }
+    const double width = std::max(std::max(max_x - min_x, max_y - min_y), 1e-6f) * 1.0001;
+
+    // The grid has num_boxes * p nodes per dimension, it is zero padded to a power of
+    // two of at least twice that size for the (circular) convolution. The number of
+    // boxes is then raised to fill the padded size.
+    int num_boxes = std::max(_params.min_num_intervals,
+        static_cast<int>(std::ceil(width * _params.intervals_per_integer)));
+    int fft_size = 2;
+    while (fft_size < 2 * num_boxes * p && fft_size < kMaxFftSize) {
+        fft_size <<= 1;
+    }
+    num_boxes = fft_size / (2 * p);
+    const int grid_size = num_boxes * p;
+    const double box_width = width / num_boxes;
+    const double spacing = box_width / p;
+    const size_t fft_cells = static_cast<size_t>(fft_size) * fft_size;
+    // The charges are taken relative to the center of the bounding box,
+    // this limits the cancellation in the expression for Z
+    const double center_x = 0.5 * (static_cast<double>(min_x) + max_x);
+    const double center_y = 0.5 * (static_cast<double>(min_y) + max_y);
+
+    // Spectrum of the squared Cauchy kernel on the (circular) node offsets
+    _kernel_spectrum.resize(fft_cells);
+#pragma omp parallel for schedule(static) num_threads(_num_threads)
+    for (int ky = 0; ky < fft_size; ++ky) {
+        const double d_y = (ky <= fft_size / 2 ? ky : ky - fft_size) * spacing;
+        for (int kx = 0; kx < fft_size; ++kx) {
+            const double d_x = (kx <= fft_size / 2 ? kx : kx - fft_size) * spacing;
+            const double q = 1.0 / (1.0 + d_x * d_x + d_y * d_y);
+            _kernel_spectrum[static_cast<size_t>(ky) * fft_size + kx] = q * q;
+        }
+    }
+    even_spectrum_2d(_kernel_spectrum, fft_size, _num_threads);
+
+    // Box and interpolation weights per point
+#pragma omp parallel for schedule(static) num_threads(_num_threads)
+    for (int i = 0; i < n; ++i) {
+        const double t_x = (embedding[i * 2] - min_x) / box_width;
+        const double t_y = (embedding[i * 2 + 1] - min_y) / box_width;
+        const int b_x = std::min(num_boxes - 1, static_cast<int>(t_x));
+        const int b_y = std::min(num_boxes - 1, static_cast<int>(t_y));
+        _point_box[i * 2] = b_x;
+        _point_box[i * 2 + 1] = b_y;
+        lagrange_weights(t_x - b_x, &_point_weights[i * 2 * p]);
+        lagrange_weights(t_y - b_y, &_point_weights[i * 2 * p + p]);
+    }
+
+    // Spread the charges 1, y_x, y_y and |y|^2 on the grid nodes, in point order
+    const size_t grid_cells = static_cast<size_t>(grid_size) * grid_size;
+    _node_charges.assign(grid_cells * 4, 0.0);
+    for (int i = 0; i < n; ++i) {
+        const double y_x = embedding[i * 2] - center_x;
+        const double y_y = embedding[i * 2 + 1] - center_y;
+        const double charges[4] = {1.0, y_x, y_y, y_x * y_x + y_y * y_y};
+        const double *w_x = &_point_weights[i * 2 * p];
+        const double *w_y = w_x + p;
+        for (int b = 0; b < p; ++b) {
+            const size_t row = static_cast<size_t>(_point_box[i * 2 + 1] * p + b) * grid_size;
+            for (int a = 0; a < p; ++a) {
+                const double w = w_x[a] * w_y[b];
+                double *node = &_node_charges[(row + _point_box[i * 2] * p + a) * 4];
+                for (int c = 0; c < 4; ++c) {
+                    node[c] += w * charges[c];
+                }
+            }
+        }
+    }
+
+    // Convolve with the kernel, two real charge grids per complex transform
+    _node_potentials.assign(grid_cells * 4, 0.0);
+    _fft_grid.resize(fft_cells);
+    const double normalization = 1.0 / static_cast<double>(fft_cells);
+    for (int c = 0; c < 4; c += 2) {
+        std::fill(_fft_grid.begin(), _fft_grid.end(), std::complex<double>(0, 0));
+        for (int gy = 0; gy < grid_size; ++gy) {
+            for (int gx = 0; gx < grid_size; ++gx) {
+                const double *node = &_node_charges[(static_cast<size_t>(gy) * grid_size + gx) * 4];
+                _fft_grid[static_cast<size_t>(gy) * fft_size + gx] = std::complex<double>(node[c], node[c + 1]);
+            }
+        }
+        fft_2d(_fft_grid, fft_size, false, grid_size, _num_threads);
+        for (size_t k = 0; k < fft_cells; ++k) {
+            _fft_grid[k] *= _kernel_spectrum[k];
+        }
+        fft_2d(_fft_grid, fft_size, true, grid_size, _num_threads);
+        for (int gy = 0; gy < grid_size; ++gy) {
+            for (int gx = 0; gx < grid_size; ++gx) {
+                const std::complex<double> value = _fft_grid[static_cast<size_t>(gy) * fft_size + gx] * normalization;
+                double *node = &_node_potentials[(static_cast<size_t>(gy) * grid_size + gx) * 4];
+                node[c] = value.real();
+                node[c + 1] = value.imag();
+            }
+        }
+    }
+
+    // Interpolate the potentials back to the points and form the forces:
+    // F_i = sum_j q_ij^2 (y_i - y_j) and Z_i = sum_j q_ij (excluding j == i)
+#pragma omp parallel for schedule(static) num_threads(_num_threads)
+    for (int i = 0; i < n; ++i) {
+        double phi[4] = {0, 0, 0, 0};
+        const double *w_x = &_point_weights[i * 2 * p];
+        const double *w_y = w_x + p;
+        for (int b = 0; b < p; ++b) {
+            const size_t row = static_cast<size_t>(_point_box[i * 2 + 1] * p + b) * grid_size;
+            for (int a = 0; a < p; ++a) {
+                const double w = w_x[a] * w_y[b];
+                const double *node = &_node_potentials[(row + _point_box[i * 2] * p + a) * 4];
+                for (int c = 0; c < 4; ++c) {
+                    phi[c] += w * node[c];
+                }
+            }
+        }
+        const double y_x = embedding[i * 2] - center_x;
+        const double y_y = embedding[i * 2 + 1] - center_y;
+        _repulsive[i * 2] = y_x * phi[0] - phi[1];
+        _repulsive[i * 2 + 1] = y_y * phi[0] - phi[2];
+        _sum_q[i] = (1.0 + y_x * y_x + y_y * y_y) * phi[0] - 2.0 * (y_x * phi[1] + y_y * phi[2]) + phi[3] - 1.0;
+    }
+}
+
+void nptsne::CpuTsne::doAnIteration(float *embedding) {
+    if (!_initialized) {
+        throw std::runtime_error("The CPU embedder has not been initialized");
+    }
+    const int n = static_cast<int>(_num_points);
+    if (_params.repulsion == Repulsion::FFT) {
+        fft_repulsion(embedding);
+    } else {
+        build_tree(embedding);
+#pragma omp parallel for schedule(dynamic, 256) num_threads(_num_threads)
+        for (int i = 0; i < n; ++i) {
+            repulsion(embedding, embedding[i * 2], embedding[i * 2 + 1], i, &_repulsive[i * 2], &_sum_q[i]);
+        }
+    }
+    // Reduced in point order, independent of the number of threads
+    double sum_q = 0;
+    for (int i = 0; i < n; ++i) {
+        sum_q += _sum_q[i];
+    }
+    const double inv_sum_q = sum_q > 0 ? 1.0 / sum_q : 0;
+    const double exaggeration_factor = exaggeration();
+
+#pragma omp parallel for schedule(dynamic, 256) num_threads(_num_threads)
+    for (int i = 0; i < n; ++i) {
+        const double y_x = embedding[i * 2];
+        const double y_y = embedding[i * 2 + 1];
+        double a_x = 0, a_y = 0;
+        const auto row = _p.row(i);
+        for (uint64_t k = 0; k < row.size; ++k) {
+            const uint32_t j = row.indices[k];
+            const double d_x = y_x - embedding[j * 2];
+            const double d_y = y_y - embedding[j * 2 + 1];
+            const double q = 1.0 / (1.0 + d_x * d_x + d_y * d_y);
+            a_x += row.values[k] * q * d_x;
+            a_y += row.values[k] * q * d_y;
+        }
+        _gradient[i * 2] = static_cast<float>(4.0 * (exaggeration_factor * a_x - _repulsive[i * 2] * inv_sum_q));
+        _gradient[i * 2 + 1] = static_cast<float>(4.0 * (exaggeration_factor * a_y - _repulsive[i * 2 + 1] * inv_sum_q));
+    }
+
+    const float momentum = static_cast<float>(
+        _iteration < _params.mom_switching_iter ? _params.momentum : _params.final_momentum);
+    const float eta = static_cast<float>(_params.eta);
+#pragma omp parallel for schedule(static) num_threads(_num_threads)
+    for (int d = 0; d < n * 2; ++d) {
+        const bool same_sign = (_gradient[d] > 0) == (_update[d] > 0);
+        _gains[d] = same_sign ? _gains[d] * 0.8f : _gains[d] + 0.2f;
+        _gains[d] = std::max(_gains[d], static_cast<float>(kMinGain));
+        _update[d] = momentum * _update[d] - eta * _gains[d] * _gradient[d];
+        embedding[d] += _update[d];
+    }
+
+    // Keep the embedding centered
+    double mean_x = 0, mean_y = 0;
+    for (int i = 0; i < n; ++i) {
+        mean_x += embedding[i * 2];
+        mean_y += embedding[i * 2 + 1];
+    }
+    mean_x /= n;
+    mean_y /= n;
+#pragma omp parallel for schedule(static) num_threads(_num_threads)
+    for (int i = 0; i < n; ++i) {
+        embedding[i * 2] -= static_cast<float>(mean_x);
+        embedding[i * 2 + 1] -= static_cast<float>(mean_y);
+    }
+    ++_iteration;
+}
+
+void nptsne::CpuTsne::project(
+    const float *reference,
+    uint64_t num_reference,
+    const CsrMatrix<float> &probabilities,
+    float *positions,
+    int iterations,
+    const Parameters &params,
+    int num_threads) {
+    const uint64_t num_points = probabilities.num_rows();
+    const std::vector<uint64_t> &indptr = probabilities.indptr();
+    const std::vector<uint32_t> &indices = probabilities.indices();
+    const std::vector<float> &values = probabilities.values();
+    if (num_reference == 0 || num_reference > static_cast<uint64_t>(std::numeric_limits<int>::max()) ||
+        num_points > static_cast<uint64_t>(std::numeric_limits<int>::max())) {
+        throw std::invalid_argument("The number of reference or new points is out of range");
+    }
+    for (auto index : indices) {
+        if (index >= num_reference) {
+            throw std::invalid_argument("A neighbor index is not a reference point");
+        }
+    }
+    // The tree over the reference embedding is built once, it does not move
+    CpuTsne tsne;
+    tsne._num_points = num_reference;
+    tsne._params = params;
+    tsne.set_num_threads(num_threads);
+    tsne.build_tree(reference);
+    const uint32_t no_point = std::numeric_limits<uint32_t>::max();
+    const int n = static_cast<int>(num_points);
+    // Z of the reference embedding. With p_ij ~ p_j|i / N a new point feels the
+    // forces of the full optimization: attraction p_j|i q_ij, repulsion N / Z q_ij^2.
+    const int num_ref = static_cast<int>(num_reference);
+    std::vector<double> ref_sum_q(num_ref);
+#pragma omp parallel for schedule(dynamic, 256) num_threads(tsne._num_threads)
+    for (int j = 0; j < num_ref; ++j) {
+        double force[2];
+        tsne.repulsion(reference, reference[j * 2], reference[j * 2 + 1], j, force, &ref_sum_q[j]);
+    }
+    double sum_q_ref = 0;
+    for (int j = 0; j < num_ref; ++j) {
+        sum_q_ref += ref_sum_q[j];
+    }
+    const double repulsion_scale = sum_q_ref > 0 ? num_reference / sum_q_ref : 0;
+
+    // The new points do not interact: each point runs its own gradient descent
+#pragma omp parallel for schedule(dynamic, 16) num_threads(tsne._num_threads)
+    for (int i = 0; i < n; ++i) {
+        double sum_p = 0;
+        double y[2] = {0, 0};
+        for (uint64_t k = indptr[i]; k < indptr[i + 1]; ++k) {
+            sum_p += values[k];
+            y[0] += values[k] * reference[indices[k] * 2];
+            y[1] += values[k] * reference[indices[k] * 2 + 1];
+        }
+        if (sum_p <= 0) {
+            // No neighbors, no attraction: leave the point at the origin
+            positions[i * 2] = 0;
+            positions[i * 2 + 1] = 0;
+            continue;
+        }
+        const double inv_sum_p = 1.0 / sum_p;
+        // Start at the probability weighted mean of the neighbors
+        y[0] *= inv_sum_p;
+        y[1] *= inv_sum_p;
+        double update[2] = {0, 0};
+        double gains[2] = {1, 1};
+        for (int iter = 0; iter < iterations; ++iter) {
+            double attractive[2] = {0, 0};
+            for (uint64_t k = indptr[i]; k < indptr[i + 1]; ++k) {
+                const double d_x = y[0] - reference[indices[k] * 2];
+                const double d_y = y[1] - reference[indices[k] * 2 + 1];
+                const double q = 1.0 / (1.0 + d_x * d_x + d_y * d_y);
+                attractive[0] += values[k] * q * d_x;
+                attractive[1] += values[k] * q * d_y;
+            }
+            double repulsive[2];
+            double sum_q;
+            tsne.repulsion(reference, y[0], y[1], no_point, repulsive, &sum_q);
+            const double momentum = iter < params.mom_switching_iter ? params.momentum : params.final_momentum;
+            for (int d = 0; d < 2; ++d) {
+                const double gradient = 4.0 * (attractive[d] * inv_sum_p - repulsive[d] * repulsion_scale);
+                const bool same_sign = (gradient > 0) == (update[d] > 0);
+                gains[d] = std::max(same_sign ? gains[d] * 0.8 : gains[d] + 0.2, kMinGain);
+                update[d] = momentum * update[d] - params.eta * gains[d] * gradient;
+                y[d] += update[d];
+            }
+        }
+        positions[i * 2] = static_cast<float>(y[0]);
+        positions[i * 2 + 1] = static_cast<float>(y[1]);
+    }
+}
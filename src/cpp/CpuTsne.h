@@ -0,0 +1,157 @@
+// Copyright 2020 LKEB at LUMC
+// Author: B. van Lew
+#pragma once
+
+// A multi-threaded CPU t-SNE gradient descent on a sparse probability matrix.
+//
+// The attractive forces are computed from the symmetrized sparse matrix,
+// the repulsive forces either with a Barnes-Hut quadtree or by polynomial
+// interpolation on a regular grid where the kernel sums become
+// convolutions evaluated with an FFT (as in FIt-SNE, Linderman et al. 2019).
+// The latter is linear in the number of points.
+// The tree is built in parallel (one subtree per top level cell), the
+// grid charges are spread in point order and all per point work is
+// independent, sums over points are reduced in point order. The result
+// therefore does not depend on the number of threads.
+// Only 2-D embeddings are supported.
+
+#include "CsrMatrix.h"
+#include <complex>
+#include <cstdint>
+#include <random>
+#include <vector>
+
+namespace nptsne {
+
+class CpuTsne {
+ public:
+    enum class Repulsion {
+        BarnesHut,
+        FFT
+    };
+
+    struct Parameters {
+        Repulsion repulsion = Repulsion::BarnesHut;
+        double theta = 0.5;  // Barnes-Hut accuracy
+        int min_num_intervals = 50;  // FFT: minimum number of grid boxes per dimension
+        double intervals_per_integer = 1.0;  // FFT: boxes per unit of embedding extent
+        double exaggeration_factor = 4;
+        int remove_exaggeration_iter = 250;
+        int exponential_decay_iter = 150;
+        int mom_switching_iter = 250;
+        double momentum = 0.5;
+        double final_momentum = 0.8;
+        double eta = 200;
+        int seed = -1;  // negative: random seed
+    };
+
+    CpuTsne() : _num_points(0), _num_threads(0), _iteration(0), _initialized(false) {}
+
+    // The sparse matrix (one row per point), the rows are conditional probabilities.
+    // The embedding (num. points x 2) is randomly initialized.
+    // num_threads 0 uses all available cores.
+    void initialize(
+        const CsrMatrix<float> &probabilities,
+        float *embedding,
+        const Parameters &params,
+        int num_threads = 0);
+
+    // As above for a sparse matrix given as a vector of rows that provide
+    // memory() with (column, value) pairs, such as nptsne::SparseScalarMatrixType
+    template <typename SparseMatrix>
+    void initialize(const SparseMatrix &sparse_matrix, float *embedding, const Parameters &params, int num_threads = 0) {
+        initialize(CsrMatrix<float>::from_rows(sparse_matrix), embedding, params, num_threads);
+    }
+
+    // The optimization parameters of an hdi::dr::TsneParameters
+    template <typename TsneParameters>
+    static Parameters from_tsne_parameters(const TsneParameters &tsne_params) {
+        Parameters params;
+        params.exaggeration_factor = tsne_params._exaggeration_factor;
+        params.remove_exaggeration_iter = tsne_params._remove_exaggeration_iter;
+        params.exponential_decay_iter = tsne_params._exponential_decay_iter;
+        params.mom_switching_iter = tsne_params._mom_switching_iter;
+        params.momentum = tsne_params._momentum;
+        params.final_momentum = tsne_params._final_momentum;
+        params.eta = tsne_params._eta;
+        params.seed = tsne_params._seed;
+        return params;
+    }
+
+    // One gradient descent step on the embedding
+    void doAnIteration(float *embedding);
+
+    // Place new points in a fixed embedding of num_reference points (out-of-sample
+    // extension). Each new point has conditional probabilities over the reference
+    // points (one row per new point). It starts at the probability weighted mean of
+    // its neighbors, then only the new points move under the tSNE forces of the
+    // reference points (without exaggeration), the reference embedding is not changed.
+    // The repulsion uses a Barnes-Hut tree of the reference points. The new points
+    // do not interact, the result does not depend on the number of threads.
+    // The gradient is scaled by the number of reference points: use a learning
+    // rate (params.eta) of about 1, not the 200 of a tSNE.
+    static void project(
+        const float *reference,
+        uint64_t num_reference,
+        const CsrMatrix<float> &probabilities,
+        float *positions,
+        int iterations,
+        const Parameters &params,
+        int num_threads = 0);
+
+    bool isInitialized() const { return _initialized; }
+    int iteration() const { return _iteration; }
+    int num_threads() const { return _num_threads; }
+    // 0 uses all available cores, always 1 without OpenMP
+    void set_num_threads(int num_threads);
+
+ private:
+    // Quadtree node, children are 4 consecutive nodes starting at first_child
+    struct Node {
+        float center_x, center_y, half_width;
+        float mass_x, mass_y;  // center of mass
+        uint32_t count;
+        int32_t first_child;  // -1 for a leaf
+        uint32_t point_begin, point_end;  // range in _tree_points for a leaf
+    };
+
+    void build_tree(const float *embedding);
+    void build_node(std::vector<Node> &nodes, int32_t node_index, const float *embedding,
+        uint32_t begin, uint32_t end, int depth);
+    // Accumulate the repulsive force at (y_x, y_y) and the contribution to Z
+    // of the points in the tree, except point skip
+    void repulsion(const float *embedding, double y_x, double y_y, uint32_t skip,
+        double *force, double *sum_q) const;
+    // Compute the repulsive forces and contributions to Z of all points by grid interpolation
+    void fft_repulsion(const float *embedding);
+    double exaggeration() const;
+
+    uint64_t _num_points;
+    int _num_threads;
+    int _iteration;
+    bool _initialized;
+    Parameters _params;
+
+    // Symmetric joint probabilities
+    CsrMatrix<float> _p;
+
+    std::vector<float> _gains;
+    std::vector<float> _update;
+    std::vector<float> _gradient;
+    std::vector<double> _repulsive;  // per point force x, y
+    std::vector<double> _sum_q;      // per point contribution to Z
+
+    // The tree: one node vector per top level cell
+    std::vector<std::vector<Node>> _subtrees;
+    std::vector<uint32_t> _tree_points;
+
+    // FFT interpolation work space
+    std::vector<double> _kernel_spectrum;
+    std::vector<std::complex<double>> _fft_grid;
+    std::vector<double> _node_charges;    // 4 charges per grid node
+    std::vector<double> _node_potentials;  // 4 potentials per grid node
+    std::vector<uint32_t> _point_box;      // per point box x, y
+    std::vector<double> _point_weights;    // per point interpolation weights x then y
+};
+
+}  // namespace nptsne
@@ -0,0 +1,122 @@
+// Copyright 2020 LKEB at LUMC
+// Author: B. van Lew
+#pragma once
+
+// A sparse matrix in compressed sparse row (CSR) form: three contiguous
+// arrays (row pointers, column indexes and values) instead of one heap
+// allocated map per row as in SparseScalarMatrixType (a std::vector of
+// MapMemEff). Rows are scanned without pointer chasing and the storage is
+// a fixed 8 bytes per row and 8 bytes per entry.
+//
+// The HDILib algorithms (hierarchy construction and the HDILib tSNE engines)
+// work on SparseScalarMatrixType, the nptsne engines on a CsrMatrix that is
+// converted once with from_rows.
+
+#include <cstdint>
+#include <stdexcept>
+#include <string>
+#include <utility>
+#include <vector>
+
+namespace nptsne {
+
+template <typename Value>
+class CsrMatrix {
+ public:
+    using value_type = Value;
+
+    // The non zeros of a row in column order
+    struct Row {
+        const uint32_t *indices;
+        const Value *values;
+        uint64_t size;
+    };
+
+    CsrMatrix() : _indptr(1, 0) {}
+
+    // Take the arrays, throws std::invalid_argument if they are inconsistent
+    CsrMatrix(std::vector<uint64_t> indptr, std::vector<uint32_t> indices, std::vector<Value> values) :
+        _indptr(std::move(indptr)), _indices(std::move(indices)), _values(std::move(values)) {
+        if (_indptr.empty() || _indptr.front() != 0) {
+            throw std::invalid_argument("The row pointers must start with 0");
+        }
+        if (_indices.size() != _values.size() || _indptr.back() != _indices.size()) {
+            throw std::invalid_argument(
+                "The row pointers end at " + std::to_string(_indptr.back()) + " for " +
+                std::to_string(_indices.size()) + " indexes and " + std::to_string(_values.size()) + " values");
+        }
+        for (size_t i = 1; i < _indptr.size(); ++i) {
+            if (_indptr[i] < _indptr[i - 1]) {
+                throw std::invalid_argument("The row pointers must not decrease");
+            }
+        }
+    }
+
+    // From a matrix of rows providing size() and memory() with (column, value)
+    // pairs, such as SparseScalarMatrixType. Each array is allocated once.
+    template <typename Rows>
+    static CsrMatrix from_rows(const Rows &rows) {
+        CsrMatrix result;
+        const uint64_t num_rows = rows.size();
+        result._indptr.assign(num_rows + 1, 0);
+        for (uint64_t i = 0; i < num_rows; ++i) {
+            result._indptr[i + 1] = result._indptr[i] + rows[i].size();
+        }
+        result._indices.resize(result._indptr[num_rows]);
+        result._values.resize(result._indptr[num_rows]);
+        for (uint64_t i = 0; i < num_rows; ++i) {
+            auto pos = result._indptr[i];
+            for (const auto &elem : rows[i].memory()) {
+                result._indices[pos] = elem.first;
+                result._values[pos] = elem.second;
+                ++pos;
+            }
+        }
+        return result;
+    }
+
+    // Fill a matrix of rows, e.g. a SparseScalarMatrixType for HDILib
+    template <typename Rows>
+    void to_rows(Rows &rows) const {
+        rows.clear();
+        rows.resize(num_rows());
+        for (uint64_t i = 0; i < num_rows(); ++i) {
+            for (uint64_t k = _indptr[i]; k < _indptr[i + 1]; ++k) {
+                // In column order, each insert appends to the row
+                rows[i][_indices[k]] = static_cast<float>(_values[k]);
+            }
+        }
+    }
+
+    // A copy with converted values, e.g. CsrMatrix<double>
+    template <typename Other>
+    CsrMatrix<Other> with_values() const {
+        std::vector<Other> values(_values.begin(), _values.end());
+        return CsrMatrix<Other>(_indptr, _indices, std::move(values));
+    }
+
+    uint64_t num_rows() const { return _indptr.size() - 1; }
+    uint64_t num_non_zero() const { return _indices.size(); }
+
+    Row row(uint64_t i) const {
+        return Row{ _indices.data() + _indptr[i], _values.data() + _indptr[i], _indptr[i + 1] - _indptr[i] };
+    }
+
+    const std::vector<uint64_t> &indptr() const { return _indptr; }
+    const std::vector<uint32_t> &indices() const { return _indices; }
+    const std::vector<Value> &values() const { return _values; }
+
+    // The bytes allocated for the arrays
+    uint64_t memory_bytes() const {
+        return _indptr.capacity() * sizeof(uint64_t) +
+            _indices.capacity() * sizeof(uint32_t) +
+            _values.capacity() * sizeof(Value);
+    }
+
+ private:
+    std::vector<uint64_t> _indptr;
+    std::vector<uint32_t> _indices;
+    std::vector<Value> _values;
+};
+
+}  // namespace nptsne
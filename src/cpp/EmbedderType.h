@@ -2,5 +2,7 @@
 
 enum class EmbedderType{
     CPU, 
-    GPU
+    GPU,
+    CPU_PARALLEL,  // multi-threaded Barnes-Hut CPU tSNE
+    CPU_FFT        // multi-threaded FFT interpolation CPU tSNE
 };
\ No newline at end of file
@@ -0,0 +1,58 @@
+// Copyright 2020 LKEB at LUMC
+// Author: B. van Lew
+#pragma once
+
+// Return an embedding to python either as a new flat array or by writing
+// it into a caller provided buffer (the out= argument of the transforms).
+
+#include <pybind11/pybind11.h>
+#include <pybind11/numpy.h>
+#include <algorithm>
+#include <stdexcept>
+namespace py = pybind11;
+
+namespace nptsne {
+    using OutputArrayType = py::array_t<float, py::array::c_style>;
+
+    // Throw std::invalid_argument unless out is None or a writeable, C contiguous
+    // float32 array with size elements (any shape, e.g. (n,) or (n / dims, dims)).
+    // Call before the transform so a bad buffer does not waste a run.
+    inline void check_embedding_out(const py::object& out, py::ssize_t size) {
+        if (out.is_none()) {
+            return;
+        }
+        if (!py::isinstance<OutputArrayType>(out)) {
+            throw std::invalid_argument("out must be a C contiguous numpy array of dtype float32");
+        }
+        auto array = py::reinterpret_borrow<py::array>(out);
+        if (!array.writeable()) {
+            throw std::invalid_argument("out must be writeable");
+        }
+        if (array.size() != size) {
+            throw std::invalid_argument(
+                "out must have " + std::to_string(size) + " elements, not " + std::to_string(array.size()));
+        }
+    }
+
+    // Copy size floats into out (checked with check_embedding_out) and return
+    // it, or into a new flat array if out is None. Requires the GIL.
+    inline OutputArrayType embedding_result(const float* data, py::ssize_t size, const py::object& out) {
+        OutputArrayType result = out.is_none() ?
+            OutputArrayType(size) : py::reinterpret_borrow<OutputArrayType>(out);
+        std::copy(data, data + size, result.mutable_data());
+        return result;
+    }
+
+    // A (num. points, dims) view on an embedding container, owned by base
+    template <typename Embedding>
+    py::array_t<float> embedding_view(Embedding& embedding, py::handle base) {
+        py::ssize_t cols = embedding.numDimensions();
+        py::ssize_t rows = embedding.numDataPoints();
+        py::ssize_t data_size = sizeof(float);
+        return py::array_t<float>(
+            { rows, cols },
+            { cols * data_size, data_size },
+            embedding.getContainer().data(),
+            base);
+    }
+}  // namespace nptsne
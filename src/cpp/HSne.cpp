@@ -1,11 +1,68 @@
 // Copyright 2020 LKEB at LUMC
 // Author: B. van Lew
 #include "HSne.h"
-#include <iostream>
+#include "KnnDistribution.h"
+#include "Log.h"
+#include "ScaleBuilder.h"
+#include <algorithm>
+#include <chrono>
+#include <cstdio>
 #include <fstream>
+#include <map>
 #include <numeric>
 #include <string>
+#include <utility>
 #include <vector>
+#ifdef _OPENMP
+#include <omp.h>
+#endif
+
+namespace {
+    // The membership of the landmarks of a scale from the membership of the
+    // points of the previous scale, through the area of influence (for each
+    // point of the previous scale the influence of the landmarks of the scale).
+    // Each row is normalized to sum to one, the rows are processed in parallel.
+    void propagate_membership(
+        const nptsne::SparseScalarMatrixType &previous,
+        const nptsne::SparseScalarMatrixType &area_of_influence,
+        nptsne::SparseScalarMatrixType &membership,
+        int num_threads) {
+        if (num_threads <= 0) {
+#ifdef _OPENMP
+            num_threads = omp_get_max_threads();
+#else
+            num_threads = 1;
+#endif
+        }
+        const int64_t num_points = static_cast<int64_t>(previous.size());
+        membership.clear();
+        membership.resize(num_points);
+#pragma omp parallel num_threads(num_threads)
+        {
+            std::map<uint32_t, double> weights;
+#pragma omp for schedule(dynamic, 64)
+            for (int64_t i = 0; i < num_points; ++i) {
+                weights.clear();
+                for (const auto &point : previous[i].memory()) {
+                    for (const auto &landmark : area_of_influence[point.first].memory()) {
+                        weights[landmark.first] += static_cast<double>(point.second) * landmark.second;
+                    }
+                }
+                double sum = 0;
+                for (const auto &weight : weights) {
+                    sum += weight.second;
+                }
+                if (sum <= 0) {
+                    continue;
+                }
+                // In landmark order, each insert appends to the row
+                for (const auto &weight : weights) {
+                    membership[i][weight.first] = static_cast<nptsne::ScalarType>(weight.second / sum);
+                }
+            }
+        }
+    }
+}  // namespace
 
 HSne::HSne(
     bool verbose
@@ -16,56 +73,393 @@ _num_target_dimensions(0),
 _verbose(verbose),
 _seed(-1),
 _hsne(nullptr),
-point_ids(nullptr) {
-    set_default_hsne_params();
+point_ids(nullptr),
+_data_source(py::none()),
+_keep_training_data(false),
+_busy("HSne") {
+    set_hsne_params();
 }
 
 
 bool HSne::create_hsne(
     py::array_t<float, py::array::c_style | py::array::forcecast> X,
-    int num_scales) {
+    int num_scales,
+    const HSneParameters *params) {
+    nptsne::BusyGuard busy(_busy);
     py::buffer_info X_info = X.request();
     _num_scales = num_scales;
+    set_hsne_params(params);
     std::vector<uint64_t> point_ids(X_info.shape[0]);
     std::iota(point_ids.begin(), point_ids.end(), 0);
-    return _init(X, point_ids.data(), X_info.shape[0]);
+    _training_data = _keep_training_data ? py::object(X) : py::object();
+    // The input is in a native buffer, the GIL is not needed for the hierarchy build
+    py::gil_scoped_release release;
+    return _init(X_info, point_ids.data(), X_info.shape[0]);
 }
 
 bool HSne::create_hsne(
     py::array_t<float, py::array::c_style | py::array::forcecast> X,
     int num_scales,
-    py::array_t<uint64_t, py::array::c_style | py::array::forcecast> point_ids) {
+    py::array_t<uint64_t, py::array::c_style | py::array::forcecast> point_ids,
+    const HSneParameters *params) {
+    nptsne::BusyGuard busy(_busy);
+    py::buffer_info X_info = X.request();
     _num_scales = num_scales;
+    set_hsne_params(params);
     py::buffer_info point_id_info = point_ids.request();
     int num_point_ids = point_id_info.shape[0];
-    return _init(X, static_cast<uint64_t *>(point_id_info.ptr), num_point_ids);
+    _training_data = _keep_training_data ? py::object(X) : py::object();
+    py::gil_scoped_release release;
+    return _init(X_info, static_cast<uint64_t *>(point_id_info.ptr), num_point_ids);
+}
+
+bool HSne::create_hsne_from_knn(
+    py::array_t<int64_t, py::array::c_style | py::array::forcecast> indices,
+    py::array_t<float, py::array::c_style | py::array::forcecast> distances,
+    int num_scales,
+    const HSneParameters *params) {
+    nptsne::BusyGuard busy(_busy);
+    py::buffer_info indices_info = indices.request();
+    py::buffer_info distances_info = distances.request();
+    if (indices_info.ndim != 2 || indices_info.shape != distances_info.shape) {
+        throw std::invalid_argument(
+            "Expecting indices and distances with the same shape (num. data points, num. neighbors)");
+    }
+    _num_scales = num_scales;
+    set_hsne_params(params);
+    // Without the data new points cannot be projected, unless a data source is set
+    _training_data = py::object();
+    py::gil_scoped_release release;
+    _last_run_stats.clear();
+    try {
+        _num_data_points = indices_info.shape[0];
+        _num_dimensions = 0;  // Not known from the graph
+        // HDILib sets the number of neighbors to three times the perplexity
+        auto num_neighbors = indices_info.shape[1];
+        // The hierarchy is built from this neighborhood, project uses it as well
+        _hsneParams._num_neighbors = static_cast<int>(num_neighbors);
+        nptsne::SparseScalarMatrixType distribution;
+        {
+            nptsne::RunStats::Phase phase(_last_run_stats, "similarities");
+            nptsne::knn_to_distribution(
+                static_cast<int64_t *>(indices_info.ptr),
+                static_cast<float *>(distances_info.ptr),
+                _num_data_points,
+                num_neighbors,
+                std::max(1.0, num_neighbors / 3.0),
+                distribution);
+        }
+
+        _hsne_file.reset();
+        _scale_loaded.clear();
+        _membership_index.reset();
+        // Scale views and shared matrices of the previous hierarchy keep it alive
+        _hsne = std::make_shared<nptsne::HsneType>();
+        _hsne->setLogger(&_log);
+        {
+            nptsne::RunStats::Phase phase(_last_run_stats, "hierarchy_init");
+            _hsne->initialize(distribution, _hsneParams);
+        }
+        _landmarkWeights.assign(_num_scales, nullptr);
+        add_scales();
+    }
+    catch (const std::exception& e) {
+        NPTSNE_LOG(Error) << "Fatal error: " << e.what();
+        return false;
+    }
+    _last_run_stats.record_peak_memory();
+    return true;
+}
+
+bool HSne::create_hsne_chunked(
+    py::object source,
+    int num_scales,
+    int64_t block_rows,
+    const HSneParameters *params,
+    const std::string &scratch) {
+    nptsne::BusyGuard busy(_busy);
+    if (block_rows <= 0) {
+        throw std::invalid_argument("block_rows must be positive");
+    }
+    if (scratch != "disk" && scratch != "memory") {
+        throw std::invalid_argument("scratch must be \"disk\" or \"memory\", not \"" + scratch + "\"");
+    }
+    auto shape = source.attr("shape").cast<std::vector<int64_t>>();
+    if (shape.size() != 2) {
+        throw std::invalid_argument("Expecting the source to have two dimensions, data point and values");
+    }
+    py::module np = py::module::import("numpy");
+    py::object float32 = np.attr("float32");
+    // A float32 C ordered array (or memmap) is used in place
+    if (py::isinstance<py::array_t<float, py::array::c_style>>(source)) {
+        return create_hsne(source.cast<py::array_t<float, py::array::c_style>>(), num_scales, params);
+    }
+
+    py::object converted;
+    py::object scratch_file = py::none();
+    if (scratch == "disk") {
+        // The OS can page the converted data out, it does not add to the resident memory
+        scratch_file = py::module::import("tempfile").attr("TemporaryFile")();
+        converted = np.attr("memmap")(
+            scratch_file,
+            py::arg("dtype") = float32,
+            py::arg("mode") = "w+",
+            py::arg("shape") = py::make_tuple(shape[0], shape[1]));
+    } else {
+        converted = np.attr("empty")(py::make_tuple(shape[0], shape[1]), py::arg("dtype") = float32);
+    }
+    py::object slice = py::module::import("builtins").attr("slice");
+    auto ingest_start = std::chrono::steady_clock::now();
+    for (int64_t start = 0; start < shape[0]; start += block_rows) {
+        py::object rows = slice(start, std::min(start + block_rows, shape[0]));
+        py::object block = np.attr("asarray")(source.attr("__getitem__")(rows), py::arg("dtype") = float32);
+        converted.attr("__setitem__")(rows, block);
+    }
+    std::chrono::duration<double> ingest_time = std::chrono::steady_clock::now() - ingest_start;
+    bool result = create_hsne(converted.cast<py::array_t<float, py::array::c_style>>(), num_scales, params);
+    // create_hsne starts new statistics
+    _last_run_stats.add_time("ingest", ingest_time.count());
+    // The converted copy (or its scratch file) is never kept, projections use the data source
+    _training_data = py::object();
+    converted = py::none();
+    if (!scratch_file.is_none()) {
+        scratch_file.attr("close")();
+    }
+    return result;
 }
 
 bool HSne::load_hsne(
     py::array_t<float, py::array::c_style | py::array::forcecast> X,
     const std::string &filePath) {
+    nptsne::BusyGuard busy(_busy);
     py::buffer_info X_info = X.request();
+    _training_data = _keep_training_data ? py::object(X) : py::object();
+    py::gil_scoped_release release;
     _num_scales = 1;  // Overwrite this when hsne is loaded
     std::vector<uint64_t> point_ids(X_info.shape[0]);
     std::iota(point_ids.begin(), point_ids.end(), 0);
     nptsne::SparseScalarMatrixType dummy_transition_matrix;  // initialize without calculation
-    if (!_init(X, point_ids.data(), X_info.shape[0], &dummy_transition_matrix)) {
+    if (!_init(X_info, point_ids.data(), X_info.shape[0], &dummy_transition_matrix)) {
         return false;
     }
     try {
-        std::ifstream in_stream(filePath, std::ios::binary);
-        hdi::dr::IO::loadHSNE(*_hsne, in_stream, _log);
+        if (nptsne::HSneFile::is_hsne_file(filePath)) {
+            nptsne::HSneFile hsne_file(filePath);
+            _hsne->hierarchy().clear();
+            _hsne->hierarchy().resize(hsne_file.num_scales());
+            for (uint64_t s = 0; s < hsne_file.num_scales(); ++s) {
+                hsne_file.read_scale(s, _hsne->scale(s));
+            }
+        } else {
+            std::ifstream in_stream(filePath, std::ios::binary);
+            hdi::dr::IO::loadHSNE(*_hsne, in_stream, &_log);
+        }
     }
     catch (const std::exception& e) {
-        std::cout << "Fatal error: " << e.what() << std::endl;
+        NPTSNE_LOG(Error) << "Fatal error: " << e.what();
         return false;
     }
     // Get the correct number of scales from the loads hsne
     _num_scales = _hsne->hierarchy().size();
+    _load_membership_index(filePath);
+    return true;
+}
+
+bool HSne::load_hsne(const std::string &filePath) {
+    nptsne::BusyGuard busy(_busy);
+    _training_data = py::object();
+    py::gil_scoped_release release;
+    try {
+        _open_file(filePath, false);
+    }
+    catch (const std::exception& e) {
+        NPTSNE_LOG(Error) << "Fatal error: " << e.what();
+        return false;
+    }
+    _last_run_stats.record_peak_memory();
     return true;
 }
 
+std::unique_ptr<HSne> HSne::open(
+    const std::string &filePath,
+    bool use_mmap,
+    bool verbose,
+    py::object data_source) {
+    std::unique_ptr<HSne> result(new HSne(verbose));
+    {
+        py::gil_scoped_release release;
+        result->_open_file(filePath, use_mmap);
+    }
+    result->_last_run_stats.record_peak_memory();
+    result->set_data_source(data_source);
+    return result;
+}
+
+void HSne::_open_file(const std::string &filePath, bool use_mmap) {
+    _last_run_stats.clear();
+    nptsne::RunStats::Phase phase(_last_run_stats, "load");
+    if (!nptsne::HSneFile::is_hsne_file(filePath)) {
+        // The HDILib format has no index, read it completely
+        std::ifstream in_stream(filePath, std::ios::binary);
+        if (!in_stream) {
+            throw std::runtime_error("Unable to open hierarchy file: " + filePath);
+        }
+        // The HDILib format does not record the dimensions
+        _init_empty(0, 0);
+        hdi::dr::IO::loadHSNE(*_hsne, in_stream, &_log);
+        _num_scales = _hsne->hierarchy().size();
+        _num_data_points = _hsne->scale(0).size();
+        _load_membership_index(filePath);
+        return;
+    }
+
+    std::unique_ptr<nptsne::HSneFile> hsne_file(new nptsne::HSneFile(filePath));
+    auto num_scales = hsne_file->num_scales();
+    _init_empty(hsne_file->num_data_points(), hsne_file->num_dimensions());
+    _num_scales = num_scales;
+    _hsne_file = std::move(hsne_file);
+    // Empty scales, these are filled from the file on first access
+    _hsne->hierarchy().clear();
+    _hsne->hierarchy().resize(num_scales);
+    _scale_loaded.assign(num_scales, false);
+    if (!use_mmap) {
+        ensure_scales_loaded(num_scales - 1);
+    }
+    _load_membership_index(filePath);
+}
+
+void HSne::set_data_source(py::object data_source) {
+    nptsne::BusyGuard busy(_busy);
+    if (!data_source.is_none()) {
+        auto shape = data_source.attr("shape").cast<std::vector<int64_t>>();
+        if (shape.size() != 2) {
+            throw std::invalid_argument("Expecting the data source to have two dimensions, data point and values");
+        }
+        if (_hsne != nullptr && shape[0] != _num_data_points) {
+            throw std::invalid_argument(
+                "The data source has " + std::to_string(shape[0]) +
+                " points, the hierarchy has " + std::to_string(_num_data_points));
+        }
+        if (_num_dimensions == 0) {
+            _num_dimensions = shape[1];
+        }
+        // Projections now use the new source
+        _training_data = py::object();
+    }
+    _data_source = data_source;
+}
+
+void HSne::set_keep_training_data(bool keep) {
+    nptsne::BusyGuard busy(_busy);
+    _keep_training_data = keep;
+    if (!keep) {
+        _training_data = py::object();
+    }
+}
+
+py::array_t<float, py::array::c_style> HSne::training_data() {
+    if (_training_data) {
+        return _training_data.cast<py::array_t<float, py::array::c_style>>();
+    }
+    if (_data_source.is_none()) {
+        throw std::runtime_error(
+            "Projecting new points needs the training data: set a data source "
+            "or keep_training_data before creating the hierarchy");
+    }
+    py::module np = py::module::import("numpy");
+    py::object converted = np.attr("ascontiguousarray")(_data_source, py::arg("dtype") = np.attr("float32"));
+    if (_keep_training_data) {
+        _training_data = converted;
+    }
+    return converted.cast<py::array_t<float, py::array::c_style>>();
+}
+
+std::vector<nptsne::SparseScalarMatrixType> HSne::project(
+    py::array_t<float, py::array::c_style | py::array::forcecast> X_new,
+    int num_threads,
+    int last_scale) {
+    nptsne::BusyGuard busy(_busy);
+    if (_hsne == nullptr) {
+        throw std::runtime_error("The HSne has not been created or loaded");
+    }
+    if (last_scale < 0 || last_scale >= _num_scales) {
+        last_scale = _num_scales - 1;
+    }
+    py::array_t<float, py::array::c_style> training = training_data();
+    py::buffer_info training_info = training.request();
+    py::buffer_info X_info = X_new.request();
+    if (training_info.ndim != 2 || training_info.shape[0] != _num_data_points) {
+        throw std::runtime_error(
+            "The training data does not match the " + std::to_string(_num_data_points) + " points of the hierarchy");
+    }
+    if (X_info.ndim != 2 || X_info.shape[1] != training_info.shape[1]) {
+        throw std::invalid_argument(
+            "Expecting new data with " + std::to_string(training_info.shape[1]) + " values per point");
+    }
+    ensure_scales_loaded(last_scale);
+    const uint64_t num_points = X_info.shape[0];
+    const uint64_t num_reference = training_info.shape[0];
+    const uint64_t num_dimensions = training_info.shape[1];
+    const uint64_t num_neighbors = std::min<uint64_t>(_hsneParams._num_neighbors, num_reference);
+    std::vector<nptsne::SparseScalarMatrixType> result(last_scale + 1);
+    py::gil_scoped_release release;
+    {
+        std::vector<int64_t> indices(num_points * num_neighbors);
+        std::vector<float> distances(num_points * num_neighbors);
+        nptsne::exact_knn(
+            static_cast<const float *>(training_info.ptr), num_reference,
+            static_cast<const float *>(X_info.ptr), num_points,
+            num_dimensions, num_neighbors,
+            indices.data(), distances.data(), num_threads);
+        // The same neighborhood size as the data scale of create_hsne_from_knn
+        nptsne::knn_to_distribution(
+            indices.data(), distances.data(), num_points, num_neighbors,
+            std::max(1.0, num_neighbors / 3.0), result[0], num_reference);
+    }
+    for (int s = 1; s <= last_scale; ++s) {
+        propagate_membership(result[s - 1], _hsne->scale(s)._area_of_influence, result[s], num_threads);
+    }
+    return result;
+}
+
+py::object HSne::get_data(py::array_t<int64_t, py::array::c_style | py::array::forcecast> indexes) {
+    nptsne::BusyGuard busy(_busy);
+    if (_data_source.is_none()) {
+        throw std::runtime_error("No data source has been set");
+    }
+    // Sorted indexes read a memory mapped source front to back,
+    // the rows are returned in the requested order.
+    py::module np = py::module::import("numpy");
+    py::object order = np.attr("argsort")(indexes, py::arg("kind") = "stable");
+    py::object sorted_rows = _data_source.attr("__getitem__")(indexes.attr("__getitem__")(order));
+    py::object result = np.attr("empty_like")(sorted_rows);
+    result.attr("__setitem__")(order, sorted_rows);
+    return result;
+}
+
+void HSne::ensure_scale_loaded(unsigned int scale_number) {
+    std::lock_guard<std::mutex> lock(_scale_load_mutex);
+    if (!_hsne_file || scale_number >= _scale_loaded.size() || _scale_loaded[scale_number]) {
+        return;
+    }
+    _hsne_file->read_scale(scale_number, _hsne->scale(scale_number));
+    _scale_loaded[scale_number] = true;
+    if (std::all_of(_scale_loaded.begin(), _scale_loaded.end(), [](bool loaded) { return loaded; })) {
+        // Everything is in memory, the mapping is no longer needed
+        _hsne_file.reset();
+    }
+}
+
+void HSne::ensure_scales_loaded(unsigned int last_scale) {
+    for (unsigned int s = 0; s <= last_scale; ++s) {
+        ensure_scale_loaded(s);
+    }
+}
+
 int HSne::read_num_scales(const std::string &filePath) {
+    if (nptsne::HSneFile::is_hsne_file(filePath)) {
+        return nptsne::HSneFile(filePath).num_scales();
+    }
     using io_scalar_type = float ;
     using io_unsigned_int_type = float;
 
@@ -92,47 +486,135 @@ int HSne::read_num_scales(const std::string &filePath) {
     return result;
 }
 
-void HSne::save_to_file(const std::string &filePath) {
+void HSne::save_to_file(const std::string &filePath, bool mappable) {
+    nptsne::BusyGuard busy(_busy);
     if (_hsne == nullptr) {
         return;
     }
-    std::ofstream out_stream(filePath, std::ios::binary);
-    hdi::dr::IO::saveHSNE(*_hsne, out_stream, _log);
+    ensure_scales_loaded(_num_scales - 1);
+    if (mappable) {
+        nptsne::HSneFile::save(*_hsne, _num_data_points, _num_dimensions, filePath);
+    } else {
+        std::ofstream out_stream(filePath, std::ios::binary);
+        hdi::dr::IO::saveHSNE(*_hsne, out_stream, &_log);
+    }
+    const std::string indexPath = nptsne::MembershipIndex::path_for(filePath);
+    if (_membership_index) {
+        _membership_index->save(indexPath);
+    } else {
+        // An index of a previous hierarchy saved at this path no longer applies
+        std::remove(indexPath.c_str());
+    }
+}
+
+void HSne::build_membership_index(double min_influence, int num_threads) {
+    nptsne::BusyGuard busy(_busy);
+    if (_hsne == nullptr) {
+        throw std::runtime_error("The HSne has not been created or loaded");
+    }
+    ensure_scales_loaded(_num_scales - 1);
+    nptsne::RunStats::Phase phase(_last_run_stats, "membership_index");
+    _membership_index.reset(new nptsne::MembershipIndex(
+        nptsne::MembershipIndex::build(*_hsne, min_influence, num_threads)));
+}
+
+void HSne::_load_membership_index(const std::string &filePath) {
+    const std::string indexPath = nptsne::MembershipIndex::path_for(filePath);
+    if (!std::ifstream(indexPath, std::ios::binary)) {
+        return;
+    }
+    try {
+        std::unique_ptr<nptsne::MembershipIndex> index(
+            new nptsne::MembershipIndex(nptsne::MembershipIndex::load(indexPath)));
+        bool matches = index->num_scales() == static_cast<uint64_t>(_num_scales) &&
+            index->num_data_points() == static_cast<uint64_t>(_num_data_points);
+        // Compare the landmarks of each scale, from the mapping for the
+        // scales that are not loaded yet
+        uint64_t fingerprint = nptsne::MembershipIndex::kFingerprintBasis;
+        for (unsigned int s = 1; matches && s < _num_scales; ++s) {
+            const uint32_t* landmarks;
+            uint64_t num_landmarks;
+            if (_hsne_file && !_scale_loaded[s]) {
+                landmarks = _hsne_file->landmark_to_original(s, &num_landmarks);
+            } else {
+                const auto& to_original = _hsne->scale(s)._landmark_to_original_data_idx;
+                landmarks = to_original.data();
+                num_landmarks = to_original.size();
+            }
+            matches = index->influence_matrix(s).num_rows() == num_landmarks;
+            fingerprint = nptsne::MembershipIndex::fingerprint(fingerprint, landmarks, num_landmarks);
+        }
+        if (!matches || fingerprint != index->hierarchy_fingerprint()) {
+            NPTSNE_LOG(Warning) << "Ignoring the membership index " << indexPath
+                << ", it does not match the hierarchy";
+            return;
+        }
+        _membership_index = std::move(index);
+    }
+    catch (const std::exception& e) {
+        NPTSNE_LOG(Warning) << "Ignoring the membership index: " << e.what();
+    }
 }
 
 HSneScale HSne::get_scale(unsigned int scale_number) {
-    return HSneScale(_hsne->scale(scale_number));
+    _busy.check();
+    if (_hsne == nullptr) {
+        throw std::runtime_error("The HSne has not been created or loaded");
+    }
+    if (scale_number >= _hsne->hierarchy().size()) {
+        throw std::out_of_range("Scale number " + std::to_string(scale_number) + " is not in the hierarchy");
+    }
+    // A view on the scale - no scale data is copied
+    return HSneScale(*this, _hsne, scale_number);
 }
 
 
+void HSne::_init_empty(int num_data_points, int num_dimensions) {
+    _hsne_file.reset();
+    _scale_loaded.clear();
+    _membership_index.reset();
+    _num_data_points = num_data_points;
+    _num_dimensions = num_dimensions;
+    _hsne = std::make_shared<nptsne::HsneType>();
+    _hsne->setLogger(&_log);
+    _hsne->setDimensionality(_num_dimensions);
+    nptsne::SparseScalarMatrixType dummy_transition_matrix;  // initialize without calculation
+    _hsne->initialize(dummy_transition_matrix, _hsneParams);
+}
+
+// Called without the GIL: only the native buffer in X_info is used
 bool HSne::_init(
-    py::array_t<float, py::array::c_style | py::array::forcecast> &X,
+    const py::buffer_info &X_info,
     uint64_t *point_ids,
     int num_point_ids,
     nptsne::SparseScalarMatrixType *top_scale_matrix) {
-    _log = new hdi::utils::CoutLog();
+    _last_run_stats.clear();
     if (nullptr == point_ids) {
-        std::cout << "No point ids\n";
+        NPTSNE_LOG(Debug) << "No point ids";
     }
 
     try {
-        auto X_loc = X;
-        py::buffer_info X_info = X_loc.request();
         if (X_info.ndim != 2) {
             throw std::runtime_error("Expecting input data to have two dimensions, data point and values");
         }
         _num_data_points = X_info.shape[0];
         _num_dimensions = X_info.shape[1];
 
-        if (_hsne) { delete _hsne; _hsne = NULL; }
-
-        _hsne = new nptsne::HsneType();
-        _hsne->setLogger(_log);
+        _hsne_file.reset();
+        _scale_loaded.clear();
+        _membership_index.reset();
+        // Scale views and shared matrices of the previous hierarchy keep it alive
+        _hsne = std::make_shared<nptsne::HsneType>();
+        _hsne->setLogger(&_log);
         _hsne->setDimensionality(_num_dimensions);
 
         if (top_scale_matrix == nullptr) {
-            _hsne->initialize(static_cast<float *>(X_info.ptr), _num_data_points, _hsneParams);
-            _hsne->statistics().log(_log);
+            {
+                // kNN, probabilities and the data scale
+                nptsne::RunStats::Phase phase(_last_run_stats, "hierarchy_init");
+                _hsne->initialize(static_cast<float *>(X_info.ptr), _num_data_points, _hsneParams);
+            }
+            _hsne->statistics().log(&_log);
 
             _landmarkWeights.resize(_num_scales);
 
@@ -140,34 +622,46 @@ bool HSne::_init(
                 _landmarkWeights[s] = NULL;
             }
 
-            for (int s = 0; s < _num_scales - 1; ++s) {
-                _hsne->addScale();
-            }
+            add_scales();
         } else {
             _hsne->initialize(*top_scale_matrix, _hsneParams);
         }
     }
     catch (const std::exception& e) {
-        std::cout << "Fatal error: " << e.what() << std::endl;
+        NPTSNE_LOG(Error) << "Fatal error: " << e.what();
         return false;
     }
+    _last_run_stats.record_peak_memory();
     return true;
 }
 
-void HSne::set_default_hsne_params() {
-    // TODO(B.van_Lew) add interface for advanced user setting
-    _hsneParams._seed = _seed;
-    _hsneParams._num_walks_per_landmark = 100;
-    _hsneParams._monte_carlo_sampling = true;
-    _hsneParams._mcmcs_num_walks = 15;
-    _hsneParams._mcmcs_landmark_thresh = 1.5;
-    _hsneParams._mcmcs_walk_length = 15;
-    _hsneParams._transition_matrix_prune_thresh = 0;
-    _hsneParams._aknn_num_checks = 512;
-    _hsneParams._out_of_core_computation = true;  // to keep memory footprint small
-    _hsneParams._aknn_algorithm = hdi::dr::knn_library::KNN_FLANN;
-    _hsneParams._aknn_metric = hdi::dr::knn_distance_metric::KNN_METRIC_EUCLIDEAN;
-    _hsneParams._num_neighbors = 90;  // TODO(B.van_lew): set this value via interface or not at all
-    _hsneParams._aknn_num_checks = 256;
-    _hsneParams._aknn_num_trees = 3;
+// Landmark selection, random walks and transition matrix for each scale above the data.
+// The parallel walk engine replaces HDILib for Markov chain Monte Carlo sampling.
+void HSne::add_scales() {
+    const bool parallel_walks = _parallel_walks && _hsneParams._monte_carlo_sampling;
+    for (int s = 1; s < _num_scales; ++s) {
+        nptsne::RunStats::Phase phase(_last_run_stats, "scale_" + std::to_string(s));
+        if (parallel_walks) {
+            nptsne::HsneType::scale_type scale;
+            nptsne::build_scale(_hsne->hierarchy().back(), _hsneParams, _seed, s, scale, _num_walk_threads);
+            _hsne->hierarchy().push_back(std::move(scale));
+        } else {
+            _hsne->addScale();
+        }
+    }
+}
+
+// Use the given parameters or the defaults (the balanced preset)
+void HSne::set_hsne_params(const HSneParameters *params) {
+    if (params != nullptr) {
+        _hsneParams = params->hdi_params();
+        _parallel_walks = params->_parallel_walks;
+        _num_walk_threads = params->_num_walk_threads;
+    } else {
+        HSneParameters defaults;
+        _hsneParams = defaults.hdi_params();
+        _parallel_walks = defaults._parallel_walks;
+        _num_walk_threads = defaults._num_walk_threads;
+    }
+    _seed = _hsneParams._seed;
 }
@@ -6,10 +6,18 @@
 #include <pybind11/numpy.h>
 #include <pybind11/stl_bind.h>
 namespace py = pybind11;
+#include "BusyState.h"
 #include "KnnAlgorithm.h"
+#include "HSneParameters.h"
+#include "HSneFile.h"
+#include "Log.h"
+#include "MembershipIndex.h"
+#include "RunStats.h"
 #include <hdi/dimensionality_reduction/hierarchical_sne.h>
-#include <hdi/utils/cout_log.h>
 #include "Types.h"
+#include <memory>
+#include <mutex>
+#include <stdexcept>
 #include <string>
 #include <vector>
 
@@ -18,6 +26,7 @@ struct Analysis;
 
 class HSne {
     friend Analysis;
+    friend HSneScale;
 
  public:
     // constructor
@@ -26,21 +35,92 @@ class HSne {
 
     // provided two overloaded init_hsne functions
     // One without point ids (these default to 0 -> n-1)
+    // The optional params default to HSneParameters::balanced
     bool create_hsne(
         py::array_t<float, py::array::c_style | py::array::forcecast> X,
-        int num_scales);
+        int num_scales,
+        const HSneParameters *params = nullptr);
 
     bool create_hsne(
         py::array_t<float, py::array::c_style | py::array::forcecast> X,
         int num_scales,
-        py::array_t<uint64_t, py::array::c_style | py::array::forcecast> point_ids);
+        py::array_t<uint64_t, py::array::c_style | py::array::forcecast> point_ids,
+        const HSneParameters *params = nullptr);
+
+    // Create the hierarchy from a precomputed kNN graph, skipping the internal kNN.
+    // indices and (squared euclidean) distances are (num. data points, num. neighbors)
+    bool create_hsne_from_knn(
+        py::array_t<int64_t, py::array::c_style | py::array::forcecast> indices,
+        py::array_t<float, py::array::c_style | py::array::forcecast> distances,
+        int num_scales,
+        const HSneParameters *params = nullptr);
+
+    // Create the hierarchy from an array like source (e.g. a numpy.memmap of any dtype)
+    // that is read and converted to float32 in blocks of block_rows rows.
+    // The converted data is held in a temporary file backed mapping
+    // (scratch "disk") or in memory (scratch "memory").
+    bool create_hsne_chunked(
+        py::object source,
+        int num_scales,
+        int64_t block_rows = 65536,
+        const HSneParameters *params = nullptr,
+        const std::string &scratch = "disk");
 
     bool load_hsne(
         py::array_t<float, py::array::c_style | py::array::forcecast> X,
         const std::string &filePath);
 
-    // save the raw hierarchy data to a file
-    void save_to_file(const std::string &filePath);
+    // Load the hierarchy from the file alone, the original data is not needed
+    bool load_hsne(const std::string &filePath);
+
+    // Open a saved hierarchy without the original data.
+    // A file in the nptsne hierarchy format is memory mapped (if use_mmap)
+    // and each scale is read on first access. The HDILib format is read completely.
+    // The optional data source (e.g. a numpy.memmap) is used for feature lookups.
+    static std::unique_ptr<HSne> open(
+        const std::string &filePath,
+        bool use_mmap = true,
+        bool verbose = false,
+        py::object data_source = py::none());
+
+    // An array like (num. data points, num. dimensions) source of the original
+    // data, indexed only when features are requested. None if not set.
+    py::object data_source() { return _data_source; }
+    void set_data_source(py::object data_source);
+
+    // Keep a reference to the training data of create_hsne and load_hsne
+    // (and the converted data source) for projecting new points. Off by
+    // default: the hierarchy does not hold the data.
+    bool keep_training_data() const { return _keep_training_data; }
+    void set_keep_training_data(bool keep);
+
+    // Rows of the data source for the given original data indexes
+    py::object get_data(py::array_t<int64_t, py::array::c_style | py::array::forcecast> indexes);
+
+    // The landmark memberships of new data points in scales 0 to last_scale
+    // (-1 for all scales). A new point is placed among its exact nearest
+    // neighbors in the training data at scale 0 and propagated up the
+    // hierarchy through the areas of influence. Row i of the matrix for
+    // scale s holds the landmarks of scale s with membership weights
+    // (summing to one) of new point i.
+    std::vector<nptsne::SparseScalarMatrixType> project(
+        py::array_t<float, py::array::c_style | py::array::forcecast> X_new,
+        int num_threads = 0,
+        int last_scale = -1);
+
+    // save the raw hierarchy data to a file, either in the HDILib format
+    // or (if mappable) in the nptsne hierarchy format. A membership index
+    // is saved next to it (see nptsne::MembershipIndex::path_for), without
+    // one an index file left at that path is removed.
+    void save_to_file(const std::string &filePath, bool mappable = false);
+
+    // Build the cross scale membership index of the hierarchy, replacing
+    // any existing index. All scales are read if opened from a file.
+    void build_membership_index(double min_influence = 0, int num_threads = 0);
+
+    // The membership index, null if it has not been built or loaded.
+    // A load or open reads the index saved next to the hierarchy file.
+    const nptsne::MembershipIndex* membership_index() const { return _membership_index.get(); }
 
     // Return scale info in a wrapper class
     HSneScale get_scale(unsigned int scale_number);
@@ -52,6 +132,46 @@ class HSne {
     int num_data_points() { return _num_data_points; }
     int num_dimensions() { return _num_dimensions; }
 
+    // The scale data, this reads the scale from the file if needed
+    nptsne::HsneType::scale_type& scale(unsigned int scale_number) {
+        if (_hsne == nullptr || scale_number >= _hsne->hierarchy().size()) {
+            throw std::out_of_range("Scale number " + std::to_string(scale_number) + " is not in the hierarchy");
+        }
+        _busy.check();
+        ensure_scale_loaded(scale_number);
+        return _hsne->scale(scale_number);
+    }
+
+    // The transition matrix of a scale as a shared handle, it is not copied.
+    // The handle shares ownership of the hierarchy: it stays valid when the
+    // hierarchy is rebuilt or loaded again.
+    nptsne::SharedSparseMatrixType transition_matrix(unsigned int scale_number) {
+        auto &matrix = scale(scale_number)._transition_matrix;
+        return nptsne::SharedSparseMatrixType(_hsne, &matrix);
+    }
+
+    // Read the scale from the mapped file if it has not been read yet
+    void ensure_scale_loaded(unsigned int scale_number);
+
+    // Read scales 0 to last_scale from the mapped file if needed
+    void ensure_scales_loaded(unsigned int last_scale);
+
+    // Phase times and peak memory of the last build or load
+    const nptsne::RunStats& last_run_stats() const { return _last_run_stats; }
+
+    // Set while an asynchronous call (e.g. create_hsne_async) runs, the
+    // hierarchy cannot be used from other threads until it is done
+    nptsne::BusyState& busy_state() { return _busy; }
+
+    // The parameters used for the last hierarchy build
+    HSneParameters parameters() {
+        HSneParameters result;
+        result._params = _hsneParams;
+        result._parallel_walks = _parallel_walks;
+        result._num_walk_threads = _num_walk_threads;
+        return result;
+    }
+
  private:
     int _num_scales;
     int _num_data_points;
@@ -59,49 +179,116 @@ class HSne {
     int _num_target_dimensions;
     bool _verbose;
     int _seed;
-    // The Hierarchical SNE algorithm
-    nptsne::HsneType* _hsne;
+    // The Hierarchical SNE algorithm, shared with the scale views, analyses
+    // and transition matrix handles so that these outlive a rebuild
+    std::shared_ptr<nptsne::HsneType> _hsne;
 
     // Hold the user supplied or default point ids
     py::array_t<uint64_t, py::array::c_style | py::array::forcecast> *point_ids;
 
     nptsne::HsneType::Parameters _hsneParams;
+    bool _parallel_walks;
+    int _num_walk_threads;
 
     std::vector< std::vector<float>* > _landmarkWeights;
 
     // This container holds the landmarks created by HSNE
     nptsne::ScalesContainerType _derivedHierarchy;
 
-    hdi::utils::CoutLog* _log;
+    // Routes the HDILib output to the nptsne log
+    nptsne::HdiLog _log;
+
+    // Set when the hierarchy is opened from a mapped nptsne hierarchy file,
+    // released when all scales have been read.
+    std::unique_ptr<nptsne::HSneFile> _hsne_file;
+    std::vector<bool> _scale_loaded;
+    std::mutex _scale_load_mutex;
+
+    // Reset with the hierarchy
+    std::unique_ptr<nptsne::MembershipIndex> _membership_index;
+
+    // Read the membership index next to the hierarchy file if there is one
+    // that matches the hierarchy
+    void _load_membership_index(const std::string &filePath);
+
+    // The original data, only indexed on request
+    py::object _data_source;
+
+    // The float32 training data for projecting new points. Only held if
+    // _keep_training_data is set: the array the hierarchy was created or
+    // loaded from or the converted data source. Otherwise the data source
+    // is converted for each projection (not copied if it is float32).
+    bool _keep_training_data;
+    py::object _training_data;
+    py::array_t<float, py::array::c_style> training_data();
+
+    nptsne::RunStats _last_run_stats;
+
+    nptsne::BusyState _busy;
+
+    // Add the scales above the data scale, timing each
+    void add_scales();
+
+    // Create an HDILib hierarchy without data, ready to be filled from a file
+    void _init_empty(int num_data_points, int num_dimensions);
+
+    // Read the hierarchy from the file, lazily if it is mappable and use_mmap is set
+    void _open_file(const std::string &filePath, bool use_mmap);
 
     bool _init(
-        py::array_t<float, py::array::c_style | py::array::forcecast> &X,
+        const py::buffer_info &X_info,
         uint64_t *point_ids,
         int num_point_ids,
         nptsne::SparseScalarMatrixType *top_scale_matrix = nullptr);
 
-    void set_default_hsne_params();
+    void set_hsne_params(const HSneParameters *params = nullptr);
 };
 
 
+// A lightweight view of a scale in an HSne.
+// The scale data is not copied. The view shares the hierarchy it was
+// created from, after a rebuild or load of the HSne it still refers to
+// the previous hierarchy. Scales of the current hierarchy are read from
+// the parent HSne on access. The python binding keeps the parent HSne alive
+// for the lifetime of the view.
 class HSneScale {
     friend HSne;
  private:
-    explicit HSneScale(nptsne::HsneType::scale_type scale) :
-        _scale(scale) {
+    HSneScale(HSne& hsne, std::shared_ptr<nptsne::HsneType> hierarchy, unsigned int scale_number) :
+        _hsne(hsne), _hierarchy(std::move(hierarchy)), _scale_number(scale_number) {
     }
  public:
     virtual ~HSneScale() {}
 
     // The length of the transition matrix is the number of points or landmarks
-    int num_points() { return _scale._transition_matrix.size(); }
+    int num_points() { return scale()._transition_matrix.size(); }
 
-    nptsne::SparseScalarMatrixType& transition_matrix() { return _scale._transition_matrix; }
+    nptsne::SparseScalarMatrixType& transition_matrix() { return scale()._transition_matrix; }
 
     nptsne::HsneType::scalar_vector_type& getLandmarkWeight() {
-        return _scale._landmark_weight;
+        return scale()._landmark_weight;
     }
 
-    nptsne::HsneType::scale_type _scale;
-};
+    nptsne::HsneType::scale_type& scale() {
+        if (_scale_number >= _hierarchy->hierarchy().size()) {
+            throw std::out_of_range("Scale number " + std::to_string(_scale_number) + " is not in the hierarchy");
+        }
+        if (_hsne._hsne == _hierarchy) {
+            return _hsne.scale(_scale_number);
+        }
+        // A replaced hierarchy is not read from its file anymore, every scale has points
+        auto &scale = _hierarchy->scale(_scale_number);
+        if (scale._transition_matrix.empty()) {
+            throw std::runtime_error("The hierarchy of scale " + std::to_string(_scale_number) +
+                " was replaced before the scale was read, get the scale again");
+        }
+        return scale;
+    }
+
+    unsigned int scale_number() { return _scale_number; }
 
+ private:
+    HSne& _hsne;
+    std::shared_ptr<nptsne::HsneType> _hierarchy;
+    unsigned int _scale_number;
+};
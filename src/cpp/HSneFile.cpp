@@ -0,0 +1,413 @@
+// Copyright 2020 LKEB at LUMC
+// Author: B. van Lew
+#include "HSneFile.h"
+#include <algorithm>
+#include <cstring>
+#include <fstream>
+#include <stdexcept>
+#include <string>
+#include <vector>
+#ifdef _WIN32
+    #ifndef NOMINMAX
+        #define NOMINMAX
+    #endif
+    #include <windows.h>
+#else
+    #include <fcntl.h>
+    #include <sys/mman.h>
+    #include <sys/stat.h>
+    #include <unistd.h>
+#endif
+
+namespace {
+const char kMagic[8] = {'N', 'P', 'T', 'H', 'S', 'N', 'E', '\0'};
+
+// magic + 2 x uint32 version + 3 x uint64 (points, dimensions, scales)
+const uint64_t kFixedHeaderSize = sizeof(kMagic) + 2 * sizeof(uint32_t) + 3 * sizeof(uint64_t);
+
+// Element sizes of the arrays in nptsne::HSneFile::ScaleArray order
+const uint64_t kElementSize[nptsne::HSneFile::kNumScaleArrays] = {
+    sizeof(uint64_t), sizeof(uint32_t), sizeof(float),
+    sizeof(uint32_t), sizeof(uint32_t), sizeof(float), sizeof(int32_t),
+    sizeof(uint64_t), sizeof(uint32_t), sizeof(float)
+};
+
+uint64_t align(uint64_t offset) {
+    const uint64_t alignment = nptsne::HSneFile::kAlignment;
+    return (offset + alignment - 1) / alignment * alignment;
+}
+
+uint64_t num_non_zero(const nptsne::SparseScalarMatrixType& matrix) {
+    uint64_t result = 0;
+    for (const auto& row : matrix) {
+        result += row.size();
+    }
+    return result;
+}
+
+// Zero padding up to the start of the next array
+void pad_to(std::ofstream& out, uint64_t offset) {
+    static const char zeros[nptsne::HSneFile::kAlignment] = {};
+    uint64_t pos = static_cast<uint64_t>(out.tellp());
+    while (pos < offset) {
+        auto count = std::min(offset - pos, nptsne::HSneFile::kAlignment);
+        out.write(zeros, count);
+        pos += count;
+    }
+}
+
+template <typename T>
+void write_vector(std::ofstream& out, const std::vector<T>& vec) {
+    static_assert(sizeof(T) == 4, "Scale vectors are stored as 32 bit values");
+    out.write(reinterpret_cast<const char*>(vec.data()), vec.size() * sizeof(T));
+}
+
+// Write the three CSR arrays of a sparse matrix starting at the table entries
+void write_csr(std::ofstream& out, const nptsne::SparseScalarMatrixType& matrix, const uint64_t* offsets) {
+    pad_to(out, offsets[0]);
+    uint64_t pos = 0;
+    out.write(reinterpret_cast<const char*>(&pos), sizeof(pos));
+    for (const auto& row : matrix) {
+        pos += row.size();
+        out.write(reinterpret_cast<const char*>(&pos), sizeof(pos));
+    }
+    std::vector<uint32_t> indices;
+    pad_to(out, offsets[1]);
+    for (const auto& row : matrix) {
+        indices.clear();
+        for (const auto& elem : row.memory()) {
+            indices.push_back(elem.first);
+        }
+        out.write(reinterpret_cast<const char*>(indices.data()), indices.size() * sizeof(uint32_t));
+    }
+    std::vector<float> values;
+    pad_to(out, offsets[2]);
+    for (const auto& row : matrix) {
+        values.clear();
+        for (const auto& elem : row.memory()) {
+            values.push_back(elem.second);
+        }
+        out.write(reinterpret_cast<const char*>(values.data()), values.size() * sizeof(float));
+    }
+}
+
+// Fill a sparse matrix from CSR arrays, validating them first: a corrupt
+// file must not index outside the arrays or create columns that do not exist
+void read_csr(const uint64_t* indptr, uint64_t indptr_count,
+    const uint32_t* indices, const float* values, uint64_t nnz,
+    uint64_t num_cols, nptsne::SparseScalarMatrixType& matrix) {
+    if (indptr_count == 0 || indptr[0] != 0 || indptr[indptr_count - 1] > nnz) {
+        throw std::runtime_error("Corrupt sparse matrix in hierarchy file");
+    }
+    for (uint64_t i = 0; i + 1 < indptr_count; ++i) {
+        if (indptr[i + 1] < indptr[i]) {
+            throw std::runtime_error("Corrupt sparse matrix in hierarchy file, row offsets decrease");
+        }
+    }
+    for (uint64_t i = 0; i + 1 < indptr_count; ++i) {
+        for (uint64_t j = indptr[i]; j < indptr[i + 1]; ++j) {
+            if (indices[j] >= num_cols) {
+                throw std::runtime_error("Corrupt sparse matrix in hierarchy file, column out of range");
+            }
+            // The rows are searched by column
+            if (j > indptr[i] && indices[j] <= indices[j - 1]) {
+                throw std::runtime_error("Corrupt sparse matrix in hierarchy file, columns not increasing");
+            }
+        }
+    }
+    matrix.clear();
+    matrix.resize(indptr_count - 1);
+    for (uint64_t i = 0; i + 1 < indptr_count; ++i) {
+        auto& memory = matrix[i].memory();
+        memory.reserve(indptr[i + 1] - indptr[i]);
+        for (uint64_t j = indptr[i]; j < indptr[i + 1]; ++j) {
+            memory.emplace_back(indices[j], values[j]);
+        }
+    }
+}
+
+// A landmark index array must have expected_count (or if allow_empty no)
+// values in [lowest, limit)
+template <typename T>
+void check_index_array(const T* values, uint64_t count, uint64_t expected_count, bool allow_empty,
+    int64_t lowest, uint64_t limit, const char* name) {
+    if (count != expected_count && !(allow_empty && count == 0)) {
+        throw std::runtime_error(std::string("Corrupt hierarchy file, ") + name + " has the wrong length");
+    }
+    for (uint64_t i = 0; i < count; ++i) {
+        if (static_cast<int64_t>(values[i]) < lowest ||
+            (values[i] >= 0 && static_cast<uint64_t>(values[i]) >= limit)) {
+            throw std::runtime_error(std::string("Corrupt hierarchy file, ") + name + " out of range");
+        }
+    }
+}
+}  // namespace
+
+namespace nptsne {
+
+const uint32_t HSneFile::kMajorVersion;
+const uint32_t HSneFile::kMinorVersion;
+const uint64_t HSneFile::kAlignment;
+
+HSneFile::HSneFile(const std::string& filePath) :
+    _data(nullptr),
+    _size(0),
+#ifdef _WIN32
+    _file_handle(nullptr),
+    _mapping_handle(nullptr),
+#else
+    _fd(-1),
+#endif
+    _num_data_points(0),
+    _num_dimensions(0),
+    _num_scales(0) {
+    map(filePath);
+    try {
+        if (_size < kFixedHeaderSize || std::memcmp(_data, kMagic, sizeof(kMagic)) != 0) {
+            throw std::runtime_error("Not an nptsne hierarchy file: " + filePath);
+        }
+        const char* pos = _data + sizeof(kMagic);
+        uint32_t major_version, minor_version;
+        std::memcpy(&major_version, pos, sizeof(uint32_t));
+        pos += sizeof(uint32_t);
+        std::memcpy(&minor_version, pos, sizeof(uint32_t));
+        pos += sizeof(uint32_t);
+        if (major_version != kMajorVersion) {
+            throw std::runtime_error("Unsupported hierarchy file version " + std::to_string(major_version));
+        }
+        std::memcpy(&_num_data_points, pos, sizeof(uint64_t));
+        pos += sizeof(uint64_t);
+        std::memcpy(&_num_dimensions, pos, sizeof(uint64_t));
+        pos += sizeof(uint64_t);
+        std::memcpy(&_num_scales, pos, sizeof(uint64_t));
+        pos += sizeof(uint64_t);
+        if (_num_scales == 0) {
+            throw std::runtime_error("Cannot load an empty hierarchy");
+        }
+        if (_num_scales > (_size - kFixedHeaderSize) / (kNumScaleArrays * sizeof(ArrayEntry))) {
+            throw std::runtime_error("Corrupt hierarchy file header: " + filePath);
+        }
+        _table.resize(_num_scales * kNumScaleArrays);
+        std::memcpy(_table.data(), pos, _table.size() * sizeof(ArrayEntry));
+    }
+    catch (...) {
+        unmap();
+        throw;
+    }
+}
+
+HSneFile::~HSneFile() {
+    unmap();
+}
+
+bool HSneFile::is_hsne_file(const std::string& filePath) {
+    std::ifstream stream(filePath, std::ios::binary);
+    char magic[sizeof(kMagic)] = {};
+    stream.read(magic, sizeof(magic));
+    return stream.good() && std::memcmp(magic, kMagic, sizeof(kMagic)) == 0;
+}
+
+void HSneFile::save(const HsneType& hsne,
+    uint64_t num_data_points,
+    uint64_t num_dimensions,
+    const std::string& filePath) {
+    uint64_t num_scales = hsne.hierarchy().size();
+    // Determine the position of every array before writing
+    std::vector<ArrayEntry> table(num_scales * kNumScaleArrays);
+    uint64_t offset = align(kFixedHeaderSize + table.size() * sizeof(ArrayEntry));
+    for (uint64_t s = 0; s < num_scales; ++s) {
+        const auto& scale = hsne.hierarchy()[s];
+        uint64_t transition_nnz = num_non_zero(scale._transition_matrix);
+        uint64_t influence_nnz = num_non_zero(scale._area_of_influence);
+        uint64_t counts[kNumScaleArrays] = {
+            scale._transition_matrix.size() + 1, transition_nnz, transition_nnz,
+            scale._landmark_to_original_data_idx.size(),
+            scale._landmark_to_previous_scale_idx.size(),
+            scale._landmark_weight.size(),
+            scale._previous_scale_to_landmark_idx.size(),
+            scale._area_of_influence.size() + 1, influence_nnz, influence_nnz
+        };
+        for (int a = 0; a < kNumScaleArrays; ++a) {
+            table[s * kNumScaleArrays + a] = {offset, counts[a]};
+            offset = align(offset + counts[a] * kElementSize[a]);
+        }
+    }
+
+    std::ofstream out(filePath, std::ios::binary | std::ios::trunc);
+    if (!out) {
+        throw std::runtime_error("Unable to write hierarchy file: " + filePath);
+    }
+    uint32_t major_version = kMajorVersion;
+    uint32_t minor_version = kMinorVersion;
+    out.write(kMagic, sizeof(kMagic));
+    out.write(reinterpret_cast<const char*>(&major_version), sizeof(major_version));
+    out.write(reinterpret_cast<const char*>(&minor_version), sizeof(minor_version));
+    out.write(reinterpret_cast<const char*>(&num_data_points), sizeof(num_data_points));
+    out.write(reinterpret_cast<const char*>(&num_dimensions), sizeof(num_dimensions));
+    out.write(reinterpret_cast<const char*>(&num_scales), sizeof(num_scales));
+    out.write(reinterpret_cast<const char*>(table.data()), table.size() * sizeof(ArrayEntry));
+
+    for (uint64_t s = 0; s < num_scales; ++s) {
+        const auto& scale = hsne.hierarchy()[s];
+        const ArrayEntry* entries = &table[s * kNumScaleArrays];
+        uint64_t offsets[kNumScaleArrays];
+        for (int a = 0; a < kNumScaleArrays; ++a) {
+            offsets[a] = entries[a].offset;
+        }
+        write_csr(out, scale._transition_matrix, &offsets[TransitionIndptr]);
+        pad_to(out, offsets[LandmarkToOriginal]);
+        write_vector(out, scale._landmark_to_original_data_idx);
+        pad_to(out, offsets[LandmarkToPrevious]);
+        write_vector(out, scale._landmark_to_previous_scale_idx);
+        pad_to(out, offsets[LandmarkWeight]);
+        write_vector(out, scale._landmark_weight);
+        pad_to(out, offsets[PreviousToLandmark]);
+        write_vector(out, scale._previous_scale_to_landmark_idx);
+        write_csr(out, scale._area_of_influence, &offsets[InfluenceIndptr]);
+    }
+    if (!out) {
+        throw std::runtime_error("Error writing hierarchy file: " + filePath);
+    }
+}
+
+template <typename T>
+const T* HSneFile::array(uint64_t scale_number, ScaleArray which, uint64_t* count) const {
+    const ArrayEntry& entry = _table[scale_number * kNumScaleArrays + which];
+    // Compare with the bytes after the offset, the end of the array may overflow
+    if (entry.offset % sizeof(T) != 0 || entry.offset > _size ||
+        entry.count > (_size - entry.offset) / sizeof(T)) {
+        throw std::runtime_error("Corrupt hierarchy file, array out of bounds");
+    }
+    *count = entry.count;
+    return reinterpret_cast<const T*>(_data + entry.offset);
+}
+
+const uint32_t* HSneFile::landmark_to_original(uint64_t scale_number, uint64_t* count) const {
+    if (scale_number >= _num_scales) {
+        throw std::out_of_range("Scale number " + std::to_string(scale_number) + " is not in the hierarchy");
+    }
+    return array<uint32_t>(scale_number, LandmarkToOriginal, count);
+}
+
+void HSneFile::read_scale(uint64_t scale_number, HsneType::scale_type& scale) const {
+    if (scale_number >= _num_scales) {
+        throw std::out_of_range("Scale number " + std::to_string(scale_number) + " is not in the hierarchy");
+    }
+    uint64_t indptr_count, nnz, num_values, count;
+    {
+        const uint64_t* indptr = array<uint64_t>(scale_number, TransitionIndptr, &indptr_count);
+        const uint32_t* indices = array<uint32_t>(scale_number, TransitionIndices, &nnz);
+        const float* values = array<float>(scale_number, TransitionValues, &num_values);
+        // The transition matrix is square
+        read_csr(indptr, indptr_count, indices, values, std::min(nnz, num_values),
+            indptr_count - 1, scale._transition_matrix);
+    }
+    {
+        const uint64_t* indptr = array<uint64_t>(scale_number, InfluenceIndptr, &indptr_count);
+        const uint32_t* indices = array<uint32_t>(scale_number, InfluenceIndices, &nnz);
+        const float* values = array<float>(scale_number, InfluenceValues, &num_values);
+        // The influence of the landmarks of this scale on the previous scale
+        read_csr(indptr, indptr_count, indices, values, std::min(nnz, num_values),
+            scale._transition_matrix.size(), scale._area_of_influence);
+    }
+    // The landmark indexes are used without checks. The data scale has the
+    // data points as landmarks, its index arrays may be empty.
+    const bool data_scale = scale_number == 0;
+    const uint64_t num_landmarks = scale._transition_matrix.size();
+    uint64_t num_previous = _num_data_points;
+    if (!data_scale) {
+        num_previous = _table[(scale_number - 1) * kNumScaleArrays + TransitionIndptr].count;
+        if (num_previous == 0) {
+            throw std::runtime_error("Corrupt sparse matrix in hierarchy file");
+        }
+        --num_previous;
+    }
+    const uint32_t* to_original = array<uint32_t>(scale_number, LandmarkToOriginal, &count);
+    check_index_array(to_original, count, num_landmarks, data_scale, 0, _num_data_points,
+        "landmark to data index");
+    scale._landmark_to_original_data_idx.assign(to_original, to_original + count);
+    const uint32_t* to_previous = array<uint32_t>(scale_number, LandmarkToPrevious, &count);
+    check_index_array(to_previous, count, num_landmarks, data_scale, 0, num_previous,
+        "landmark to previous scale index");
+    scale._landmark_to_previous_scale_idx.assign(to_previous, to_previous + count);
+    const float* weights = array<float>(scale_number, LandmarkWeight, &count);
+    scale._landmark_weight.assign(weights, weights + count);
+    const int32_t* from_previous = array<int32_t>(scale_number, PreviousToLandmark, &count);
+    check_index_array(from_previous, count, num_previous, data_scale, -1, num_landmarks,
+        "previous scale to landmark index");
+    scale._previous_scale_to_landmark_idx.assign(from_previous, from_previous + count);
+}
+
+#ifdef _WIN32
+void HSneFile::map(const std::string& filePath) {
+    _file_handle = CreateFileA(filePath.c_str(), GENERIC_READ, FILE_SHARE_READ,
+        NULL, OPEN_EXISTING, FILE_ATTRIBUTE_NORMAL, NULL);
+    if (_file_handle == INVALID_HANDLE_VALUE) {
+        _file_handle = nullptr;
+        throw std::runtime_error("Unable to open hierarchy file: " + filePath);
+    }
+    LARGE_INTEGER size;
+    if (!GetFileSizeEx(_file_handle, &size) || size.QuadPart == 0) {
+        unmap();
+        throw std::runtime_error("Unable to read hierarchy file: " + filePath);
+    }
+    _size = static_cast<uint64_t>(size.QuadPart);
+    _mapping_handle = CreateFileMappingA(_file_handle, NULL, PAGE_READONLY, 0, 0, NULL);
+    if (_mapping_handle == NULL) {
+        unmap();
+        throw std::runtime_error("Unable to map hierarchy file: " + filePath);
+    }
+    _data = static_cast<const char*>(MapViewOfFile(_mapping_handle, FILE_MAP_READ, 0, 0, 0));
+    if (_data == nullptr) {
+        unmap();
+        throw std::runtime_error("Unable to map hierarchy file: " + filePath);
+    }
+}
+
+void HSneFile::unmap() {
+    if (_data != nullptr) {
+        UnmapViewOfFile(_data);
+        _data = nullptr;
+    }
+    if (_mapping_handle != nullptr) {
+        CloseHandle(_mapping_handle);
+        _mapping_handle = nullptr;
+    }
+    if (_file_handle != nullptr) {
+        CloseHandle(_file_handle);
+        _file_handle = nullptr;
+    }
+}
+#else
+void HSneFile::map(const std::string& filePath) {
+    _fd = ::open(filePath.c_str(), O_RDONLY);
+    if (_fd < 0) {
+        throw std::runtime_error("Unable to open hierarchy file: " + filePath);
+    }
+    struct stat file_stat;
+    if (fstat(_fd, &file_stat) != 0 || file_stat.st_size == 0) {
+        unmap();
+        throw std::runtime_error("Unable to read hierarchy file: " + filePath);
+    }
+    _size = static_cast<uint64_t>(file_stat.st_size);
+    void* data = mmap(nullptr, _size, PROT_READ, MAP_PRIVATE, _fd, 0);
+    if (data == MAP_FAILED) {
+        unmap();
+        throw std::runtime_error("Unable to map hierarchy file: " + filePath);
+    }
+    _data = static_cast<const char*>(data);
+}
+
+void HSneFile::unmap() {
+    if (_data != nullptr) {
+        munmap(const_cast<char*>(_data), _size);
+        _data = nullptr;
+    }
+    if (_fd >= 0) {
+        ::close(_fd);
+        _fd = -1;
+    }
+}
+#endif
+
+}  // namespace nptsne
@@ -0,0 +1,103 @@
+// Copyright 2020 LKEB at LUMC
+// Author: B. van Lew
+#pragma once
+
+// The nptsne hierarchy file format
+//
+// A versioned binary layout that can be memory mapped. The header
+// contains the data shape and a table with the offset and length of
+// every array in every scale. Sparse matrices are stored in
+// compressed sparse row (CSR) form. This allows a hierarchy to be
+// opened without reading the file, each scale is read from the
+// mapping on first access.
+//
+// Layout (little endian):
+//   char[8]   magic "NPTHSNE\0"
+//   uint32    major version, minor version
+//   uint64    number of data points
+//   uint64    number of dimensions
+//   uint64    number of scales
+//   per scale: kNumScaleArrays x (uint64 offset, uint64 count)
+//   array data, each array aligned to kAlignment bytes
+
+#include "Types.h"
+#include <cstdint>
+#include <string>
+#include <vector>
+
+namespace nptsne {
+
+class HSneFile {
+ public:
+    // The arrays stored per scale, in table order
+    enum ScaleArray {
+        TransitionIndptr = 0,       // uint64, num landmarks + 1
+        TransitionIndices,          // uint32
+        TransitionValues,           // float32
+        LandmarkToOriginal,         // uint32
+        LandmarkToPrevious,         // uint32
+        LandmarkWeight,             // float32
+        PreviousToLandmark,         // int32
+        InfluenceIndptr,            // uint64
+        InfluenceIndices,           // uint32
+        InfluenceValues,            // float32
+        kNumScaleArrays
+    };
+
+    static const uint32_t kMajorVersion = 1;
+    static const uint32_t kMinorVersion = 0;
+    static const uint64_t kAlignment = 64;
+
+    // Map the file and read the header, no scale data is read
+    explicit HSneFile(const std::string& filePath);
+    ~HSneFile();
+
+    HSneFile(const HSneFile&) = delete;
+    HSneFile& operator=(const HSneFile&) = delete;
+
+    // True if the file starts with the nptsne hierarchy magic
+    static bool is_hsne_file(const std::string& filePath);
+
+    // Write the hierarchy in the nptsne hierarchy file format
+    static void save(const HsneType& hsne,
+        uint64_t num_data_points,
+        uint64_t num_dimensions,
+        const std::string& filePath);
+
+    uint64_t num_data_points() const { return _num_data_points; }
+    uint64_t num_dimensions() const { return _num_dimensions; }
+    uint64_t num_scales() const { return _num_scales; }
+
+    // Copy a scale from the mapping into the HDILib scale
+    void read_scale(uint64_t scale_number, HsneType::scale_type& scale) const;
+
+    // The landmarks of a scale as data points, in the mapping (not copied)
+    const uint32_t* landmark_to_original(uint64_t scale_number, uint64_t* count) const;
+
+ private:
+    struct ArrayEntry {
+        uint64_t offset;
+        uint64_t count;
+    };
+
+    template <typename T>
+    const T* array(uint64_t scale_number, ScaleArray which, uint64_t* count) const;
+
+    void map(const std::string& filePath);
+    void unmap();
+
+    const char* _data;
+    uint64_t _size;
+#ifdef _WIN32
+    void* _file_handle;
+    void* _mapping_handle;
+#else
+    int _fd;
+#endif
+    uint64_t _num_data_points;
+    uint64_t _num_dimensions;
+    uint64_t _num_scales;
+    std::vector<ArrayEntry> _table;
+};
+
+}  // namespace nptsne
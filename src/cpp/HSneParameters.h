@@ -0,0 +1,93 @@
+// Copyright 2020 LKEB at LUMC
+// Author: B. van Lew
+#pragma once
+
+#include <hdi/dimensionality_reduction/hierarchical_sne.h>
+#include "KnnAlgorithm.h"
+#include "Types.h"
+#include <stdexcept>
+#include <string>
+
+// The user settable parameters for building an HSne hierarchy.
+// Wraps the HDILib HierarchicalSNE parameters and provides
+// named presets trading build speed against accuracy.
+class HSneParameters {
+ public:
+    // The default values are the balanced preset
+    HSneParameters() : _parallel_walks(false), _num_walk_threads(0) {
+        _params._seed = -1;
+        _params._num_walks_per_landmark = 100;
+        _params._monte_carlo_sampling = true;
+        _params._mcmcs_num_walks = 15;
+        _params._mcmcs_landmark_thresh = 1.5;
+        _params._mcmcs_walk_length = 15;
+        _params._transition_matrix_prune_thresh = 0;
+        _params._out_of_core_computation = true;  // to keep memory footprint small
+        _params._aknn_algorithm = hdi::dr::knn_library::KNN_FLANN;
+        _params._aknn_metric = hdi::dr::knn_distance_metric::KNN_METRIC_EUCLIDEAN;
+        _params._num_neighbors = 90;
+        _params._aknn_num_checks = 256;
+        _params._aknn_num_trees = 3;
+    }
+
+    // Fewer neighbors, checks and random walks: fastest build
+    static HSneParameters fast() {
+        HSneParameters result;
+        result._params._num_neighbors = 30;
+        result._params._aknn_num_trees = 1;
+        result._params._aknn_num_checks = 64;
+        result._params._aknn_algorithm = hdi::dr::knn_library::KNN_HNSW;
+        result._params._num_walks_per_landmark = 50;
+        result._params._mcmcs_num_walks = 10;
+        result._params._mcmcs_walk_length = 10;
+        return result;
+    }
+
+    // The nptsne defaults
+    static HSneParameters balanced() {
+        HSneParameters result;
+        return result;
+    }
+
+    // More neighbors, checks and random walks: best neighborhood preservation
+    static HSneParameters accurate() {
+        HSneParameters result;
+        result._params._num_neighbors = 120;
+        result._params._aknn_num_trees = 4;
+        result._params._aknn_num_checks = 1024;
+        result._params._num_walks_per_landmark = 200;
+        result._params._mcmcs_num_walks = 30;
+        result._params._mcmcs_walk_length = 20;
+        return result;
+    }
+
+    static HSneParameters preset(const std::string& name) {
+        if (name == "fast") {
+            return fast();
+        }
+        if (name == "balanced") {
+            return balanced();
+        }
+        if (name == "accurate") {
+            return accurate();
+        }
+        throw std::invalid_argument("Unknown HSneParameters preset: " + name);
+    }
+
+    KnnAlgorithm get_knn_algorithm() const {
+        return static_cast<KnnAlgorithm>(_params._aknn_algorithm);
+    }
+    void set_knn_algorithm(KnnAlgorithm knn_algorithm) {
+        _params._aknn_algorithm = static_cast<hdi::dr::knn_library>(knn_algorithm);
+    }
+
+    const nptsne::HsneType::Parameters& hdi_params() const { return _params; }
+
+    nptsne::HsneType::Parameters _params;
+
+    // Build the scales with the nptsne parallel random walk engine
+    // (nptsne::build_scale) instead of HierarchicalSNE::addScale
+    bool _parallel_walks;
+    // The threads of the walk engine, 0 uses all available cores
+    int _num_walk_threads;
+};
@@ -0,0 +1,263 @@
+// Copyright 2020 LKEB at LUMC
+// Author: B. van Lew
+#include "Influence.h"
+#include "RandomWalk.h"
+#include <algorithm>
+#include <cmath>
+#include <random>
+#include <stdexcept>
+#include <string>
+#include <utility>
+#ifdef _OPENMP
+#include <omp.h>
+#endif
+
+namespace {
+    const double kTolerance = 1e-6;
+
+    // The selected landmarks of the scale as a mask
+    std::vector<char> selection_mask(
+        const nptsne::HsneType::scale_type &scale,
+        const std::vector<uint32_t> &landmarks) {
+        const uint64_t num_landmarks = scale._landmark_to_previous_scale_idx.size();
+        std::vector<char> selected(num_landmarks, 0);
+        for (auto l : landmarks) {
+            if (l >= num_landmarks) {
+                throw std::invalid_argument("Landmark " + std::to_string(l) + " is not in the scale of " +
+                    std::to_string(num_landmarks) + " landmarks");
+            }
+            selected[l] = 1;
+        }
+        return selected;
+    }
+
+    // The points of the previous scale that are not landmarks and can reach
+    // the selection according to the area of influence (all if there is none)
+    std::vector<uint32_t> influence_region(
+        const nptsne::HsneType::scale_type &previous_scale,
+        const nptsne::HsneType::scale_type &scale,
+        const std::vector<char> &selected) {
+        const auto &landmark_idx = scale._previous_scale_to_landmark_idx;
+        const uint64_t num_points = previous_scale._transition_matrix.size();
+        if (landmark_idx.size() != num_points) {
+            throw std::runtime_error("The scale has " + std::to_string(landmark_idx.size()) +
+                " previous scale points, the previous scale " + std::to_string(num_points));
+        }
+        const auto &area_of_influence = scale._area_of_influence;
+        const bool use_area_of_influence = area_of_influence.size() == num_points;
+        std::vector<uint32_t> region;
+        for (uint64_t i = 0; i < num_points; ++i) {
+            if (landmark_idx[i] >= 0) {
+                continue;
+            }
+            if (use_area_of_influence) {
+                const auto &row = area_of_influence[i].memory();
+                if (std::none_of(row.begin(), row.end(),
+                    [&selected](const nptsne::MapStorageType::value_type &elem) {
+                        return selected[elem.first] != 0;
+                    })) {
+                    continue;
+                }
+            }
+            region.push_back(static_cast<uint32_t>(i));
+        }
+        return region;
+    }
+
+    int resolve_num_threads(int num_threads) {
+        if (num_threads <= 0) {
+#ifdef _OPENMP
+            num_threads = omp_get_max_threads();
+#else
+            num_threads = 1;
+#endif
+        }
+        return num_threads;
+    }
+}  // namespace
+
+namespace nptsne {
+
+void matrix_power_influence(
+    const HsneType::scale_type &previous_scale,
+    const HsneType::scale_type &scale,
+    const std::vector<uint32_t> &landmarks,
+    std::map<uint32_t, ScalarType> &influenced,
+    int max_walk_length,
+    int num_threads) {
+    num_threads = resolve_num_threads(num_threads);
+    const auto &matrix = previous_scale._transition_matrix;
+    const auto &landmark_idx = scale._previous_scale_to_landmark_idx;
+    const uint64_t num_points = matrix.size();
+    const std::vector<char> selected = selection_mask(scale, landmarks);
+    const std::vector<uint32_t> region = influence_region(previous_scale, scale, selected);
+    std::vector<int64_t> local(num_points, -1);
+    for (uint64_t r = 0; r < region.size(); ++r) {
+        local[region[r]] = static_cast<int64_t>(r);
+    }
+
+    // The walk probabilities restricted to the region: a step to a selected
+    // landmark ends the walk (the constant b), a step to another landmark or
+    // out of the region does not contribute
+    const int64_t num_region = static_cast<int64_t>(region.size());
+    std::vector<double> base(num_region, 0);
+    std::vector<uint64_t> indptr(num_region + 1, 0);
+    std::vector<uint32_t> indices;
+    std::vector<double> values;
+    for (int64_t r = 0; r < num_region; ++r) {
+        const auto &row = matrix[region[r]].memory();
+        double row_sum = 0;
+        for (const auto &elem : row) {
+            row_sum += elem.second;
+        }
+        if (row_sum > 0) {
+            for (const auto &elem : row) {
+                const double p = elem.second / row_sum;
+                if (landmark_idx[elem.first] >= 0) {
+                    if (selected[landmark_idx[elem.first]]) {
+                        base[r] += p;
+                    }
+                } else if (local[elem.first] >= 0) {
+                    indices.push_back(static_cast<uint32_t>(local[elem.first]));
+                    values.push_back(p);
+                }
+            }
+        }
+        indptr[r + 1] = indices.size();
+    }
+    const CsrMatrix<double> walk(std::move(indptr), std::move(indices), std::move(values));
+
+    // One step walks, then a step more per product
+    std::vector<double> influence(base);
+    std::vector<double> next(num_region);
+    for (int step = 1; step < max_walk_length; ++step) {
+#pragma omp parallel for num_threads(num_threads) schedule(dynamic, 256)
+        for (int64_t r = 0; r < num_region; ++r) {
+            const auto row = walk.row(r);
+            double value = base[r];
+            for (uint64_t k = 0; k < row.size; ++k) {
+                value += row.values[k] * influence[row.indices[k]];
+            }
+            next[r] = value;
+        }
+        double change = 0;
+        for (int64_t r = 0; r < num_region; ++r) {
+            change = std::max(change, std::abs(next[r] - influence[r]));
+        }
+        influence.swap(next);
+        if (change < kTolerance) {
+            break;
+        }
+    }
+
+    influenced.clear();
+    for (auto l : landmarks) {
+        influenced[scale._landmark_to_previous_scale_idx[l]] = 1;
+    }
+    for (int64_t r = 0; r < num_region; ++r) {
+        if (influence[r] > 0) {
+            influenced[region[r]] = static_cast<ScalarType>(influence[r]);
+        }
+    }
+}
+
+void walk_influence(
+    const HsneType::scale_type &previous_scale,
+    const HsneType::scale_type &scale,
+    unsigned int scale_number,
+    const std::vector<uint32_t> &landmarks,
+    std::map<uint32_t, ScalarType> &influenced,
+    int num_walks,
+    int max_walk_length,
+    int seed,
+    int num_threads) {
+    num_threads = resolve_num_threads(num_threads);
+    if (num_walks <= 0 || max_walk_length <= 0) {
+        throw std::invalid_argument("The number and length of the random walks must be positive");
+    }
+    const uint64_t stream_seed = seed < 0 ? std::random_device()() : static_cast<uint64_t>(seed);
+    const auto &landmark_idx = scale._previous_scale_to_landmark_idx;
+    const std::vector<char> selected = selection_mask(scale, landmarks);
+    const std::vector<uint32_t> region = influence_region(previous_scale, scale, selected);
+    std::vector<char> in_region(landmark_idx.size(), 0);
+    for (auto i : region) {
+        in_region[i] = 1;
+    }
+    // The walks stay in the region, only its rows are prepared
+    // (not a copy of the whole, e.g. data scale, graph)
+    const WalkGraph graph(previous_scale._transition_matrix, region);
+
+    // A walk ends on the first landmark reached or on leaving the region
+    // (as in matrix_power_influence), the hits are counted per point
+    const int64_t num_region = static_cast<int64_t>(region.size());
+    std::vector<uint32_t> hits(num_region, 0);
+#pragma omp parallel for num_threads(num_threads) schedule(dynamic, 256)
+    for (int64_t r = 0; r < num_region; ++r) {
+        WalkRandom random(stream_seed, scale_number, kSelectionPhase, region[r]);
+        for (int w = 0; w < num_walks; ++w) {
+            uint32_t point = region[r];
+            for (int s = 0; s < max_walk_length; ++s) {
+                point = graph.step(point, random);
+                if (landmark_idx[point] >= 0) {
+                    hits[r] += selected[landmark_idx[point]];
+                    break;
+                }
+                if (!in_region[point]) {
+                    break;
+                }
+            }
+        }
+    }
+
+    influenced.clear();
+    for (auto l : landmarks) {
+        influenced[scale._landmark_to_previous_scale_idx[l]] = 1;
+    }
+    for (int64_t r = 0; r < num_region; ++r) {
+        if (hits[r] > 0) {
+            influenced[region[r]] = static_cast<ScalarType>(static_cast<double>(hits[r]) / num_walks);
+        }
+    }
+}
+
+void area_of_influence_top_down(
+    const HsneType &hsne,
+    unsigned int scale_number,
+    const std::vector<uint32_t> &landmarks,
+    std::vector<ScalarType> &influence,
+    int num_threads) {
+    num_threads = resolve_num_threads(num_threads);
+    const auto &hierarchy = hsne.hierarchy();
+    if (scale_number >= hierarchy.size()) {
+        throw std::out_of_range("Scale number " + std::to_string(scale_number) + " is not in the hierarchy");
+    }
+    const uint64_t num_landmarks = hierarchy[scale_number]._transition_matrix.size();
+    std::vector<double> current(num_landmarks, 0);
+    for (auto l : landmarks) {
+        if (l >= num_landmarks) {
+            throw std::out_of_range("Landmark " + std::to_string(l) + " is not in scale " +
+                std::to_string(scale_number));
+        }
+        current[l] = 1;
+    }
+    for (unsigned int s = scale_number; s > 0; --s) {
+        const auto &area_of_influence = hierarchy[s]._area_of_influence;
+        const int64_t num_points = static_cast<int64_t>(hierarchy[s - 1]._transition_matrix.size());
+        if (area_of_influence.size() != static_cast<uint64_t>(num_points)) {
+            throw std::runtime_error("Scale " + std::to_string(s) + " has no area of influence");
+        }
+        std::vector<double> next(num_points, 0);
+#pragma omp parallel for num_threads(num_threads) schedule(dynamic, 256)
+        for (int64_t i = 0; i < num_points; ++i) {
+            double value = 0;
+            for (const auto &elem : area_of_influence[i].memory()) {
+                value += elem.second * current[elem.first];
+            }
+            next[i] = value;
+        }
+        current.swap(next);
+    }
+    influence.assign(current.begin(), current.end());
+}
+
+}  // namespace nptsne
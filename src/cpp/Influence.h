@@ -0,0 +1,71 @@
+// Copyright 2020 LKEB at LUMC
+// Author: B. van Lew
+#pragma once
+
+#include <cstdint>
+#include <map>
+#include <vector>
+#include "Types.h"
+
+namespace nptsne {
+
+// The influence of a selection of landmarks of a scale on the points of the
+// previous scale: for each point the probability that a random walk on the
+// previous scale transition matrix reaches a selected landmark before any
+// other landmark.
+//
+// Only the points influenced by the selection in the area of influence of the
+// scale (the region) take part, all points if the scale has no area of
+// influence. A walk that steps to a point outside the region that is not a
+// landmark ends without reaching the selection: the area of influence of
+// that point has no selected landmark. walk_influence applies the same rule,
+// this is the exact value of what it estimates.
+//
+// The probabilities h = b + P h are computed by repeated sparse matrix vector
+// products (Jacobi iterations), each adding one step to the walks, until the
+// largest change is below 1e-6 or the walks reach max_walk_length steps.
+// The selected landmarks themselves have influence 1.
+// The rows are processed in parallel with a fixed summation order, the result
+// does not depend on num_threads, 0 uses all available cores.
+void matrix_power_influence(
+    const HsneType::scale_type &previous_scale,
+    const HsneType::scale_type &scale,
+    const std::vector<uint32_t> &landmarks,
+    std::map<uint32_t, ScalarType> &influenced,
+    int max_walk_length = 100,
+    int num_threads = 0);
+
+// As matrix_power_influence estimated with Monte Carlo random walks, like
+// HierarchicalSNE::getInfluencedLandmarksInPreviousScale but seeded and in
+// parallel: num_walks walks start from every point of the region and stop on
+// the first landmark reached, on leaving the region or after max_walk_length
+// steps. The influence of a point is the fraction of its walks that end on a
+// selected landmark.
+// Each point has its own random stream derived from the seed, the scale
+// number and the point index (see RandomWalk.h), the result only depends on
+// the seed and not on num_threads. A negative seed draws a random seed.
+void walk_influence(
+    const HsneType::scale_type &previous_scale,
+    const HsneType::scale_type &scale,
+    unsigned int scale_number,
+    const std::vector<uint32_t> &landmarks,
+    std::map<uint32_t, ScalarType> &influenced,
+    int num_walks,
+    int max_walk_length = 100,
+    int seed = -1,
+    int num_threads = 0);
+
+// The influence of a selection of landmarks of a scale on the data points:
+// the selection propagated down the hierarchy through the areas of influence,
+// influence_{s-1} = A_s influence_s. This is the product A_1 ... A_s that the
+// membership index stores (MembershipIndex::area_of_influence), computed
+// without the index. The scales up to scale_number must be loaded.
+// Throws std::out_of_range for a landmark that is not in the scale.
+void area_of_influence_top_down(
+    const HsneType &hsne,
+    unsigned int scale_number,
+    const std::vector<uint32_t> &landmarks,
+    std::vector<ScalarType> &influence,
+    int num_threads = 0);
+
+}  // namespace nptsne
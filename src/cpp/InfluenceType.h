@@ -0,0 +1,6 @@
+#pragma once
+
+enum class InfluenceType {
+    WALKS,         // seeded, parallel random walks from the points of the previous scale
+    MATRIX_POWER   // truncated walk probabilities from sparse matrix products
+};
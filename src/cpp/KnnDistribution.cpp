@@ -0,0 +1,248 @@
+// Copyright 2020 LKEB at LUMC
+// Author: B. van Lew
+#include "KnnDistribution.h"
+#include <algorithm>
+#include <cmath>
+#include <utility>
+#include <limits>
+#include <stdexcept>
+#include <string>
+#include <vector>
+#ifdef _OPENMP
+#include <omp.h>
+#endif
+
+namespace {
+    // The binary search settings match those of the HDILib probability generator
+    const int kMaxIterations = 200;
+    const double kTolerance = 1e-5;
+
+    // Find the gaussian precision (beta) giving the target perplexity
+    // and write the normalized probabilities to p.
+    void calibrate_row(
+        const std::vector<double> &distances,
+        double perplexity,
+        std::vector<double> &p) {
+        p.assign(distances.size(), 0);
+        if (distances.empty()) {
+            return;
+        }
+        const double target_entropy = std::log(perplexity);
+        // Shift by the smallest distance for numerical stability
+        const double min_distance = *std::min_element(distances.begin(), distances.end());
+        double beta = 1;
+        double beta_min = -std::numeric_limits<double>::max();
+        double beta_max = std::numeric_limits<double>::max();
+        for (int iter = 0; iter < kMaxIterations; ++iter) {
+            double sum_p = 0;
+            for (size_t j = 0; j < distances.size(); ++j) {
+                p[j] = std::exp(-beta * (distances[j] - min_distance));
+                sum_p += p[j];
+            }
+            double weighted_distance = 0;
+            for (size_t j = 0; j < distances.size(); ++j) {
+                p[j] /= sum_p;
+                weighted_distance += p[j] * (distances[j] - min_distance);
+            }
+            const double entropy = std::log(sum_p) + beta * weighted_distance;
+            const double diff = entropy - target_entropy;
+            if (std::abs(diff) < kTolerance) {
+                break;
+            }
+            if (diff > 0) {
+                beta_min = beta;
+                beta = (beta_max == std::numeric_limits<double>::max()) ? beta * 2 : (beta + beta_max) / 2;
+            } else {
+                beta_max = beta;
+                beta = (beta_min == -std::numeric_limits<double>::max()) ? beta / 2 : (beta + beta_min) / 2;
+            }
+        }
+    }
+}  // namespace
+
+void nptsne::knn_to_distribution(
+    const int64_t *indices,
+    const float *distances,
+    uint64_t num_points,
+    uint64_t num_neighbors,
+    double perplexity,
+    SparseScalarMatrixType &distribution,
+    uint64_t num_reference_points) {
+    if (perplexity <= 0) {
+        throw std::invalid_argument("The perplexity must be positive");
+    }
+    const bool self_neighbors = num_reference_points == 0;
+    const uint64_t num_candidates = self_neighbors ? num_points : num_reference_points;
+    distribution.clear();
+    distribution.resize(num_points);
+    std::vector<double> row_distances;
+    std::vector<uint32_t> row_indices;
+    std::vector<double> p;
+    for (uint64_t i = 0; i < num_points; ++i) {
+        row_distances.clear();
+        row_indices.clear();
+        for (uint64_t j = 0; j < num_neighbors; ++j) {
+            const int64_t neighbor = indices[i * num_neighbors + j];
+            if (neighbor < 0 || (self_neighbors && static_cast<uint64_t>(neighbor) == i)) {
+                continue;
+            }
+            if (static_cast<uint64_t>(neighbor) >= num_candidates) {
+                throw std::invalid_argument(
+                    "Neighbor index " + std::to_string(neighbor) + " of point " +
+                    std::to_string(i) + " is out of range");
+            }
+            row_indices.push_back(static_cast<uint32_t>(neighbor));
+            row_distances.push_back(distances[i * num_neighbors + j]);
+        }
+        calibrate_row(row_distances, perplexity, p);
+        for (size_t j = 0; j < row_indices.size(); ++j) {
+            distribution[i][row_indices[j]] = static_cast<ScalarType>(p[j]);
+        }
+    }
+}
+
+void nptsne::recalibrate_distribution(
+    const SparseScalarMatrixType &source,
+    double perplexity,
+    double perplexity_multiplier,
+    SparseScalarMatrixType &distribution,
+    int num_threads) {
+    if (perplexity <= 0) {
+        throw std::invalid_argument("The perplexity must be positive");
+    }
+    if (num_threads <= 0) {
+#ifdef _OPENMP
+        num_threads = omp_get_max_threads();
+#else
+        num_threads = 1;
+#endif
+    }
+    const int64_t num_points = static_cast<int64_t>(source.size());
+    const size_t num_neighbors = static_cast<size_t>(std::max(1.0, perplexity * perplexity_multiplier));
+    distribution.clear();
+    distribution.resize(num_points);
+#pragma omp parallel num_threads(num_threads)
+    {
+        // (distance, neighbor) pairs
+        std::vector<std::pair<double, uint32_t>> neighbors;
+        std::vector<double> row_distances;
+        std::vector<double> p;
+        std::vector<std::pair<uint32_t, ScalarType>> row;
+#pragma omp for schedule(dynamic, 256)
+        for (int64_t i = 0; i < num_points; ++i) {
+            neighbors.clear();
+            for (const auto &elem : source[i].memory()) {
+                if (elem.second > 0) {
+                    neighbors.emplace_back(-std::log(static_cast<double>(elem.second)), elem.first);
+                }
+            }
+            if (neighbors.size() > num_neighbors) {
+                std::nth_element(neighbors.begin(), neighbors.begin() + num_neighbors, neighbors.end());
+                neighbors.resize(num_neighbors);
+            }
+            row_distances.clear();
+            for (const auto &neighbor : neighbors) {
+                row_distances.push_back(neighbor.first);
+            }
+            calibrate_row(row_distances, perplexity, p);
+            row.clear();
+            for (size_t j = 0; j < neighbors.size(); ++j) {
+                row.emplace_back(neighbors[j].second, static_cast<ScalarType>(p[j]));
+            }
+            // The map memory is ordered by neighbor index
+            std::sort(row.begin(), row.end());
+            auto &memory = distribution[i].memory();
+            memory.reserve(row.size());
+            for (const auto &elem : row) {
+                memory.emplace_back(elem.first, elem.second);
+            }
+        }
+    }
+}
+
+void nptsne::exact_knn(
+    const float *reference,
+    uint64_t num_reference,
+    const float *queries,
+    uint64_t num_queries,
+    uint64_t num_dimensions,
+    uint64_t num_neighbors,
+    int64_t *indices,
+    float *distances,
+    int num_threads) {
+    if (num_neighbors == 0 || num_neighbors > num_reference) {
+        throw std::invalid_argument("The number of neighbors must be between 1 and the number of reference points");
+    }
+    if (num_threads <= 0) {
+#ifdef _OPENMP
+        num_threads = omp_get_max_threads();
+#else
+        num_threads = 1;
+#endif
+    }
+    // Blocks of queries against blocks of reference points that stay in cache
+    const int64_t query_block = 32;
+    const uint64_t reference_block = 512;
+    std::vector<float> reference_norm(num_reference);
+    for (uint64_t j = 0; j < num_reference; ++j) {
+        const float *r = reference + j * num_dimensions;
+        float norm = 0;
+        for (uint64_t d = 0; d < num_dimensions; ++d) {
+            norm += r[d] * r[d];
+        }
+        reference_norm[j] = norm;
+    }
+    const int64_t num_query_blocks = (static_cast<int64_t>(num_queries) + query_block - 1) / query_block;
+#pragma omp parallel num_threads(num_threads)
+    {
+        // Per query a max heap of (distance, index) of the nearest so far
+        std::vector<std::vector<std::pair<float, int64_t>>> heaps(query_block);
+        std::vector<float> query_norm(query_block);
+#pragma omp for schedule(dynamic, 1)
+        for (int64_t b = 0; b < num_query_blocks; ++b) {
+            const uint64_t first = b * query_block;
+            const uint64_t last = std::min(num_queries, first + query_block);
+            for (uint64_t i = first; i < last; ++i) {
+                heaps[i - first].clear();
+                const float *q = queries + i * num_dimensions;
+                float norm = 0;
+                for (uint64_t d = 0; d < num_dimensions; ++d) {
+                    norm += q[d] * q[d];
+                }
+                query_norm[i - first] = norm;
+            }
+            for (uint64_t r_first = 0; r_first < num_reference; r_first += reference_block) {
+                const uint64_t r_last = std::min(num_reference, r_first + reference_block);
+                for (uint64_t i = first; i < last; ++i) {
+                    const float *q = queries + i * num_dimensions;
+                    auto &heap = heaps[i - first];
+                    for (uint64_t j = r_first; j < r_last; ++j) {
+                        const float *r = reference + j * num_dimensions;
+                        float dot = 0;
+#pragma omp simd reduction(+:dot)
+                        for (uint64_t d = 0; d < num_dimensions; ++d) {
+                            dot += q[d] * r[d];
+                        }
+                        const float distance = std::max(0.0f, query_norm[i - first] + reference_norm[j] - 2 * dot);
+                        if (heap.size() < num_neighbors) {
+                            heap.emplace_back(distance, static_cast<int64_t>(j));
+                            std::push_heap(heap.begin(), heap.end());
+                        } else if (distance < heap.front().first) {
+                            std::pop_heap(heap.begin(), heap.end());
+                            heap.back() = std::make_pair(distance, static_cast<int64_t>(j));
+                            std::push_heap(heap.begin(), heap.end());
+                        }
+                    }
+                }
+            }
+            for (uint64_t i = first; i < last; ++i) {
+                auto &heap = heaps[i - first];
+                std::sort_heap(heap.begin(), heap.end());
+                for (uint64_t k = 0; k < num_neighbors; ++k) {
+                    indices[i * num_neighbors + k] = heap[k].second;
+                    distances[i * num_neighbors + k] = heap[k].first;
+                }
+            }
+        }
+    }
+}
@@ -0,0 +1,62 @@
+// Copyright 2020 LKEB at LUMC
+// Author: B. van Lew
+#pragma once
+
+#include <cstdint>
+#include "Types.h"
+
+namespace nptsne {
+
+// Compute the perplexity calibrated conditional probabilities from a precomputed
+// k nearest neighbor graph. This replaces the kNN stage of the HDILib
+// probability generator when the neighbors are known.
+//
+// indices and distances are row major (num_points x num_neighbors).
+// The distances are squared euclidean distances, as returned by FLANN and HNSW.
+// A neighbor equal to the point itself is skipped, as are negative indices
+// (used by several kNN libraries to pad missing neighbors).
+// With num_reference_points > 0 the neighbors are indexes of that many other
+// (reference) points, as for new points placed in an existing embedding,
+// and no neighbor is the point itself.
+// Each row of the result sums to one.
+void knn_to_distribution(
+    const int64_t *indices,
+    const float *distances,
+    uint64_t num_points,
+    uint64_t num_neighbors,
+    double perplexity,
+    SparseScalarMatrixType &distribution,
+    uint64_t num_reference_points = 0);
+
+// Derive the conditional probabilities for a perplexity from a distribution
+// of the HDILib probability generator for a larger perplexity, without a kNN.
+//
+// The gaussian probabilities give the neighbor distances up to a scale and an
+// offset (-log p = beta * d + c) and neither changes the calibration. Each row
+// keeps its perplexity * perplexity_multiplier nearest neighbors, as the
+// probability generator does, and is recalibrated. Neighbors with a zero
+// probability are dropped. The rows are processed in parallel,
+// num_threads 0 uses all available cores.
+void recalibrate_distribution(
+    const SparseScalarMatrixType &source,
+    double perplexity,
+    double perplexity_multiplier,
+    SparseScalarMatrixType &distribution,
+    int num_threads = 0);
+
+// The exact num_neighbors nearest reference points of each query point with
+// their squared euclidean distances, nearest first. The data are row major
+// (points x num_dimensions), indices and distances (num_queries x num_neighbors).
+// Blocks of query points are processed in parallel, num_threads 0 uses all cores.
+void exact_knn(
+    const float *reference,
+    uint64_t num_reference,
+    const float *queries,
+    uint64_t num_queries,
+    uint64_t num_dimensions,
+    uint64_t num_neighbors,
+    int64_t *indices,
+    float *distances,
+    int num_threads = 0);
+
+}  // namespace nptsne
@@ -0,0 +1,88 @@
+// Copyright 2020 LKEB at LUMC
+// Author: B. van Lew
+#include "Log.h"
+#include <atomic>
+#include <chrono>
+#include <iostream>
+#include <memory>
+#include <mutex>
+
+namespace {
+    std::atomic<int> log_level(static_cast<int>(nptsne::LogLevel::Warning));
+
+    // The sink and the rate limit state
+    std::mutex log_mutex;
+    std::shared_ptr<nptsne::LogSink> log_sink;
+    int rate_limit = 0;
+    std::chrono::steady_clock::time_point window_start;
+    int window_count = 0;
+    int suppressed_count = 0;
+}  // namespace
+
+bool nptsne::log_enabled(LogLevel level) {
+    return static_cast<int>(level) >= log_level.load(std::memory_order_relaxed);
+}
+
+void nptsne::set_log_level(int level) {
+    log_level.store(level, std::memory_order_relaxed);
+}
+
+int nptsne::get_log_level() {
+    return log_level.load(std::memory_order_relaxed);
+}
+
+void nptsne::set_log_rate_limit(int messages_per_second) {
+    std::lock_guard<std::mutex> lock(log_mutex);
+    rate_limit = messages_per_second > 0 ? messages_per_second : 0;
+    window_count = 0;
+}
+
+void nptsne::set_log_sink(LogSink sink) {
+    std::shared_ptr<LogSink> new_sink;
+    if (sink) {
+        new_sink = std::make_shared<LogSink>(std::move(sink));
+    }
+    std::shared_ptr<LogSink> old_sink;
+    {
+        std::lock_guard<std::mutex> lock(log_mutex);
+        old_sink = log_sink;
+        log_sink = new_sink;
+    }
+    // The old sink is released outside the lock
+}
+
+void nptsne::log_message(LogLevel level, const std::string& message) {
+    std::shared_ptr<LogSink> sink;
+    int suppressed = 0;
+    {
+        std::lock_guard<std::mutex> lock(log_mutex);
+        if (rate_limit > 0) {
+            auto now = std::chrono::steady_clock::now();
+            if (now - window_start >= std::chrono::seconds(1)) {
+                window_start = now;
+                window_count = 0;
+                suppressed = suppressed_count;
+                suppressed_count = 0;
+            }
+            if (window_count >= rate_limit) {
+                ++suppressed_count;
+                return;
+            }
+            ++window_count;
+        }
+        sink = log_sink;
+    }
+    // The sink is called without the lock, it may log or take time
+    auto deliver = [&sink](int lvl, const std::string& msg) {
+        if (sink) {
+            (*sink)(lvl, msg);
+        } else {
+            std::cerr << msg << std::endl;
+        }
+    };
+    if (suppressed > 0) {
+        deliver(static_cast<int>(LogLevel::Warning),
+            std::to_string(suppressed) + " log messages were suppressed by the rate limit");
+    }
+    deliver(static_cast<int>(level), message);
+}
@@ -0,0 +1,80 @@
+// Copyright 2020 LKEB at LUMC
+// Author: B. van Lew
+#pragma once
+
+// Leveled logging for the native code.
+//
+// Messages are delivered to a single sink, the python module routes this
+// to the "nptsne" logger of the python logging package (or a user callback).
+// A message below the log level is not formatted: NPTSNE_LOG checks the level
+// (a relaxed atomic load) before any of the stream arguments are evaluated.
+//
+//     NPTSNE_LOG(Info) << "Read " << num_points << " points";
+
+#include <functional>
+#include <sstream>
+#include <string>
+#include <hdi/utils/abstract_log.h>
+
+namespace nptsne {
+
+// The values match the python logging levels
+enum class LogLevel : int {
+    Debug = 10,
+    Info = 20,
+    Warning = 30,
+    Error = 40
+};
+
+using LogSink = std::function<void(int level, const std::string& message)>;
+
+// True if a message at the level will be delivered
+bool log_enabled(LogLevel level);
+
+void set_log_level(int level);
+int get_log_level();
+
+// Deliver at most messages_per_second messages, 0 (the default) is unlimited.
+// The number of dropped messages is reported when the next second starts.
+void set_log_rate_limit(int messages_per_second);
+
+// Replace the sink, an empty sink writes to standard error.
+// The sink may be called from any thread.
+void set_log_sink(LogSink sink);
+
+void log_message(LogLevel level, const std::string& message);
+
+// Collects a streamed message and delivers it at the end of the statement
+class LogLine {
+ public:
+    explicit LogLine(LogLevel level) : _level(level) {}
+    ~LogLine() { log_message(_level, _stream.str()); }
+    LogLine(const LogLine&) = delete;
+    LogLine& operator=(const LogLine&) = delete;
+
+    template <typename T>
+    LogLine& operator<<(const T& value) {
+        _stream << value;
+        return *this;
+    }
+
+ private:
+    LogLevel _level;
+    std::ostringstream _stream;
+};
+
+// Routes the HDILib log output to the nptsne log at debug level
+class HdiLog : public hdi::utils::AbstractLog {
+ public:
+    void clear() override {}
+    void display(const std::string& message) override {
+        if (log_enabled(LogLevel::Debug)) {
+            log_message(LogLevel::Debug, message);
+        }
+    }
+};
+
+}  // namespace nptsne
+
+#define NPTSNE_LOG(level) \
+    if (!nptsne::log_enabled(nptsne::LogLevel::level)) {} else nptsne::LogLine(nptsne::LogLevel::level)
@@ -0,0 +1,369 @@
+// Copyright 2020 LKEB at LUMC
+// Author: B. van Lew
+#include "MembershipIndex.h"
+#include <algorithm>
+#include <cstring>
+#include <fstream>
+#include <stdexcept>
+#include <string>
+#include <utility>
+#ifdef _OPENMP
+#include <omp.h>
+#endif
+
+namespace {
+const char kMagic[8] = {'N', 'P', 'T', 'M', 'E', 'M', 'B', '\0'};
+
+template <typename T>
+void write_value(std::ofstream& out, T value) {
+    out.write(reinterpret_cast<const char*>(&value), sizeof(value));
+}
+
+template <typename T>
+void write_array(std::ofstream& out, const std::vector<T>& vec) {
+    out.write(reinterpret_cast<const char*>(vec.data()), vec.size() * sizeof(T));
+}
+
+// Reads values from the stream, checking each count against the bytes left
+// so that a corrupt count does not allocate
+class IndexReader {
+ public:
+    IndexReader(std::ifstream& in, const std::string& filePath) : _in(in), _filePath(filePath), _remaining(0) {
+        _in.seekg(0, std::ios::end);
+        _remaining = static_cast<uint64_t>(_in.tellg());
+        _in.seekg(0, std::ios::beg);
+    }
+
+    template <typename T>
+    T value() {
+        T result;
+        read(&result, 1);
+        return result;
+    }
+
+    template <typename T>
+    std::vector<T> array(uint64_t count) {
+        if (count > _remaining / sizeof(T)) {
+            fail();
+        }
+        std::vector<T> result(count);
+        read(result.data(), count);
+        return result;
+    }
+
+    [[noreturn]] void fail() const {
+        throw std::runtime_error("Corrupt membership index file: " + _filePath);
+    }
+
+ private:
+    template <typename T>
+    void read(T* data, uint64_t count) {
+        const uint64_t bytes = count * sizeof(T);
+        if (bytes > _remaining) {
+            fail();
+        }
+        _in.read(reinterpret_cast<char*>(data), bytes);
+        if (!_in) {
+            fail();
+        }
+        _remaining -= bytes;
+    }
+
+    std::ifstream& _in;
+    const std::string& _filePath;
+    uint64_t _remaining;
+};
+}  // namespace
+
+namespace nptsne {
+
+const uint32_t MembershipIndex::kMajorVersion;
+const uint32_t MembershipIndex::kMinorVersion;
+const uint64_t MembershipIndex::kFingerprintBasis;
+
+uint64_t MembershipIndex::fingerprint(uint64_t hash, const uint32_t* landmarks, uint64_t num_landmarks) {
+    const uint64_t kPrime = 1099511628211ULL;
+    auto add = [&hash, kPrime](uint64_t value, int num_bytes) {
+        for (int b = 0; b < num_bytes; ++b) {
+            hash = (hash ^ ((value >> (8 * b)) & 0xff)) * kPrime;
+        }
+    };
+    add(num_landmarks, 8);
+    for (uint64_t l = 0; l < num_landmarks; ++l) {
+        add(landmarks[l], 4);
+    }
+    return hash;
+}
+
+uint64_t MembershipIndex::fingerprint(const HsneType& hsne) {
+    uint64_t hash = kFingerprintBasis;
+    for (size_t s = 1; s < hsne.hierarchy().size(); ++s) {
+        const auto& landmarks = hsne.hierarchy()[s]._landmark_to_original_data_idx;
+        hash = fingerprint(hash, landmarks.data(), landmarks.size());
+    }
+    return hash;
+}
+
+MembershipIndex MembershipIndex::build(const HsneType& hsne, double min_influence, int num_threads) {
+    if (num_threads <= 0) {
+#ifdef _OPENMP
+        num_threads = omp_get_max_threads();
+#else
+        num_threads = 1;
+#endif
+    }
+    const auto& hierarchy = hsne.hierarchy();
+    if (hierarchy.empty()) {
+        throw std::runtime_error("Cannot index an empty hierarchy");
+    }
+    MembershipIndex result;
+    result._num_scales = hierarchy.size();
+    result._num_data_points = hierarchy[0]._transition_matrix.size();
+    result._fingerprint = fingerprint(hsne);
+    const int64_t num_points = static_cast<int64_t>(result._num_data_points);
+
+    // The membership of the data points in the landmarks of the previous scale,
+    // the identity for the data scale
+    SparseScalarMatrixType membership;
+    for (uint64_t s = 1; s < result._num_scales; ++s) {
+        const auto& area_of_influence = hierarchy[s]._area_of_influence;
+        if (area_of_influence.size() != hierarchy[s - 1]._transition_matrix.size()) {
+            throw std::runtime_error("Scale " + std::to_string(s) + " has no area of influence");
+        }
+        const uint64_t num_landmarks = hierarchy[s]._transition_matrix.size();
+        SparseScalarMatrixType next(num_points);
+        std::vector<int32_t> dominant(num_points, -1);
+#pragma omp parallel num_threads(num_threads)
+        {
+            std::vector<double> row_sum(num_landmarks, 0);
+            std::vector<uint32_t> touched;
+            auto add_row = [&](const MapType& row, double weight) {
+                for (const auto& elem : row.memory()) {
+                    const double value = weight * elem.second;
+                    if (value <= 0) {
+                        continue;
+                    }
+                    if (row_sum[elem.first] == 0) {
+                        touched.push_back(elem.first);
+                    }
+                    row_sum[elem.first] += value;
+                }
+            };
+#pragma omp for schedule(dynamic, 256)
+            for (int64_t i = 0; i < num_points; ++i) {
+                touched.clear();
+                if (s == 1) {
+                    add_row(area_of_influence[i], 1);
+                } else {
+                    for (const auto& elem : membership[i].memory()) {
+                        add_row(area_of_influence[elem.first], elem.second);
+                    }
+                }
+                std::sort(touched.begin(), touched.end());
+                // In landmark order, each insert appends to the row.
+                // The first of equal largest influences is dominant.
+                double largest = 0;
+                for (auto l : touched) {
+                    next[i][l] = static_cast<ScalarType>(row_sum[l]);
+                    if (row_sum[l] > largest) {
+                        largest = row_sum[l];
+                        dominant[i] = static_cast<int32_t>(l);
+                    }
+                    row_sum[l] = 0;
+                }
+            }
+        }
+
+        // Landmark to data, data points in increasing order
+        std::vector<uint64_t> indptr(num_landmarks + 1, 0);
+        for (int64_t i = 0; i < num_points; ++i) {
+            for (const auto& elem : next[i].memory()) {
+                if (elem.second >= min_influence) {
+                    ++indptr[elem.first + 1];
+                }
+            }
+        }
+        for (uint64_t l = 0; l < num_landmarks; ++l) {
+            indptr[l + 1] += indptr[l];
+        }
+        std::vector<uint32_t> indices(indptr[num_landmarks]);
+        std::vector<float> values(indptr[num_landmarks]);
+        std::vector<uint64_t> pos(indptr.begin(), indptr.end() - 1);
+        for (int64_t i = 0; i < num_points; ++i) {
+            for (const auto& elem : next[i].memory()) {
+                if (elem.second >= min_influence) {
+                    indices[pos[elem.first]] = static_cast<uint32_t>(i);
+                    values[pos[elem.first]] = elem.second;
+                    ++pos[elem.first];
+                }
+            }
+        }
+        result._influence.emplace_back(std::move(indptr), std::move(indices), std::move(values));
+        result._dominant.push_back(std::move(dominant));
+        membership.swap(next);
+    }
+    return result;
+}
+
+void MembershipIndex::save(const std::string& filePath) const {
+    std::ofstream out(filePath, std::ios::binary | std::ios::trunc);
+    if (!out) {
+        throw std::runtime_error("Unable to write membership index file: " + filePath);
+    }
+    out.write(kMagic, sizeof(kMagic));
+    write_value(out, kMajorVersion);
+    write_value(out, kMinorVersion);
+    write_value(out, _num_data_points);
+    write_value(out, _num_scales);
+    write_value(out, _fingerprint);
+    for (size_t s = 0; s < _influence.size(); ++s) {
+        write_value(out, _influence[s].num_rows());
+        write_value(out, _influence[s].num_non_zero());
+        write_array(out, _influence[s].indptr());
+        write_array(out, _influence[s].indices());
+        write_array(out, _influence[s].values());
+        write_array(out, _dominant[s]);
+    }
+    if (!out) {
+        throw std::runtime_error("Error writing membership index file: " + filePath);
+    }
+}
+
+MembershipIndex MembershipIndex::load(const std::string& filePath) {
+    std::ifstream in(filePath, std::ios::binary);
+    if (!in) {
+        throw std::runtime_error("Unable to open membership index file: " + filePath);
+    }
+    IndexReader reader(in, filePath);
+    auto magic = reader.array<char>(sizeof(kMagic));
+    if (std::memcmp(magic.data(), kMagic, sizeof(kMagic)) != 0) {
+        throw std::runtime_error("Not an nptsne membership index file: " + filePath);
+    }
+    const auto major_version = reader.value<uint32_t>();
+    reader.value<uint32_t>();
+    if (major_version != kMajorVersion) {
+        throw std::runtime_error("Unsupported membership index version " + std::to_string(major_version));
+    }
+    MembershipIndex result;
+    result._num_data_points = reader.value<uint64_t>();
+    result._num_scales = reader.value<uint64_t>();
+    result._fingerprint = reader.value<uint64_t>();
+    if (result._num_scales == 0) {
+        reader.fail();
+    }
+    for (uint64_t s = 1; s < result._num_scales; ++s) {
+        const auto num_landmarks = reader.value<uint64_t>();
+        const auto nnz = reader.value<uint64_t>();
+        auto indptr = reader.array<uint64_t>(num_landmarks + 1);
+        auto indices = reader.array<uint32_t>(nnz);
+        auto values = reader.array<float>(nnz);
+        auto dominant = reader.array<int32_t>(result._num_data_points);
+        for (auto i : indices) {
+            if (i >= result._num_data_points) {
+                reader.fail();
+            }
+        }
+        for (auto l : dominant) {
+            if (l >= static_cast<int64_t>(num_landmarks)) {
+                reader.fail();
+            }
+        }
+        try {
+            result._influence.emplace_back(std::move(indptr), std::move(indices), std::move(values));
+        }
+        catch (const std::invalid_argument&) {
+            reader.fail();
+        }
+        result._dominant.push_back(std::move(dominant));
+    }
+    return result;
+}
+
+void MembershipIndex::area_of_influence(
+    uint64_t scale_number,
+    const std::vector<uint32_t>& landmarks,
+    std::vector<uint32_t>& points,
+    std::vector<float>& influence) const {
+    points.clear();
+    influence.clear();
+    if (scale_number == 0) {
+        // The landmarks are the data points
+        for (auto l : landmarks) {
+            if (l >= _num_data_points) {
+                throw std::out_of_range("Data point " + std::to_string(l) + " is not in the hierarchy");
+            }
+        }
+        points = landmarks;
+        std::sort(points.begin(), points.end());
+        points.erase(std::unique(points.begin(), points.end()), points.end());
+        influence.assign(points.size(), 1);
+        return;
+    }
+    const auto& matrix = influence_matrix(scale_number);
+    std::vector<std::pair<uint32_t, float>> entries;
+    for (auto l : landmarks) {
+        if (l >= matrix.num_rows()) {
+            throw std::out_of_range("Landmark " + std::to_string(l) + " is not in scale " +
+                std::to_string(scale_number));
+        }
+        const auto row = matrix.row(l);
+        for (uint64_t k = 0; k < row.size; ++k) {
+            entries.emplace_back(row.indices[k], row.values[k]);
+        }
+    }
+    // Rows are sorted by data point, a single landmark needs no merge
+    if (landmarks.size() > 1) {
+        std::stable_sort(entries.begin(), entries.end(),
+            [](const std::pair<uint32_t, float>& a, const std::pair<uint32_t, float>& b) {
+                return a.first < b.first;
+            });
+    }
+    for (const auto& entry : entries) {
+        if (!points.empty() && points.back() == entry.first) {
+            influence.back() += entry.second;
+        } else {
+            points.push_back(entry.first);
+            influence.push_back(entry.second);
+        }
+    }
+}
+
+void MembershipIndex::area_of_influence(
+    uint64_t scale_number,
+    const std::vector<uint32_t>& landmarks,
+    std::vector<float>& influence) const {
+    std::vector<uint32_t> points;
+    std::vector<float> values;
+    area_of_influence(scale_number, landmarks, points, values);
+    influence.assign(_num_data_points, 0);
+    for (size_t k = 0; k < points.size(); ++k) {
+        influence[points[k]] = values[k];
+    }
+}
+
+const std::vector<int32_t>& MembershipIndex::dominant_landmarks(uint64_t scale_number) const {
+    check_scale(scale_number);
+    return _dominant[scale_number - 1];
+}
+
+const CsrMatrix<float>& MembershipIndex::influence_matrix(uint64_t scale_number) const {
+    check_scale(scale_number);
+    return _influence[scale_number - 1];
+}
+
+uint64_t MembershipIndex::memory_bytes() const {
+    uint64_t bytes = 0;
+    for (size_t s = 0; s < _influence.size(); ++s) {
+        bytes += _influence[s].memory_bytes() + _dominant[s].capacity() * sizeof(int32_t);
+    }
+    return bytes;
+}
+
+void MembershipIndex::check_scale(uint64_t scale_number) const {
+    if (scale_number == 0 || scale_number >= _num_scales) {
+        throw std::out_of_range("Scale number " + std::to_string(scale_number) +
+            " is not an indexed scale (1 to " + std::to_string(_num_scales - 1) + ")");
+    }
+}
+
+}  // namespace nptsne
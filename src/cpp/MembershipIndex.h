@@ -0,0 +1,107 @@
+// Copyright 2020 LKEB at LUMC
+// Author: B. van Lew
+#pragma once
+
+// A precomputed cross scale membership index of an HSNE hierarchy
+//
+// For every scale s above the data the influence of each landmark of s on
+// each data point: the product of the areas of influence of scales 1 to s,
+// M_s = A_1 A_2 ... A_s. This is the fraction of the random walks from a data
+// point that end on the landmark going up the hierarchy. The index holds it
+// per landmark (landmark to data, a CSR matrix) together with the dominant
+// landmark of each data point (the landmark with the largest influence).
+// The area of influence of a selection and the landmark that represents a
+// data point are then sparse lookups instead of a propagation through the
+// hierarchy. The data scale (scale 0) is the identity and is not stored.
+//
+// File layout (little endian), saved next to the hierarchy file:
+//   char[8]   magic "NPTMEMB\0"
+//   uint32    major version, minor version
+//   uint64    number of data points
+//   uint64    number of scales (including the data scale)
+//   uint64    fingerprint of the hierarchy
+//   per scale above the data:
+//     uint64  number of landmarks, number of non zeros
+//     uint64  indptr (landmarks + 1), uint32 indices (data points),
+//     float32 values, int32 dominant landmark (data points, -1 if none)
+
+#include "Types.h"
+#include <cstdint>
+#include <string>
+#include <vector>
+
+namespace nptsne {
+
+class MembershipIndex {
+ public:
+    static const uint32_t kMajorVersion = 2;
+    static const uint32_t kMinorVersion = 0;
+    // The fingerprint of a hierarchy without scales above the data
+    static const uint64_t kFingerprintBasis = 14695981039346656037ULL;
+
+    MembershipIndex() : _num_data_points(0), _num_scales(0), _fingerprint(kFingerprintBasis) {}
+
+    // Build the index of a complete (all scales loaded) hierarchy.
+    // Influences below min_influence are not stored, they still take part
+    // in the higher scales. The data points are processed in parallel with
+    // a fixed summation order, num_threads 0 uses all available cores.
+    static MembershipIndex build(const HsneType& hsne, double min_influence = 0, int num_threads = 0);
+
+    // The index file of a hierarchy file
+    static std::string path_for(const std::string& hsneFilePath) { return hsneFilePath + ".membership"; }
+
+    void save(const std::string& filePath) const;
+
+    // Read an index file, throws std::runtime_error if it is not valid
+    static MembershipIndex load(const std::string& filePath);
+
+    // Identifies the hierarchy of an index: a hash (FNV-1a) of the landmarks,
+    // as data points, of the scales above the data. Adds a scale to the
+    // fingerprint of the scales below it, starting at kFingerprintBasis.
+    static uint64_t fingerprint(uint64_t hash, const uint32_t* landmarks, uint64_t num_landmarks);
+
+    // The fingerprint of a complete hierarchy
+    static uint64_t fingerprint(const HsneType& hsne);
+
+    uint64_t num_data_points() const { return _num_data_points; }
+    uint64_t num_scales() const { return _num_scales; }
+    // The fingerprint of the hierarchy the index was built from
+    uint64_t hierarchy_fingerprint() const { return _fingerprint; }
+
+    // The data points influenced by the landmarks of a scale, in increasing
+    // order, with the summed influence
+    void area_of_influence(
+        uint64_t scale_number,
+        const std::vector<uint32_t>& landmarks,
+        std::vector<uint32_t>& points,
+        std::vector<float>& influence) const;
+
+    // As above with the influence on every data point, zero if not influenced
+    void area_of_influence(
+        uint64_t scale_number,
+        const std::vector<uint32_t>& landmarks,
+        std::vector<float>& influence) const;
+
+    // The landmark of the scale with the largest influence on each data point,
+    // -1 if the point is not influenced
+    const std::vector<int32_t>& dominant_landmarks(uint64_t scale_number) const;
+
+    // The landmark to data influence of a scale
+    const CsrMatrix<float>& influence_matrix(uint64_t scale_number) const;
+
+    // The bytes allocated for the index
+    uint64_t memory_bytes() const;
+
+ private:
+    // Throws std::out_of_range unless the scale is above the data scale
+    void check_scale(uint64_t scale_number) const;
+
+    uint64_t _num_data_points;
+    uint64_t _num_scales;
+    uint64_t _fingerprint;
+    // Indexed by scale number - 1
+    std::vector<CsrMatrix<float>> _influence;
+    std::vector<std::vector<int32_t>> _dominant;
+};
+
+}  // namespace nptsne
@@ -0,0 +1,448 @@
+// Copyright 2020 LKEB at LUMC
+// Author: B. van Lew
+#include "OffscreenContext.h"
+#ifdef __APPLE__
+    #include "glad/glad_3_3.h"
+#endif
+#include <GLFW/glfw3.h>
+#include "hdi/dimensionality_reduction/tsne.h"
+#ifdef __APPLE__
+    #define __gl3_h_
+#endif
+#include "hdi/dimensionality_reduction/gradient_descent_tsne_texture.h"
+#include "Log.h"
+#include <cstdint>
+#include <cstdlib>
+#include <stdexcept>
+#include <string>
+#include <thread>
+#ifdef __linux__
+#include <dlfcn.h>
+#include <sys/syscall.h>
+#include <unistd.h>
+#endif
+#ifdef __APPLE__
+#include <pthread.h>
+#endif
+
+// not present in glfw 3.1.2
+#ifndef GLFW_FALSE
+#define GLFW_FALSE 0
+#endif
+
+namespace {
+    // Live contexts per backend, glfwTerminate and eglTerminate are only
+    // called when the last one is destroyed. Guarded by glfw_mutex().
+    int glfw_context_count = 0;
+    int egl_context_count = 0;
+
+#if !defined(__linux__) && !defined(__APPLE__)
+    // The thread that loaded the module, normally the main thread
+    const std::thread::id load_thread_id = std::this_thread::get_id();
+#endif
+
+    // GLFW initializes and creates its windows on the main thread only
+    bool is_main_thread() {
+#if defined(__linux__)
+        return syscall(SYS_gettid) == getpid();
+#elif defined(__APPLE__)
+        return pthread_main_np() != 0;
+#else
+        return std::this_thread::get_id() == load_thread_id;
+#endif
+    }
+
+    bool has_display() {
+#ifdef __linux__
+        const char* x11 = std::getenv("DISPLAY");
+        const char* wayland = std::getenv("WAYLAND_DISPLAY");
+        return (x11 && *x11) || (wayland && *wayland);
+#else
+        return true;
+#endif
+    }
+
+#ifdef __linux__
+    // The part of EGL 1.4 used here, loaded from libEGL at run time
+    typedef void* EGLDisplay;
+    typedef void* EGLConfig;
+    typedef void* EGLContext;
+    typedef void* EGLSurface;
+    typedef int32_t EGLint;
+    typedef unsigned int EGLBoolean;
+    typedef unsigned int EGLenum;
+
+    const EGLint EGL_NONE = 0x3038;
+    const EGLint EGL_SURFACE_TYPE = 0x3033;
+    const EGLint EGL_PBUFFER_BIT = 0x0001;
+    const EGLint EGL_RENDERABLE_TYPE = 0x3040;
+    const EGLint EGL_OPENGL_BIT = 0x0008;
+    const EGLint EGL_WIDTH = 0x3057;
+    const EGLint EGL_HEIGHT = 0x3056;
+    const EGLint EGL_EXTENSIONS = 0x3055;
+    const EGLint EGL_CONTEXT_MAJOR_VERSION = 0x3098;
+    const EGLint EGL_CONTEXT_MINOR_VERSION = 0x30FB;
+    const EGLint EGL_CONTEXT_OPENGL_PROFILE_MASK = 0x30FD;
+    const EGLint EGL_CONTEXT_OPENGL_CORE_PROFILE_BIT = 0x0001;
+    const EGLenum EGL_OPENGL_API = 0x30A2;
+    const EGLenum EGL_PLATFORM_SURFACELESS_MESA = 0x31DD;
+
+    struct EglApi {
+        bool loaded = false;
+        void* (*GetProcAddress)(const char*) = nullptr;
+        EGLDisplay (*GetDisplay)(void*) = nullptr;
+        EGLDisplay (*GetPlatformDisplayEXT)(EGLenum, void*, const EGLint*) = nullptr;
+        EGLBoolean (*Initialize)(EGLDisplay, EGLint*, EGLint*) = nullptr;
+        EGLBoolean (*Terminate)(EGLDisplay) = nullptr;
+        const char* (*QueryString)(EGLDisplay, EGLint) = nullptr;
+        EGLBoolean (*ChooseConfig)(EGLDisplay, const EGLint*, EGLConfig*, EGLint, EGLint*) = nullptr;
+        EGLBoolean (*BindAPI)(EGLenum) = nullptr;
+        EGLContext (*CreateContext)(EGLDisplay, EGLConfig, EGLContext, const EGLint*) = nullptr;
+        EGLBoolean (*DestroyContext)(EGLDisplay, EGLContext) = nullptr;
+        EGLSurface (*CreatePbufferSurface)(EGLDisplay, EGLConfig, const EGLint*) = nullptr;
+        EGLBoolean (*DestroySurface)(EGLDisplay, EGLSurface) = nullptr;
+        EGLBoolean (*MakeCurrent)(EGLDisplay, EGLSurface, EGLSurface, EGLContext) = nullptr;
+        EGLContext (*GetCurrentContext)() = nullptr;
+        EGLint (*GetError)() = nullptr;
+    };
+
+    template <typename T>
+    bool load_symbol(void* library, const char* name, T* function) {
+        *function = reinterpret_cast<T>(dlsym(library, name));
+        return *function != nullptr;
+    }
+
+    EglApi load_egl() {
+        EglApi api;
+        void* library = dlopen("libEGL.so.1", RTLD_NOW | RTLD_LOCAL);
+        if (!library) {
+            library = dlopen("libEGL.so", RTLD_NOW | RTLD_LOCAL);
+        }
+        if (!library) {
+            NPTSNE_LOG(Debug) << "libEGL not found";
+            return api;
+        }
+        // The library stays loaded for the lifetime of the process
+        api.loaded = load_symbol(library, "eglGetProcAddress", &api.GetProcAddress)
+            && load_symbol(library, "eglGetDisplay", &api.GetDisplay)
+            && load_symbol(library, "eglInitialize", &api.Initialize)
+            && load_symbol(library, "eglTerminate", &api.Terminate)
+            && load_symbol(library, "eglQueryString", &api.QueryString)
+            && load_symbol(library, "eglChooseConfig", &api.ChooseConfig)
+            && load_symbol(library, "eglBindAPI", &api.BindAPI)
+            && load_symbol(library, "eglCreateContext", &api.CreateContext)
+            && load_symbol(library, "eglDestroyContext", &api.DestroyContext)
+            && load_symbol(library, "eglCreatePbufferSurface", &api.CreatePbufferSurface)
+            && load_symbol(library, "eglDestroySurface", &api.DestroySurface)
+            && load_symbol(library, "eglMakeCurrent", &api.MakeCurrent)
+            && load_symbol(library, "eglGetCurrentContext", &api.GetCurrentContext)
+            && load_symbol(library, "eglGetError", &api.GetError);
+        if (api.loaded) {
+            // An extension, may be absent
+            api.GetPlatformDisplayEXT = reinterpret_cast<EGLDisplay (*)(EGLenum, void*, const EGLint*)>(
+                api.GetProcAddress("eglGetPlatformDisplayEXT"));
+        } else {
+            NPTSNE_LOG(Debug) << "libEGL lacks required functions";
+        }
+        return api;
+    }
+
+    const EglApi& egl() {
+        static const EglApi api = load_egl();
+        return api;
+    }
+
+    bool has_extension(const char* extensions, const char* name) {
+        if (!extensions) {
+            return false;
+        }
+        const std::string list = std::string(" ") + extensions + " ";
+        return list.find(std::string(" ") + name + " ") != std::string::npos;
+    }
+#endif
+}  // namespace
+
+nptsne::OffscreenContext::OffscreenContext()
+    : _backend(Backend::Glfw),
+    _window(nullptr),
+    _egl_display(nullptr),
+    _egl_surface(nullptr),
+    _egl_context(nullptr) {
+}
+
+std::unique_ptr<nptsne::OffscreenContext> nptsne::OffscreenContext::create() {
+    std::unique_ptr<OffscreenContext> context(new OffscreenContext());
+    bool try_glfw = true;
+    bool try_egl = true;
+    bool glfw_first = has_display();
+    const char* forced = std::getenv("NPTSNE_GL_BACKEND");
+    if (forced && *forced) {
+        const std::string backend(forced);
+        if (backend == "glfw") {
+            try_egl = false;
+        } else if (backend == "egl") {
+            try_glfw = false;
+            glfw_first = false;
+        } else {
+            throw std::runtime_error("NPTSNE_GL_BACKEND must be glfw or egl, not " + backend);
+        }
+    }
+    // Off the main thread only EGL can create a context
+    const bool glfw_needs_main_thread = try_glfw && !is_main_thread();
+    if (glfw_needs_main_thread) {
+        try_glfw = false;
+        glfw_first = false;
+    }
+    bool created = false;
+    if (glfw_first) {
+        created = (try_glfw && context->create_glfw()) || (try_egl && context->create_egl());
+    } else {
+        created = (try_egl && context->create_egl()) || (try_glfw && context->create_glfw());
+    }
+    if (!created && glfw_needs_main_thread) {
+        throw std::runtime_error(
+            "An OpenGL context can only be created on the main thread with GLFW, "
+            "call prepare_context() on the main thread before using the GPU from another thread");
+    }
+    if (!created) {
+        const std::string tried = try_glfw && try_egl ? "GLFW and EGL" : (try_glfw ? "GLFW" : "EGL");
+        throw std::runtime_error("Failed to create an offscreen OpenGL context, tried " + tried);
+    }
+    context->load_gl();
+    return context;
+}
+
+bool nptsne::OffscreenContext::create_glfw() {
+    if (!glfwInit()) {
+        NPTSNE_LOG(Debug) << "Unable to initialize GLFW";
+        return false;
+    }
+#ifdef __APPLE__
+    glfwWindowHint(GLFW_CONTEXT_VERSION_MAJOR, 4);
+    glfwWindowHint(GLFW_CONTEXT_VERSION_MINOR, 1);
+    glfwWindowHint(GLFW_OPENGL_FORWARD_COMPAT, GL_TRUE);
+    glfwWindowHint(GLFW_OPENGL_PROFILE, GLFW_OPENGL_CORE_PROFILE);
+#endif
+    glfwWindowHint(GLFW_VISIBLE, GLFW_FALSE);  // invisible - ie offscreen, window
+    _window = glfwCreateWindow(640, 480, "", NULL, NULL);
+    if (!_window) {
+        NPTSNE_LOG(Debug) << "Failed to create GLFW offscreen window";
+        if (0 == glfw_context_count) {
+            glfwTerminate();
+        }
+        return false;
+    }
+    ++glfw_context_count;
+    _backend = Backend::Glfw;
+    glfwMakeContextCurrent(_window);
+    return true;
+}
+
+bool nptsne::OffscreenContext::create_egl() {
+#ifdef __linux__
+    const EglApi& api = egl();
+    if (!api.loaded) {
+        return false;
+    }
+    // Prefer the Mesa surfaceless platform, it needs neither a display nor a GPU
+    EGLDisplay display = nullptr;
+    const char* client_extensions = api.QueryString(nullptr, EGL_EXTENSIONS);
+    if (api.GetPlatformDisplayEXT && has_extension(client_extensions, "EGL_MESA_platform_surfaceless")) {
+        display = api.GetPlatformDisplayEXT(EGL_PLATFORM_SURFACELESS_MESA, nullptr, nullptr);
+    }
+    EGLint major = 0, minor = 0;
+    if (!display || !api.Initialize(display, &major, &minor)) {
+        display = api.GetDisplay(nullptr);
+        if (!display || !api.Initialize(display, &major, &minor)) {
+            NPTSNE_LOG(Debug) << "Unable to initialize an EGL display, error " << api.GetError();
+            return false;
+        }
+    }
+    NPTSNE_LOG(Debug) << "EGL " << major << "." << minor;
+    auto terminate = [&]() {
+        if (0 == egl_context_count) {
+            api.Terminate(display);
+        }
+    };
+
+    const EGLint config_attributes[] = {
+        EGL_SURFACE_TYPE, EGL_PBUFFER_BIT,
+        EGL_RENDERABLE_TYPE, EGL_OPENGL_BIT,
+        EGL_NONE};
+    EGLConfig config = nullptr;
+    EGLint num_configs = 0;
+    if (!api.ChooseConfig(display, config_attributes, &config, 1, &num_configs) || num_configs < 1) {
+        NPTSNE_LOG(Debug) << "No EGL config for desktop OpenGL";
+        terminate();
+        return false;
+    }
+    if (!api.BindAPI(EGL_OPENGL_API)) {
+        NPTSNE_LOG(Debug) << "Unable to bind the EGL OpenGL API";
+        terminate();
+        return false;
+    }
+    // The compute shader tSNE needs 4.3, else fall back to 3.3 (texture rasterization)
+    EGLContext context = nullptr;
+    const EGLint versions[][2] = {{4, 3}, {3, 3}};
+    for (const auto& version : versions) {
+        const EGLint context_attributes[] = {
+            EGL_CONTEXT_MAJOR_VERSION, version[0],
+            EGL_CONTEXT_MINOR_VERSION, version[1],
+            EGL_CONTEXT_OPENGL_PROFILE_MASK, EGL_CONTEXT_OPENGL_CORE_PROFILE_BIT,
+            EGL_NONE};
+        context = api.CreateContext(display, config, nullptr, context_attributes);
+        if (context) {
+            break;
+        }
+    }
+    if (!context) {
+        NPTSNE_LOG(Debug) << "Unable to create an EGL OpenGL context, error " << api.GetError();
+        terminate();
+        return false;
+    }
+    // A small pbuffer, without it rely on EGL_KHR_surfaceless_context
+    const EGLint surface_attributes[] = {EGL_WIDTH, 1, EGL_HEIGHT, 1, EGL_NONE};
+    EGLSurface surface = api.CreatePbufferSurface(display, config, surface_attributes);
+    if (!api.MakeCurrent(display, surface, surface, context)) {
+        NPTSNE_LOG(Debug) << "Unable to make the EGL context current, error " << api.GetError();
+        if (surface) {
+            api.DestroySurface(display, surface);
+        }
+        api.DestroyContext(display, context);
+        terminate();
+        return false;
+    }
+    ++egl_context_count;
+    _backend = Backend::Egl;
+    _egl_display = display;
+    _egl_surface = surface;
+    _egl_context = context;
+    return true;
+#else
+    NPTSNE_LOG(Debug) << "EGL offscreen contexts are only supported on Linux";
+    return false;
+#endif
+}
+
+void nptsne::OffscreenContext::load_gl() {
+    GLADloadproc loader = nullptr;
+#ifdef __linux__
+    if (Backend::Egl == _backend) {
+        loader = reinterpret_cast<GLADloadproc>(egl().GetProcAddress);
+    }
+#endif
+    if (!loader) {
+        loader = reinterpret_cast<GLADloadproc>(glfwGetProcAddress);
+    }
+    if (!gladLoadGLLoader(loader)) {
+        throw std::runtime_error("Failed to initialize OpenGL context");
+    }
+    const char* renderer = reinterpret_cast<const char*>(glGetString(GL_RENDERER));
+    const char* version = reinterpret_cast<const char*>(glGetString(GL_VERSION));
+    NPTSNE_LOG(Info) << "OpenGL context (" << backend_name() << "): "
+        << (renderer ? renderer : "unknown renderer") << ", " << (version ? version : "unknown version");
+}
+
+void nptsne::OffscreenContext::make_current() {
+    if (Backend::Glfw == _backend) {
+        if (glfwGetCurrentContext() != _window) {
+            glfwMakeContextCurrent(_window);
+        }
+        return;
+    }
+#ifdef __linux__
+    if (egl().GetCurrentContext() != _egl_context) {
+        egl().MakeCurrent(_egl_display, _egl_surface, _egl_surface, _egl_context);
+    }
+#endif
+}
+
+void nptsne::OffscreenContext::release() {
+    if (Backend::Glfw == _backend) {
+        glfwMakeContextCurrent(NULL);
+        return;
+    }
+#ifdef __linux__
+    egl().MakeCurrent(_egl_display, nullptr, nullptr, nullptr);
+#endif
+}
+
+nptsne::OffscreenContext::~OffscreenContext() {
+    if (Backend::Glfw == _backend) {
+        if (_window) {
+            glfwDestroyWindow(_window);
+            if (0 == --glfw_context_count) {
+                glfwTerminate();
+            }
+        }
+        return;
+    }
+#ifdef __linux__
+    if (_egl_context) {
+        const EglApi& api = egl();
+        if (api.GetCurrentContext() == _egl_context) {
+            api.MakeCurrent(_egl_display, nullptr, nullptr, nullptr);
+        }
+        if (_egl_surface) {
+            api.DestroySurface(_egl_display, _egl_surface);
+        }
+        api.DestroyContext(_egl_display, _egl_context);
+        if (0 == --egl_context_count) {
+            api.Terminate(_egl_display);
+        }
+    }
+#endif
+}
+
+void nptsne::PooledContextReturn::operator()(OffscreenContext* context) const {
+    OffscreenContextPool::instance().give_back(context);
+}
+
+nptsne::OffscreenContextPool& nptsne::OffscreenContextPool::instance() {
+    // Never destroyed: contexts still in the pool at process exit are left
+    // to the operating system, release_idle is called at (python) exit.
+    static OffscreenContextPool* pool = new OffscreenContextPool();
+    return *pool;
+}
+
+nptsne::PooledContext nptsne::OffscreenContextPool::acquire() {
+    {
+        std::lock_guard<std::mutex> lock(_mutex);
+        if (!_idle.empty()) {
+            PooledContext context(_idle.back().release());
+            _idle.pop_back();
+            context->make_current();
+            return context;
+        }
+    }
+    std::lock_guard<std::mutex> glfw_lock(glfw_mutex());
+    NPTSNE_LOG(Debug) << "Create a new pooled OpenGL context";
+    return PooledContext(OffscreenContext::create().release());
+}
+
+void nptsne::OffscreenContextPool::give_back(OffscreenContext* context) {
+    if (!context) {
+        return;
+    }
+    // Detach from this thread, the next user may be on another thread
+    context->release();
+    std::lock_guard<std::mutex> lock(_mutex);
+    _idle.emplace_back(context);
+}
+
+size_t nptsne::OffscreenContextPool::release_idle() {
+    std::vector<std::unique_ptr<OffscreenContext>> idle;
+    {
+        std::lock_guard<std::mutex> lock(_mutex);
+        idle.swap(_idle);
+    }
+    std::lock_guard<std::mutex> glfw_lock(glfw_mutex());
+    const size_t count = idle.size();
+    idle.clear();
+    return count;
+}
+
+size_t nptsne::OffscreenContextPool::num_idle() {
+    std::lock_guard<std::mutex> lock(_mutex);
+    return _idle.size();
+}
@@ -0,0 +1,110 @@
+// Copyright 2020 LKEB at LUMC
+// Author: B. van Lew
+#pragma once
+
+#include <cstddef>
+#include <memory>
+#include <mutex>
+#include <vector>
+
+struct GLFWwindow;
+
+namespace nptsne {
+    // GLFW initialization, window creation and termination are process wide.
+    // Hold this lock while creating or destroying the offscreen OpenGL
+    // contexts so that transforms run from different threads do not interfere.
+    inline std::mutex& glfw_mutex() {
+        static std::mutex mutex;
+        return mutex;
+    }
+
+    // An OpenGL context without a visible window for the texture tSNE.
+    //
+    // There are two backends: an invisible GLFW window or (Linux only) an
+    // EGL context that needs no window system, using the Mesa surfaceless
+    // platform if available. libEGL is loaded at run time so it is neither
+    // a build nor an install requirement. With Mesa the EGL context also
+    // works without a GPU (llvmpipe software rendering).
+    //
+    // GLFW is used when a display is available (always on Windows and macOS,
+    // on Linux when DISPLAY or WAYLAND_DISPLAY is set), otherwise EGL. If the
+    // first choice fails the other one is tried. The environment variable
+    // NPTSNE_GL_BACKEND=glfw or NPTSNE_GL_BACKEND=egl forces a backend.
+    // GLFW requires the main thread, on another thread only EGL is tried.
+    //
+    // Create and destroy contexts with glfw_mutex() held, usually contexts
+    // are obtained from the OffscreenContextPool which takes care of this.
+    class OffscreenContext {
+     public:
+        enum class Backend {
+            Glfw,
+            Egl
+        };
+
+        // Create a context and load the OpenGL functions, the context is
+        // current on return. Throws std::runtime_error on failure, also when
+        // only GLFW could create it and this is not the main thread.
+        static std::unique_ptr<OffscreenContext> create();
+        ~OffscreenContext();
+
+        OffscreenContext(const OffscreenContext&) = delete;
+        OffscreenContext& operator=(const OffscreenContext&) = delete;
+
+        // Make the context current on the calling thread (if it is not already)
+        void make_current();
+        // Detach the context from the calling thread
+        void release();
+
+        Backend backend() const { return _backend; }
+        const char* backend_name() const { return Backend::Glfw == _backend ? "GLFW" : "EGL"; }
+
+     private:
+        OffscreenContext();
+
+        bool create_glfw();
+        bool create_egl();
+        void load_gl();
+
+        Backend _backend;
+        GLFWwindow* _window;
+        void* _egl_display;
+        void* _egl_surface;
+        void* _egl_context;
+    };
+
+    // Returns a context to the OffscreenContextPool when the PooledContext is destroyed
+    struct PooledContextReturn {
+        void operator()(OffscreenContext* context) const;
+    };
+    typedef std::unique_ptr<OffscreenContext, PooledContextReturn> PooledContext;
+
+    // The process wide pool of offscreen contexts.
+    //
+    // Creating a context (GLFW or EGL initialization, the window and loading
+    // the OpenGL functions) costs more than a small embedding. Contexts are
+    // therefore not destroyed after use but kept for the next transform,
+    // one context per concurrent user. The idle contexts are destroyed by
+    // release_idle, called from nptsne.release_gl_contexts and at exit.
+    class OffscreenContextPool {
+     public:
+        static OffscreenContextPool& instance();
+
+        // An idle context or else a new one, current on the calling thread.
+        // Throws std::runtime_error if no context can be created, e.g. with
+        // GLFW on a thread other than the main thread (see prepare_context).
+        PooledContext acquire();
+
+        // Destroy the idle contexts, returns the number destroyed
+        size_t release_idle();
+
+        size_t num_idle();
+
+     private:
+        friend struct PooledContextReturn;
+        OffscreenContextPool() {}
+        void give_back(OffscreenContext* context);
+
+        std::mutex _mutex;
+        std::vector<std::unique_ptr<OffscreenContext>> _idle;
+    };
+}  // namespace nptsne
@@ -0,0 +1,145 @@
+// Copyright 2020 LKEB at LUMC
+// Author: B. van Lew
+#pragma once
+
+#include <algorithm>
+#include <cstdint>
+#include <vector>
+#include "Types.h"
+
+namespace nptsne {
+
+// The random walks on a scale transition matrix, shared by the scale
+// builder and the walk influence of a drill-down
+
+// The phases of the walks from a scale, each has its own random streams
+const uint64_t kLandmarkPhase = 1;
+const uint64_t kInfluencePhase = 2;
+const uint64_t kSelectionPhase = 3;
+
+inline uint64_t splitmix64(uint64_t x) {
+    x += 0x9e3779b97f4a7c15ULL;
+    x = (x ^ (x >> 30)) * 0xbf58476d1ce4e5b9ULL;
+    x = (x ^ (x >> 27)) * 0x94d049bb133111ebULL;
+    return x ^ (x >> 31);
+}
+
+// A small, fast generator (SplitMix64) with a stream for each
+// seed, scale, phase and point
+class WalkRandom {
+ public:
+    WalkRandom(uint64_t seed, uint64_t scale_number, uint64_t phase, uint64_t point) :
+        _state(splitmix64(splitmix64(splitmix64(seed) ^ scale_number) ^ phase) ^ point) {
+    }
+
+    // Uniform in [0, 1)
+    double uniform() {
+        _state += 0x9e3779b97f4a7c15ULL;
+        uint64_t z = _state;
+        z = (z ^ (z >> 30)) * 0xbf58476d1ce4e5b9ULL;
+        z = (z ^ (z >> 27)) * 0x94d049bb133111ebULL;
+        z ^= z >> 31;
+        return (z >> 11) * (1.0 / 9007199254740992.0);
+    }
+
+ private:
+    uint64_t _state;
+};
+
+// The transition matrix in CSR form with the cumulative sum of each row,
+// a step of a walk is a binary search
+class WalkGraph {
+ public:
+    explicit WalkGraph(const SparseScalarMatrixType &transition_matrix) :
+        _matrix(transition_matrix), _all_points(true) {
+        const uint64_t num_points = transition_matrix.size();
+        _indptr.assign(num_points + 1, 0);
+        for (uint64_t i = 0; i < num_points; ++i) {
+            _indptr[i + 1] = _indptr[i] + transition_matrix[i].size();
+        }
+        fill_rows([](uint64_t r) { return r; });
+    }
+
+    // Only the rows of the points (in increasing order), for walks that
+    // mostly stay among them. A step from another point scans its transition
+    // matrix row, with the same result.
+    WalkGraph(const SparseScalarMatrixType &transition_matrix, std::vector<uint32_t> points) :
+        _matrix(transition_matrix), _all_points(false), _points(std::move(points)) {
+        _indptr.assign(_points.size() + 1, 0);
+        for (uint64_t r = 0; r < _points.size(); ++r) {
+            _indptr[r + 1] = _indptr[r] + transition_matrix[_points[r]].size();
+        }
+        fill_rows([this](uint64_t r) { return static_cast<uint64_t>(_points[r]); });
+    }
+
+    // The next point of a walk, a point without neighbors is not left
+    uint32_t step(uint32_t point, WalkRandom &random) const {
+        uint64_t row = point;
+        if (!_all_points) {
+            const auto it = std::lower_bound(_points.begin(), _points.end(), point);
+            if (it == _points.end() || *it != point) {
+                return scan_step(_matrix[point].memory(), point, random);
+            }
+            row = it - _points.begin();
+        }
+        const auto begin = _cumulative.begin() + _indptr[row];
+        const auto end = _cumulative.begin() + _indptr[row + 1];
+        if (begin == end) {
+            return point;
+        }
+        const double target = random.uniform() * *(end - 1);
+        auto it = std::upper_bound(begin, end, target);
+        if (it == end) {
+            --it;
+        }
+        return _indices[it - _cumulative.begin()];
+    }
+
+ private:
+    template <typename RowPoint>
+    void fill_rows(RowPoint row_point) {
+        const uint64_t num_rows = _indptr.size() - 1;
+        _indices.resize(_indptr[num_rows]);
+        _cumulative.resize(_indptr[num_rows]);
+        for (uint64_t r = 0; r < num_rows; ++r) {
+            auto pos = _indptr[r];
+            double sum = 0;
+            for (const auto &elem : _matrix[row_point(r)].memory()) {
+                sum += elem.second;
+                _indices[pos] = elem.first;
+                _cumulative[pos] = sum;
+                ++pos;
+            }
+        }
+    }
+
+    // As the binary search of step on the cumulative sums computed in place
+    static uint32_t scan_step(const MapStorageType &row, uint32_t point, WalkRandom &random) {
+        if (row.empty()) {
+            return point;
+        }
+        double sum = 0;
+        for (const auto &elem : row) {
+            sum += elem.second;
+        }
+        const double target = random.uniform() * sum;
+        double cumulative = 0;
+        for (const auto &elem : row) {
+            cumulative += elem.second;
+            if (cumulative > target) {
+                return elem.first;
+            }
+        }
+        return row.back().first;
+    }
+
+    const SparseScalarMatrixType &_matrix;
+    const bool _all_points;
+    // The points of the rows, if not all
+    std::vector<uint32_t> _points;
+    std::vector<uint64_t> _indptr;
+    std::vector<uint32_t> _indices;
+    std::vector<double> _cumulative;
+};
+
+}  // namespace nptsne
@@ -0,0 +1,33 @@
+// Copyright 2020 LKEB at LUMC
+// Author: B. van Lew
+#include "RunStats.h"
+#ifdef _WIN32
+#define NOMINMAX
+#include <windows.h>
+#include <psapi.h>
+#ifdef _MSC_VER
+#pragma comment(lib, "psapi.lib")
+#endif
+#else
+#include <sys/resource.h>
+#endif
+
+uint64_t nptsne::peak_resident_bytes() {
+#ifdef _WIN32
+    PROCESS_MEMORY_COUNTERS counters;
+    if (GetProcessMemoryInfo(GetCurrentProcess(), &counters, sizeof(counters))) {
+        return counters.PeakWorkingSetSize;
+    }
+    return 0;
+#else
+    struct rusage usage;
+    if (getrusage(RUSAGE_SELF, &usage) != 0) {
+        return 0;
+    }
+#ifdef __APPLE__
+    return static_cast<uint64_t>(usage.ru_maxrss);  // bytes
+#else
+    return static_cast<uint64_t>(usage.ru_maxrss) * 1024;  // kilobytes
+#endif
+#endif
+}
@@ -0,0 +1,72 @@
+// Copyright 2020 LKEB at LUMC
+// Author: B. van Lew
+#pragma once
+
+#include <chrono>
+#include <cstdint>
+#include <string>
+#include <utility>
+#include <vector>
+
+namespace nptsne {
+
+// Peak resident memory of the process in bytes, 0 if not available
+uint64_t peak_resident_bytes();
+
+// Statistics of the last run of an entry point: the wall time per phase
+// (in order of first occurrence), the number of iterations and the peak
+// resident memory of the process at the end of the run.
+class RunStats {
+ public:
+    RunStats() : _iterations(0), _peak_resident_bytes(0) {}
+
+    void clear() {
+        _phase_seconds.clear();
+        _iterations = 0;
+        _peak_resident_bytes = 0;
+    }
+
+    // Add to the time of a phase, repeated phases accumulate
+    void add_time(const std::string &phase, double seconds) {
+        for (auto &entry : _phase_seconds) {
+            if (entry.first == phase) {
+                entry.second += seconds;
+                return;
+            }
+        }
+        _phase_seconds.emplace_back(phase, seconds);
+    }
+
+    void add_iterations(int iterations) { _iterations += iterations; }
+
+    void record_peak_memory() { _peak_resident_bytes = peak_resident_bytes(); }
+
+    const std::vector<std::pair<std::string, double>> &phase_seconds() const { return _phase_seconds; }
+    int iterations() const { return _iterations; }
+    uint64_t peak_resident_bytes_at_end() const { return _peak_resident_bytes; }
+
+    // Times the enclosing scope as a phase
+    class Phase {
+     public:
+        Phase(RunStats &stats, std::string name) :
+            _stats(stats), _name(std::move(name)), _start(std::chrono::steady_clock::now()) {}
+        ~Phase() {
+            std::chrono::duration<double> elapsed = std::chrono::steady_clock::now() - _start;
+            _stats.add_time(_name, elapsed.count());
+        }
+        Phase(const Phase&) = delete;
+        Phase& operator=(const Phase&) = delete;
+
+     private:
+        RunStats &_stats;
+        std::string _name;
+        std::chrono::steady_clock::time_point _start;
+    };
+
+ private:
+    std::vector<std::pair<std::string, double>> _phase_seconds;
+    int _iterations;
+    uint64_t _peak_resident_bytes;
+};
+
+}  // namespace nptsne
@@ -0,0 +1,202 @@
+// Copyright 2020 LKEB at LUMC
+// Author: B. van Lew
+#include "ScaleBuilder.h"
+#include "Log.h"
+#include "RandomWalk.h"
+#include <algorithm>
+#include <map>
+#include <random>
+#include <stdexcept>
+#include <string>
+#include <vector>
+#ifdef _OPENMP
+#include <omp.h>
+#endif
+
+namespace {
+    // Walks towards a landmark that do not reach one in this many steps are
+    // dropped, e.g. in a component of the graph without landmarks
+    const int kMaxWalkLength = 1000;
+}  // namespace
+
+namespace nptsne {
+
+void build_scale(
+    const HsneType::scale_type &previous_scale,
+    const HsneType::Parameters &params,
+    int seed,
+    unsigned int scale_number,
+    HsneType::scale_type &scale,
+    int num_threads) {
+    if (num_threads <= 0) {
+#ifdef _OPENMP
+        num_threads = omp_get_max_threads();
+#else
+        num_threads = 1;
+#endif
+    }
+    if (params._mcmcs_num_walks <= 0 || params._mcmcs_walk_length <= 0 || params._num_walks_per_landmark <= 0) {
+        throw std::invalid_argument("The number and length of the random walks must be positive");
+    }
+    const uint64_t stream_seed = seed < 0 ? std::random_device()() : static_cast<uint64_t>(seed);
+    const auto &previous_matrix = previous_scale._transition_matrix;
+    const int64_t num_points = static_cast<int64_t>(previous_matrix.size());
+    const WalkGraph graph(previous_matrix);
+
+    // Landmark selection, the walk end counts are integers: the sum does
+    // not depend on the order of the threads
+    std::vector<uint32_t> end_count(num_points, 0);
+#pragma omp parallel for num_threads(num_threads) schedule(dynamic, 256)
+    for (int64_t i = 0; i < num_points; ++i) {
+        WalkRandom random(stream_seed, scale_number, kLandmarkPhase, i);
+        for (int w = 0; w < params._mcmcs_num_walks; ++w) {
+            uint32_t point = static_cast<uint32_t>(i);
+            for (int s = 0; s < params._mcmcs_walk_length; ++s) {
+                point = graph.step(point, random);
+            }
+#pragma omp atomic
+            ++end_count[point];
+        }
+    }
+
+    const double landmark_thresh = params._mcmcs_landmark_thresh * params._mcmcs_num_walks;
+    scale._landmark_to_original_data_idx.clear();
+    scale._landmark_to_previous_scale_idx.clear();
+    scale._previous_scale_to_landmark_idx.assign(num_points, -1);
+    for (int64_t i = 0; i < num_points; ++i) {
+        if (end_count[i] > landmark_thresh) {
+            scale._previous_scale_to_landmark_idx[i] =
+                static_cast<int32_t>(scale._landmark_to_previous_scale_idx.size());
+            scale._landmark_to_previous_scale_idx.push_back(static_cast<uint32_t>(i));
+            scale._landmark_to_original_data_idx.push_back(
+                i < static_cast<int64_t>(previous_scale._landmark_to_original_data_idx.size()) ?
+                previous_scale._landmark_to_original_data_idx[i] : static_cast<uint32_t>(i));
+        }
+    }
+    const int64_t num_landmarks = static_cast<int64_t>(scale._landmark_to_previous_scale_idx.size());
+    NPTSNE_LOG(Info) << "Scale " << scale_number << ": " << num_landmarks << " landmarks from "
+        << num_points << " points";
+    if (num_landmarks == 0) {
+        throw std::runtime_error("No landmarks selected for scale " + std::to_string(scale_number) +
+            ", lower mcmcs_landmark_thresh or use fewer scales");
+    }
+
+    // Area of influence: the landmarks where the walks of each point end
+    const auto &landmark_idx = scale._previous_scale_to_landmark_idx;
+    scale._area_of_influence.clear();
+    scale._area_of_influence.resize(num_points);
+#pragma omp parallel num_threads(num_threads)
+    {
+        std::map<uint32_t, uint32_t> counts;
+#pragma omp for schedule(dynamic, 256)
+        for (int64_t i = 0; i < num_points; ++i) {
+            auto &row = scale._area_of_influence[i];
+            if (landmark_idx[i] >= 0) {
+                row[landmark_idx[i]] = 1;
+                continue;
+            }
+            WalkRandom random(stream_seed, scale_number, kInfluencePhase, i);
+            counts.clear();
+            uint32_t num_reached = 0;
+            for (int w = 0; w < params._num_walks_per_landmark; ++w) {
+                uint32_t point = static_cast<uint32_t>(i);
+                for (int s = 0; s < kMaxWalkLength; ++s) {
+                    point = graph.step(point, random);
+                    if (landmark_idx[point] >= 0) {
+                        ++counts[landmark_idx[point]];
+                        ++num_reached;
+                        break;
+                    }
+                }
+            }
+            // In landmark order, each insert appends to the row
+            for (const auto &count : counts) {
+                row[count.first] = static_cast<ScalarType>(static_cast<double>(count.second) / num_reached);
+            }
+        }
+    }
+
+    // Landmark weights: the influence weighted sum of the previous weights,
+    // a previous scale without weights (the data scale) has unit weights
+    const auto &previous_weight = previous_scale._landmark_weight;
+    auto point_weight = [&previous_weight](int64_t i) -> double {
+        return i < static_cast<int64_t>(previous_weight.size()) ? previous_weight[i] : 1.0;
+    };
+    std::vector<double> weight(num_landmarks, 0);
+    // The influence per landmark (the transpose), points in increasing order
+    std::vector<uint64_t> influence_indptr(num_landmarks + 1, 0);
+    for (int64_t i = 0; i < num_points; ++i) {
+        for (const auto &elem : scale._area_of_influence[i].memory()) {
+            weight[elem.first] += point_weight(i) * elem.second;
+            ++influence_indptr[elem.first + 1];
+        }
+    }
+    for (int64_t l = 0; l < num_landmarks; ++l) {
+        influence_indptr[l + 1] += influence_indptr[l];
+    }
+    std::vector<uint32_t> influence_points(influence_indptr[num_landmarks]);
+    std::vector<double> influence_values(influence_indptr[num_landmarks]);
+    {
+        std::vector<uint64_t> pos(influence_indptr.begin(), influence_indptr.end() - 1);
+        for (int64_t i = 0; i < num_points; ++i) {
+            for (const auto &elem : scale._area_of_influence[i].memory()) {
+                influence_points[pos[elem.first]] = static_cast<uint32_t>(i);
+                influence_values[pos[elem.first]] = point_weight(i) * elem.second;
+                ++pos[elem.first];
+            }
+        }
+    }
+    scale._landmark_weight.assign(weight.begin(), weight.end());
+
+    // Transition matrix, each row is summed in a fixed order
+    scale._transition_matrix.clear();
+    scale._transition_matrix.resize(num_landmarks);
+#pragma omp parallel num_threads(num_threads)
+    {
+        std::vector<double> row_sum(num_landmarks, 0);
+        std::vector<uint32_t> touched;
+#pragma omp for schedule(dynamic, 64)
+        for (int64_t l = 0; l < num_landmarks; ++l) {
+            touched.clear();
+            for (uint64_t k = influence_indptr[l]; k < influence_indptr[l + 1]; ++k) {
+                const double value = influence_values[k];
+                for (const auto &elem : scale._area_of_influence[influence_points[k]].memory()) {
+                    const double product = value * elem.second;
+                    if (product <= 0) {
+                        continue;
+                    }
+                    if (row_sum[elem.first] == 0) {
+                        touched.push_back(elem.first);
+                    }
+                    row_sum[elem.first] += product;
+                }
+            }
+            std::sort(touched.begin(), touched.end());
+            double sum = 0;
+            for (auto j : touched) {
+                sum += row_sum[j];
+            }
+            if (sum > 0 && params._transition_matrix_prune_thresh > 0) {
+                const double prune = params._transition_matrix_prune_thresh * sum / touched.size();
+                double kept = 0;
+                for (auto j : touched) {
+                    if (row_sum[j] < prune) {
+                        row_sum[j] = 0;
+                    }
+                    kept += row_sum[j];
+                }
+                sum = kept;
+            }
+            // In landmark order, each insert appends to the row
+            auto &row = scale._transition_matrix[l];
+            for (auto j : touched) {
+                if (row_sum[j] > 0) {
+                    row[j] = static_cast<ScalarType>(row_sum[j] / sum);
+                }
+                row_sum[j] = 0;
+            }
+        }
+    }
+}
+
+}  // namespace nptsne
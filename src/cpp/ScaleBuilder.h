@@ -0,0 +1,38 @@
+// Copyright 2020 LKEB at LUMC
+// Author: B. van Lew
+#pragma once
+
+#include <cstdint>
+#include "Types.h"
+
+namespace nptsne {
+
+// Build the next scale of an HSNE hierarchy from the previous scale with
+// Monte Carlo random walks on its transition matrix, as HierarchicalSNE::addScale
+// does with Markov chain Monte Carlo sampling, but with the walks of all points
+// run in parallel.
+//
+// 1. Landmark selection: every point starts mcmcs_num_walks walks of
+//    mcmcs_walk_length steps, a point is a landmark if more than
+//    mcmcs_landmark_thresh times the mean number of walks end on it.
+// 2. Area of influence: every point that is not a landmark starts
+//    num_walks_per_landmark walks that stop on the first landmark reached,
+//    its influence row holds the fraction of the walks ending on each landmark.
+//    A landmark influences itself only.
+// 3. Landmark weights and the transition matrix between the landmarks
+//    T(l1, l2) = sum_i w_i A(i, l1) A(i, l2), normalized per row. Values below
+//    transition_matrix_prune_thresh times the mean row value are removed.
+//
+// Each point has its own random stream derived from the seed, the scale number,
+// the phase and the point index, the scale only depends on the seed and not on
+// the number of threads. A negative seed draws a random seed.
+// num_threads 0 uses all available cores.
+void build_scale(
+    const HsneType::scale_type &previous_scale,
+    const HsneType::Parameters &params,
+    int seed,
+    unsigned int scale_number,
+    HsneType::scale_type &scale,
+    int num_threads = 0);
+
+}  // namespace nptsne
@@ -0,0 +1,516 @@
+// Copyright 2020 LKEB at LUMC
+// Author: B. van Lew
+#include "SimilarityCache.h"
+#include "Log.h"
+#include <algorithm>
+#include <atomic>
+#include <cerrno>
+#include <cstdio>
+#include <cstring>
+#include <fstream>
+#include <stdexcept>
+#include <string>
+#include <vector>
+#ifdef _WIN32
+    #ifndef NOMINMAX
+        #define NOMINMAX
+    #endif
+    #include <windows.h>
+    #include <process.h>
+    #include <sys/types.h>
+    #include <sys/utime.h>
+#else
+    #include <dirent.h>
+    #include <sys/stat.h>
+    #include <sys/types.h>
+    #include <unistd.h>
+    #include <utime.h>
+#endif
+
+namespace {
+const char kMagic[8] = {'N', 'P', 'T', 'P', 'C', 'A', 'C', 'H'};
+const char kExtension[] = ".nptp";
+
+// magic, version, reserved, key, shape, 2 x float64, 4 x int32, nnz
+const uint64_t kHeaderSize = sizeof(kMagic) + 2 * sizeof(uint32_t) + 2 * sizeof(uint64_t) +
+    2 * sizeof(uint64_t) + 2 * sizeof(double) + 4 * sizeof(int32_t) + sizeof(uint64_t);
+
+struct Entry {
+    std::string path;
+    uint64_t size;
+    int64_t modified;
+};
+
+uint64_t mix(uint64_t x) {
+    x ^= x >> 30;
+    x *= 0xbf58476d1ce4e5b9ULL;
+    x ^= x >> 27;
+    x *= 0x94d049bb133111ebULL;
+    x ^= x >> 31;
+    return x;
+}
+
+uint64_t rotl(uint64_t x, int r) {
+    return (x << r) | (x >> (64 - r));
+}
+
+// Two independent 64 bit lanes over the data words
+void hash_bytes(const char* data, uint64_t size, uint64_t* hash) {
+    uint64_t a = 0x9e3779b97f4a7c15ULL;
+    uint64_t b = 0xc2b2ae3d27d4eb4fULL;
+    uint64_t num_words = size / sizeof(uint64_t);
+    for (uint64_t i = 0; i < num_words; ++i) {
+        uint64_t word;
+        std::memcpy(&word, data + i * sizeof(uint64_t), sizeof(uint64_t));
+        a = (a ^ mix(word)) * 0x100000001b3ULL;
+        b = rotl(b + word * 0x87c37b91114253d5ULL, 31) * 0x4cf5ad432745937fULL;
+    }
+    uint64_t tail = 0;
+    std::memcpy(&tail, data + num_words * sizeof(uint64_t), size - num_words * sizeof(uint64_t));
+    a = mix(a ^ mix(tail ^ size));
+    b = mix(b ^ tail ^ rotl(size, 17));
+    hash[0] = a;
+    hash[1] = b;
+}
+
+std::string join(const std::string& directory, const std::string& name) {
+#ifdef _WIN32
+    const char separator = '\\';
+#else
+    const char separator = '/';
+#endif
+    if (directory.empty() || directory.back() == '/' || directory.back() == separator) {
+        return directory + name;
+    }
+    return directory + separator + name;
+}
+
+bool is_directory(const std::string& path) {
+#ifdef _WIN32
+    DWORD attributes = GetFileAttributesA(path.c_str());
+    return attributes != INVALID_FILE_ATTRIBUTES && (attributes & FILE_ATTRIBUTE_DIRECTORY);
+#else
+    struct stat info;
+    return stat(path.c_str(), &info) == 0 && S_ISDIR(info.st_mode);
+#endif
+}
+
+// Create the directory and its missing parents
+void make_directories(const std::string& path) {
+    if (path.empty() || is_directory(path)) {
+        return;
+    }
+    auto pos = path.find_last_of("/\\");
+    if (pos != std::string::npos && pos > 0) {
+        make_directories(path.substr(0, pos));
+    }
+#ifdef _WIN32
+    bool created = CreateDirectoryA(path.c_str(), nullptr) || GetLastError() == ERROR_ALREADY_EXISTS;
+#else
+    bool created = mkdir(path.c_str(), 0777) == 0 || errno == EEXIST;
+#endif
+    if (!created || !is_directory(path)) {
+        throw std::runtime_error("Cannot create the similarity cache directory " + path);
+    }
+}
+
+bool ends_with(const std::string& name, const char* suffix) {
+    auto length = std::strlen(suffix);
+    return name.size() > length && name.compare(name.size() - length, length, suffix) == 0;
+}
+
+// The cache entries in the directory
+std::vector<Entry> list_entries(const std::string& directory) {
+    std::vector<Entry> entries;
+#ifdef _WIN32
+    WIN32_FIND_DATAA data;
+    HANDLE find = FindFirstFileA(join(directory, std::string("*") + kExtension).c_str(), &data);
+    if (find == INVALID_HANDLE_VALUE) {
+        return entries;
+    }
+    do {
+        if (data.dwFileAttributes & FILE_ATTRIBUTE_DIRECTORY) {
+            continue;
+        }
+        Entry entry;
+        entry.path = join(directory, data.cFileName);
+        entry.size = (static_cast<uint64_t>(data.nFileSizeHigh) << 32) | data.nFileSizeLow;
+        entry.modified = (static_cast<int64_t>(data.ftLastWriteTime.dwHighDateTime) << 32) |
+            data.ftLastWriteTime.dwLowDateTime;
+        entries.push_back(entry);
+    } while (FindNextFileA(find, &data));
+    FindClose(find);
+#else
+    DIR* dir = opendir(directory.c_str());
+    if (dir == nullptr) {
+        return entries;
+    }
+    while (struct dirent* item = readdir(dir)) {
+        std::string name = item->d_name;
+        if (!ends_with(name, kExtension)) {
+            continue;
+        }
+        Entry entry;
+        entry.path = join(directory, name);
+        struct stat info;
+        if (stat(entry.path.c_str(), &info) != 0 || !S_ISREG(info.st_mode)) {
+            continue;
+        }
+        entry.size = static_cast<uint64_t>(info.st_size);
+#ifdef __APPLE__
+        const struct timespec& modified = info.st_mtimespec;
+#else
+        const struct timespec& modified = info.st_mtim;
+#endif
+        entry.modified = static_cast<int64_t>(modified.tv_sec) * 1000000000 + modified.tv_nsec;
+        entries.push_back(entry);
+    }
+    closedir(dir);
+#endif
+    return entries;
+}
+
+// Mark an entry as recently used
+void touch(const std::string& path) {
+#ifdef _WIN32
+    _utime(path.c_str(), nullptr);
+#else
+    utime(path.c_str(), nullptr);
+#endif
+}
+
+int process_id() {
+#ifdef _WIN32
+    return _getpid();
+#else
+    return static_cast<int>(getpid());
+#endif
+}
+
+template <typename T>
+void write_value(std::ofstream& out, const T& value) {
+    out.write(reinterpret_cast<const char*>(&value), sizeof(T));
+}
+
+template <typename T>
+bool read_value(std::ifstream& in, T* value) {
+    return static_cast<bool>(in.read(reinterpret_cast<char*>(value), sizeof(T)));
+}
+
+uint64_t num_non_zero(const nptsne::SparseScalarMatrixType& matrix) {
+    uint64_t result = 0;
+    for (const auto& row : matrix) {
+        result += row.size();
+    }
+    return result;
+}
+}  // namespace
+
+namespace nptsne {
+
+const uint32_t SimilarityCache::kVersion;
+
+std::string SimilarityCache::Key::file_name() const {
+    char name[2 * 16 + 1];
+    std::snprintf(name, sizeof(name), "%016llx%016llx",
+        static_cast<unsigned long long>(hash[0]), static_cast<unsigned long long>(hash[1]));
+    return std::string(name) + kExtension;
+}
+
+SimilarityCache& SimilarityCache::instance() {
+    static SimilarityCache cache;
+    return cache;
+}
+
+void SimilarityCache::configure(const std::string& directory, uint64_t max_bytes) {
+    make_directories(directory);
+    std::lock_guard<std::mutex> lock(_mutex);
+    _directory = directory;
+    _max_bytes = max_bytes;
+}
+
+bool SimilarityCache::enabled() {
+    std::lock_guard<std::mutex> lock(_mutex);
+    return !_directory.empty();
+}
+
+SimilarityCache::Key SimilarityCache::make_key(const float* data, uint64_t num_points, uint64_t num_dimensions,
+    const ProbGenType::Parameters& params) {
+    Key key;
+    key.num_points = num_points;
+    key.num_dimensions = num_dimensions;
+    key.perplexity = params._perplexity;
+    key.perplexity_multiplier = params._perplexity_multiplier;
+    key.aknn_algorithm = static_cast<int32_t>(params._aknn_algorithm);
+    key.aknn_metric = static_cast<int32_t>(params._aknn_metric);
+    key.num_trees = params._num_trees;
+    key.num_checks = params._num_checks;
+    hash_bytes(reinterpret_cast<const char*>(data), num_points * num_dimensions * sizeof(float), key.hash);
+    // Fold the shape and parameters into the data hash
+    uint64_t fields[8];
+    fields[0] = num_points;
+    fields[1] = num_dimensions;
+    std::memcpy(&fields[2], &key.perplexity, sizeof(double));
+    std::memcpy(&fields[3], &key.perplexity_multiplier, sizeof(double));
+    fields[4] = static_cast<uint32_t>(key.aknn_algorithm);
+    fields[5] = static_cast<uint32_t>(key.aknn_metric);
+    fields[6] = static_cast<uint32_t>(key.num_trees);
+    fields[7] = static_cast<uint32_t>(key.num_checks);
+    uint64_t field_hash[2];
+    hash_bytes(reinterpret_cast<const char*>(fields), sizeof(fields), field_hash);
+    key.hash[0] = mix(key.hash[0] ^ field_hash[0]);
+    key.hash[1] = mix(key.hash[1] + rotl(field_hash[1], 23));
+    return key;
+}
+
+bool SimilarityCache::load(const Key& key, SparseScalarMatrixType& matrix) {
+    std::string directory;
+    {
+        std::lock_guard<std::mutex> lock(_mutex);
+        directory = _directory;
+    }
+    if (directory.empty()) {
+        return false;
+    }
+    const std::string path = join(directory, key.file_name());
+    std::ifstream in(path, std::ios::binary);
+    bool found = false;
+    if (in) {
+        char magic[sizeof(kMagic)];
+        uint32_t version, reserved;
+        Key stored;
+        uint64_t nnz = 0;
+        bool valid = in.read(magic, sizeof(magic)) && std::memcmp(magic, kMagic, sizeof(kMagic)) == 0 &&
+            read_value(in, &version) && version == kVersion && read_value(in, &reserved) &&
+            read_value(in, &stored.hash[0]) && read_value(in, &stored.hash[1]) &&
+            read_value(in, &stored.num_points) && read_value(in, &stored.num_dimensions) &&
+            read_value(in, &stored.perplexity) && read_value(in, &stored.perplexity_multiplier) &&
+            read_value(in, &stored.aknn_algorithm) && read_value(in, &stored.aknn_metric) &&
+            read_value(in, &stored.num_trees) && read_value(in, &stored.num_checks) &&
+            read_value(in, &nnz);
+        valid = valid && stored.hash[0] == key.hash[0] && stored.hash[1] == key.hash[1] &&
+            stored.num_points == key.num_points && stored.num_dimensions == key.num_dimensions &&
+            stored.perplexity == key.perplexity && stored.perplexity_multiplier == key.perplexity_multiplier &&
+            stored.aknn_algorithm == key.aknn_algorithm && stored.aknn_metric == key.aknn_metric &&
+            stored.num_trees == key.num_trees && stored.num_checks == key.num_checks;
+        if (valid) {
+            // Bound the array sizes by the bytes left in the file before allocating
+            const auto header_end = in.tellg();
+            in.seekg(0, std::ios::end);
+            const uint64_t remaining = static_cast<uint64_t>(in.tellg() - header_end);
+            in.seekg(header_end);
+            const uint64_t max_indptr_count = remaining / sizeof(uint64_t);
+            valid = key.num_points < max_indptr_count &&
+                nnz <= (remaining - (key.num_points + 1) * sizeof(uint64_t)) / (sizeof(uint32_t) + sizeof(float));
+        }
+        if (valid) {
+            std::vector<uint64_t> indptr(key.num_points + 1);
+            std::vector<uint32_t> indices(nnz);
+            std::vector<float> values(nnz);
+            valid = in.read(reinterpret_cast<char*>(indptr.data()), indptr.size() * sizeof(uint64_t)) &&
+                in.read(reinterpret_cast<char*>(indices.data()), nnz * sizeof(uint32_t)) &&
+                in.read(reinterpret_cast<char*>(values.data()), nnz * sizeof(float)) &&
+                indptr[0] == 0 && indptr[key.num_points] == nnz;
+            for (uint64_t i = 0; valid && i < key.num_points; ++i) {
+                valid = indptr[i] <= indptr[i + 1];
+            }
+            for (uint64_t j = 0; valid && j < nnz; ++j) {
+                valid = indices[j] < key.num_points;
+            }
+            if (valid) {
+                matrix.clear();
+                matrix.resize(key.num_points);
+                for (uint64_t i = 0; i < key.num_points; ++i) {
+                    auto& memory = matrix[i].memory();
+                    memory.reserve(indptr[i + 1] - indptr[i]);
+                    for (uint64_t j = indptr[i]; j < indptr[i + 1]; ++j) {
+                        memory.emplace_back(indices[j], values[j]);
+                    }
+                }
+                found = true;
+            }
+        }
+        if (!valid) {
+            NPTSNE_LOG(Warning) << "Ignoring invalid similarity cache entry " << path;
+        }
+    }
+    in.close();
+    if (found) {
+        touch(path);
+    }
+    std::lock_guard<std::mutex> lock(_mutex);
+    if (found) {
+        ++_hits;
+    } else {
+        ++_misses;
+    }
+    return found;
+}
+
+void SimilarityCache::store(const Key& key, const SparseScalarMatrixType& matrix) {
+    std::string directory;
+    uint64_t max_bytes;
+    {
+        std::lock_guard<std::mutex> lock(_mutex);
+        directory = _directory;
+        max_bytes = _max_bytes;
+    }
+    if (directory.empty()) {
+        return;
+    }
+    const uint64_t nnz = num_non_zero(matrix);
+    const uint64_t entry_size = kHeaderSize + (matrix.size() + 1) * sizeof(uint64_t) +
+        nnz * (sizeof(uint32_t) + sizeof(float));
+    if (entry_size > max_bytes) {
+        NPTSNE_LOG(Info) << "Similarity matrix of " << entry_size << " bytes exceeds the cache size, not cached";
+        return;
+    }
+    static std::atomic<uint64_t> counter(0);
+    const std::string path = join(directory, key.file_name());
+    const std::string temp_path = path + ".tmp" + std::to_string(process_id()) + "_" + std::to_string(counter++);
+    {
+        std::ofstream out(temp_path, std::ios::binary);
+        out.write(kMagic, sizeof(kMagic));
+        write_value(out, kVersion);
+        write_value(out, uint32_t(0));
+        write_value(out, key.hash[0]);
+        write_value(out, key.hash[1]);
+        write_value(out, key.num_points);
+        write_value(out, key.num_dimensions);
+        write_value(out, key.perplexity);
+        write_value(out, key.perplexity_multiplier);
+        write_value(out, key.aknn_algorithm);
+        write_value(out, key.aknn_metric);
+        write_value(out, key.num_trees);
+        write_value(out, key.num_checks);
+        write_value(out, nnz);
+        uint64_t pos = 0;
+        write_value(out, pos);
+        for (const auto& row : matrix) {
+            pos += row.size();
+            write_value(out, pos);
+        }
+        for (const auto& row : matrix) {
+            for (const auto& elem : row.memory()) {
+                write_value(out, static_cast<uint32_t>(elem.first));
+            }
+        }
+        for (const auto& row : matrix) {
+            for (const auto& elem : row.memory()) {
+                write_value(out, static_cast<float>(elem.second));
+            }
+        }
+        out.close();
+        if (!out) {
+            std::remove(temp_path.c_str());
+            NPTSNE_LOG(Warning) << "Cannot write the similarity cache entry " << path;
+            return;
+        }
+    }
+    if (std::rename(temp_path.c_str(), path.c_str()) != 0) {
+        // Windows does not replace an existing file, another process may have stored the same entry
+        std::remove(path.c_str());
+        if (std::rename(temp_path.c_str(), path.c_str()) != 0) {
+            std::remove(temp_path.c_str());
+            NPTSNE_LOG(Warning) << "Cannot write the similarity cache entry " << path;
+            return;
+        }
+    }
+    evict(directory, max_bytes, path);
+}
+
+// Remove the least recently used entries until the total size is within max_bytes
+void SimilarityCache::evict(const std::string& directory, uint64_t max_bytes, const std::string& keep) {
+    auto entries = list_entries(directory);
+    uint64_t total = 0;
+    for (const auto& entry : entries) {
+        total += entry.size;
+    }
+    if (total <= max_bytes) {
+        return;
+    }
+    std::sort(entries.begin(), entries.end(), [](const Entry& a, const Entry& b) {
+        return a.modified < b.modified;
+    });
+    for (const auto& entry : entries) {
+        if (total <= max_bytes) {
+            break;
+        }
+        if (entry.path == keep) {
+            continue;
+        }
+        if (std::remove(entry.path.c_str()) == 0) {
+            NPTSNE_LOG(Debug) << "Evicted similarity cache entry " << entry.path;
+        }
+        total -= entry.size;
+    }
+}
+
+uint64_t SimilarityCache::clear() {
+    std::string directory;
+    {
+        std::lock_guard<std::mutex> lock(_mutex);
+        directory = _directory;
+    }
+    uint64_t removed = 0;
+    if (directory.empty()) {
+        return removed;
+    }
+    for (const auto& entry : list_entries(directory)) {
+        if (std::remove(entry.path.c_str()) == 0) {
+            ++removed;
+        }
+    }
+    return removed;
+}
+
+SimilarityCache::Info SimilarityCache::info() {
+    Info result;
+    {
+        std::lock_guard<std::mutex> lock(_mutex);
+        result.directory = _directory;
+        result.max_bytes = _max_bytes;
+        result.hits = _hits;
+        result.misses = _misses;
+    }
+    result.num_entries = 0;
+    result.total_bytes = 0;
+    if (!result.directory.empty()) {
+        for (const auto& entry : list_entries(result.directory)) {
+            ++result.num_entries;
+            result.total_bytes += entry.size;
+        }
+    }
+    return result;
+}
+
+bool compute_probability_distributions(
+    const float* data,
+    uint64_t num_dimensions,
+    uint64_t num_points,
+    SparseScalarMatrixType& distributions,
+    const ProbGenType::Parameters& params) {
+    auto& cache = SimilarityCache::instance();
+    const bool use_cache = cache.enabled();
+    SimilarityCache::Key key;
+    if (use_cache) {
+        key = SimilarityCache::make_key(data, num_points, num_dimensions, params);
+        if (cache.load(key, distributions)) {
+            NPTSNE_LOG(Info) << "Similarities read from the cache";
+            return true;
+        }
+    }
+    ProbGenType prob_gen;
+    prob_gen.computeProbabilityDistributions(
+        const_cast<float*>(data),
+        num_dimensions,
+        num_points,
+        distributions,
+        params);
+    if (use_cache) {
+        cache.store(key, distributions);
+    }
+    return false;
+}
+
+}  // namespace nptsne
@@ -0,0 +1,107 @@
+// Copyright 2020 LKEB at LUMC
+// Author: B. van Lew
+#pragma once
+
+// An opt-in, process wide on-disk cache of perplexity calibrated
+// probability matrices (the similarity phase of the tSNE).
+//
+// The key is a 128 bit hash of the data content and shape and of the
+// probability generator parameters (perplexity, kNN library, metric and
+// accuracy settings). Each entry is a file <key>.nptp in the cache
+// directory with the matrix in compressed sparse row (CSR) form. The
+// header repeats the shape and parameters, they are checked on load.
+// Entries are written to a temporary file and renamed so concurrent
+// processes never read a partial entry.
+//
+// The total size is bounded: after a store the least recently used
+// entries are removed. A hit touches the file modification time, which
+// serves as the LRU order.
+//
+// Layout (little endian):
+//   char[8]   magic "NPTPCACH"
+//   uint32    version
+//   uint32    reserved
+//   uint64    key (2 x uint64)
+//   uint64    number of points, number of dimensions
+//   float64   perplexity, perplexity multiplier
+//   int32     kNN library, metric, num. trees, num. checks
+//   uint64    number of non zeros
+//   uint64    indptr[num points + 1], uint32 indices[nnz], float32 values[nnz]
+
+#include "Types.h"
+#include <cstdint>
+#include <mutex>
+#include <string>
+
+namespace nptsne {
+
+class SimilarityCache {
+ public:
+    struct Key {
+        uint64_t hash[2];
+        uint64_t num_points;
+        uint64_t num_dimensions;
+        double perplexity;
+        double perplexity_multiplier;
+        int32_t aknn_algorithm;
+        int32_t aknn_metric;
+        int32_t num_trees;
+        int32_t num_checks;
+
+        // The entry file name, without the directory
+        std::string file_name() const;
+    };
+
+    struct Info {
+        std::string directory;
+        uint64_t max_bytes;
+        uint64_t num_entries;
+        uint64_t total_bytes;
+        uint64_t hits;
+        uint64_t misses;
+    };
+
+    static const uint32_t kVersion = 1;
+
+    static SimilarityCache& instance();
+
+    // Enable the cache in directory (created if needed) with a size bound,
+    // an empty directory disables it. Throws std::runtime_error if the
+    // directory cannot be created.
+    void configure(const std::string& directory, uint64_t max_bytes);
+    bool enabled();
+
+    static Key make_key(const float* data, uint64_t num_points, uint64_t num_dimensions,
+        const ProbGenType::Parameters& params);
+
+    // True and the matrix if the key is in the cache
+    bool load(const Key& key, SparseScalarMatrixType& matrix);
+    // Add an entry and evict the least recently used ones beyond the size bound.
+    // Failures are logged, not thrown: the cache is an optimization.
+    void store(const Key& key, const SparseScalarMatrixType& matrix);
+
+    // Remove all entries, returns the number removed
+    uint64_t clear();
+    Info info();
+
+ private:
+    SimilarityCache() : _max_bytes(0), _hits(0), _misses(0) {}
+    void evict(const std::string& directory, uint64_t max_bytes, const std::string& keep);
+
+    std::mutex _mutex;
+    std::string _directory;
+    uint64_t _max_bytes;
+    uint64_t _hits;
+    uint64_t _misses;
+};
+
+// ProbGenType::computeProbabilityDistributions through the SimilarityCache
+// if it is enabled. Returns true on a cache hit.
+bool compute_probability_distributions(
+    const float* data,
+    uint64_t num_dimensions,
+    uint64_t num_points,
+    SparseScalarMatrixType& distributions,
+    const ProbGenType::Parameters& params);
+
+}  // namespace nptsne
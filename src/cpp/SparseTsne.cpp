@@ -1,40 +1,52 @@
 // Copyright 2020 LKEB at LUMC
 // Author: B. van Lew
 #include "SparseTsne.h"
+#include "Log.h"
 #include <hdi/utils/log_helper_functions.h>
-#include <iostream>
+#include <algorithm>
 #include <random>
+#include <stdexcept>
+#include <utility>
 
-void SparseTsne::initialize(nptsne::SparseScalarMatrixType& sparse_matrix,
+void SparseTsne::initialize(nptsne::SharedSparseMatrixType shared_matrix,
     uint32_t analysis_id,
     hdi::dr::TsneParameters params) {
     _tSNE.setLogger(_logger);
 
     // The sparse matrix should have at least 7 entries
     // TODO(B.van_Lew) repair this correctly
-    std::cout << "Set the sparse matrix\n";
-    std::random_device rd;
-    std::mt19937 gen(rd());
-    std::uniform_int_distribution<> dis(0, sparse_matrix.size() - 1);
-    for (int i = 0; i < sparse_matrix.size(); ++i) {
-        if (sparse_matrix[i].size() < 7) {
-            int to_add = 7 - sparse_matrix[i].size();
-            for (int v = 0; v < to_add; ++v) {
-                int id = dis(gen);
-                sparse_matrix[i][id] = 1. / to_add;
+    NPTSNE_LOG(Debug) << "Set the sparse matrix";
+    bool needs_padding = std::any_of(shared_matrix->begin(), shared_matrix->end(),
+        [](const nptsne::MapType& row) { return row.size() < 7; });
+    if (needs_padding) {
+        // Copy on write, the shared matrix may belong to the hierarchy
+        nptsne::SparseScalarMatrixType padded(*shared_matrix);
+        std::random_device rd;
+        std::mt19937 gen(rd());
+        std::uniform_int_distribution<> dis(0, padded.size() - 1);
+        for (int i = 0; i < padded.size(); ++i) {
+            if (padded[i].size() < 7) {
+                int to_add = 7 - padded[i].size();
+                for (int v = 0; v < to_add; ++v) {
+                    int id = dis(gen);
+                    padded[i][id] = 1. / to_add;
+                }
             }
         }
+        shared_matrix = nptsne::share_matrix(std::move(padded));
     }
+    _sparse_matrix = shared_matrix;
+    const nptsne::SparseScalarMatrixType& sparse_matrix = *_sparse_matrix;
 
     // theta and the exaggeration factor are set based on the size of the data
     // Less than 1000 points: theta = 0 exaggeration = 1.5
     // 1000 to 15000 points:  theta scales up to 0.5 exaggeration scales up to 10
     // 15000 or more points: theta = 0.5 exaggeration = 10
-    std::cout << "Determine the theta\n";
+    NPTSNE_LOG(Debug) << "Determine the theta";
     double theta = 0;
-    std::cout << "Sparse matrix size " << sparse_matrix.size() << std::endl;
+    NPTSNE_LOG(Debug) << "Sparse matrix size " << sparse_matrix.size();
     if (sparse_matrix.size() < 1000) {
-        std::cout << "Theta 0 exaggeration 1.5" << std::endl;
+        NPTSNE_LOG(Debug) << "Theta 0 exaggeration 1.5";
         theta = 0;
         params._exaggeration_factor = 1.5;
     } else if (sparse_matrix.size() < 15000) {
@@ -46,18 +58,47 @@ void SparseTsne::initialize(nptsne::SparseScalarMatrixType& sparse_matrix,
     }
     params._remove_exaggeration_iter = 170;
 
-    std::cout << "Set tSNE theta" << std::endl;
-    _tSNE.setTheta(theta);
     hdi::utils::secureLogValue(_logger, "theta", theta);
     hdi::utils::secureLogValue(_logger, "exg", params._exaggeration_factor);
+    _analysis_id = analysis_id;
+    if (EmbedderType::CPU != _embedder_type) {
+        initialize_cpu_tsne(sparse_matrix, theta, params);
+        return;
+    }
 
-    std::cout << "Initialize tSNE" << std::endl;
+    NPTSNE_LOG(Debug) << "Set tSNE theta";
+    _tSNE.setTheta(theta);
+    NPTSNE_LOG(Debug) << "Initialize tSNE";
     _tSNE.initialize(sparse_matrix, &_embedding, params);
-    std::cout << "Record the analysis id\n";
-    _analysis_id = analysis_id;
+}
+
+void SparseTsne::set_embedder_type(EmbedderType embedder_type, int num_threads) {
+    if (EmbedderType::GPU == embedder_type) {
+        throw std::invalid_argument("SparseTsne is a CPU embedder");
+    }
+    _embedder_type = embedder_type;
+    _num_threads = num_threads;
+}
+
+void SparseTsne::initialize_cpu_tsne(const nptsne::SparseScalarMatrixType& sparse_matrix,
+    double theta,
+    const hdi::dr::TsneParameters& params) {
+    auto cpu_params = nptsne::CpuTsne::from_tsne_parameters(params);
+    cpu_params.repulsion = EmbedderType::CPU_FFT == _embedder_type ?
+        nptsne::CpuTsne::Repulsion::FFT : nptsne::CpuTsne::Repulsion::BarnesHut;
+    cpu_params.theta = theta;
+    // Without a seed use a fixed one, the embedding is then reproducible
+    cpu_params.seed = params._seed < 0 ? 0 : params._seed;
+    _embedding = nptsne::EmbeddingType(2, sparse_matrix.size());
+    NPTSNE_LOG(Debug) << "Initialize CPU tSNE with " << _num_threads << " threads (0: all)";
+    _cpu_tsne.initialize(sparse_matrix, _embedding.getContainer().data(), cpu_params, _num_threads);
 }
 
 void SparseTsne::doAnIteration() {
+    if (EmbedderType::CPU != _embedder_type) {
+        _cpu_tsne.doAnIteration(_embedding.getContainer().data());
+        return;
+    }
     _tSNE.doAnIteration();
 }
 
@@ -10,6 +10,8 @@
 #include <hdi/utils/abstract_log.h>
 #include <hdi/data/map_mem_eff.h>
 #include "Types.h"
+#include "CpuTsne.h"
+#include "EmbedderType.h"
 #include <vector>
 
 // Provides a wrapping for a sparse tSNE embedder
@@ -17,18 +19,31 @@
 // intermediate embedding can be retrieved.
 class SparseTsne final {
  public:
-    SparseTsne() : _logger(nullptr) {}
+    SparseTsne() :
+        _sparse_matrix(nptsne::share_matrix(nptsne::SparseScalarMatrixType())),
+        _logger(nullptr), _embedder_type(EmbedderType::CPU), _num_threads(0) {}
     // No virtual destructor - we are final
 
-    void initialize(nptsne::SparseScalarMatrixType& sparse_matrix,
+    // The matrix is shared, not copied. Rows with fewer than 7 entries
+    // are padded in a private copy, the shared matrix is not changed.
+    void initialize(nptsne::SharedSparseMatrixType sparse_matrix,
         uint32_t analysis_id,
         hdi::dr::TsneParameters params = hdi::dr::TsneParameters());
 
     void doAnIteration();
 
+    // Select the CPU engine before initialize: EmbedderType::CPU is the HDILib
+    // (single threaded) engine, EmbedderType::CPU_PARALLEL the multi-threaded one
+    // and EmbedderType::CPU_FFT the multi-threaded one with FFT interpolated repulsion.
+    // num_threads 0 uses all cores.
+    void set_embedder_type(EmbedderType embedder_type, int num_threads = 0);
+
+    EmbedderType embedder_type() const { return _embedder_type; }
+    int num_threads() const { return _num_threads; }
+
     nptsne::EmbeddingType& getEmbedding() { return _embedding; }
 
-    nptsne::SparseScalarMatrixType& getTransitionMatrix() { return _sparse_matrix; }
+    const nptsne::SparseScalarMatrixType& getTransitionMatrix() { return *_sparse_matrix; }
 
     void setLogger(hdi::utils::AbstractLog* logger) {
         _logger = logger;
@@ -36,9 +51,17 @@ class SparseTsne final {
     }
 
  private:
+    // Initialize the CpuTsne engine with the settings of the HDILib engine
+    void initialize_cpu_tsne(const nptsne::SparseScalarMatrixType& sparse_matrix,
+        double theta,
+        const hdi::dr::TsneParameters& params);
+
     nptsne::SparseTsneType _tSNE;
     nptsne::EmbeddingType _embedding;
-    nptsne::SparseScalarMatrixType _sparse_matrix;
+    nptsne::SharedSparseMatrixType _sparse_matrix;
     hdi::utils::AbstractLog* _logger;
     uint32_t _analysis_id;
+    EmbedderType _embedder_type;
+    int _num_threads;
+    nptsne::CpuTsne _cpu_tsne;
 };
@@ -2,11 +2,15 @@
 // Author: B. van Lew
 // Interface is a simplified version of https://scikit-learn.org/stable/modules/generated/sklearn.manifold.TSNE.html
 #include "TextureTsne.h"
+#include "CpuTsne.h"
+#include "OffscreenContext.h"
+#include "EmbeddingOutput.h"
+#include "SimilarityCache.h"
+#include "Log.h"
 #include <cstdio>
-#include <iostream>
 #include <fstream>
+#include <utility>
 #include <vector>
-#include "hdi/utils/cout_log.h"
 #include "hdi/utils/log_helper_functions.h"
 #include "hdi/data/embedding.h"
 #include "hdi/data/panel_data.h"
@@ -14,11 +18,6 @@
 #include "hdi/dimensionality_reduction/hd_joint_probability_generator.h"
 #include "hdi/utils/scoped_timers.h"
 
-// not present in glfw 3.1.2
-#ifndef GLFW_FALSE
-#define GLFW_FALSE 0
-#endif
-
 // constructor
 TextureTsne::TextureTsne(
     bool verbose,
@@ -29,7 +28,17 @@ TextureTsne::TextureTsne(
     KnnAlgorithm knn_algorithm
 ) : _verbose(verbose), _iterations(iterations), _num_target_dimensions(num_target_dimensions),
     _perplexity(perplexity), _exaggeration_iter(exaggeration_iter),
-    _knn_algorithm(knn_algorithm), _offscreen_context(nullptr) {
+    _knn_algorithm(knn_algorithm), _busy("TextureTsne") {
+}
+
+// Acquire the context here, on the calling thread. fit_transform makes
+// it current on the thread that runs it.
+void TextureTsne::prepare_context() {
+    nptsne::BusyGuard busy(_busy);
+    if (!_prepared_context) {
+        _prepared_context = nptsne::OffscreenContextPool::instance().acquire();
+        _prepared_context->release();
+    }
 }
 
 // tSNE transform and return results
@@ -37,115 +46,147 @@ TextureTsne::TextureTsne(
 // Return a numpy compatible array.
 // py::array_t<float, py::array::c_style>
 py::array_t<float, py::array::c_style> TextureTsne::fit_transform(
-    py::array_t<float, py::array::c_style | py::array::forcecast> X) {
-    if (_verbose) {
-        std::cout << "Iterations: " << _iterations << "\n";
-        std::cout << "Target dimensions: " << _num_target_dimensions << "\n";
-        std::cout << "Perplexity: " << _perplexity << "\n";
-        std::cout << "Exaggeration iter.: " << _exaggeration_iter << "\n";
-        std::cout << "knn type: " << ((KnnAlgorithm::Flann == _knn_algorithm) ? "flann\n" : "hnsw\n");
+    py::array_t<float, py::array::c_style | py::array::forcecast> X,
+    const std::string& backend,
+    int num_threads,
+    py::object out) {
+    nptsne::BusyGuard busy(_busy);
+    const bool cpu_backend = backend != "gpu";
+    if (cpu_backend && backend != "cpu" && backend != "cpu_fft") {
+        throw std::invalid_argument("The backend must be one of \"gpu\", \"cpu\" or \"cpu_fft\"");
     }
-
-    if (!glfwInit()) {
-        throw std::runtime_error("Unable to initialize GLFW.");
+    if (cpu_backend && _num_target_dimensions != 2) {
+        throw std::invalid_argument("The CPU backends only support 2 target dimensions");
     }
-#ifdef __APPLE__
-    glfwWindowHint(GLFW_CONTEXT_VERSION_MAJOR, 4);
-    glfwWindowHint(GLFW_CONTEXT_VERSION_MINOR, 1);
-    glfwWindowHint(GLFW_OPENGL_FORWARD_COMPAT, GL_TRUE);
-    glfwWindowHint(GLFW_OPENGL_PROFILE, GLFW_OPENGL_CORE_PROFILE);
-#endif
-    glfwWindowHint(GLFW_VISIBLE, GLFW_FALSE);  // invisible - ie offscreen, window
-    _offscreen_context = glfwCreateWindow(640, 480, "", NULL, NULL);
-    if (_offscreen_context == NULL) {
-        glfwTerminate();
-        throw std::runtime_error("Failed to create GLFW window");
+    if (_verbose) {
+        NPTSNE_LOG(Info) << "Iterations: " << _iterations;
+        NPTSNE_LOG(Info) << "Target dimensions: " << _num_target_dimensions;
+        NPTSNE_LOG(Info) << "Perplexity: " << _perplexity;
+        NPTSNE_LOG(Info) << "Exaggeration iter.: " << _exaggeration_iter;
+        NPTSNE_LOG(Info) << "knn type: " << ((KnnAlgorithm::Flann == _knn_algorithm) ? "flann" : "hnsw");
+        NPTSNE_LOG(Info) << "Backend: " << backend;
     }
-    glfwMakeContextCurrent(_offscreen_context);
 
-    if (!gladLoadGLLoader((GLADloadproc)glfwGetProcAddress)) {
-        glfwTerminate();
-        throw std::runtime_error("Failed to initialize OpenGL context");
+    auto result = nptsne::OutputArrayType(0);
+    nptsne::SparseScalarMatrixType distributions;
+    nptsne::ProbGenType::Parameters prob_gen_param;
+    float similarities_comp_time = 0;
+    float gradient_desc_comp_time = 0;
+    _last_run_stats.clear();
+    py::buffer_info X_info = X.request();
+    if (X_info.ndim == 2) {
+        nptsne::check_embedding_out(out, X_info.shape[0] * _num_target_dimensions);
     }
-
-    auto result = py::array_t<float>(0);
     try {
-        hdi::dr::GradientDescentTSNETexture tSNE;
-        nptsne::ProbGenType prob_gen;
-        nptsne::SparseScalarMatrixType distributions;
-        nptsne::ProbGenType::Parameters prob_gen_param;
-        nptsne::EmbeddingType embedding;
-        auto X_loc = X;
-        float similarities_comp_time = 0;
-        float gradient_desc_comp_time = 0;
-        py::buffer_info X_info = X_loc.request();
         if (X_info.ndim != 2) {
             throw std::runtime_error("Expecting input data to have two dimensions, data point and values");
         }
         _num_data_points = X_info.shape[0];
         _num_dimensions = X_info.shape[1];
         if (_verbose) {
-            std::cout << "Read " << _num_data_points << " points,\n";
-            std::cout << " and " << _num_dimensions << " value dimensions.\n";
+            NPTSNE_LOG(Info) << "Read " << _num_data_points << " points, and " << _num_dimensions << " value dimensions.";
         }
 
-        hdi::utils::CoutLog log;
+        // The input is in a native buffer, the GIL is not needed for the knn
+        py::gil_scoped_release release;
         {
             hdi::utils::ScopedTimer<float, hdi::utils::Seconds> timer(similarities_comp_time);
             prob_gen_param._perplexity = _perplexity;
             prob_gen_param._aknn_metric = hdi::dr::knn_distance_metric::KNN_METRIC_EUCLIDEAN;
             prob_gen_param._aknn_algorithm = static_cast<hdi::dr::knn_library>(_knn_algorithm);
-            prob_gen.computeProbabilityDistributions(
+            nptsne::compute_probability_distributions(
                 static_cast<float *>(X_info.ptr),
                 _num_dimensions,
                 _num_data_points,
                 distributions,
                 prob_gen_param);
         }
+        _last_run_stats.add_time("similarities", similarities_comp_time);
 
-        std::cout << "knn complete" << "\n";
-
-        std::cout << "grad descent tsne starting" << "\n";
-        {
-            hdi::utils::ScopedTimer<float, hdi::utils::Seconds> timer(gradient_desc_comp_time);
-            tSNE_param._embedding_dimensionality = _num_target_dimensions;
-            tSNE_param._mom_switching_iter = _exaggeration_iter;
-            tSNE_param._remove_exaggeration_iter = _exaggeration_iter;
-            tSNE.initialize(distributions, &embedding, tSNE_param);
+        NPTSNE_LOG(Debug) << "knn complete";
+    }
+    catch (const std::exception& e) {
+        NPTSNE_LOG(Error) << "Fatal error: " << e.what();
+        return result;
+    }
 
-            if (_verbose) {
-                std::cout << "Computing gradient descent...\n";
-            }
-            for (int iter = 0; iter < _iterations; ++iter) {
-                tSNE.doAnIteration();
+    bool descent_complete = false;
+    tSNE_param._embedding_dimensionality = _num_target_dimensions;
+    tSNE_param._mom_switching_iter = _exaggeration_iter;
+    tSNE_param._remove_exaggeration_iter = _exaggeration_iter;
+    if (cpu_backend) {
+        // No OpenGL context needed
+        py::gil_scoped_release release;
+        try {
+            {
+                hdi::utils::ScopedTimer<float, hdi::utils::Seconds> timer(gradient_desc_comp_time);
+                auto cpu_params = nptsne::CpuTsne::from_tsne_parameters(tSNE_param);
+                cpu_params.repulsion = backend == "cpu_fft" ?
+                    nptsne::CpuTsne::Repulsion::FFT : nptsne::CpuTsne::Repulsion::BarnesHut;
+                nptsne::CpuTsne cpu_tsne;
+                _embedding.resize(2, _num_data_points);
+                cpu_tsne.initialize(distributions, _embedding.getContainer().data(), cpu_params, num_threads);
                 if (_verbose) {
-                    std::cout << "Iter: " << iter << "\n";
+                    NPTSNE_LOG(Info) << "Computing gradient descent with " << cpu_tsne.num_threads() << " threads...";
                 }
+                for (int iter = 0; iter < _iterations; ++iter) {
+                    cpu_tsne.doAnIteration(_embedding.getContainer().data());
+                }
+                _last_run_stats.add_iterations(_iterations);
             }
-            if (_verbose) {
-                std::cout << "... done!\n";
-            }
+            _last_run_stats.add_time("gradient_descent", gradient_desc_comp_time);
+            descent_complete = true;
         }
-        std::cout << "grad descent tsne complete" << "\n";
-        glfwDestroyWindow(_offscreen_context);
-        glfwTerminate();
-
-        auto size = _num_data_points * _num_target_dimensions;
-        result = py::array_t<float>(size);
-        py::buffer_info result_info = result.request();
-        float *output = static_cast<float *>(result_info.ptr);
+        catch (const std::exception& e) {
+            NPTSNE_LOG(Error) << "Fatal error: " << e.what();
+        }
+    } else {
+        py::gil_scoped_release release;
+        // The OpenGL context is only needed for the gradient descent,
+        // it is returned to the pool for the next call
+        nptsne::PooledContext context = _prepared_context ?
+            std::move(_prepared_context) : nptsne::OffscreenContextPool::instance().acquire();
+        context->make_current();
+        try {
+            // Declared here so its OpenGL resources are freed while the context is current
+            hdi::dr::GradientDescentTSNETexture tSNE;
+            NPTSNE_LOG(Debug) << "grad descent tsne starting";
+            {
+                hdi::utils::ScopedTimer<float, hdi::utils::Seconds> timer(gradient_desc_comp_time);
+                tSNE.initialize(distributions, &_embedding, tSNE_param);
 
-        auto data = embedding.getContainer().data();
-        for (decltype(size) i = 0; i < size; i++) {
-            output[i] = data[i];
+                if (_verbose) {
+                    NPTSNE_LOG(Info) << "Computing gradient descent...";
+                }
+                for (int iter = 0; iter < _iterations; ++iter) {
+                    tSNE.doAnIteration();
+                    if (_verbose) {
+                        NPTSNE_LOG(Debug) << "Iter: " << iter;
+                    }
+                }
+                _last_run_stats.add_iterations(_iterations);
+                if (_verbose) {
+                    NPTSNE_LOG(Info) << "... done!";
+                }
+            }
+            _last_run_stats.add_time("gradient_descent", gradient_desc_comp_time);
+            NPTSNE_LOG(Debug) << "grad descent tsne complete";
+            descent_complete = true;
         }
-        if (_verbose) {
-            std::cout << "Similarities computation (sec) " << similarities_comp_time << "\n";
-            std::cout << "Gradient descent (sec) " << gradient_desc_comp_time << "\n";
+        catch (const std::exception& e) {
+            NPTSNE_LOG(Error) << "Fatal error: " << e.what();
         }
     }
-    catch (const std::exception& e) {
-        std::cout << "Fatal error: " << e.what() << std::endl;
+    _last_run_stats.record_peak_memory();
+
+    if (!descent_complete) {
+        return result;
+    }
+    result = nptsne::embedding_result(
+        _embedding.getContainer().data(), _num_data_points * _num_target_dimensions, out);
+    if (_verbose) {
+        NPTSNE_LOG(Info) << "Similarities computation (sec) " << similarities_comp_time;
+        NPTSNE_LOG(Info) << "Gradient descent (sec) " << gradient_desc_comp_time;
     }
     return result;
 }
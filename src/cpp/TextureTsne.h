@@ -15,7 +15,11 @@ namespace py = pybind11;
     #define __gl3_h_
 #endif
 #include "hdi/dimensionality_reduction/gradient_descent_tsne_texture.h"
+#include "BusyState.h"
+#include "OffscreenContext.h"
 #include "Types.h"
+#include "RunStats.h"
+#include <string>
 
 class TextureTsne {
  public:
@@ -29,8 +33,13 @@ class TextureTsne {
         KnnAlgorithm knn_algorithm = KnnAlgorithm::Flann);
 
     // tSNE transform and return results
+    // backend: "gpu", "cpu" (Barnes-Hut) or "cpu_fft" (FFT interpolation)
+    // out: None or a float32 buffer that receives the result and is returned
     py::array_t<float, py::array::c_style> fit_transform(
-        py::array_t<float, py::array::c_style | py::array::forcecast> X);
+        py::array_t<float, py::array::c_style | py::array::forcecast> X,
+        const std::string& backend = "gpu",
+        int num_threads = 0,
+        py::object out = py::none());
 
     bool get_verbose() { return _verbose;  }
     int get_num_target_dimensions() { return _num_target_dimensions; }
@@ -39,6 +48,20 @@ class TextureTsne {
     int get_exaggeration_iter() { return _exaggeration_iter; }
     KnnAlgorithm get_knn_algorithm() { return _knn_algorithm; }
 
+    // Phase times, iterations and peak memory of the last fit_transform
+    const nptsne::RunStats& last_run_stats() const { return _last_run_stats; }
+
+    // The embedding of the last fit_transform
+    nptsne::EmbeddingType& getEmbedding() { return _embedding; }
+
+    // Create (or take from the pool) the OpenGL context of the next gpu
+    // fit_transform on the calling thread, e.g. the main thread before
+    // fit_transform_async. It is not current on return.
+    void prepare_context();
+
+    // Set while an asynchronous call (fit_transform_async) runs
+    nptsne::BusyState& busy_state() { return _busy; }
+
  private:
     int _num_data_points;
     int _num_dimensions;
@@ -51,5 +74,9 @@ class TextureTsne {
     hdi::dr::TsneParameters tSNE_param;
     double _theta;
     int _num_target_dimensions;
-    GLFWwindow* _offscreen_context;
+    nptsne::RunStats _last_run_stats;
+    nptsne::EmbeddingType _embedding;
+    // Used by the next gpu fit_transform if set, see prepare_context
+    nptsne::PooledContext _prepared_context;
+    nptsne::BusyState _busy;
 };
@@ -1,43 +1,53 @@
 // Copyright 2020 LKEB at LUMC
 // Author: B. van Lew
 #include "TextureTsneExtended.h"
+#include "OffscreenContext.h"
+#include "EmbeddingOutput.h"
+#include "SimilarityCache.h"
+#include "Log.h"
+#include "KnnDistribution.h"
+#include "CpuTsne.h"
+#include <algorithm>
 #include <cstdio>
-#include <iostream>
 #include <fstream>
+#include <utility>
 #include <vector>
 #include <exception>
 #include "hdi/dimensionality_reduction/tsne.h"
-#include "hdi/utils/cout_log.h"
 #include "hdi/utils/log_helper_functions.h"
 #include "hdi/data/panel_data.h"
 #include "hdi/data/io.h"
 #include "hdi/utils/scoped_timers.h"
 
-// not present in glfw 3.1.2
-#ifndef GLFW_FALSE
-#define GLFW_FALSE 0
-#endif
 // constructor
 TextureTsneExtended::TextureTsneExtended(
     bool verbose,
     int num_target_dimensions,
     int perplexity,
     KnnAlgorithm knn_algorithm
-) : _decay_started_at(-1),
+) : _distributions(nptsne::share_matrix(nptsne::SparseScalarMatrixType())),
+    _num_data_points(0),
+    _decay_started_at(-1),
     _verbose(verbose),
     _num_target_dimensions(num_target_dimensions),
     _perplexity(perplexity),
     _knn_algorithm(knn_algorithm),
-    _offscreen_context(nullptr),
     _exaggeration_decay(false),
     _iteration_count(0),
-    _have_preset_embedding(false) {
+    _have_preset_embedding(false),
+    _busy("TextureTsneExtended") {
+}
+
+TextureTsneExtended::~TextureTsneExtended() {
+    free_context();
 }
 
 // Initialise the tSNE with the data and an optional starting embedding
 bool TextureTsneExtended::init_transform(
     py::array_t<float, py::array::c_style | py::array::forcecast> X,
-    py::array_t<float, py::array::c_style | py::array::forcecast> initial_embedding) {
+    py::array_t<float, py::array::c_style | py::array::forcecast> initial_embedding,
+    bool keep_data) {
+    nptsne::BusyGuard busy(_busy);
     auto embedding_loc = initial_embedding;
     py::buffer_info emb_info = embedding_loc.request();
     auto X_loc = X;
@@ -47,43 +57,28 @@ bool TextureTsneExtended::init_transform(
     }
     _num_data_points = X_info.shape[0];
     _num_dimensions = X_info.shape[1];
-    std::cout << "emb_info size: " << emb_info.size << " emb_info dims: " << emb_info.ndim << std::endl;
-    if (emb_info.ndim == 2 && emb_info.size > 0) {
-        if (_verbose) {
-            std::cout << "Initialize from given embedding...\n";
-            std::cout << "Embed dimensions: " << emb_info.shape[0] << ", " << emb_info.shape[1] << "\n";
-        }
-        _have_preset_embedding = true;
-        float * emb_in = static_cast<float *>(emb_info.ptr);
-        // user provided default for embedding - overwrite the random def.
-        _embedding = nptsne::EmbeddingType(emb_info.shape[0], emb_info.shape[1]);
-        typename nptsne::EmbeddingType::scalar_vector_type* embedding_container = &(_embedding.getContainer());
-        // simply replace the container by the input?
-        for (int p = 0; p < _num_data_points; p++) {
-            for (int d = 0; d < 2; d++) {
-                (*embedding_container)[p * 2 + d] = emb_in[p * 2 + d];
-            }
-        }
-    }
+    _training_data = keep_data ? py::object(X_loc) : py::object();
+    NPTSNE_LOG(Debug) << "emb_info size: " << emb_info.size << " emb_info dims: " << emb_info.ndim;
+    set_initial_embedding(emb_info);
     // std::cout << "Embedding size before init: " << _embedding.getContainer().size() << std::endl;
     if (_verbose) {
-        std::cout << "Target dimensions: " << _num_target_dimensions << "\n";
-        std::cout << "Perplexity: " << _perplexity << "\n";
-        std::cout << "knn type: " << ((KnnAlgorithm::Flann == _knn_algorithm) ? "flann\n" : "hnsw\n");
+        NPTSNE_LOG(Info) << "Target dimensions: " << _num_target_dimensions;
+        NPTSNE_LOG(Info) << "Perplexity: " << _perplexity;
+        NPTSNE_LOG(Info) << "knn type: " << ((KnnAlgorithm::Flann == _knn_algorithm) ? "flann" : "hnsw");
     }
     try {
         float similarities_comp_time = 0;
+        _last_run_stats.clear();
         _exaggeration_decay = false;
         _iteration_count = 0;
         _decay_started_at = -1;
 
         if (_verbose) {
-            std::cout << "Read " << _num_data_points << " points,\n";
-            std::cout << " and " << _num_dimensions << " value dimensions.\n";
+            NPTSNE_LOG(Info) << "Read " << _num_data_points << " points, and " << _num_dimensions << " value dimensions.";
         }
 
-        hdi::utils::CoutLog log;
-        nptsne::ProbGenType prob_gen;
+        // The input is in a native buffer, the GIL is not needed for the knn
+        py::gil_scoped_release release;
         nptsne::ProbGenType::Parameters prob_gen_param;
 
         {
@@ -91,41 +86,333 @@ bool TextureTsneExtended::init_transform(
             prob_gen_param._perplexity = _perplexity;
             prob_gen_param._aknn_metric = hdi::dr::knn_distance_metric::KNN_METRIC_EUCLIDEAN;
             prob_gen_param._aknn_algorithm = static_cast<hdi::dr::knn_library>(_knn_algorithm);
-            prob_gen.computeProbabilityDistributions(
+            nptsne::SparseScalarMatrixType distributions;
+            nptsne::compute_probability_distributions(
                 static_cast<float *>(X_info.ptr),
                 _num_dimensions,
                 _num_data_points,
-                _distributions,
+                distributions,
                 prob_gen_param);
+            _distributions = nptsne::share_matrix(std::move(distributions));
         }
 
-        std::cout << "knn complete" << "\n";
+        _last_run_stats.add_time("similarities", similarities_comp_time);
+        _last_run_stats.record_peak_memory();
+        NPTSNE_LOG(Debug) << "knn complete";
         if (_verbose) {
-            std::cout << "Similarities computation (sec) " << similarities_comp_time << "\n";
+            NPTSNE_LOG(Info) << "Similarities computation (sec) " << similarities_comp_time;
         }
     }
     catch (const std::exception& e) {
-        std::cout << "Fatal error: " << e.what() << std::endl;
+        NPTSNE_LOG(Error) << "Fatal error: " << e.what();
         return false;
     }
     return true;
 }
 
-void TextureTsneExtended::init_transform_with_distribution(nptsne::SparseScalarMatrixType& sparse_matrix) {
-    _num_data_points = sparse_matrix.size();
-    _num_target_dimensions = 2;
-    _distributions.clear();
+bool TextureTsneExtended::init_transform_from_knn(
+    py::array_t<int64_t, py::array::c_style | py::array::forcecast> indices,
+    py::array_t<float, py::array::c_style | py::array::forcecast> distances,
+    py::array_t<float, py::array::c_style | py::array::forcecast> initial_embedding) {
+    nptsne::BusyGuard busy(_busy);
+    py::buffer_info indices_info = indices.request();
+    py::buffer_info distances_info = distances.request();
+    py::buffer_info emb_info = initial_embedding.request();
+    if (indices_info.ndim != 2 || indices_info.shape != distances_info.shape) {
+        throw std::invalid_argument(
+            "Expecting indices and distances with the same shape (num. data points, num. neighbors)");
+    }
+    _num_data_points = indices_info.shape[0];
+    _num_dimensions = 0;  // Not known from the graph
+    _training_data = py::object();
+    set_initial_embedding(emb_info);
+    try {
+        float similarities_comp_time = 0;
+        _last_run_stats.clear();
+        _exaggeration_decay = false;
+        _iteration_count = 0;
+        _decay_started_at = -1;
+
+        py::gil_scoped_release release;
+        {
+            hdi::utils::ScopedTimer<float, hdi::utils::Seconds> timer(similarities_comp_time);
+            nptsne::SparseScalarMatrixType distributions;
+            nptsne::knn_to_distribution(
+                static_cast<int64_t *>(indices_info.ptr),
+                static_cast<float *>(distances_info.ptr),
+                _num_data_points,
+                indices_info.shape[1],
+                _perplexity,
+                distributions);
+            _distributions = nptsne::share_matrix(std::move(distributions));
+        }
+        _last_run_stats.add_time("similarities", similarities_comp_time);
+        _last_run_stats.record_peak_memory();
+        if (_verbose) {
+            NPTSNE_LOG(Info) << "Similarities computation (sec) " << similarities_comp_time;
+        }
+    }
+    catch (const std::exception& e) {
+        NPTSNE_LOG(Error) << "Fatal error: " << e.what();
+        return false;
+    }
+    return true;
+}
+
+std::vector<std::unique_ptr<TextureTsneExtended>> TextureTsneExtended::perplexity_sweep(
+    py::array_t<float, py::array::c_style | py::array::forcecast> X,
+    const std::vector<int>& perplexities,
+    bool verbose,
+    int num_target_dimensions,
+    KnnAlgorithm knn_algorithm,
+    int num_threads,
+    bool keep_data) {
+    py::buffer_info X_info = X.request();
+    if (X_info.ndim != 2) {
+        throw std::invalid_argument("Expecting input data to have two dimensions, data point and values");
+    }
+    if (perplexities.empty()) {
+        throw std::invalid_argument("Expecting at least one perplexity");
+    }
+    for (auto perplexity : perplexities) {
+        if (perplexity <= 0) {
+            throw std::invalid_argument("The perplexities must be positive");
+        }
+    }
+    std::vector<std::unique_ptr<TextureTsneExtended>> result;
+    for (auto perplexity : perplexities) {
+        result.emplace_back(new TextureTsneExtended(verbose, num_target_dimensions, perplexity, knn_algorithm));
+        result.back()->_num_data_points = X_info.shape[0];
+        result.back()->_num_dimensions = X_info.shape[1];
+        if (keep_data) {
+            result.back()->_training_data = X;
+        }
+    }
+    const int max_perplexity = *std::max_element(perplexities.begin(), perplexities.end());
+
+    // The input is in a native buffer, the GIL is not needed for the knn
+    py::gil_scoped_release release;
+    float knn_comp_time = 0;
+    nptsne::SharedSparseMatrixType distributions;
+    nptsne::ProbGenType::Parameters prob_gen_param;
+    {
+        hdi::utils::ScopedTimer<float, hdi::utils::Seconds> timer(knn_comp_time);
+        prob_gen_param._perplexity = max_perplexity;
+        prob_gen_param._aknn_metric = hdi::dr::knn_distance_metric::KNN_METRIC_EUCLIDEAN;
+        prob_gen_param._aknn_algorithm = static_cast<hdi::dr::knn_library>(knn_algorithm);
+        nptsne::SparseScalarMatrixType max_distributions;
+        nptsne::compute_probability_distributions(
+            static_cast<float *>(X_info.ptr),
+            X_info.shape[1],
+            X_info.shape[0],
+            max_distributions,
+            prob_gen_param);
+        distributions = nptsne::share_matrix(std::move(max_distributions));
+    }
+    if (verbose) {
+        NPTSNE_LOG(Info) << "Similarities for perplexity " << max_perplexity << " (sec) " << knn_comp_time;
+    }
+    // The kNN time is attributed to the first embedder with the largest perplexity
+    bool knn_attributed = false;
+    for (auto& tsne : result) {
+        float similarities_comp_time = 0;
+        if (tsne->_perplexity == max_perplexity) {
+            // Shared, embedders with the same perplexity do not copy the matrix
+            tsne->_distributions = distributions;
+            if (!knn_attributed) {
+                similarities_comp_time = knn_comp_time;
+                knn_attributed = true;
+            }
+        } else {
+            hdi::utils::ScopedTimer<float, hdi::utils::Seconds> timer(similarities_comp_time);
+            nptsne::SparseScalarMatrixType recalibrated;
+            nptsne::recalibrate_distribution(
+                *distributions,
+                tsne->_perplexity,
+                prob_gen_param._perplexity_multiplier,
+                recalibrated,
+                num_threads);
+            tsne->_distributions = nptsne::share_matrix(std::move(recalibrated));
+        }
+        if (verbose) {
+            NPTSNE_LOG(Info) << "Similarities for perplexity " << tsne->_perplexity << " (sec) " << similarities_comp_time;
+        }
+        tsne->_last_run_stats.add_time("similarities", similarities_comp_time);
+        tsne->_last_run_stats.record_peak_memory();
+    }
+    return result;
+}
+
+py::array_t<float, py::array::c_style> TextureTsneExtended::transform(
+    py::array_t<float, py::array::c_style | py::array::forcecast> X,
+    int iterations,
+    int num_threads,
+    py::object out,
+    py::object data) {
+    nptsne::BusyGuard busy(_busy);
+    py::buffer_info X_info = X.request();
+    if (X_info.ndim != 2) {
+        throw std::invalid_argument("Expecting input data to have two dimensions, data point and values");
+    }
+    py::array_t<float, py::array::c_style> training_data;
+    if (!data.is_none()) {
+        training_data = py::array_t<float, py::array::c_style | py::array::forcecast>::ensure(data);
+        if (!training_data) {
+            throw py::error_already_set();
+        }
+        if (training_data.ndim() != 2 || training_data.shape(0) != _num_data_points ||
+            training_data.shape(1) != _num_dimensions) {
+            throw std::invalid_argument("Expecting the data of init_transform with shape (" +
+                std::to_string(_num_data_points) + ", " + std::to_string(_num_dimensions) + ")");
+        }
+    } else if (_training_data) {
+        training_data = py::reinterpret_borrow<py::array_t<float, py::array::c_style>>(_training_data);
+    } else {
+        throw std::runtime_error("transform needs the data of init_transform: pass data, "
+            "initialize with keep_data=True or use transform_from_knn");
+    }
+    if (X_info.shape[1] != _num_dimensions) {
+        throw std::invalid_argument(
+            "Expecting new points with " + std::to_string(_num_dimensions) + " dimensions, as the data");
+    }
+    const uint64_t num_points = X_info.shape[0];
+    // The neighbors of the probability generator: perplexity * 3
+    const uint64_t num_neighbors = std::min<uint64_t>(_num_data_points, std::max(1, _perplexity * 3));
+    std::vector<int64_t> indices(num_points * num_neighbors);
+    std::vector<float> distances(num_points * num_neighbors);
+    float knn_comp_time = 0;
+    {
+        py::gil_scoped_release release;
+        hdi::utils::ScopedTimer<float, hdi::utils::Seconds> timer(knn_comp_time);
+        nptsne::exact_knn(
+            training_data.data(),
+            _num_data_points,
+            static_cast<float *>(X_info.ptr),
+            num_points,
+            _num_dimensions,
+            num_neighbors,
+            indices.data(),
+            distances.data(),
+            num_threads);
+    }
+    auto result = project(indices.data(), distances.data(), num_points, num_neighbors, iterations, num_threads, out);
+    _last_run_stats.add_time("knn", knn_comp_time);
+    return result;
+}
+
+py::array_t<float, py::array::c_style> TextureTsneExtended::transform_from_knn(
+    py::array_t<int64_t, py::array::c_style | py::array::forcecast> indices,
+    py::array_t<float, py::array::c_style | py::array::forcecast> distances,
+    int iterations,
+    int num_threads,
+    py::object out) {
+    nptsne::BusyGuard busy(_busy);
+    py::buffer_info indices_info = indices.request();
+    py::buffer_info distances_info = distances.request();
+    if (indices_info.ndim != 2 || indices_info.shape != distances_info.shape) {
+        throw std::invalid_argument(
+            "Expecting indices and distances with the same shape (num. new points, num. neighbors)");
+    }
+    return project(
+        static_cast<int64_t *>(indices_info.ptr),
+        static_cast<float *>(distances_info.ptr),
+        indices_info.shape[0],
+        indices_info.shape[1],
+        iterations,
+        num_threads,
+        out);
+}
+
+py::array_t<float, py::array::c_style> TextureTsneExtended::project(
+    const int64_t* indices,
+    const float* distances,
+    uint64_t num_points,
+    uint64_t num_neighbors,
+    int iterations,
+    int num_threads,
+    const py::object& out) {
+    if (_num_target_dimensions != 2) {
+        throw std::invalid_argument("Placing new points is only supported for 2 target dimensions");
+    }
+    if (_iteration_count == 0 ||
+        _embedding.getContainer().size() < static_cast<size_t>(_num_data_points) * _num_target_dimensions) {
+        throw std::runtime_error("Run the transform before placing new points");
+    }
+    nptsne::check_embedding_out(out, num_points * _num_target_dimensions);
+    std::vector<float> positions(num_points * _num_target_dimensions);
+    float similarities_comp_time = 0;
+    float gradient_desc_comp_time = 0;
+    _last_run_stats.clear();
+    {
+        py::gil_scoped_release release;
+        nptsne::SparseScalarMatrixType distribution;
+        {
+            hdi::utils::ScopedTimer<float, hdi::utils::Seconds> timer(similarities_comp_time);
+            nptsne::knn_to_distribution(
+                indices, distances, num_points, num_neighbors, _perplexity, distribution, _num_data_points);
+        }
+        {
+            hdi::utils::ScopedTimer<float, hdi::utils::Seconds> timer(gradient_desc_comp_time);
+            nptsne::CpuTsne::Parameters params;
+            params.eta = 1;
+            params.mom_switching_iter = iterations / 2;
+            nptsne::CpuTsne::project(
+                _embedding.getContainer().data(),
+                _num_data_points,
+                nptsne::CsrMatrixType::from_rows(distribution),
+                positions.data(),
+                iterations,
+                params,
+                num_threads);
+        }
+    }
+    _last_run_stats.add_time("similarities", similarities_comp_time);
+    _last_run_stats.add_time("gradient_descent", gradient_desc_comp_time);
+    _last_run_stats.add_iterations(iterations);
+    _last_run_stats.record_peak_memory();
+    if (_verbose) {
+        NPTSNE_LOG(Info) << "Placed " << num_points << " new points (sec) " << gradient_desc_comp_time;
+    }
+    return nptsne::embedding_result(positions.data(), positions.size(), out);
+}
+
+void TextureTsneExtended::set_initial_embedding(const py::buffer_info &emb_info) {
+    _have_preset_embedding = false;
+    if (emb_info.size == 0) {
+        return;
+    }
+    if (emb_info.ndim != 2 || emb_info.shape[0] != _num_data_points ||
+        emb_info.shape[1] != _num_target_dimensions) {
+        throw std::invalid_argument("Expecting an initial embedding with shape (" +
+            std::to_string(_num_data_points) + ", " + std::to_string(_num_target_dimensions) + ")");
+    }
+    if (_verbose) {
+        NPTSNE_LOG(Info) << "Initialize from given embedding...";
+        NPTSNE_LOG(Info) << "Embed dimensions: " << emb_info.shape[0] << ", " << emb_info.shape[1];
+    }
+    _have_preset_embedding = true;
+    const float * emb_in = static_cast<const float *>(emb_info.ptr);
+    // user provided default for embedding - overwrite the random def.
+    // The embedding is (dimensions, points), its container point major as the input.
     _embedding = nptsne::EmbeddingType(_num_target_dimensions, _num_data_points);
+    auto& embedding_container = _embedding.getContainer();
+    std::copy(emb_in, emb_in + emb_info.size, embedding_container.begin());
+}
+
+void TextureTsneExtended::init_transform_with_distribution(nptsne::SharedSparseMatrixType sparse_matrix) {
+    nptsne::BusyGuard busy(_busy);
+    _num_data_points = sparse_matrix->size();
+    _num_target_dimensions = 2;
+    _distributions = std::move(sparse_matrix);
     // use a default embedding
-    for (auto map : sparse_matrix) {
-        _distributions.push_back(map);
-    }
+    _embedding = nptsne::EmbeddingType(_num_target_dimensions, _num_data_points);
     if (_verbose) {
-        std::cout << " Size of distribution " << _distributions.size() << "\n";
+        NPTSNE_LOG(Info) << " Size of distribution " << _distributions->size();
     }
 }
 
 void TextureTsneExtended::start_exaggeration_decay() {
+    nptsne::BusyGuard busy(_busy);
     if (!_exaggeration_decay) {
         hdi::dr::TsneParameters tSNE_param;
         _exaggeration_decay = true;
@@ -134,7 +421,9 @@ void TextureTsneExtended::start_exaggeration_decay() {
         tSNE_param._remove_exaggeration_iter = _iteration_count;
         tSNE_param._presetEmbedding = _have_preset_embedding;
         _decay_started_at = _iteration_count;
-        _tSNE.updateParams(tSNE_param);
+        if (_tSNE) {
+            _tSNE->updateParams(tSNE_param);
+        }
     } else {
         throw std::runtime_error("Exaggeration decay is already active.");
     }
@@ -150,127 +439,147 @@ int TextureTsneExtended::get_iteration_count() {
 
 py::array_t<float, py::array::c_style> TextureTsneExtended::run_transform(
     bool verbose,
-    int iterations) {
+    int iterations,
+    py::object out) {
+    nptsne::BusyGuard busy(_busy);
+    auto size = _num_data_points * _num_target_dimensions;
+    nptsne::check_embedding_out(out, size);
+    try {
+        {
+            // The gradient descent only uses native data
+            py::gil_scoped_release release;
+            run_iterations(verbose, iterations);
+        }
+        return nptsne::embedding_result(_embedding.getContainer().data(), size, out);
+    }
+    catch (const std::exception& e) {
+        NPTSNE_LOG(Error) << "Fatal error: " << e.what();
+    }
+    return nptsne::OutputArrayType(0);
+}
+
+// Run the gradient descent iterations, does not require the GIL
+void TextureTsneExtended::run_iterations(
+    bool verbose,
+    int iterations,
+    bool record_memory) {
+    nptsne::BusyGuard busy(_busy);
     _verbose = verbose;
     _iterations = iterations;
     // std::cout << "Embedding size before run_transform: " << _embedding.getContainer().size() << std::endl;
 
-    try {
-        int argc = 1;
-        float gradient_desc_comp_time = 0;
-        if (_verbose) {
-            std::cout << "grad descent tsne starting" << "\n";
-        }
-        {
-            hdi::utils::ScopedTimer<float, hdi::utils::Seconds> timer(gradient_desc_comp_time);
+    float gradient_desc_comp_time = 0;
+    _last_run_stats.clear();
+    if (_verbose) {
+        NPTSNE_LOG(Info) << "grad descent tsne starting";
+    }
+    {
+        hdi::utils::ScopedTimer<float, hdi::utils::Seconds> timer(gradient_desc_comp_time);
 
-            bool continuing = _tSNE.isInitialized();
-            if (!continuing) {
-                if (_verbose) {
-                    std::cout << "start a new tSNE" << "\n";
-                }
-                // a new tSNE
+        bool continuing = _tSNE && _tSNE->isInitialized();
+        if (!continuing) {
+            if (_verbose) {
+                NPTSNE_LOG(Info) << "start a new tSNE";
+            }
+            // a new tSNE
+            hdi::dr::TsneParameters tSNE_param;
+            tSNE_param._embedding_dimensionality = _num_target_dimensions;
+            tSNE_param._mom_switching_iter = _iteration_count + iterations;
+            tSNE_param._remove_exaggeration_iter = _iteration_count + iterations;
+            tSNE_param._presetEmbedding = _have_preset_embedding;
+
+            if (!_offscreen_context) {
+                _offscreen_context = nptsne::OffscreenContextPool::instance().acquire();
+            }
+            make_context_current();
+            NPTSNE_LOG(Debug) << "initializing tSNE";
+            nptsne::RunStats::Phase phase(_last_run_stats, "embedding_init");
+            _tSNE.reset(new hdi::dr::GradientDescentTSNETexture());
+            _tSNE->initialize(*_distributions, &_embedding, tSNE_param);
+        } else {
+            if (_verbose) {
+                NPTSNE_LOG(Info) << "continuing tSNE";
+            }
+            make_context_current();
+            // continuing tSNE possibly with new params from start_exaggeration_decay
+            if (!_exaggeration_decay) {
+                // Continuing with no decay, maintain the disabled decay for this run
                 hdi::dr::TsneParameters tSNE_param;
                 tSNE_param._embedding_dimensionality = _num_target_dimensions;
                 tSNE_param._mom_switching_iter = _iteration_count + iterations;
                 tSNE_param._remove_exaggeration_iter = _iteration_count + iterations;
                 tSNE_param._presetEmbedding = _have_preset_embedding;
-
-                if (!glfwInit()) {
-                    throw std::runtime_error("Unable to initialize GLFW.");
-                }
-#ifdef __APPLE__
-                glfwWindowHint(GLFW_CONTEXT_VERSION_MAJOR, 4);
-                glfwWindowHint(GLFW_CONTEXT_VERSION_MINOR, 1);
-                glfwWindowHint(GLFW_OPENGL_FORWARD_COMPAT, GL_TRUE);
-                glfwWindowHint(GLFW_OPENGL_PROFILE, GLFW_OPENGL_CORE_PROFILE);
-#endif
-                glfwWindowHint(GLFW_VISIBLE, GLFW_FALSE);  // invisible - ie offscreen, window
-                _offscreen_context = glfwCreateWindow(640, 480, "", NULL, NULL);
-                if (!_offscreen_context) {
-                    throw std::runtime_error("Failed to create GLFW offscreen window");
-                }
-                glfwMakeContextCurrent(_offscreen_context);
-
-                if (!gladLoadGLLoader((GLADloadproc)glfwGetProcAddress)) {
-                    throw std::runtime_error("Failed to initialize OpenGL context");
-                }
-                std::cout << "initializing tSNE" << "\n";
-                _tSNE.initialize(_distributions, &_embedding, tSNE_param);
-            } else {
-                if (_verbose) {
-                    std::cout << "continuing tSNE" << "\n";
-                }
-                // continuing tSNE possibly with new params from start_exaggeration_decay
-                if (!_exaggeration_decay) {
-                    // Continuing with no decay, maintain the disabled decay for this run
-                    hdi::dr::TsneParameters tSNE_param;
-                    tSNE_param._embedding_dimensionality = _num_target_dimensions;
-                    tSNE_param._mom_switching_iter = _iteration_count + iterations;
-                    tSNE_param._remove_exaggeration_iter = _iteration_count + iterations;
-                    tSNE_param._presetEmbedding = _have_preset_embedding;
-                    _tSNE.updateParams(tSNE_param);
-                }
+                _tSNE->updateParams(tSNE_param);
             }
+        }
 
-            if (_have_preset_embedding) {
-                if (_verbose) {
-                    std::cout << "Starting from given embedding...\n";
-                }
-            } else {
-                if (_verbose) {
-                    if (!continuing) {
-                        std::cout << "Starting from random embedding...\n";
-                    } else {
-                        std::cout << "Continue previous embedding...\n";
-                    }
-                }
+        if (_have_preset_embedding) {
+            if (_verbose) {
+                NPTSNE_LOG(Info) << "Starting from given embedding...";
             }
-
+        } else {
             if (_verbose) {
-                std::cout << "Continuing gradient descent from iteration: " << _iteration_count << "\n";
-                if (_exaggeration_decay) {
-                    std::cout << "Exaggeration state on \n";
+                if (!continuing) {
+                    NPTSNE_LOG(Info) << "Starting from random embedding...";
                 } else {
-                    std::cout << "Exaggeration decay started at iteration: " << _decay_started_at << "\n";
+                    NPTSNE_LOG(Info) << "Continue previous embedding...";
                 }
             }
+        }
 
+        if (_verbose) {
+            NPTSNE_LOG(Info) << "Continuing gradient descent from iteration: " << _iteration_count;
+            if (_exaggeration_decay) {
+                NPTSNE_LOG(Info) << "Exaggeration state on";
+            } else {
+                NPTSNE_LOG(Info) << "Exaggeration decay started at iteration: " << _decay_started_at;
+            }
+        }
+
+        {
+            nptsne::RunStats::Phase phase(_last_run_stats, "gradient_descent");
             for (int iter = 0; iter < _iterations; ++iter) {
-                _tSNE.doAnIteration();
+                _tSNE->doAnIteration();
                 if (_verbose) {
-                    std::cout << "Iter: " << _iteration_count + iter << "\n";
+                    NPTSNE_LOG(Debug) << "Iter: " << _iteration_count + iter;
                 }
             }
-
-            _iteration_count += _iterations;
-            if (_verbose) {
-                std::cout << " in total " << _iteration_count << " iterations done... \n";
-            }
         }
+        _last_run_stats.add_iterations(_iterations);
 
-        auto size = _num_data_points * _num_target_dimensions;
-        auto result = py::array_t<float>(size);
-        py::buffer_info result_info = result.request();
-        float *output = static_cast<float *>(result_info.ptr);
-        auto data = _embedding.getContainer().data();
-        for (decltype(size) i = 0; i < size; i++) {
-            output[i] = data[i];
-        }
+        _iteration_count += _iterations;
         if (_verbose) {
-            std::cout << "Gradient descent (sec) " << gradient_desc_comp_time << "\n";
+            NPTSNE_LOG(Info) << " in total " << _iteration_count << " iterations done...";
         }
-        return result;
+        release_context();
     }
-    catch (const std::exception& e) {
-        std::cout << "Fatal error: " << e.what() << std::endl;
+    if (record_memory) {
+        _last_run_stats.record_peak_memory();
+    }
+    if (_verbose) {
+        NPTSNE_LOG(Info) << "Gradient descent (sec) " << gradient_desc_comp_time;
+    }
+}
+
+// The context may be used from another thread in a later call
+// (e.g. from the *_async methods). Make it current on this thread
+// for the duration of the GL work and release it afterwards.
+void TextureTsneExtended::make_context_current() {
+    if (_offscreen_context) {
+        _offscreen_context->make_current();
+    }
+}
+
+void TextureTsneExtended::release_context() {
+    if (_offscreen_context) {
+        _offscreen_context->release();
     }
-    return py::array_t<float>(0);
 }
 
 void TextureTsneExtended::reinitialize_transform(
     py::array_t<float, py::array::c_style | py::array::forcecast> initial_embedding) {
-    if (!_tSNE.isInitialized()) {
+    nptsne::BusyGuard busy(_busy);
+    if (!_tSNE || !_tSNE->isInitialized()) {
         throw std::runtime_error("Tsne object must have been initialized in order to reinitialize.");
     }
     if (!_offscreen_context) {
@@ -279,28 +588,12 @@ void TextureTsneExtended::reinitialize_transform(
     _exaggeration_decay = false;
     _iteration_count = 0;
     _decay_started_at = -1;
-    _have_preset_embedding = false;
     _iterations = 0;
     try {
         auto embedding_loc = initial_embedding;
         py::buffer_info emb_info = embedding_loc.request();
-        if (emb_info.ndim == 2 && emb_info.size > 0) {
-            if (_verbose) {
-                std::cout << "Initialize from given embedding...\n";
-                std::cout << "Embed dimensions: " << emb_info.shape[0] << ", " << emb_info.shape[1] << "\n";
-            }
-            _have_preset_embedding = true;
-            float * emb_in = static_cast<float *>(emb_info.ptr);
-            // user provided default for embedding - overwrite the random def.
-            _embedding = nptsne::EmbeddingType(emb_info.shape[0], emb_info.shape[1]);
-            typename nptsne::EmbeddingType::scalar_vector_type* embedding_container = &(_embedding.getContainer());
-            // simply replace the container by the input?
-            for (int p = 0; p < _num_data_points; p++) {
-                for (int d = 0; d < 2; d++) {
-                    (*embedding_container)[p * 2 + d] = emb_in[p * 2 + d];
-                }
-            }
-        } else {
+        set_initial_embedding(emb_info);
+        if (!_have_preset_embedding) {
             // No user supplied embedding clear the current one.
             // std::cout << "Embedding size before clear: " << _embedding.getContainer().size() << std::endl;
             _embedding = nptsne::EmbeddingType();
@@ -311,16 +604,36 @@ void TextureTsneExtended::reinitialize_transform(
         tSNE_param._mom_switching_iter = 0;
         tSNE_param._remove_exaggeration_iter = 0;
         tSNE_param._presetEmbedding = _have_preset_embedding;
-        _tSNE.initialize(_distributions, &_embedding, tSNE_param);
+        make_context_current();
+        _tSNE->initialize(*_distributions, &_embedding, tSNE_param);
+        release_context();
     }
     catch (std::exception& e) {
-        std::cout << e.what() << std::endl;
+        NPTSNE_LOG(Error) << e.what();
         throw;
     }
 }
 
 void TextureTsneExtended::close() {
-    glfwDestroyWindow(_offscreen_context);
-    glfwTerminate();
-    _offscreen_context = nullptr;
+    nptsne::BusyGuard busy(_busy);
+    free_context();
+}
+
+// Acquire the context here, on the calling thread. The gradient descent
+// makes it current on the thread that runs it.
+void TextureTsneExtended::prepare_context() {
+    nptsne::BusyGuard busy(_busy);
+    if (!_offscreen_context) {
+        _offscreen_context = nptsne::OffscreenContextPool::instance().acquire();
+    }
+    release_context();
+}
+
+// Free the tSNE OpenGL resources and return the context to the pool
+void TextureTsneExtended::free_context() {
+    if (_offscreen_context) {
+        make_context_current();
+        _tSNE.reset();
+        _offscreen_context.reset();
+    }
 }
@@ -18,7 +18,12 @@ namespace py = pybind11;
 #endif
 #include "hdi/dimensionality_reduction/gradient_descent_tsne_texture.h"
 
+#include "BusyState.h"
 #include "Types.h"
+#include "RunStats.h"
+#include "OffscreenContext.h"
+#include <memory>
+#include <vector>
 
 class TextureTsneExtended {
  public:
@@ -29,13 +34,57 @@ class TextureTsneExtended {
         int perplexity = 30,
         KnnAlgorithm knn_algorithm = KnnAlgorithm::Flann);
 
-    // Initialize the probabilities based on the data
+    // Closes (returns to the pool) the OpenGL context if still open
+    ~TextureTsneExtended();
+
+    // Initialize the probabilities based on the data.
+    // If keep_data the data is kept for the neighbor search of transform.
     bool init_transform(
         py::array_t<float, py::array::c_style | py::array::forcecast> X,
+        py::array_t<float, py::array::c_style | py::array::forcecast> initial_embedding =
+            py::array_t<nptsne::ScalarType>({}),
+        bool keep_data = false);
+
+    // Initialize the probabilities from a precomputed kNN graph,
+    // indices and (squared euclidean) distances are (num. data points, num. neighbors)
+    bool init_transform_from_knn(
+        py::array_t<int64_t, py::array::c_style | py::array::forcecast> indices,
+        py::array_t<float, py::array::c_style | py::array::forcecast> distances,
         py::array_t<float, py::array::c_style | py::array::forcecast> initial_embedding =
             py::array_t<nptsne::ScalarType>({}));
 
-    void init_transform_with_distribution(nptsne::SparseScalarMatrixType& sparse_matrix);
+    // Use the given probabilities, they are shared not copied
+    void init_transform_with_distribution(nptsne::SharedSparseMatrixType sparse_matrix);
+
+    // Place new points in the current embedding, only the new points are optimized.
+    // The neighbors are searched in data, the data of init_transform given again,
+    // or if None in the data kept by init_transform.
+    py::array_t<float, py::array::c_style> transform(
+        py::array_t<float, py::array::c_style | py::array::forcecast> X,
+        int iterations = 250,
+        int num_threads = 0,
+        py::object out = py::none(),
+        py::object data = py::none());
+
+    // As transform with the neighbors among the data of the embedding given,
+    // indices and (squared euclidean) distances are (num. new points, num. neighbors)
+    py::array_t<float, py::array::c_style> transform_from_knn(
+        py::array_t<int64_t, py::array::c_style | py::array::forcecast> indices,
+        py::array_t<float, py::array::c_style | py::array::forcecast> distances,
+        int iterations = 250,
+        int num_threads = 0,
+        py::object out = py::none());
+
+    // One embedder per perplexity, initialized as by init_transform, from a single
+    // kNN computed for the largest perplexity. num_threads 0 uses all cores.
+    static std::vector<std::unique_ptr<TextureTsneExtended>> perplexity_sweep(
+        py::array_t<float, py::array::c_style | py::array::forcecast> X,
+        const std::vector<int>& perplexities,
+        bool verbose = false,
+        int num_target_dimensions = 2,
+        KnnAlgorithm knn_algorithm = KnnAlgorithm::Flann,
+        int num_threads = 0,
+        bool keep_data = false);
 
     void start_exaggeration_decay();
 
@@ -49,9 +98,19 @@ class TextureTsneExtended {
     int get_perplexity() { return _perplexity; }
     KnnAlgorithm get_knn_algorithm() { return _knn_algorithm; }
 
+    // out: None or a float32 buffer that receives the embedding and is returned
     py::array_t<float, py::array::c_style> run_transform(
         bool verbose = false,
-        int iterations = 1000);
+        int iterations = 1000,
+        py::object out = py::none());
+
+    // The gradient descent without result conversion, can run without the GIL.
+    // record_memory false skips the peak memory query (a system call) for
+    // callers that run many small batches and record it once themselves.
+    void run_iterations(
+        bool verbose = false,
+        int iterations = 1000,
+        bool record_memory = true);
 
     // Restart the transform with an optional initial embedding
     void reinitialize_transform(
@@ -60,14 +119,43 @@ class TextureTsneExtended {
 
     void close();
 
+    // Create (or take from the pool) the OpenGL context on the calling thread,
+    // e.g. the main thread before run_transform_async. It is not current on return.
+    void prepare_context();
+
+    // Set while an asynchronous call (e.g. run_transform_async) runs
+    nptsne::BusyState& busy_state() { return _busy; }
+
     nptsne::EmbeddingType& getEmbedding() {return _embedding;}
 
-    nptsne::SparseScalarMatrixType& getTransitionMatrix() {return _distributions;}
+    const nptsne::SparseScalarMatrixType& getTransitionMatrix() {return *_distributions;}
+
+    // Phase times, iterations and peak memory of the last init or run
+    const nptsne::RunStats& last_run_stats() const { return _last_run_stats; }
 
  private:
-    typename nptsne::SparseScalarMatrixType _distributions;
+    // Copy a user provided embedding, an empty buffer keeps the random initialization.
+    // Throws std::invalid_argument unless the shape is (num. data points, num. target dimensions).
+    void set_initial_embedding(const py::buffer_info &emb_info);
+
+    // Optimize the positions of new points with the given kNN among the embedded points
+    py::array_t<float, py::array::c_style> project(
+        const int64_t* indices,
+        const float* distances,
+        uint64_t num_points,
+        uint64_t num_neighbors,
+        int iterations,
+        int num_threads,
+        const py::object& out);
+
+    void make_context_current();
+    void release_context();
+    void free_context();
+
+    nptsne::SharedSparseMatrixType _distributions;
     nptsne::EmbeddingType _embedding;
-    hdi::dr::GradientDescentTSNETexture _tSNE;
+    // Created with the OpenGL context and freed while it is current
+    std::unique_ptr<hdi::dr::GradientDescentTSNETexture> _tSNE;
 
     int _num_data_points;
     int _num_dimensions;
@@ -81,5 +169,11 @@ class TextureTsneExtended {
     double _theta;
     int _num_target_dimensions;
     bool _have_preset_embedding;
-    GLFWwindow* _offscreen_context;
+    // The data array of init_transform if kept (keep_data) for the neighbor search
+    // of transform: the float32 C contiguous array given, a converted copy for other
+    // input. A null handle otherwise, also when constructed without the GIL.
+    py::object _training_data;
+    nptsne::PooledContext _offscreen_context;
+    nptsne::RunStats _last_run_stats;
+    nptsne::BusyState _busy;
 };
@@ -1,12 +1,15 @@
 // Copyright 2020 LKEB at LUMC
 // Author: B. van Lew
 #pragma once
+#include "CsrMatrix.h"
 #include <hdi/data/map_mem_eff.h>
 #include <hdi/dimensionality_reduction/sparse_tsne_user_def_probabilities.h>
 #include <hdi/dimensionality_reduction/hd_joint_probability_generator.h>
 #include <hdi/dimensionality_reduction/gradient_descent_tsne_texture.h>
 #include <hdi/dimensionality_reduction/hierarchical_sne.h>
 #include <hdi/data/embedding.h>
+#include <memory>
+#include <utility>
 #include <vector>
 
 namespace nptsne {
@@ -23,6 +26,19 @@ namespace nptsne {
     // use the memory-efficient map to hold sparse data
     using SparseScalarMatrixType = std::vector<MapType>;
 
+    // Contiguous compressed sparse row storage, used by the nptsne engines
+    using CsrMatrixType = CsrMatrix<ScalarType>;
+
+    // An immutable, reference counted sparse matrix. The hierarchy scales,
+    // the analyses and their embedders share probabilities through it
+    // instead of copying them.
+    using SharedSparseMatrixType = std::shared_ptr<const SparseScalarMatrixType>;
+
+    // Take ownership of a matrix, it is moved not copied
+    inline SharedSparseMatrixType share_matrix(SparseScalarMatrixType&& matrix) {
+        return std::make_shared<const SparseScalarMatrixType>(std::move(matrix));
+    }
+
     // a tSNE embedder that works with sparse data
     using SparseTsneType = hdi::dr::SparseTSNEUserDefProbabilities<ScalarType, SparseScalarMatrixType>;
 
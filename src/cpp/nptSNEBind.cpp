@@ -4,26 +4,330 @@
 #include <pybind11/stl.h>  // automatic conversion of STL to list, set, tuple, dict
 #include <pybind11/stl_bind.h>
 #include "TextureTsne.h"
+#include "OffscreenContext.h"
+#include "EmbeddingOutput.h"
+#include "SimilarityCache.h"
 #include "TextureTsneExtended.h"
 #include "HSne.h"
+#include "Log.h"
 #include "Analysis.h"
+#include "Influence.h"
 #include "SparseTsne.h"
 #include "Types.h"
 #include <string>
 #include <functional>
+#include <memory>
 #include <tuple>
 #include <limits>
 namespace py = pybind11;
 
+// Export a sparse matrix as the compressed sparse row arrays
+// (indptr, indices, values). The row lengths are summed first so that
+// each array is allocated once and then filled in a single pass over the rows.
+static py::tuple sparse_matrix_to_csr(const nptsne::SparseScalarMatrixType& matrix) {
+    auto num_rows = matrix.size();
+    auto indptr = py::array_t<int64_t>(num_rows + 1);
+    int64_t *indptr_out = indptr.mutable_data();
+    indptr_out[0] = 0;
+    for (size_t i = 0; i < num_rows; ++i) {
+        indptr_out[i + 1] = indptr_out[i] + matrix[i].size();
+    }
+    auto nnz = indptr_out[num_rows];
+    auto indices = py::array_t<nptsne::UnsignedIntType>(nnz);
+    auto values = py::array_t<nptsne::ScalarType>(nnz);
+    nptsne::UnsignedIntType *indices_out = indices.mutable_data();
+    nptsne::ScalarType *values_out = values.mutable_data();
+    for (size_t i = 0; i < num_rows; ++i) {
+        auto pos = indptr_out[i];
+        for (const auto& elem : matrix[i].memory()) {
+            indices_out[pos] = elem.first;
+            values_out[pos] = elem.second;
+            ++pos;
+        }
+    }
+    return py::make_tuple(indptr, indices, values);
+}
+
+// The statistics of the last run as a dict with the per phase wall times
+// in seconds, the number of iterations and the process peak memory.
+static py::dict run_stats_to_dict(const nptsne::RunStats& stats) {
+    py::dict phase_seconds;
+    for (const auto& phase : stats.phase_seconds()) {
+        phase_seconds[py::str(phase.first)] = phase.second;
+    }
+    py::dict result;
+    result["phase_seconds"] = phase_seconds;
+    result["iterations"] = stats.iterations();
+    result["peak_resident_bytes"] = stats.peak_resident_bytes_at_end();
+    return result;
+}
+
+// Submit a (bound) callable to the shared nptsne executor.
+// The native calls release the GIL so the returned
+// concurrent.futures.Future runs concurrently with the caller.
+// The owner is busy until the call is done (or cancelled): using it from
+// another thread meanwhile raises a RuntimeError instead of racing the call.
+static py::object submit_async(py::object owner, nptsne::BusyState& busy,
+    py::object callable, py::args args, py::kwargs kwargs) {
+    busy.reserve();
+    try {
+        // The captured owner keeps the busy state alive
+        py::cpp_function run([owner, &busy, callable](py::args call_args, py::kwargs call_kwargs) {
+            busy.adopt();
+            struct Release {
+                nptsne::BusyState& busy;
+                ~Release() { busy.release(); }
+            } release{busy};
+            return callable(*call_args, **call_kwargs);
+        });
+        py::object future = py::module::import("nptsne._futures").attr("submit")(run, *args, **kwargs);
+        future.attr("add_done_callback")(py::cpp_function([owner, &busy](py::object done) {
+            // A cancelled call never runs to release the owner
+            if (done.attr("cancelled")().cast<bool>()) {
+                busy.release();
+            }
+        }));
+        return future;
+    }
+    catch (...) {
+        busy.release();
+        throw;
+    }
+}
+
+// Route the native log to a python callable(level, message).
+// The sink may be called from any thread, it takes the GIL for the call.
+static void set_python_log_callback(py::object callback) {
+    if (callback.is_none()) {
+        callback = py::module::import("logging").attr("getLogger")("nptsne").attr("log");
+    }
+    std::shared_ptr<py::object> holder(new py::object(callback), [](py::object *obj) {
+        py::gil_scoped_acquire acquire;
+        delete obj;
+    });
+    nptsne::set_log_sink([holder](int level, const std::string& message) {
+        py::gil_scoped_acquire acquire;
+        try {
+            (*holder)(level, message);
+        }
+        catch (py::error_already_set& e) {
+            // A failing callback is reported but does not stop the computation
+            e.restore();
+            PyErr_WriteUnraisable(holder->ptr());
+        }
+    });
+}
+
 // Maintainer note - this uses Google style docstrings
 
 PYBIND11_MODULE(_nptsne, m) {
-    m.attr("__all__") = py::make_tuple("KnnAlgorithm", "TextureTsne", "TextureTsneExtended", "HSne", "HSneScale", "_hsne_analysis");
+    m.attr("__all__") = py::make_tuple("KnnAlgorithm", "TextureTsne", "TextureTsneExtended", "HSne", "HSneParameters", "HSneScale",
+        "set_log_level", "get_log_level", "set_log_callback", "set_log_rate_limit", "release_gl_contexts",
+        "set_similarity_cache", "similarity_cache_info", "clear_similarity_cache", "_hsne_analysis");
     m.doc() = R"pbdoc(
         A numpy compatible python extension for GPGPU linear complexity tSNE and HSNE
         -----------------------------------------------------------------------------
     )pbdoc";
 
+    // LOGGING
+    // The native log goes to the "nptsne" python logger until a callback is set.
+    // The sink is reset at exit, before the interpreter is finalized.
+    set_python_log_callback(py::none());
+    py::module::import("atexit").attr("register")(py::cpp_function([]() {
+        nptsne::set_log_sink(nullptr);
+    }));
+
+    m.def("set_log_level", &nptsne::set_log_level,
+        R"pbdoc(
+            Set the level of the native log messages that are delivered.
+
+            Messages below the level are not formatted, the default is
+            ``logging.WARNING``. The messages that were printed with ``verbose``
+            are at ``logging.INFO``, step by step tracing is at ``logging.DEBUG``.
+
+            Parameters
+            ----------
+            level : int
+                A python :mod:`logging` level
+
+            Examples
+            --------
+            >>> import logging
+            >>> import nptsne
+            >>> nptsne.set_log_level(logging.INFO)
+            >>> nptsne.get_log_level() == logging.INFO
+            True
+            >>> nptsne.set_log_level(logging.WARNING)
+        )pbdoc",
+        py::arg("level"));
+
+    m.def("get_log_level", &nptsne::get_log_level,
+        R"pbdoc(
+            Get the level of the native log messages that are delivered.
+
+            Returns
+            -------
+            int
+                A python :mod:`logging` level
+        )pbdoc");
+
+    m.def("set_log_callback", &set_python_log_callback,
+        R"pbdoc(
+            Send the native log messages to a callback instead of the ``nptsne`` logger.
+
+            The callback may be called from a worker thread (for example
+            during an ``*_async`` call), it should return quickly.
+
+            Parameters
+            ----------
+            callback : callable, optional
+                Called as ``callback(level, message)``. None (the default)
+                restores the ``nptsne`` logger of the python :mod:`logging` package.
+
+            Examples
+            --------
+            >>> import logging
+            >>> import nptsne
+            >>> messages = []
+            >>> nptsne.set_log_callback(lambda level, message: messages.append(message))
+            >>> nptsne.set_log_callback()
+        )pbdoc",
+        py::arg("callback") = py::none());
+
+    m.def("set_log_rate_limit", &nptsne::set_log_rate_limit,
+        R"pbdoc(
+            Limit the number of native log messages delivered per second.
+
+            Messages over the limit are dropped, the number dropped is
+            reported as a warning when the next second starts.
+
+            Parameters
+            ----------
+            messages_per_second : int
+                The maximum number of messages per second, 0 (the default) is unlimited
+        )pbdoc",
+        py::arg("messages_per_second"));
+
+    // OPENGL CONTEXTS
+    // The pooled contexts are destroyed at exit, while the GL libraries are still loaded
+    py::module::import("atexit").attr("register")(py::cpp_function([]() {
+        nptsne::OffscreenContextPool::instance().release_idle();
+    }));
+
+    m.def("release_gl_contexts",
+        []() {
+            py::gil_scoped_release release;
+            return nptsne::OffscreenContextPool::instance().release_idle();
+        },
+        R"pbdoc(
+            Destroy the idle offscreen OpenGL contexts.
+
+            :class:`TextureTsne` and :class:`TextureTsneExtended` take their
+            OpenGL context from a process wide pool and return it after use
+            (:meth:`TextureTsneExtended.close`), so that repeated transforms
+            skip the context creation. The pool keeps one context per
+            concurrent transform until this function is called or the
+            process exits.
+
+            Returns
+            -------
+            int
+                The number of contexts destroyed
+
+            Examples
+            --------
+            >>> import nptsne
+            >>> nptsne.release_gl_contexts() >= 0
+            True
+        )pbdoc");
+
+    m.def("set_similarity_cache",
+        [](const std::string& directory, uint64_t max_bytes) {
+            nptsne::SimilarityCache::instance().configure(directory, max_bytes);
+        },
+        R"pbdoc(
+            Enable (or disable) the on-disk cache of similarity matrices.
+
+            :meth:`TextureTsne.fit_transform` and :meth:`TextureTsneExtended.init_transform`
+            compute a perplexity calibrated probability matrix from the kNN of the data.
+            With the cache enabled this matrix is stored in the directory, keyed by a hash
+            of the data and of the perplexity and kNN settings. Later runs on the same
+            data, also in other processes, read it instead of repeating the kNN.
+            When the total size exceeds `max_bytes` the least recently used entries are removed.
+
+            Parameters
+            ----------
+            directory : str
+                The cache directory, created if it does not exist.
+                An empty string disables the cache (the default state).
+            max_bytes : int, optional
+                The size bound of the cache in bytes, default 1 GiB.
+
+            Raises
+            ------
+            RuntimeError
+                If the directory cannot be created.
+
+            Examples
+            --------
+            >>> import nptsne
+            >>> import tempfile
+            >>> cache_dir = tempfile.mkdtemp()
+            >>> nptsne.set_similarity_cache(cache_dir, max_bytes=2**26)
+            >>> tsne = nptsne.TextureTsne(iterations=10)
+            >>> _ = tsne.fit_transform(sample_tsne_data, backend="cpu")
+            >>> _ = tsne.fit_transform(sample_tsne_data, backend="cpu")
+            >>> info = nptsne.similarity_cache_info()
+            >>> info['num_entries'], info['hits'] >= 1
+            (1, True)
+            >>> nptsne.clear_similarity_cache()
+            1
+            >>> nptsne.set_similarity_cache("")
+        )pbdoc",
+        py::arg("directory"),
+        py::arg("max_bytes") = uint64_t(1) << 30);
+
+    m.def("similarity_cache_info",
+        []() {
+            auto info = nptsne::SimilarityCache::instance().info();
+            py::dict result;
+            result["directory"] = info.directory;
+            result["max_bytes"] = info.max_bytes;
+            result["num_entries"] = info.num_entries;
+            result["total_bytes"] = info.total_bytes;
+            result["hits"] = info.hits;
+            result["misses"] = info.misses;
+            return result;
+        },
+        R"pbdoc(
+            The state of the similarity cache, see :func:`set_similarity_cache`.
+
+            Returns
+            -------
+            dict
+                ``directory`` (empty if disabled), ``max_bytes``, ``num_entries``
+                and ``total_bytes`` on disk and the ``hits`` and ``misses`` of this process.
+
+            Examples
+            --------
+            >>> import nptsne
+            >>> sorted(nptsne.similarity_cache_info().keys())
+            ['directory', 'hits', 'max_bytes', 'misses', 'num_entries', 'total_bytes']
+        )pbdoc");
+
+    m.def("clear_similarity_cache",
+        []() {
+            return nptsne::SimilarityCache::instance().clear();
+        },
+        R"pbdoc(
+            Remove all entries from the similarity cache directory.
+
+            Returns
+            -------
+            int
+                The number of entries removed
+        )pbdoc");
+
     // ENUMS
     py::enum_<KnnAlgorithm>(m, "KnnAlgorithm", R"pbdoc(
             Enumeration used to select the knn algorithm used. Three possibilities are
@@ -82,6 +386,11 @@ PYBIND11_MODULE(_nptsne, m) {
             linear tSNE. If the system does not support OpenGL 4.3 an abover the implementation
             falls back to the a Texture rendering approach as described in [1]_.
 
+            The OpenGL context is an invisible GLFW window or, on Linux without a
+            display, a headless EGL context. With Mesa the EGL context also runs
+            without a GPU (llvmpipe). Set the environment variable
+            NPTSNE_GL_BACKEND to `glfw` or `egl` to force a choice.
+
             See Also
             --------
             TextureTsneExtended
@@ -113,6 +422,22 @@ PYBIND11_MODULE(_nptsne, m) {
             ----------
             X : :class:`ndarray`
                 The input data with shape (num. data points, num. dimensions)
+            backend : str, optional
+                The gradient descent implementation:
+                `"gpu"` (the default) the OpenGL texture based tSNE,
+                `"cpu"` a multi-threaded Barnes-Hut tSNE,
+                `"cpu_fft"` a multi-threaded tSNE with the repulsive forces
+                interpolated on a grid and evaluated with an FFT (FIt-SNE).
+                The CPU backends need no OpenGL context and only support
+                2 target dimensions.
+            num_threads : int, optional
+                The number of threads for the CPU backends, 0 (the default) uses all cores
+            out : :class:`ndarray`, optional
+                A writeable, C contiguous float32 array with
+                num. data points * num_target_dimensions elements, for example
+                with shape (num. data points, num_target_dimensions).
+                The embedding is written into it and it is returned
+                instead of a new array.
 
             Example
             -------
@@ -128,12 +453,85 @@ PYBIND11_MODULE(_nptsne, m) {
             >>> embedding.dtype == numpy.float32  # doctest: +SKIP_IN_CI
             True
 
+            The CPU FFT backend runs without a GPU
+
+            >>> tsne = nptsne.TextureTsne(iterations=100)
+            >>> embedding = tsne.fit_transform(sample_tsne_data, backend="cpu_fft")
+            >>> embedding.shape
+            (4000,)
+
+            Write the result into a preallocated buffer
+
+            >>> import numpy
+            >>> out = numpy.empty((2000, 2), dtype=numpy.float32)
+            >>> result = tsne.fit_transform(sample_tsne_data, backend="cpu_fft", out=out)
+            >>> result is out
+            True
+            >>> numpy.array_equal(tsne.embedding, out)
+            True
+
             Returns
             -------
             :class:`ndarray`
                 A numpy array contain a flatten (1D) embedding
+
+            Raises
+            ------
+            ValueError
+                If the backend is unknown, a CPU backend is combined with
+                other than 2 target dimensions or `out` is not a suitable buffer.
+
+            Notes
+            -----
+            The GIL is released during the knn and gradient descent.
+            The CPU embeddings are linear in the number of points for `"cpu_fft"`
+            and do not depend on the number of threads.
         )pbdoc",
-        py::arg("X"));
+        py::arg("X"),
+        py::arg("backend") = "gpu",
+        py::arg("num_threads") = 0,
+        py::arg("out") = py::none());
+
+    textureTsne.def("fit_transform_async",
+        [](py::object self, py::args args, py::kwargs kwargs) {
+            auto& tsne = self.cast<TextureTsne&>();
+            const std::string backend = args.size() > 1 ? args[1].cast<std::string>() :
+                kwargs.contains("backend") ? kwargs["backend"].cast<std::string>() : std::string("gpu");
+            if (backend == "gpu") {
+                // Create the OpenGL context on this thread, not in the executor
+                tsne.prepare_context();
+            }
+            return submit_async(self, tsne.busy_state(), self.attr("fit_transform"), args, kwargs);
+        },
+        R"pbdoc(
+            Run :func:`fit_transform` in a background thread.
+
+            The arguments are the same as for :func:`fit_transform`.
+
+            Examples
+            --------
+            >>> import nptsne
+            >>> tsne = nptsne.TextureTsne()
+            >>> future = tsne.fit_transform_async(sample_tsne_data)  # doctest: +SKIP_IN_CI
+            >>> future.result().shape  # doctest: +SKIP_IN_CI
+            (4000,)
+
+            Returns
+            -------
+            :class:`concurrent.futures.Future`
+                The future result of :func:`fit_transform`
+
+            Notes
+            -----
+            Using the instance from another thread before the future is done
+            raises a RuntimeError.
+            The OpenGL context is created (or taken from the pool) on the calling
+            thread, the executor thread only makes it current. GLFW creates windows,
+            and so contexts, on the main thread only: on macOS this is enforced and
+            on Windows and Linux (X11, Wayland) it is required by GLFW as well.
+            Call this from the main thread when GLFW is the backend. The EGL
+            backend (Linux without a display) has no such restriction.
+        )pbdoc");
 
     textureTsne.def_property_readonly("verbose", &TextureTsne::get_verbose,
         R"pbdoc(
@@ -199,6 +597,47 @@ PYBIND11_MODULE(_nptsne, m) {
                
         )pbdoc");
 
+    textureTsne.def_property_readonly("last_run_stats",
+        [](const TextureTsne& self) { return run_stats_to_dict(self.last_run_stats()); },
+        R"pbdoc(
+            dict: Statistics of the last :func:`fit_transform`.
+
+            ``phase_seconds`` maps the phases (``similarities``, ``gradient_descent``)
+            to their wall time in seconds, ``iterations`` is the number of gradient descent
+            iterations and ``peak_resident_bytes`` is the peak resident memory of the process.
+
+            Examples
+            --------
+
+            >>> sorted(sample_texture_tsne.last_run_stats.keys())
+            ['iterations', 'peak_resident_bytes', 'phase_seconds']
+        )pbdoc");
+
+    // Share the embedding without a copy
+    textureTsne.def_property_readonly("embedding",
+        [](py::object self) {
+            return nptsne::embedding_view(self.cast<TextureTsne&>().getEmbedding(), self);
+        },
+        R"pbdoc(
+            :class:`ndarray` : The embedding of the last :func:`fit_transform`
+            with shape (num. data points, num_target_dimensions).
+
+            Examples
+            --------
+
+            >>> import nptsne
+            >>> tsne = nptsne.TextureTsne(iterations=100)
+            >>> _ = tsne.fit_transform(sample_tsne_data, backend="cpu_fft")
+            >>> tsne.embedding.shape
+            (2000, 2)
+
+            Notes
+            -----
+            This is a view on the internal buffer, not a copy. The next :func:`fit_transform`
+            overwrites it and, with a different number of points, invalidates it.
+            Use `numpy.copy` to keep an embedding.
+        )pbdoc");
+
     // Extended TextureTsne interface for advanced use of GPU texture tSNE
     py::class_<TextureTsneExtended> textureTsneExtended(m, "TextureTsneExtended",
         R"pbdoc(
@@ -275,6 +714,10 @@ PYBIND11_MODULE(_nptsne, m) {
                 The input data with shape (num. data points, num. dimensions)
             initial_embedding : :class:`ndarray`
                 An optional initial embedding. Shape should be (num data points, num output dimensions)
+            keep_data : bool, optional
+                Keep X for the neighbor search of :func:`transform`, default False.
+                A float32 C contiguous X is referenced, other input is kept as a
+                converted copy.
 
             Returns
             -------
@@ -290,10 +733,180 @@ PYBIND11_MODULE(_nptsne, m) {
             >>> tsne.init_transform(sample_tsne_data)
             True
 
+            Start from a given embedding, one row per data point.
+
+            >>> import numpy as np
+            >>> start = np.random.default_rng(0).random((sample_tsne_data.shape[0], 2), dtype=np.float32)
+            >>> tsne.init_transform(sample_tsne_data, initial_embedding=start)
+            True
+            >>> tsne.embedding.shape == (sample_tsne_data.shape[0], 2)
+            True
+            >>> np.array_equal(tsne.embedding, start)
+            True
+
+            Raises
+            ------
+            ValueError
+                If the initial embedding does not have the shape (num. data points, num_target_dimensions)
         )pbdoc",
         py::arg("X"),
+        py::arg("initial_embedding") = py::array_t<nptsne::ScalarType>({}),
+        py::arg("keep_data") = false);
+
+    textureTsneExtended.def("init_transform_from_knn",
+        &TextureTsneExtended::init_transform_from_knn,
+        R"pbdoc(
+            Initialize the transform from a precomputed k nearest neighbor graph.
+
+            The internal kNN is skipped, the perplexity calibrated probabilities are
+            computed directly from the neighbors. Use this when an approximate
+            nearest neighbor index is already available for the data.
+
+            Parameters
+            ----------
+            indices : :class:`ndarray`
+                The neighbor indexes, shape (num. data points, num. neighbors).
+                The point itself and negative (padding) indexes are ignored.
+            distances : :class:`ndarray`
+                The squared euclidean distances to the neighbors, same shape as indices.
+            initial_embedding : :class:`ndarray`
+                An optional initial embedding. Shape should be (num data points, num output dimensions)
+
+            Returns
+            -------
+            bool
+                True if successful, False otherwise
+
+            Examples
+            --------
+            Initialize from a brute force kNN of part of the sample data.
+            For the perplexity of 30 use about 90 neighbors.
+
+            >>> import nptsne
+            >>> import numpy as np
+            >>> X = sample_tsne_data[:2000]
+            >>> sq_dist = ((X[:, None, :] - X[None, :, :]) ** 2).sum(axis=2)
+            >>> indices = np.argsort(sq_dist, axis=1)[:, :91]
+            >>> distances = np.take_along_axis(sq_dist, indices, axis=1)
+            >>> tsne = nptsne.TextureTsneExtended()
+            >>> tsne.init_transform_from_knn(indices, distances)
+            True
+
+            Raises
+            ------
+            ValueError
+                If indices and distances do not have the same two dimensional shape
+        )pbdoc",
+        py::arg("indices"),
+        py::arg("distances"),
         py::arg("initial_embedding") = py::array_t<nptsne::ScalarType>({}));
 
+    textureTsneExtended.def_static("perplexity_sweep",
+        [](py::array_t<float, py::array::c_style | py::array::forcecast> X,
+            const std::vector<int>& perplexities,
+            bool verbose,
+            int num_target_dimensions,
+            KnnAlgorithm knn_algorithm,
+            int num_threads,
+            bool keep_data) {
+            auto embedders = TextureTsneExtended::perplexity_sweep(
+                X, perplexities, verbose, num_target_dimensions, knn_algorithm, num_threads, keep_data);
+            py::list result;
+            for (auto& embedder : embedders) {
+                result.append(py::cast(std::move(embedder)));
+            }
+            return result;
+        },
+        R"pbdoc(
+            Create initialized embedders for several perplexities from a single kNN.
+
+            The kNN is computed once, for the largest perplexity. The probabilities
+            for the smaller perplexities are derived from it by keeping the nearest
+            perplexity * 3 neighbors of each point and recalibrating, in parallel.
+            A sweep over five perplexities therefore costs about one :func:`init_transform`.
+
+            Parameters
+            ----------
+            X : :class:`ndarray`
+                The input data with shape (num. data points, num. dimensions)
+            perplexities : list of int
+                The perplexities, one embedder is returned for each
+            verbose : bool, optional
+                Enable verbose logging, default False
+            num_target_dimensions : int, optional
+                The number of dimensions for the output embeddings. Default is 2.
+            knn_algorithm : :class:`KnnAlgorithm`, optional
+                The knn algorithm, default `Flann`
+            num_threads : int, optional
+                The number of threads for the recalibration, 0 (the default) uses all cores
+            keep_data : bool, optional
+                Keep X in the embedders for :func:`transform`, default False
+
+            Returns
+            -------
+            list of :class:`TextureTsneExtended`
+                Embedders in the order of `perplexities`, ready for :func:`run_transform`.
+                ``last_run_stats`` of the first embedder with the largest perplexity
+                holds the kNN time, the others their recalibration time.
+
+            Examples
+            --------
+            >>> import nptsne
+            >>> embedders = nptsne.TextureTsneExtended.perplexity_sweep(sample_tsne_data, [5, 10, 30])
+            >>> [tsne.perplexity for tsne in embedders]
+            [5, 10, 30]
+            >>> embedding = embedders[0].run_transform(iterations=100)    # doctest: +SKIP_IN_CI
+            >>> embedding.shape    # doctest: +SKIP_IN_CI
+            (4000,)
+
+            Raises
+            ------
+            ValueError
+                If X is not two dimensional or a perplexity is not positive
+
+            Notes
+            -----
+            The GIL is released during the kNN and the recalibration. The similarity
+            cache (:func:`set_similarity_cache`) applies to the kNN for the largest perplexity.
+        )pbdoc",
+        py::arg("X"),
+        py::arg("perplexities"),
+        py::arg("verbose") = false,
+        py::arg("num_target_dimensions") = 2,
+        py::arg("knn_algorithm") = KnnAlgorithm::Flann,
+        py::arg("num_threads") = 0,
+        py::arg("keep_data") = false);
+
+    textureTsneExtended.def("init_transform_async",
+        [](py::object self, py::args args, py::kwargs kwargs) {
+            auto& tsne = self.cast<TextureTsneExtended&>();
+            return submit_async(self, tsne.busy_state(), self.attr("init_transform"), args, kwargs);
+        },
+        R"pbdoc(
+            Run :func:`init_transform` in a background thread.
+
+            The arguments are the same as for :func:`init_transform`.
+
+            Examples
+            --------
+            >>> import nptsne
+            >>> tsne = nptsne.TextureTsneExtended()
+            >>> future = tsne.init_transform_async(sample_tsne_data)
+            >>> future.result()
+            True
+
+            Returns
+            -------
+            :class:`concurrent.futures.Future`
+                The future result of :func:`init_transform`
+
+            Notes
+            -----
+            Using the instance from another thread before the future is done
+            raises a RuntimeError. No OpenGL context is needed, it is created
+            by :func:`run_transform` (or :func:`run_transform_async`).
+        )pbdoc");
+
     textureTsneExtended.def("run_transform", &TextureTsneExtended::run_transform,
         R"pbdoc(
             Run the transform gradient descent for a number of iterations
@@ -305,6 +918,12 @@ PYBIND11_MODULE(_nptsne, m) {
                 Enable verbose logging to standard output.
             iterations : int
                 The number of iterations to run.
+            out : :class:`ndarray`, optional
+                A writeable, C contiguous float32 array with
+                num. data points * num_target_dimensions elements, for example
+                with shape (num. data points, num_target_dimensions).
+                The embedding is written into it and it is returned
+                instead of a new array.
 
 
             Examples
@@ -321,14 +940,179 @@ PYBIND11_MODULE(_nptsne, m) {
             >>> tsne.iteration_count    # doctest: +SKIP_IN_CI
             250
 
+            Reuse one buffer when running in steps, for example to animate the embedding
+
+            >>> import numpy
+            >>> out = numpy.empty((2000, 2), dtype=numpy.float32)
+            >>> for i in range(5):    # doctest: +SKIP_IN_CI
+            ...     _ = tsne.run_transform(iterations=10, out=out)
+            >>> tsne.iteration_count    # doctest: +SKIP_IN_CI
+            300
+
             Returns
             -------
             :class:`ndarray`
                 A numpy array contain a flatten (1D) embedding.
                 Coordinates are arranged: x0, y0, x, y1, ...
+                If `out` is given that array is returned.
+
+            Raises
+            ------
+            ValueError
+                If `out` is not a suitable buffer.
+
+            Notes
+            -----
+            The GIL is released during the gradient descent.
+            The :attr:`embedding` property gives the current embedding without a copy.
         )pbdoc",
         py::arg("verbose") = false,
-        py::arg("iterations") = 1000);
+        py::arg("iterations") = 1000,
+        py::arg("out") = py::none());
+
+    textureTsneExtended.def("transform", &TextureTsneExtended::transform,
+        R"pbdoc(
+            Place new points in the current embedding without changing it.
+
+            The nearest neighbors of the new points are searched (exactly) in the data
+            of :func:`init_transform`, given as `data` or kept with `keep_data`, and calibrated with the perplexity of this instance.
+            Each new point starts at the probability weighted mean of its neighbors in
+            the embedding and is then optimized alone under the tSNE forces of the
+            embedded points, which stay fixed. The new points do not affect each other.
+
+            Parameters
+            ----------
+            X : :class:`ndarray`
+                The new points with shape (num. new points, num. dimensions)
+            iterations : int, optional
+                The number of gradient descent iterations, default 250
+            num_threads : int, optional
+                The number of threads, 0 (the default) uses all cores
+            out : :class:`ndarray`, optional
+                A writeable, C contiguous float32 buffer with num. new points * 2 elements,
+                the positions are written into it and it is returned
+            data : :class:`ndarray`, optional
+                The data of :func:`init_transform`, (num. data points, num. dimensions).
+                Not needed if it was kept (`keep_data`).
+
+            Returns
+            -------
+            :class:`ndarray`
+                The flattened (1D) positions of the new points, x0, y0, x1, y1, ...
+
+            Examples
+            --------
+            >>> import nptsne
+            >>> tsne = nptsne.TextureTsneExtended()
+            >>> tsne.init_transform(sample_tsne_data)
+            True
+            >>> _ = tsne.run_transform(iterations=500)    # doctest: +SKIP_IN_CI
+            >>> new_points = tsne.transform(sample_tsne_data[:10] + 0.01, data=sample_tsne_data)    # doctest: +SKIP_IN_CI
+            >>> new_points.shape    # doctest: +SKIP_IN_CI
+            (20,)
+
+            Raises
+            ------
+            ValueError
+                If X or `data` do not have the dimensions of the data, for other than
+                2 target dimensions or if `out` is not a suitable buffer
+            RuntimeError
+                If there is no embedding yet or neither `data` is given nor the
+                data kept (see also :func:`transform_from_knn`)
+
+            Notes
+            -----
+            Data kept by :func:`init_transform` with `keep_data` is referenced if it
+            was float32 and C contiguous, modifying it then changes the neighbors found. The GIL is released during the
+            neighbor search and the optimization. ``last_run_stats`` reports the
+            ``knn``, ``similarities`` and ``gradient_descent`` phases.
+        )pbdoc",
+        py::arg("X"),
+        py::arg("iterations") = 250,
+        py::arg("num_threads") = 0,
+        py::arg("out") = py::none(),
+        py::arg("data") = py::none());
+
+    textureTsneExtended.def("transform_from_knn", &TextureTsneExtended::transform_from_knn,
+        R"pbdoc(
+            Place new points in the current embedding given their nearest neighbors.
+
+            As :func:`transform` with the neighbor search done by the caller,
+            for example with the approximate nearest neighbor index of the data.
+
+            Parameters
+            ----------
+            indices : :class:`ndarray`
+                The indexes of the neighbors of the new points among the embedded points,
+                shape (num. new points, num. neighbors). Negative (padding) indexes are ignored.
+                For the perplexity of 30 use about 90 neighbors.
+            distances : :class:`ndarray`
+                The squared euclidean distances to the neighbors, same shape as indices.
+            iterations : int, optional
+                The number of gradient descent iterations, default 250
+            num_threads : int, optional
+                The number of threads, 0 (the default) uses all cores
+            out : :class:`ndarray`, optional
+                A writeable, C contiguous float32 buffer with num. new points * 2 elements,
+                the positions are written into it and it is returned
+
+            Returns
+            -------
+            :class:`ndarray`
+                The flattened (1D) positions of the new points, x0, y0, x1, y1, ...
+
+            Raises
+            ------
+            ValueError
+                If indices and distances do not have the same two dimensional shape,
+                a neighbor is out of range or `out` is not a suitable buffer
+            RuntimeError
+                If there is no embedding yet
+        )pbdoc",
+        py::arg("indices"),
+        py::arg("distances"),
+        py::arg("iterations") = 250,
+        py::arg("num_threads") = 0,
+        py::arg("out") = py::none());
+
+    textureTsneExtended.def("run_transform_async",
+        [](py::object self, py::args args, py::kwargs kwargs) {
+            auto& tsne = self.cast<TextureTsneExtended&>();
+            // Create the OpenGL context on this thread, not in the executor
+            tsne.prepare_context();
+            return submit_async(self, tsne.busy_state(), self.attr("run_transform"), args, kwargs);
+        },
+        R"pbdoc(
+            Run :func:`run_transform` in a background thread.
+
+            The arguments are the same as for :func:`run_transform`.
+
+            Examples
+            --------
+            >>> import nptsne
+            >>> tsne = nptsne.TextureTsneExtended()
+            >>> tsne.init_transform(sample_tsne_data)
+            True
+            >>> future = tsne.run_transform_async(iterations=100)    # doctest: +SKIP_IN_CI
+            >>> future.result().shape    # doctest: +SKIP_IN_CI
+            (4000,)
+
+            Returns
+            -------
+            :class:`concurrent.futures.Future`
+                The future result of :func:`run_transform`
+
+            Notes
+            -----
+            Using the instance from another thread before the future is done
+            raises a RuntimeError.
+            The OpenGL context is created (or taken from the pool) on the calling
+            thread, the executor thread only makes it current. GLFW creates windows,
+            and so contexts, on the main thread only: on macOS this is enforced and
+            on Windows and Linux (X11, Wayland) it is required by GLFW as well.
+            Call this from the main thread when GLFW is the backend. The EGL
+            backend (Linux without a display) has no such restriction.
+        )pbdoc");
 
     textureTsneExtended.def("reinitialize_transform",
         &TextureTsneExtended::reinitialize_transform,
@@ -413,7 +1197,10 @@ PYBIND11_MODULE(_nptsne, m) {
 
     textureTsneExtended.def("close", &TextureTsneExtended::close,
         R"pbdoc(
-            Release GPU resources for the transform
+            Release GPU resources for the transform.
+
+            The OpenGL context is returned to the process wide pool
+            (see :func:`release_gl_contexts`) for reuse by the next transform.
         )pbdoc");
 
     textureTsneExtended.def_property_readonly("verbose", &TextureTsneExtended::get_verbose,
@@ -461,6 +1248,213 @@ PYBIND11_MODULE(_nptsne, m) {
             30
         )pbdoc");
 
+    textureTsneExtended.def_property_readonly("last_run_stats",
+        [](const TextureTsneExtended& self) { return run_stats_to_dict(self.last_run_stats()); },
+        R"pbdoc(
+            dict: Statistics of the last :func:`init_transform` or :func:`run_transform`.
+
+            ``phase_seconds`` maps the phases (``similarities`` for the initialization,
+            ``embedding_init`` and ``gradient_descent`` for a run) to their wall time in
+            seconds, ``iterations`` is the number of iterations in the run and
+            ``peak_resident_bytes`` is the peak resident memory of the process.
+
+            Examples
+            --------
+
+            >>> 'phase_seconds' in sample_texture_tsne_extended.last_run_stats
+            True
+        )pbdoc");
+
+    // Share the embedding without a copy
+    textureTsneExtended.def_property_readonly("embedding",
+        [](py::object self) {
+            return nptsne::embedding_view(self.cast<TextureTsneExtended&>().getEmbedding(), self);
+        },
+        R"pbdoc(
+            :class:`ndarray` : The current embedding with shape (num. data points, num_target_dimensions).
+
+            Examples
+            --------
+
+            >>> import nptsne
+            >>> tsne = nptsne.TextureTsneExtended()
+            >>> tsne.init_transform(sample_tsne_data)
+            True
+            >>> _ = tsne.run_transform(iterations=10)    # doctest: +SKIP_IN_CI
+            >>> tsne.embedding.shape    # doctest: +SKIP_IN_CI
+            (2000, 2)
+
+            Notes
+            -----
+            This is a view on the internal buffer, not a copy, it follows each
+            :func:`run_transform`. It is invalidated by :func:`init_transform` and
+            :func:`reinitialize_transform`. Use `numpy.copy` to keep an embedding.
+        )pbdoc");
+
+    // ******************************************************************
+    // Hierarchical SNE build parameters
+    py::class_<HSneParameters> hsne_params_class(m, "HSneParameters",
+        R"pbdoc(
+            Parameters for building an HSNE hierarchy with :func:`HSne.create_hsne`.
+
+            The default values are those of the `balanced` preset. Start
+            from a preset and adjust the individual attributes if needed.
+
+            Attributes
+            ----------
+            seed
+            num_neighbors
+            knn_algorithm
+            aknn_num_trees
+            aknn_num_checks
+            num_walks_per_landmark
+            monte_carlo_sampling
+            mcmcs_num_walks
+            mcmcs_walk_length
+            mcmcs_landmark_thresh
+            transition_matrix_prune_thresh
+            out_of_core_computation
+            parallel_walks
+            num_walk_threads
+
+            Examples
+            --------
+            Use a preset and change the knn library
+
+            >>> import nptsne
+            >>> params = nptsne.HSneParameters.fast()
+            >>> params.knn_algorithm = nptsne.KnnAlgorithm.Annoy
+            >>> params.knn_algorithm
+            KnnAlgorithm.Annoy
+            >>> nptsne.HSneParameters().num_neighbors == nptsne.HSneParameters.balanced().num_neighbors
+            True
+
+            Notes
+            -----
+            The presets trade hierarchy build time and memory against
+            neighborhood preservation:
+
+            `fast`: 30 neighbors using HNSW, fewer knn checks and random walks
+            `balanced`: 90 neighbors using FLANN, the nptsne default
+            `accurate`: 120 neighbors using FLANN, more knn checks and random walks
+
+            The benchmark demos/Benchmarks/bench_hsne_presets.py measures
+            the presets on synthetic data.
+        )pbdoc");
+
+    hsne_params_class.def(py::init<>());
+
+    hsne_params_class
+        .def_static("fast", &HSneParameters::fast,
+            "HSneParameters: Fastest build, lowest neighborhood preservation")
+        .def_static("balanced", &HSneParameters::balanced,
+            "HSneParameters: The default build parameters")
+        .def_static("accurate", &HSneParameters::accurate,
+            "HSneParameters: Slowest build, highest neighborhood preservation")
+        .def_static("preset", &HSneParameters::preset,
+            R"pbdoc(
+                Get the parameters for a preset by name.
+
+                Parameters
+                ----------
+                name : str
+                    One of "fast", "balanced" or "accurate"
+
+                Examples
+                --------
+                >>> import nptsne
+                >>> nptsne.HSneParameters.preset("accurate").num_neighbors
+                120
+                >>> nptsne.HSneParameters.preset("slow")
+                Traceback (most recent call last):
+                ...
+                ValueError: Unknown HSneParameters preset: slow
+
+                Returns
+                -------
+                :class:`HSneParameters`
+            )pbdoc",
+            py::arg("name"));
+
+    hsne_params_class
+        .def_property("seed",
+            [](const HSneParameters& self) { return self._params._seed; },
+            [](HSneParameters& self, int value) { self._params._seed = value; },
+            "int: Random seed, a negative value uses a random seed.")
+        .def_property("num_neighbors",
+            [](const HSneParameters& self) { return self._params._num_neighbors; },
+            [](HSneParameters& self, int value) { self._params._num_neighbors = value; },
+            "int: Number of nearest neighbors used to build the data scale.")
+        .def_property("knn_algorithm", &HSneParameters::get_knn_algorithm, &HSneParameters::set_knn_algorithm,
+            ":class:`KnnAlgorithm`: The knn library used for the nearest neighbors.")
+        .def_property("aknn_num_trees",
+            [](const HSneParameters& self) { return self._params._aknn_num_trees; },
+            [](HSneParameters& self, int value) { self._params._aknn_num_trees = value; },
+            "int: Number of trees in the approximate knn index.")
+        .def_property("aknn_num_checks",
+            [](const HSneParameters& self) { return self._params._aknn_num_checks; },
+            [](HSneParameters& self, int value) { self._params._aknn_num_checks = value; },
+            "int: Number of checks in the approximate knn search.")
+        .def_property("num_walks_per_landmark",
+            [](const HSneParameters& self) { return self._params._num_walks_per_landmark; },
+            [](HSneParameters& self, int value) { self._params._num_walks_per_landmark = value; },
+            "int: Number of random walks per landmark used to compute the transition matrix.")
+        .def_property("monte_carlo_sampling",
+            [](const HSneParameters& self) { return self._params._monte_carlo_sampling; },
+            [](HSneParameters& self, bool value) { self._params._monte_carlo_sampling = value; },
+            "bool: Use Markov chain Monte Carlo sampling for landmark selection.")
+        .def_property("mcmcs_num_walks",
+            [](const HSneParameters& self) { return self._params._mcmcs_num_walks; },
+            [](HSneParameters& self, int value) { self._params._mcmcs_num_walks = value; },
+            "int: Number of random walks per point for landmark selection.")
+        .def_property("mcmcs_walk_length",
+            [](const HSneParameters& self) { return self._params._mcmcs_walk_length; },
+            [](HSneParameters& self, int value) { self._params._mcmcs_walk_length = value; },
+            "int: Length of the random walks for landmark selection.")
+        .def_property("mcmcs_landmark_thresh",
+            [](const HSneParameters& self) { return self._params._mcmcs_landmark_thresh; },
+            [](HSneParameters& self, double value) { self._params._mcmcs_landmark_thresh = value; },
+            "float: Landmark selection threshold, multiple of the mean walk count.")
+        .def_property("transition_matrix_prune_thresh",
+            [](const HSneParameters& self) { return self._params._transition_matrix_prune_thresh; },
+            [](HSneParameters& self, double value) { self._params._transition_matrix_prune_thresh = value; },
+            "float: Transition matrix values below this are pruned.")
+        .def_property("out_of_core_computation",
+            [](const HSneParameters& self) { return self._params._out_of_core_computation; },
+            [](HSneParameters& self, bool value) { self._params._out_of_core_computation = value; },
+            "bool: Compute the transition matrices with a small memory footprint.")
+        .def_readwrite("parallel_walks", &HSneParameters::_parallel_walks,
+            R"pbdoc(
+                bool: Build the scales with the nptsne parallel random walk engine.
+
+                The landmark selection and area of influence walks of all points
+                run in parallel on :attr:`num_walk_threads` threads. Each point has
+                its own random stream derived from :attr:`seed`, so the hierarchy
+                for a given (non negative) seed does not depend on the number of
+                threads. Only used with :attr:`monte_carlo_sampling`. Default False,
+                the HDILib single threaded walks.
+
+                Examples
+                --------
+                >>> import nptsne
+                >>> params = nptsne.HSneParameters()
+                >>> params.parallel_walks = True
+                >>> params.seed = 7
+                >>> hsne = nptsne.HSne(False)
+                >>> hsne.create_hsne(sample_hsne_data, 2, params=params)
+                True
+                >>> other = nptsne.HSne(False)
+                >>> params.num_walk_threads = 1
+                >>> other.create_hsne(sample_hsne_data, 2, params=params)
+                True
+                >>> import numpy as np
+                >>> np.array_equal(hsne.get_scale(1).landmark_orig_indexes,
+                ...     other.get_scale(1).landmark_orig_indexes)
+                True
+            )pbdoc")
+        .def_readwrite("num_walk_threads", &HSneParameters::_num_walk_threads,
+            "int: Threads of the parallel random walk engine, 0 (default) uses all cores.");
+
     // ******************************************************************
     // Hierarchical SNE wrapper
     py::class_<HSne> hsne_class(m, "HSne");
@@ -515,15 +1509,18 @@ PYBIND11_MODULE(_nptsne, m) {
         .def("create_hsne",
             (bool (HSne::*)(
                 py::array_t<float, py::array::c_style | py::array::forcecast>,
-                int)) &HSne::create_hsne,
+                int,
+                const HSneParameters*)) &HSne::create_hsne,
             py::arg("X"),
-            py::arg("num_scales")
+            py::arg("num_scales"),
+            py::arg_v("params", nullptr, "None")
         )
         .def("create_hsne",
             (bool (HSne::*)(
                 py::array_t<float, py::array::c_style | py::array::forcecast>,
                 int,
-                py::array_t<uint64_t, py::array::c_style | py::array::forcecast>)) &HSne::create_hsne,
+                py::array_t<uint64_t, py::array::c_style | py::array::forcecast>,
+                const HSneParameters*)) &HSne::create_hsne,
             R"pbdoc(
                 Create the hSNE analysis data hierarchy with user assigned point ids from the input data with the number of scales required.
 
@@ -538,6 +1535,10 @@ PYBIND11_MODULE(_nptsne, m) {
                 point_ids : :class:`ndarray`, optional
                     Array of ids associated with the data points
 
+                params : :class:`HSneParameters`, optional
+                    The hierarchy build parameters, the default is
+                    :func:`HSneParameters.balanced`
+
                 Examples
                 --------
                 >>> import nptsne
@@ -550,13 +1551,123 @@ PYBIND11_MODULE(_nptsne, m) {
                 16
                 >>> hsne.num_scales
                 3
-            
+
+                Trade accuracy for build speed with a preset
+
+                >>> hsne.create_hsne(sample_hsne_data, 3, params=nptsne.HSneParameters.fast())
+                True
+                >>> hsne.parameters.num_neighbors
+                30
+
             )pbdoc",
             py::arg("X"),
             py::arg("num_scales"),
-            py::arg("point_ids"))
+            py::arg("point_ids"),
+            py::arg_v("params", nullptr, "None"))
+        .def("create_hsne_from_knn",
+            &HSne::create_hsne_from_knn,
+            R"pbdoc(
+                Create the hSNE analysis data hierarchy from a precomputed k nearest neighbor graph.
+
+                The internal kNN is skipped, the first scale is built from perplexity
+                calibrated probabilities of the given neighbors (the perplexity is a third
+                of the number of neighbors, as in the internal build).
+                The hierarchy has no :attr:`num_dimensions`. The number of neighbors of
+                the :attr:`parameters` is that of the graph, :func:`project` searches
+                that many neighbors.
+
+                Parameters
+                ----------
+                indices : :class:`ndarray`
+                    The neighbor indexes, shape (num. data points, num. neighbors).
+                    The point itself and negative (padding) indexes are ignored.
+                distances : :class:`ndarray`
+                    The squared euclidean distances to the neighbors, same shape as indices.
+                num_scales : int
+                    How many scales to create in the hsne analysis
+                params : :class:`HSneParameters`, optional
+                    The hierarchy build parameters, the kNN settings are not used.
+
+                Examples
+                --------
+                >>> import nptsne
+                >>> import numpy as np
+                >>> X = sample_hsne_data[:2000]
+                >>> sq_dist = ((X[:, None, :] - X[None, :, :]) ** 2).sum(axis=2)
+                >>> indices = np.argsort(sq_dist, axis=1)[:, :91]
+                >>> distances = np.take_along_axis(sq_dist, indices, axis=1)
+                >>> hsne = nptsne.HSne(False)
+                >>> hsne.create_hsne_from_knn(indices, distances, 2)
+                True
+                >>> hsne.num_data_points
+                2000
+                >>> hsne.parameters.num_neighbors
+                91
+
+                Raises
+                ------
+                ValueError
+                    If indices and distances do not have the same two dimensional shape
+            )pbdoc",
+            py::arg("indices"),
+            py::arg("distances"),
+            py::arg("num_scales"),
+            py::arg_v("params", nullptr, "None"))
+        .def("create_hsne_chunked",
+            &HSne::create_hsne_chunked,
+            R"pbdoc(
+                Create the hSNE analysis data hierarchy from a large array like source.
+
+                The source is read in blocks of rows and each block is converted to
+                float32, so a :class:`numpy.memmap` of any dtype is not copied into memory
+                in one piece. The converted data is held in a temporary file backed
+                mapping (the default) or in memory, see `scratch`.
+                A C ordered float32 source is used in place.
+
+                Parameters
+                ----------
+                source : array like
+                    An object with a 2-D ``shape`` that supports row slicing,
+                    for example a :class:`numpy.memmap`, zarr or h5py array.
+                    Shape is : (num. data points, num. dimensions)
+                num_scales : int
+                    How many scales to create in the hsne analysis
+                block_rows : int
+                    The number of rows read and converted at a time (default 65536)
+                params : :class:`HSneParameters`, optional
+                    The hierarchy build parameters, the default is
+                    :func:`HSneParameters.balanced`
+                scratch : str, optional
+                    Where the converted float32 data is held during the build:
+                    "disk" (the default), a temporary file backed mapping the OS can
+                    page out, or "memory", a float32 array in memory.
+
+                Examples
+                --------
+                >>> import nptsne
+                >>> hsne = nptsne.HSne(False)
+                >>> hsne.create_hsne_chunked(sample_hsne_data.astype('float64'), 2, block_rows=4096)
+                True
+                >>> hsne.num_data_points
+                10000
+                >>> hsne.create_hsne_chunked(sample_hsne_data.astype('float64'), 2, scratch="memory")
+                True
+
+                Raises
+                ------
+                ValueError
+                    If the source is not two dimensional, block_rows is not positive or
+                    scratch is not "disk" or "memory"
+            )pbdoc",
+            py::arg("source"),
+            py::arg("num_scales"),
+            py::arg("block_rows") = 65536,
+            py::arg_v("params", nullptr, "None"),
+            py::arg("scratch") = "disk")
         .def("load_hsne",
-            &HSne::load_hsne,
+            (bool (HSne::*)(
+                py::array_t<float, py::array::c_style | py::array::forcecast>,
+                const std::string&)) &HSne::load_hsne,
             R"pbdoc(
                 Load the HSNE analysis data hierarchy from a pre-existing HSNE file.
 
@@ -583,9 +1694,231 @@ PYBIND11_MODULE(_nptsne, m) {
                 >>> loaded_hsne.num_scales
                 3
 
-            )pbdoc",
-            py::arg("X"),
-            py::arg("file_path"));
+            )pbdoc",
+            py::arg("X"),
+            py::arg("file_path"))
+        .def("load_hsne",
+            (bool (HSne::*)(const std::string&)) &HSne::load_hsne,
+            R"pbdoc(
+                Load the HSNE analysis data hierarchy from a pre-existing HSNE file
+                without the original data.
+
+                Only the file is read, this is sufficient for navigating the hierarchy.
+                Use :attr:`data_source` to attach the original data for feature lookups.
+
+                Parameters
+                ----------
+                file_path : str
+                    Path to saved HSNE file
+
+                Examples
+                --------
+                Load hsne from a file without the data
+
+                >>> import nptsne
+                >>> loaded_hsne = nptsne.HSne(True)
+                >>> loaded_hsne.load_hsne(sample_hsne_file)  # doctest: +ELLIPSIS
+                True
+                >>> loaded_hsne.num_data_points
+                10000
+                >>> loaded_hsne.num_scales
+                3
+
+            )pbdoc",
+            py::arg("file_path"))
+        .def_property("keep_training_data",
+            &HSne::keep_training_data,
+            &HSne::set_keep_training_data,
+            R"pbdoc(
+                bool: Keep the training data for :func:`project`, default False.
+
+                When set before :func:`create_hsne` or :func:`load_hsne` the hierarchy
+                keeps a reference to the (float32) data, a converted copy for other
+                dtypes. The converted data of :func:`create_hsne_chunked` is never kept.
+                Otherwise :func:`project` converts the :attr:`data_source` on each call,
+                a float32 source is used without a copy.
+
+                Examples
+                --------
+                >>> import nptsne
+                >>> hsne = nptsne.HSne(False)
+                >>> hsne.keep_training_data
+                False
+                >>> hsne.keep_training_data = True
+                >>> hsne.create_hsne(sample_hsne_data, 2)
+                True
+                >>> len(hsne.project(sample_hsne_data[:2])) == hsne.num_scales
+                True
+            )pbdoc")
+        .def_property("data_source",
+            &HSne::data_source,
+            &HSne::set_data_source,
+            R"pbdoc(
+                object: The original data as an array like (num. data points, num. dimensions), or None.
+
+                The source is only indexed when rows are requested with :func:`get_data`,
+                a :class:`numpy.memmap` keeps the footprint small.
+
+                Examples
+                --------
+                >>> import nptsne
+                >>> loaded_hsne = nptsne.HSne(True)
+                >>> loaded_hsne.load_hsne(sample_hsne_file)  # doctest: +ELLIPSIS
+                True
+                >>> loaded_hsne.data_source = sample_hsne_data
+                >>> loaded_hsne.get_data([2, 0]).shape
+                (2, 16)
+
+            )pbdoc")
+        .def("get_data",
+            &HSne::get_data,
+            R"pbdoc(
+                Get the rows of the :attr:`data_source` for the original data indexes.
+
+                Parameters
+                ----------
+                indexes : :class:`ndarray`
+                    Original data point indexes, for example the points in an area of influence
+
+                Returns
+                -------
+                :class:`ndarray`
+                    The rows in the order of the indexes, shape (len(indexes), num. dimensions)
+
+                Raises
+                ------
+                RuntimeError
+                    If no data source has been set
+            )pbdoc",
+            py::arg("indexes"))
+        .def("project",
+            [](HSne& self,
+                py::array_t<float, py::array::c_style | py::array::forcecast> X_new,
+                int num_threads) {
+                auto memberships = self.project(X_new, num_threads);
+                py::list result;
+                for (const auto& membership : memberships) {
+                    result.append(sparse_matrix_to_csr(membership));
+                }
+                return result;
+            },
+            R"pbdoc(
+                Find the landmarks that new data points belong to at each scale.
+
+                Each new point is placed among its exact nearest neighbors in the
+                training data (scale 0) and its membership is propagated up the
+                hierarchy through the areas of influence of the landmarks.
+                The hierarchy is not changed, the call is cheap enough to place
+                incoming data in real time.
+
+                Parameters
+                ----------
+                X_new : :class:`ndarray`
+                    The new data, shape (num. new points, num. dimensions)
+                num_threads : int, optional
+                    The number of threads for the neighbor search and the propagation,
+                    0 (the default) uses all cores
+
+                Returns
+                -------
+                list
+                    For each scale the memberships as compressed sparse row arrays
+                    (indptr, indices, values). Row i holds the landmark indexes
+                    of the scale and the membership weights of new point i, the weights
+                    in a row sum to one.
+
+                Examples
+                --------
+                >>> import numpy
+                >>> sample_hsne.data_source = sample_hsne_data
+                >>> memberships = sample_hsne.project(sample_hsne_data[:5])
+                >>> len(memberships) == sample_hsne.num_scales
+                True
+                >>> indptr, indices, values = memberships[2]
+                >>> indptr.shape[0]
+                6
+                >>> bool((indices < sample_scale2.num_points).all())
+                True
+                >>> bool(numpy.allclose(numpy.add.reduceat(values, indptr[:-1]), 1))
+                True
+
+                Raises
+                ------
+                RuntimeError
+                    If no :attr:`data_source` is set and the training data was not kept
+                ValueError
+                    If the new data do not have the number of dimensions of the training data
+
+                Notes
+                -----
+                The training data is the :attr:`data_source`, converted to float32
+                on each call, or the data the hierarchy was created or loaded with
+                if :attr:`keep_training_data` was set. The neighbor search is euclidean and uses the
+                number of neighbors of the hierarchy parameters.
+            )pbdoc",
+            py::arg("X_new"),
+            py::arg("num_threads") = 0)
+        .def("create_hsne_async",
+            [](py::object self, py::args args, py::kwargs kwargs) {
+                auto& hsne = self.cast<HSne&>();
+                return submit_async(self, hsne.busy_state(), self.attr("create_hsne"), args, kwargs);
+            },
+            R"pbdoc(
+                Run :func:`create_hsne` in a background thread.
+
+                The arguments are the same as for :func:`create_hsne`.
+
+                Examples
+                --------
+                Several hierarchies can be created concurrently.
+
+                >>> import nptsne
+                >>> hsnes = [nptsne.HSne(False) for i in range(2)]
+                >>> futures = [h.create_hsne_async(sample_hsne_data, 2) for h in hsnes]
+                >>> [f.result() for f in futures]
+                [True, True]
+                >>> hsnes[1].num_scales
+                2
+
+                Returns
+                -------
+                :class:`concurrent.futures.Future`
+                    The future result of :func:`create_hsne`
+
+                Notes
+                -----
+                Using the instance from another thread before the future is done
+                raises a RuntimeError, this includes :func:`get_scale` and the
+                views of its scales.
+            )pbdoc")
+        .def("load_hsne_async",
+            [](py::object self, py::args args, py::kwargs kwargs) {
+                auto& hsne = self.cast<HSne&>();
+                return submit_async(self, hsne.busy_state(), self.attr("load_hsne"), args, kwargs);
+            },
+            R"pbdoc(
+                Run :func:`load_hsne` in a background thread.
+
+                The arguments are the same as for :func:`load_hsne`.
+
+                Examples
+                --------
+                >>> import nptsne
+                >>> loaded_hsne = nptsne.HSne(False)
+                >>> loaded_hsne.load_hsne_async(sample_hsne_data, sample_hsne_file).result()
+                True
+
+                Returns
+                -------
+                :class:`concurrent.futures.Future`
+                    The future result of :func:`load_hsne`
+
+                Notes
+                -----
+                Using the instance from another thread before the future is done
+                raises a RuntimeError, this includes :func:`get_scale` and the
+                views of its scales.
+            )pbdoc");
 
     hsne_class.def_static("read_num_scales",
         static_cast<int (*)(const std::string&)>(&HSne::read_num_scales),
@@ -613,6 +1946,56 @@ PYBIND11_MODULE(_nptsne, m) {
         )pbdoc",
         py::arg("file_path"));
 
+    hsne_class.def_static("open", &HSne::open,
+        R"pbdoc(
+            Open a saved hierarchy without the original data.
+
+            A file saved with ``mappable=True`` is memory mapped and only the
+            header is read. Each scale is read from the mapping the first time
+            it is used, so opening a large hierarchy to explore the top scale
+            is fast and only touches the pages that are needed.
+            A file in the HDILib format is read completely.
+
+            Parameters
+            ----------
+            file_path : str
+                Path to a saved hierarchy
+            mmap : bool
+                Read the scales lazily from a memory mapping (default True).
+                If False all scales are read immediately.
+            verbose : bool
+                Enable verbose logging to standard output
+            data : array like, optional
+                The original data, for example a :class:`numpy.memmap`. It is only
+                indexed by :func:`get_data` and becomes the :attr:`data_source`.
+
+            Examples
+            --------
+            Save a hierarchy in the mappable format and open it again.
+
+            >>> import nptsne
+            >>> sample_hsne.save("mappable_test.hsne", mappable=True)
+            >>> opened_hsne = nptsne.HSne.open("mappable_test.hsne")
+            >>> opened_hsne.num_scales == sample_hsne.num_scales
+            True
+            >>> opened_hsne.get_scale(0).num_points == sample_hsne.get_scale(0).num_points
+            True
+
+            Returns
+            -------
+            :class:`HSne`
+                The opened hierarchy
+
+            Raises
+            ------
+            RuntimeError
+                If the file cannot be opened or is not a valid hierarchy
+        )pbdoc",
+        py::arg("file_path"),
+        py::arg("mmap") = true,
+        py::arg("verbose") = false,
+        py::arg("data") = py::none());
+
     hsne_class.def("save", &HSne::save_to_file,
         R"pbdoc(
             Save the HSNE as a binary structure to a file
@@ -621,6 +2004,10 @@ PYBIND11_MODULE(_nptsne, m) {
             ----------
             filename : str
                 The file to save to. If it already exists it is overwritten.
+            mappable : bool
+                Save in the nptsne hierarchy format (default False). This format can be
+                memory mapped and lazily loaded with :func:`open`. The default is
+                the HDILib format that can be read by :func:`load_hsne`.
 
             Examples
             --------
@@ -632,7 +2019,204 @@ PYBIND11_MODULE(_nptsne, m) {
             3
 
         )pbdoc",
-        py::arg("file_path"));
+        py::arg("file_path"),
+        py::arg("mappable") = false);
+
+    hsne_class.def("build_membership_index",
+        [](HSne& self, double min_influence, int num_threads) {
+            py::gil_scoped_release release;
+            self.build_membership_index(min_influence, num_threads);
+        },
+        R"pbdoc(
+            Build the cross scale membership index of the hierarchy.
+
+            For every scale above the data the index holds the influence of each
+            landmark on each data point (the product of the areas of influence
+            down the hierarchy) and the dominant landmark of each data point.
+            Area of influence and representative landmark queries are then
+            sparse lookups, see :func:`membership_influence` and
+            :func:`dominant_landmarks`. :func:`hsne_analysis.Analysis.get_area_of_influence`
+            uses the index when there is one.
+
+            The index is saved next to the hierarchy by :func:`save` (with the
+            extension ".membership" added) and read back by :func:`load_hsne`
+            and :func:`open`. A save without an index removes the index file of
+            an earlier save. An index file is only read back if its landmarks
+            match those of the hierarchy.
+
+            Parameters
+            ----------
+            min_influence : float, optional
+                Influences below this value are not stored, default 0 (all)
+            num_threads : int, optional
+                The number of threads, 0 (the default) uses all cores.
+                The index does not depend on the number of threads.
+
+            Examples
+            --------
+            >>> import nptsne
+            >>> hsne = nptsne.HSne(False)
+            >>> hsne.load_hsne(sample_hsne_file)
+            True
+            >>> hsne.has_membership_index
+            False
+            >>> hsne.build_membership_index()
+            >>> hsne.has_membership_index
+            True
+            >>> hsne.save("membership_test.hsne")
+            >>> loaded = nptsne.HSne(False)
+            >>> loaded.load_hsne("membership_test.hsne")
+            True
+            >>> loaded.has_membership_index
+            True
+
+            Saving over it without an index also removes the index file.
+
+            >>> hsne = nptsne.HSne(False)
+            >>> hsne.load_hsne(sample_hsne_file)
+            True
+            >>> hsne.save("membership_test.hsne")
+            >>> loaded = nptsne.HSne(False)
+            >>> loaded.load_hsne("membership_test.hsne")
+            True
+            >>> loaded.has_membership_index
+            False
+        )pbdoc",
+        py::arg("min_influence") = 0.0,
+        py::arg("num_threads") = 0);
+
+    hsne_class.def_property_readonly("has_membership_index",
+        [](const HSne& self) { return self.membership_index() != nullptr; },
+        "bool: True if the membership index has been built or loaded with the hierarchy");
+
+    hsne_class.def("membership_influence",
+        [](HSne& self, unsigned int scale_number, std::vector<uint32_t> landmarks) {
+            const auto *index = self.membership_index();
+            if (index == nullptr) {
+                throw std::runtime_error("No membership index, use build_membership_index");
+            }
+            std::vector<uint32_t> points;
+            std::vector<float> influence;
+            index->area_of_influence(scale_number, landmarks, points, influence);
+            py::array_t<uint32_t> points_array(points.size());
+            py::array_t<float> influence_array(influence.size());
+            std::copy(points.begin(), points.end(), points_array.mutable_data());
+            std::copy(influence.begin(), influence.end(), influence_array.mutable_data());
+            return py::make_tuple(points_array, influence_array);
+        },
+        R"pbdoc(
+            The data points influenced by landmarks of a scale, from the membership index.
+
+            Parameters
+            ----------
+            scale_number : int
+                The scale of the landmarks, 0 is the data scale
+            landmarks : list
+                Landmark indexes in the scale
+
+            Returns
+            -------
+            tuple
+                The influenced data point indexes (increasing, uint32) and
+                the summed influence of the landmarks on each (float32)
+
+            Examples
+            --------
+            >>> import nptsne
+            >>> hsne = nptsne.HSne(False)
+            >>> hsne.load_hsne(sample_hsne_file)
+            True
+            >>> hsne.build_membership_index()
+            >>> points, influence = hsne.membership_influence(2, [0])
+            >>> points.shape == influence.shape
+            True
+            >>> bool((influence > 0).all() and (influence <= 1.0001).all())
+            True
+
+            Raises
+            ------
+            RuntimeError
+                If there is no membership index
+            IndexError
+                If a landmark or the scale is not in the hierarchy
+        )pbdoc",
+        py::arg("scale_number"),
+        py::arg("landmarks"));
+
+    hsne_class.def("dominant_landmarks",
+        [](HSne& self, unsigned int scale_number, py::object points) {
+            const auto *index = self.membership_index();
+            if (index == nullptr) {
+                throw std::runtime_error("No membership index, use build_membership_index");
+            }
+            const int64_t num_points = static_cast<int64_t>(index->num_data_points());
+            // The data scale is the identity
+            const std::vector<int32_t> *dominant =
+                scale_number == 0 ? nullptr : &index->dominant_landmarks(scale_number);
+            auto lookup = [num_points, dominant](int64_t i) -> int32_t {
+                if (i < 0 || i >= num_points) {
+                    throw std::out_of_range("Data point " + std::to_string(i) + " is not in the hierarchy");
+                }
+                return dominant == nullptr ? static_cast<int32_t>(i) : (*dominant)[i];
+            };
+            if (points.is_none()) {
+                py::array_t<int32_t> result(num_points);
+                auto output = result.mutable_data();
+                for (int64_t i = 0; i < num_points; ++i) {
+                    output[i] = lookup(i);
+                }
+                return result;
+            }
+            auto indexes = py::array_t<int64_t, py::array::c_style | py::array::forcecast>::ensure(points);
+            if (!indexes) {
+                throw std::invalid_argument("The points must be an array of data point indexes");
+            }
+            py::array_t<int32_t> result(indexes.size());
+            auto output = result.mutable_data();
+            for (py::ssize_t k = 0; k < indexes.size(); ++k) {
+                output[k] = lookup(indexes.data()[k]);
+            }
+            return result;
+        },
+        R"pbdoc(
+            The landmark that represents each data point at a scale, from the membership index.
+
+            The representative is the landmark with the largest influence on the point.
+
+            Parameters
+            ----------
+            scale_number : int
+                The scale, 0 is the data scale
+            points : list or :class:`ndarray`, optional
+                Data point indexes, default None for all data points
+
+            Returns
+            -------
+            :class:`ndarray`
+                The landmark index in the scale for each point (int32),
+                -1 if no landmark of the scale influences the point
+
+            Examples
+            --------
+            >>> import nptsne
+            >>> hsne = nptsne.HSne(False)
+            >>> hsne.load_hsne(sample_hsne_file)
+            True
+            >>> hsne.build_membership_index()
+            >>> hsne.dominant_landmarks(2).shape
+            (10000,)
+            >>> hsne.dominant_landmarks(0, [3, 7]).tolist()
+            [3, 7]
+            >>> int(hsne.dominant_landmarks(2, [5])[0]) < hsne.get_scale(2).num_points
+            True
+
+            Raises
+            ------
+            RuntimeError
+                If there is no membership index
+        )pbdoc",
+        py::arg("scale_number"),
+        py::arg("points") = py::none());
 
     hsne_class.def("get_scale", &HSne::get_scale,
         R"pbdoc(
@@ -651,12 +2235,61 @@ PYBIND11_MODULE(_nptsne, m) {
             >>> scale.num_points
             10000
 
+            The scale is a view on the HSne data, repeated calls are cheap.
+
+            >>> sample_hsne.get_scale(2).num_points == sample_scale2.num_points
+            True
+
+            Requesting a scale outside the hierarchy raises an IndexError
+
+            >>> sample_hsne.get_scale(sample_hsne.num_scales)
+            Traceback (most recent call last):
+            ...
+            IndexError: Scale number 3 is not in the hierarchy
+
             Returns
             -------
             :class:`HSneScale`
-                A numpy array contain a flatten (1D) embedding
+                A view of the scale, this keeps the HSne alive
+
+            Notes
+            -----
+            No scale data is copied. The returned :class:`HSneScale` shares the
+            hierarchy of this HSne, after recreating or reloading the HSne it
+            still shows the previous hierarchy. A scale of a replaced hierarchy
+            that was opened from a file and never read raises a RuntimeError.
         )pbdoc",
-        py::arg("scale_number"));
+        py::arg("scale_number"),
+        py::keep_alive<0, 1>());
+
+    hsne_class.def_property_readonly("parameters", &HSne::parameters,
+        R"pbdoc(
+            :class:`HSneParameters`: A copy of the parameters used to build the hierarchy.
+
+            Examples
+            --------
+
+            >>> sample_hsne.parameters.num_neighbors
+            90
+        )pbdoc");
+
+    hsne_class.def_property_readonly("last_run_stats",
+        [](const HSne& self) { return run_stats_to_dict(self.last_run_stats()); },
+        R"pbdoc(
+            dict: Statistics of the last hierarchy build or load.
+
+            ``phase_seconds`` maps the phases to their wall time in seconds:
+            ``hierarchy_init`` (kNN, probabilities and the data scale), ``scale_1`` ...
+            (landmark selection, random walks and transition matrix per scale), and
+            depending on the entry point ``similarities``, ``ingest`` or ``load``.
+            ``peak_resident_bytes`` is the peak resident memory of the process.
+
+            Examples
+            --------
+
+            >>> list(sample_hsne.last_run_stats['phase_seconds'].keys())
+            ['hierarchy_init', 'scale_1', 'scale_2']
+        )pbdoc");
 
     hsne_class.def_property_readonly("num_scales", &HSne::num_scales,
         R"pbdoc(
@@ -728,7 +2361,8 @@ PYBIND11_MODULE(_nptsne, m) {
         return hsne.get_scale(scale_number);
     }),
         py::arg("hsne"),
-        py::arg("scale_number"));
+        py::arg("scale_number"),
+        py::keep_alive<1, 2>());
 
     hsne_scale_class.def_property_readonly("num_points", &HSneScale::num_points,
         R"pbdoc(
@@ -744,11 +2378,11 @@ PYBIND11_MODULE(_nptsne, m) {
     hsne_scale_class
         .def("get_landmark_weight",
         [](HSneScale& self) {
-            auto rows = self._scale._landmark_weight.size();
+            auto rows = self.scale()._landmark_weight.size();
             return py::array_t<float>(
                 { rows },
                 { sizeof(float) },
-                self._scale._landmark_weight.data(),
+                self.scale()._landmark_weight.data(),
                 py::cast(self));
         },
         R"pbdoc(
@@ -811,15 +2445,58 @@ PYBIND11_MODULE(_nptsne, m) {
             list(list(tuple)):
                 The transition (probability) matrix in this scale
 
+            See Also
+            --------
+            transition_matrix_csr
+
+        )pbdoc");
+
+    hsne_scale_class.def("transition_matrix_csr",
+        [](HSneScale& self) {
+            return sparse_matrix_to_csr(self.transition_matrix());
+        },
+        R"pbdoc(
+            The transition (probability) matrix in this scale in compressed sparse row form.
+
+            Examples
+            --------
+            There is one row per landmark and one value per index.
+
+            >>> indptr, indices, values = sample_scale2.transition_matrix_csr()
+            >>> indptr.shape[0] == sample_scale2.num_points + 1
+            True
+            >>> indices.shape == values.shape
+            True
+            >>> int(indptr[-1]) == values.shape[0]
+            True
+
+            The row contents match the transition_matrix property.
+
+            >>> row = sample_scale2.transition_matrix[0]
+            >>> [int(i) for i in indices[indptr[0]:indptr[1]]] == [t[0] for t in row]
+            True
+
+            Notes
+            -----
+            The arrays are filled natively in a single pass, no per entry
+            python objects are created. They can be passed directly to
+            scipy: `scipy.sparse.csr_matrix((values, indices, indptr))`
+
+            Returns
+            -------
+            tuple(:class:`ndarray`, :class:`ndarray`, :class:`ndarray`):
+                The row pointers (int64, length num_points + 1), the column
+                landmark indexes (uint32) and the transition values (float32)
+
         )pbdoc");
 
     hsne_scale_class.def_property_readonly("landmark_orig_indexes",
         [](HSneScale& self) {
-        auto rows = self._scale._landmark_to_original_data_idx.size();
+        auto rows = self.scale()._landmark_to_original_data_idx.size();
         return py::array_t<unsigned int>(
             { rows },
             { sizeof(unsigned int) },
-            self._scale._landmark_to_original_data_idx.data(),
+            self.scale()._landmark_to_original_data_idx.data(),
             py::cast(self));
         },
         R"pbdoc(
@@ -857,19 +2534,72 @@ PYBIND11_MODULE(_nptsne, m) {
         // ENUMS
         py::enum_<EmbedderType>(m_hsne, "EmbedderType", py::arithmetic(),
         R"pbdoc(
-            Enumeration used to select the embedder used. Two possibilities are
+            Enumeration used to select the embedder used. Four possibilities are
             supported:
 
             `EmbedderType.CPU`: CPU tSNE
-            `EmbedderType.CPU`: GPU tSNE
+            `EmbedderType.GPU`: GPU tSNE
+            `EmbedderType.CPU_PARALLEL`: multi-threaded CPU tSNE, the number of
+            threads is set with the `num_threads` of the :class:`Analysis`
+            `EmbedderType.CPU_FFT`: multi-threaded CPU tSNE with the repulsive
+            forces interpolated on a grid and evaluated with an FFT (FIt-SNE).
+            The cost is linear in the number of points, this is the CPU choice
+            for large analyses. The `num_threads` of the :class:`Analysis` applies.
 
         )pbdoc")
             .value("CPU", EmbedderType::CPU)
-            .value("GPU", EmbedderType::GPU);
+            .value("GPU", EmbedderType::GPU)
+            .value("CPU_PARALLEL", EmbedderType::CPU_PARALLEL)
+            .value("CPU_FFT", EmbedderType::CPU_FFT);
+
+        py::enum_<InfluenceType>(m_hsne, "InfluenceType", py::arithmetic(),
+        R"pbdoc(
+            Enumeration used to select how a sub-analysis finds the landmarks
+            influenced by the parent selection. Two possibilities are supported:
+
+            `InfluenceType.WALKS`: the fraction of the random walks from each
+            point that reach the selection, `num_walks_per_landmark` walks per
+            point truncated at 100 steps. The walks run in parallel, seeded by
+            the `seed` of the :class:`HSneParameters` of the hierarchy: for a
+            given seed the result is independent of the number of threads.
+            `InfluenceType.MATRIX_POWER`: the probability that a random walk
+            reaches the selection, computed with sparse matrix vector products
+            on the scale transition matrix (walks truncated at 100 steps).
+            Without sampling noise and independent of the number of threads.
+            The `num_threads` of the :class:`Analysis` applies.
+
+            Both only follow the walks among the points that the area of
+            influence relates to the selection, WALKS estimates the
+            probabilities that MATRIX_POWER computes.
+
+            Examples
+            --------
+            For a seeded hierarchy both find nearly the same landmarks
+
+            >>> import nptsne
+            >>> from nptsne.hsne_analysis import Analysis, EmbedderType, InfluenceType
+            >>> params = nptsne.HSneParameters()
+            >>> params.seed = 7
+            >>> hsne = nptsne.HSne(False)
+            >>> hsne.create_hsne(sample_hsne_data, 2, params)
+            True
+            >>> top = Analysis(hsne, EmbedderType.CPU)
+            >>> selection = list(range(top.number_of_points // 2))
+            >>> walks = Analysis(hsne, EmbedderType.CPU, top, selection,
+            ...     influence_type=InfluenceType.WALKS)
+            >>> power = Analysis(hsne, EmbedderType.CPU, top, selection,
+            ...     influence_type=InfluenceType.MATRIX_POWER)
+            >>> a, b = set(walks.landmark_indexes), set(power.landmark_indexes)
+            >>> len(a & b) >= 0.9 * max(len(a), len(b))
+            True
+
+        )pbdoc")
+            .value("WALKS", InfluenceType::WALKS)
+            .value("MATRIX_POWER", InfluenceType::MATRIX_POWER);
 
         // ***** A selection driven hSNE analysis ******
         // The classes are defined at the level of the submodule
-        m_hsne.attr("__all__") = py::make_tuple("Analysis", "SparseTsne", "EmbedderType");
+        m_hsne.attr("__all__") = py::make_tuple("Analysis", "SparseTsne", "EmbedderType", "InfluenceType");
 
         // ******************************************************************
         // Note that parent None is allowed for creation of the top
@@ -888,6 +2618,13 @@ PYBIND11_MODULE(_nptsne, m) {
                 The parent Analysis (where the selection was performed) if any
             parent_selection : list, optional
                 List of selection indexes in the parent analysis.
+            num_threads : int, optional
+                The number of threads used by `EmbedderType.CPU_PARALLEL` and
+                `EmbedderType.CPU_FFT`, 0 (the default) uses all cores. These
+                embeddings are reproducible and do not depend on the number of threads.
+            influence_type : :class:`InfluenceType`, optional
+                How the landmarks influenced by the parent selection are found,
+                `InfluenceType.WALKS` (the default) or `InfluenceType.MATRIX_POWER`.
 
             Attributes
             ----------
@@ -926,15 +2663,88 @@ PYBIND11_MODULE(_nptsne, m) {
             HSne& hsne,
             EmbedderType embedder_type,
             Analysis* parent,
-            std::vector<uint32_t> parent_selection) {
-            return Analysis::make_analysis(hsne, embedder_type, parent, parent_selection);
+            std::vector<uint32_t> parent_selection,
+            int num_threads,
+            InfluenceType influence_type) {
+            // The analysis is built from native data only
+            py::gil_scoped_release release;
+            return Analysis::make_analysis(
+                hsne, embedder_type, parent, parent_selection, num_threads, influence_type);
         }),
             py::arg("hnse"),
             py::arg("embedder_type"),
             py::arg("parent")=nullptr,
-            py::arg("parent_selection")=std::vector<uint32_t>());
+            py::arg("parent_selection")=std::vector<uint32_t>(),
+            py::arg("num_threads")=0,
+            py::arg("influence_type")=InfluenceType::WALKS,
+            // The embedder shares the scale transition matrices of the hsne
+            py::keep_alive<1, 2>());
+
+        analysis_class.def_static("create_async",
+            [](py::args args, py::kwargs kwargs) {
+                auto analysis_type = py::module::import("nptsne.hsne_analysis").attr("Analysis");
+                py::object hsne = args.size() > 0 ? py::object(args[0]) :
+                    kwargs.contains("hnse") ? py::object(kwargs["hnse"]) : py::object(py::none());
+                if (!py::isinstance<HSne>(hsne)) {
+                    // The constructor reports the missing or wrong argument
+                    return analysis_type(*args, **kwargs);
+                }
+                return submit_async(hsne, hsne.cast<HSne&>().busy_state(), analysis_type, args, kwargs);
+            },
+            R"pbdoc(
+                Create an :class:`Analysis` in a background thread.
+
+                The arguments are the same as for the :class:`Analysis` constructor.
+
+                Examples
+                --------
+                >>> import nptsne
+                >>> future = nptsne.hsne_analysis.Analysis.create_async(
+                ...     sample_hsne, nptsne.hsne_analysis.EmbedderType.CPU)
+                >>> future.result().scale_id
+                2
+
+                Returns
+                -------
+                :class:`concurrent.futures.Future`
+                    The future :class:`Analysis`
+
+                Notes
+                -----
+                The parent analysis, if any, must not be changed until the future is done.
+                The :class:`HSne` is busy until then, using it from another thread
+                raises a RuntimeError. Analyses of one HSne are created one at a time.
+                No OpenGL context is created, a GPU embedder creates it on the
+                first iteration in the calling thread. To run a GPU analysis in
+                another thread call :func:`prepare_context` on the main thread first.
+            )pbdoc");
 
         // The analysis properties
+        analysis_class.def_readonly("num_threads", &Analysis::num_threads,
+            "int : The number of threads for the `EmbedderType.CPU_PARALLEL` and `CPU_FFT` embedders, 0 is all cores");
+
+        analysis_class.def_readonly("influence_type", &Analysis::influence_type,
+            R"pbdoc(
+                :class:`InfluenceType` : How the landmarks of this analysis were found from the parent selection
+
+                Examples
+                --------
+                A sub-analysis from the walk probabilities is the same on every drill-down
+
+                >>> import nptsne
+                >>> from nptsne.hsne_analysis import Analysis, EmbedderType, InfluenceType
+                >>> top = Analysis(sample_hsne, EmbedderType.CPU)
+                >>> selection = list(range(top.number_of_points // 2))
+                >>> first = Analysis(sample_hsne, EmbedderType.CPU, top, selection,
+                ...     influence_type=InfluenceType.MATRIX_POWER)
+                >>> first.influence_type
+                InfluenceType.MATRIX_POWER
+                >>> second = Analysis(sample_hsne, EmbedderType.CPU, top, selection,
+                ...     influence_type=InfluenceType.MATRIX_POWER)
+                >>> list(first.landmark_indexes) == list(second.landmark_indexes)
+                True
+            )pbdoc");
+
         analysis_class
             .def_readwrite("id", &Analysis::id,
             R"pbdoc(
@@ -991,14 +2801,105 @@ PYBIND11_MODULE(_nptsne, m) {
             )pbdoc");
 
         analysis_class
-            .def("do_iteration", &Analysis::doAnIteration,
-                "Perform one iteration of the chosen embedder");
+            .def("do_iteration",
+                &Analysis::do_iteration,
+                "Perform one iteration of the chosen embedder",
+                py::call_guard<py::gil_scoped_release>());
+
+        analysis_class
+            .def("prepare_context",
+                &Analysis::prepare_context,
+                R"pbdoc(
+                    Create (or take from the pool) the OpenGL context of a GPU embedder on this thread.
+
+                    GLFW creates contexts on the main thread only. Call this on the
+                    main thread before :func:`run` or :func:`do_iteration` run in
+                    another thread (e.g. an executor), there the context is only made
+                    current. Without it the first GPU iteration in another thread
+                    raises a RuntimeError unless EGL (Linux without a display) is used.
+                    Nothing is done for the CPU embedders.
+
+                    Examples
+                    --------
+                    >>> import nptsne
+                    >>> analysis = nptsne.hsne_analysis.Analysis(sample_hsne, nptsne.hsne_analysis.EmbedderType.CPU)
+                    >>> analysis.prepare_context()
+                )pbdoc",
+                py::call_guard<py::gil_scoped_release>());
+
+        analysis_class
+            .def("run",
+                [](Analysis& self, int iterations, py::object time_budget_ms) {
+                    double budget = -1;
+                    if (!time_budget_ms.is_none()) {
+                        budget = time_budget_ms.cast<double>();
+                        if (!(budget > 0)) {
+                            throw py::value_error("time_budget_ms must be positive, use None for no budget");
+                        }
+                    }
+                    py::gil_scoped_release release;
+                    return self.run(iterations, budget);
+                },
+            R"pbdoc(
+                Perform a number of iterations of the chosen embedder in a single call.
+
+                Parameters
+                ----------
+                iterations : int
+                    The maximum number of iterations to perform, none if not positive
+                time_budget_ms : float, optional
+                    If given (positive) stop once this wall-clock time (milliseconds)
+                    has been used. The time is checked after each iteration: if
+                    `iterations` is positive at least one iteration is performed.
+                    None (the default) is no time budget.
+
+                Examples
+                --------
+                Without a time budget all iterations are performed.
+
+                >>> import nptsne
+                >>> analysis = nptsne.hsne_analysis.Analysis(sample_hsne, nptsne.hsne_analysis.EmbedderType.CPU)
+                >>> analysis.run(10)
+                10
+
+                With a time budget fewer iterations may be done.
+
+                >>> done = analysis.run(100000, time_budget_ms=1)
+                >>> 1 <= done <= 100000
+                True
+
+                Returns
+                -------
+                int
+                    The number of iterations performed
+
+                Raises
+                ------
+                ValueError
+                    If `time_budget_ms` is given and not positive
+
+                Notes
+                -----
+                The iterations loop natively with the GIL released. This is more efficient
+                than calling `do_iteration` repeatedly, for example to fill an animation frame.
+            )pbdoc",
+            py::arg("iterations"),
+            py::arg("time_budget_ms") = py::none());
 
         analysis_class
             .def("get_area_of_influence",
                 [](Analysis& self, std::vector<nptsne::UnsignedIntType> selection_list) {
                     std::vector<nptsne::ScalarType> aoi;
-                    self.hsne->getAreaOfInfluenceTopDown(self.scale_id, selection_list, aoi);
+                    const auto *index = self.hsne_owner->membership_index();
+                    if (index != nullptr) {
+                        py::gil_scoped_release release;
+                        index->area_of_influence(self.scale_id, selection_list, aoi);
+                    } else {
+                        // The same influence propagated through all scales below this one
+                        self.hsne_owner->ensure_scales_loaded(self.scale_id);
+                        py::gil_scoped_release release;
+                        nptsne::area_of_influence_top_down(*self.hsne, self.scale_id, selection_list, aoi);
+                    }
                     py::array_t<nptsne::ScalarType> result = py::array_t<nptsne::ScalarType>(aoi.size());
                     auto result_info = result.request();
                     nptsne::ScalarType *output = static_cast<nptsne::ScalarType *>(result_info.ptr);
@@ -1010,6 +2911,12 @@ PYBIND11_MODULE(_nptsne, m) {
             R"pbdoc(
                 Get the area of influence of the selection in the original data.
 
+                The influence of the selected landmarks on each data point is
+                propagated down the scales through their areas of influence.
+                With a membership index (:func:`HSne.build_membership_index`) the
+                same influence is looked up in the index instead, up to
+                rounding and the `min_influence` of the index.
+
                 Parameters
                 ----------
                 select_list : list
@@ -1018,9 +2925,74 @@ PYBIND11_MODULE(_nptsne, m) {
                 Returns
                 -------
                 :class:`ndarray`
-                    The indexes for the original points represented by the selected landmarks 
+                    The influence (0 to 1) of the selection on each original data point
+
+                Examples
+                --------
+                The influence is the same with and without a membership index.
+
+                >>> import nptsne
+                >>> import numpy as np
+                >>> hsne = nptsne.HSne(False)
+                >>> hsne.load_hsne(sample_hsne_file)
+                True
+                >>> analysis = nptsne.hsne_analysis.Analysis(hsne, nptsne.hsne_analysis.EmbedderType.CPU)
+                >>> selection = list(range(0, analysis.number_of_points, 3))
+                >>> top_down = analysis.get_area_of_influence(selection)
+                >>> top_down.shape == (hsne.num_data_points,)
+                True
+                >>> hsne.build_membership_index()
+                >>> np.allclose(analysis.get_area_of_influence(selection), top_down, atol=1e-5)
+                True
+            )pbdoc",
+            py::arg("select_list"))
+            .def("project",
+                [](Analysis& self,
+                    py::array_t<float, py::array::c_style | py::array::forcecast> X_new,
+                    int num_threads) {
+                    auto memberships = self.hsne_owner->project(X_new, num_threads, self.scale_id);
+                    std::vector<float> positions;
+                    {
+                        py::gil_scoped_release release;
+                        self.place_points(memberships.back(), positions);
+                    }
+                    py::ssize_t dims = self.getEmbedding().numDimensions();
+                    py::array_t<float> result({ static_cast<py::ssize_t>(positions.size()) / dims, dims });
+                    std::copy(positions.begin(), positions.end(), result.mutable_data());
+                    return result;
+            },
+            R"pbdoc(
+                Approximate positions of new data points in this embedding.
+
+                The new points are projected into the hierarchy with :func:`HSne.project`
+                and placed at the membership weighted mean of the landmarks of this
+                analysis. The embedding is not changed.
+
+                Parameters
+                ----------
+                X_new : :class:`ndarray`
+                    The new data, shape (num. new points, num. dimensions)
+                num_threads : int, optional
+                    The number of threads for the projection, 0 (the default) uses all cores
+
+                Returns
+                -------
+                :class:`ndarray`
+                    The positions, shape (num. new points, embedding dimensions). Points that
+                    belong to none of the landmarks of this analysis are NaN.
+
+                Examples
+                --------
+                >>> import numpy
+                >>> sample_hsne.data_source = sample_hsne_data
+                >>> positions = sample_analysis.project(sample_hsne_data[:5])
+                >>> positions.shape
+                (5, 2)
+                >>> bool(numpy.isfinite(positions).all())
+                True
             )pbdoc",
-            py::arg("select_list"));
+            py::arg("X_new"),
+            py::arg("num_threads") = 0);
 
         // id of the parent analysis (numeric_limits<uint32_t>::max if this is root)
         analysis_class.def_property_readonly(
@@ -1034,14 +3006,55 @@ PYBIND11_MODULE(_nptsne, m) {
 
         analysis_class.def_property_readonly("transition_matrix",
             [](Analysis& self) {
-            nptsne::SparseScalarMatrixType& matrix = self.getTransitionMatrix();
-            std::vector<std::reference_wrapper<nptsne::MapStorageType >> sparse;
+            const nptsne::SparseScalarMatrixType& matrix = self.getTransitionMatrix();
+            std::vector<std::reference_wrapper<const nptsne::MapStorageType >> sparse;
             for (uint32_t i = 0; i < matrix.size(); ++i) {
                 sparse.push_back(matrix[i].memory());
             }
             return sparse;
         }, "list(dict) : The transition (probability) matrix in this `Analysis`");
 
+        analysis_class.def("transition_matrix_csr",
+            [](Analysis& self) {
+            return sparse_matrix_to_csr(self.getTransitionMatrix());
+        }, R"pbdoc(
+            The transition (probability) matrix in this `Analysis` in compressed sparse row form.
+
+            Examples
+            --------
+            There is one row per analysis landmark.
+
+            >>> indptr, indices, values = sample_analysis.transition_matrix_csr()
+            >>> indptr.shape[0] == sample_analysis.number_of_points + 1
+            True
+            >>> int(indptr[-1]) == values.shape[0] == indices.shape[0]
+            True
+
+            Returns
+            -------
+            tuple(:class:`ndarray`, :class:`ndarray`, :class:`ndarray`):
+                The row pointers (int64), column indexes (uint32) and values (float32)
+        )pbdoc");
+
+        analysis_class.def_property_readonly("last_run_stats",
+            [](const Analysis& self) { return run_stats_to_dict(self.last_run_stats); },
+            R"pbdoc(
+                dict: Statistics of the analysis creation or the last :func:`run`.
+
+                ``phase_seconds`` maps the phases to their wall time in seconds:
+                ``influence`` and ``subgraph`` (sub-analyses only) and ``embedding_init``
+                for the creation, ``gradient_descent`` for a run. ``iterations`` is the number
+                of iterations in the run and ``peak_resident_bytes`` is the peak resident
+                memory of the process, recorded once per run. A :func:`do_iteration`
+                only adds to ``iterations``.
+
+                Examples
+                --------
+
+                >>> 'phase_seconds' in sample_analysis.last_run_stats
+                True
+            )pbdoc");
+
         // Share the landmark weights without a copy
         analysis_class.def_property_readonly(
             "landmark_weights",
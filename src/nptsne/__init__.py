@@ -23,7 +23,10 @@ References
 .. [2] Pezzotti, N. et al., `Hierarchical Stochastic Neighbor Embedding <https://doi.org/10.1111/cgf.12878>`_
 
 """        
-from .libs._nptsne import (TextureTsne, TextureTsneExtended, KnnAlgorithm, HSne, HSneScale)
+from .libs._nptsne import (TextureTsne, TextureTsneExtended, KnnAlgorithm, HSne, HSneParameters, HSneScale,
+                           set_log_level, get_log_level, set_log_callback, set_log_rate_limit,
+                           release_gl_contexts, set_similarity_cache, similarity_cache_info,
+                           clear_similarity_cache)
 from .version import __version__
 from . import hsne_analysis
 
@@ -32,6 +35,15 @@ __all__ = (
     'TextureTsneExtended', 
     'KnnAlgorithm', 
     'HSne',
+    'HSneParameters',
     'HSneScale',
+    'set_log_level',
+    'get_log_level',
+    'set_log_callback',
+    'set_log_rate_limit',
+    'release_gl_contexts',
+    'set_similarity_cache',
+    'similarity_cache_info',
+    'clear_similarity_cache',
     'hsne_analysis'
 )
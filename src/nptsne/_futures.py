@@ -0,0 +1,36 @@
+"""Shared executor for the ``*_async`` methods of the nptsne classes
+
+The long running native calls in nptsne release the GIL. The
+``*_async`` methods submit the call to the thread pool defined
+here and return a :class:`concurrent.futures.Future`, so a GUI
+or service thread keeps running and several hierarchies or
+analyses can be computed concurrently.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Return the shared executor, it is created on first use"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=os.cpu_count() or 1,
+                thread_name_prefix='nptsne')
+        return _executor
+
+
+def submit(fn, *args, **kwargs):
+    """Run fn(*args, **kwargs) in the shared executor
+
+    Returns
+    -------
+    :class:`concurrent.futures.Future`
+        The future result of the call
+    """
+    return get_executor().submit(fn, *args, **kwargs)
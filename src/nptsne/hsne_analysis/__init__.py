@@ -5,11 +5,12 @@
 # it simply presents a generic model for navigating an hsne analysis
 
 from .analysis_model import AnalysisModel
-from ..libs._nptsne._hsne_analysis import (Analysis, SparseTsne, EmbedderType) 
+from ..libs._nptsne._hsne_analysis import (Analysis, SparseTsne, EmbedderType, InfluenceType) 
 
 __all__ = (
     'AnalysisModel',
     'Analysis',
     'EmbedderType',
+    'InfluenceType',
     'SparseTsne'
 )
@@ -1,4 +1,4 @@
-from ..libs._nptsne._hsne_analysis import (EmbedderType, Analysis) 
+from ..libs._nptsne._hsne_analysis import (EmbedderType, Analysis, InfluenceType) 
 import numpy as np
 
 class AnalysisContainer:
@@ -99,7 +99,9 @@ class AnalysisModel:
     hsne : HSne 
         The python HSne wrapper class
     embedder_type : :class:`hsne_analysis.EmbedderType`
-        The embedder to be used when creating a new analysis CPU or GPU
+        The embedder to be used when creating a new analysis CPU, GPU, CPU_PARALLEL or CPU_FFT
+    num_threads : int, optional
+        The number of threads for the CPU_PARALLEL and CPU_FFT embedders, 0 (the default) uses all cores
         
     Examples
     --------
@@ -129,9 +131,10 @@ class AnalysisModel:
     with a top level default hsne_analysis.Analysis containing all top level landmarks.
     """
 
-    def __init__(self, hsne, embedder_type):
+    def __init__(self, hsne, embedder_type, num_threads=0):
         self.hsne = hsne
         self.embedder_type = embedder_type
+        self.num_threads = num_threads
 
 
         self._analysis_container = None
@@ -163,11 +166,11 @@ class AnalysisModel:
         """The toplevel of the hsne_analysis.Model """
         
         # All the landmark points at from the top scale are in the 
-        topAnalysis = Analysis(self.hsne, self.embedder_type) 
+        topAnalysis = Analysis(self.hsne, self.embedder_type, num_threads=self.num_threads)
         self.top_analysis_id = topAnalysis.id
         self._analysis_container = AnalysisContainer(topAnalysis)
         
-    def add_new_analysis(self, parent, parent_selection):
+    def add_new_analysis(self, parent, parent_selection, influence_type=InfluenceType.WALKS):
         """Add a new analysis based on a selection in a parent analysis
 
         Parameters
@@ -177,6 +180,10 @@ class AnalysisModel:
 
         parent_selection: ndarray<np.uint32>
            The selection indices in the parent analysis
+
+        influence_type: :class:`hsne_analysis.InfluenceType`, optional
+           How the landmarks influenced by the selection are found,
+           WALKS (the default) or MATRIX_POWER
            
         Examples
         --------
@@ -196,7 +203,8 @@ class AnalysisModel:
         True
         """
 
-        analysis = Analysis(self.hsne, self.embedder_type, parent, parent_selection)
+        analysis = Analysis(self.hsne, self.embedder_type, parent, parent_selection, self.num_threads,
+                            influence_type)
         self._analysis_container.add_analysis(analysis)
         return analysis
         